@@ -1,12 +1,12 @@
 from datetime import datetime
 import os
 import json
-from fastapi import FastAPI, Depends, HTTPException, Header, Request
+from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, Header, Request
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from starlette.concurrency import run_in_threadpool
-from .database import Base, engine, get_db
+from .database import Base, SessionLocal, engine, get_db
 from . import models, schemas, services, mercadopago
 
 
@@ -103,16 +103,12 @@ def health_ready(db: Session = Depends(get_db)):
         raise HTTPException(status_code=503, detail=f"db_down: {ex}") from ex
 
 
-@app.post("/auth/register", response_model=schemas.AuthOut)
-def register(payload: schemas.RegisterIn, db: Session = Depends(get_db)):
-    exists = db.query(models.User).filter(models.User.email_id == payload.email_id.strip().lower()).first()
-    if exists:
-        raise HTTPException(status_code=409, detail="ID ja cadastrado")
-    user = models.User(
-        name=payload.name.strip(),
-        email_id=payload.email_id.strip().lower(),
-        password_hash=services.hash_password(payload.password),
-    )
+def _find_user_by_email(db: Session, email_id: str) -> models.User | None:
+    return db.query(models.User).filter(models.User.email_id == email_id).first()
+
+
+def _create_user(db: Session, name: str, email_id: str, password_hash: str) -> schemas.AuthOut:
+    user = models.User(name=name, email_id=email_id, password_hash=password_hash)
     db.add(user)
     try:
         db.commit()
@@ -121,11 +117,7 @@ def register(payload: schemas.RegisterIn, db: Session = Depends(get_db)):
         detail = str(getattr(ex, "orig", ex) or "").lower()
         if ("users_pkey" in detail) or ("duplicate key value violates unique constraint" in detail and "users" in detail):
             _realign_users_id_sequence(db)
-            user = models.User(
-                name=payload.name.strip(),
-                email_id=payload.email_id.strip().lower(),
-                password_hash=services.hash_password(payload.password),
-            )
+            user = models.User(name=name, email_id=email_id, password_hash=password_hash)
             db.add(user)
             try:
                 db.commit()
@@ -144,14 +136,41 @@ def register(payload: schemas.RegisterIn, db: Session = Depends(get_db)):
     return _auth_out(db, user)
 
 
+# register/login sao async para o hash de senha esperar no pool limitado sem
+# prender uma thread; todo acesso ao banco (sincrono) vai para o threadpool.
+@app.post("/auth/register", response_model=schemas.AuthOut)
+async def register(payload: schemas.RegisterIn, db: Session = Depends(get_db)):
+    email_id = payload.email_id.strip().lower()
+    if await run_in_threadpool(_find_user_by_email, db, email_id):
+        raise HTTPException(status_code=409, detail="ID ja cadastrado")
+    password_hash = await services.hash_password_async(payload.password)
+    return await run_in_threadpool(_create_user, db, payload.name.strip(), email_id, password_hash)
+
+
+async def _rehash_password_task(user_id: int, raw: str, old_hash: str) -> None:
+    """Atualiza hash legado depois da resposta do login (nao atrasa o usuario)."""
+    new_hash = await services.hash_password_async(raw)
+
+    def _store() -> None:
+        db = SessionLocal()
+        try:
+            services.replace_password_hash(db, user_id, old_hash, new_hash)
+        finally:
+            db.close()
+
+    await run_in_threadpool(_store)
+
+
 @app.post("/auth/login", response_model=schemas.AuthOut)
-def login(payload: schemas.LoginIn, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email_id == payload.email_id.strip().lower()).first()
+async def login(payload: schemas.LoginIn, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    user = await run_in_threadpool(_find_user_by_email, db, payload.email_id.strip().lower())
     if not user:
         raise HTTPException(status_code=401, detail="Credenciais invalidas")
-    if not services.verify_password(payload.password, user.password_hash):
+    if not await services.verify_password_async(payload.password, user.password_hash):
         raise HTTPException(status_code=401, detail="Credenciais invalidas")
-    return _auth_out(db, user)
+    if services.password_needs_rehash(user.password_hash):
+        background_tasks.add_task(_rehash_password_task, int(user.id), payload.password, str(user.password_hash or ""))
+    return await run_in_threadpool(_auth_out, db, user)
 
 
 @app.get("/plans/me/{user_id}", response_model=schemas.AuthOut)
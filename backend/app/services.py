@@ -1,4 +1,6 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, date
+import asyncio
 import secrets
 import uuid
 import os
@@ -11,6 +13,10 @@ from . import models
 
 PWD_SCHEME = "pbkdf2_sha256"
 PWD_ITERS = 210_000
+# Pool proprio para hash de senha: uma rajada de logins nao ocupa o threadpool
+# padrao do FastAPI (que atende todos os endpoints sincronos).
+PWD_HASH_MAX_CONCURRENCY = max(1, int(os.getenv("PWD_HASH_MAX_CONCURRENCY", "2") or 2))
+_PWD_EXECUTOR = ThreadPoolExecutor(max_workers=PWD_HASH_MAX_CONCURRENCY, thread_name_prefix="pwd-hash")
 PLAN_DEFINITIONS = {
     "premium_30": {
         "price_cents": 1499,
@@ -56,6 +62,36 @@ def verify_password(raw: str, hashed: str) -> bool:
     return hmac.compare_digest(pwd, value)
 
 
+async def hash_password_async(raw: str) -> str:
+    return await asyncio.wrap_future(_PWD_EXECUTOR.submit(hash_password, raw))
+
+
+async def verify_password_async(raw: str, hashed: str) -> bool:
+    return bool(await asyncio.wrap_future(_PWD_EXECUTOR.submit(verify_password, raw, hashed)))
+
+
+def password_needs_rehash(hashed: str) -> bool:
+    """Hash fora do esquema atual (bcrypt antigo, texto puro, menos iteracoes)."""
+    value = str(hashed or "").strip()
+    if not value.startswith(f"{PWD_SCHEME}$"):
+        return True
+    try:
+        return int(value.split("$", 2)[1]) < PWD_ITERS
+    except (IndexError, ValueError):
+        return True
+
+
+def replace_password_hash(db: Session, user_id: int, old_hash: str, new_hash: str) -> bool:
+    """Troca o hash so se ainda for `old_hash` (nao sobrescreve troca de senha concorrente)."""
+    updated = (
+        db.query(models.User)
+        .filter(models.User.id == user_id, models.User.password_hash == old_hash)
+        .update({models.User.password_hash: new_hash}, synchronize_session=False)
+    )
+    db.commit()
+    return bool(updated)
+
+
 def ensure_plan_row(db: Session, user_id: int):
     row = db.query(models.UserPlan).filter(models.UserPlan.user_id == user_id).first()
     if row:
@@ -13,8 +13,10 @@ from .services import (
     FlashcardsService,
     MockExamReportService,
     MockExamService,
+    NearDuplicateService,
     OpenQuizService,
     QuizFilterService,
+    QuizGenerationService,
     QuestionReviewService,
     ReviewSessionService,
     SpacedRepetitionService,
@@ -31,8 +33,10 @@ __all__ = [
     'FlashcardsService',
     'MockExamReportService',
     'MockExamService',
+    'NearDuplicateService',
     'OpenQuizService',
     'QuizFilterService',
+    'QuizGenerationService',
     'QuestionReviewService',
     'ReviewSessionService',
     'SpacedRepetitionService',
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""Saude dos provedores de IA: limite de taxa aprendido, disjuntor e backoff."""
+
+from __future__ import annotations
+
+import random
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Tempo de disjuntor aberto por tipo de falha (segundos); dobra a cada
+# reabertura sem sucesso no meio, ate `_MAX_COOLDOWN`.
+_COOLDOWN = {"quota_soft": 30.0, "quota_hard": 3600.0, "auth": 600.0}
+_COOLDOWN_PADRAO = 15.0
+_MAX_COOLDOWN = 3600.0
+# Falhas que abrem o disjuntor de imediato; as demais precisam repetir.
+_ABRE_NA_HORA = frozenset({"quota_soft", "quota_hard", "auth"})
+_FALHAS_PARA_ABRIR = 3
+# Sonda em meio-aberto sem resposta por mais que isso e considerada perdida.
+_SONDA_TIMEOUT = 60.0
+
+
+def backoff_delay(attempt: int, base: float = 0.35, cap: float = 8.0) -> float:
+    """Backoff exponencial com jitter completo: uniforme em [0, min(cap, base * 2^attempt)]."""
+    return random.uniform(0.0, min(float(cap), float(base) * (2 ** max(0, int(attempt)))))
+
+
+class TokenBucket:
+    """
+    Balde de fichas com taxa aprendida: cada 429 corta a taxa pela metade e
+    esvazia o balde; cada sucesso devolve um pouco (AIMD).
+    """
+
+    def __init__(self, rate: float = 1.0, capacity: float = 3.0, min_rate: float = 1 / 60.0, max_rate: float = 5.0):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.tokens = float(capacity)
+        self._ts = time.monotonic()
+
+    def _repor(self, agora: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (agora - self._ts) * self.rate)
+        self._ts = agora
+
+    def wait_time(self, agora: Optional[float] = None) -> float:
+        self._repor(time.monotonic() if agora is None else agora)
+        return 0.0 if self.tokens >= 1.0 else (1.0 - self.tokens) / self.rate
+
+    def take(self, agora: Optional[float] = None) -> float:
+        """Consome uma ficha (pode ficar negativo) e devolve quanto esperar antes de usa-la."""
+        espera = self.wait_time(agora)
+        self.tokens -= 1.0
+        return espera
+
+    def on_throttled(self) -> None:
+        self.rate = max(self.min_rate, self.rate * 0.5)
+        self.tokens = min(self.tokens, 0.0)
+
+    def on_success(self) -> None:
+        self.rate = min(self.max_rate, self.rate + 0.02)
+
+
+class ModelHealth:
+    """Estado de um (provedor, chave, modelo): balde de fichas + disjuntor."""
+
+    def __init__(self):
+        self.bucket = TokenBucket()
+        self.state = CLOSED
+        self.failures = 0
+        self.opens = 0
+        self.retry_at = 0.0
+        self.last_error_kind = ""
+        self._sonda_desde: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _estado(self, agora: float) -> str:
+        if self.state == OPEN and agora >= self.retry_at:
+            self.state = HALF_OPEN
+            self._sonda_desde = None
+        if self.state == HALF_OPEN and self._sonda_desde is not None and agora - self._sonda_desde > _SONDA_TIMEOUT:
+            self._sonda_desde = None
+        return self.state
+
+    def available(self) -> bool:
+        """Pode receber chamada agora (sem consumir ficha nem a sonda)?"""
+        with self._lock:
+            estado = self._estado(time.time())
+            return estado == CLOSED or (estado == HALF_OPEN and self._sonda_desde is None)
+
+    def acquire(self, max_wait: float = 10.0) -> bool:
+        """
+        Reserva a chamada: respeita o disjuntor (uma sonda por vez em
+        meio-aberto) e o balde. Se a espera pelo balde passar de `max_wait`,
+        nao reserva nada; senao dorme o necessario e devolve True.
+        """
+        with self._lock:
+            agora = time.time()
+            estado = self._estado(agora)
+            if estado == OPEN or (estado == HALF_OPEN and self._sonda_desde is not None):
+                return False
+            if self.bucket.wait_time() > max_wait:
+                return False
+            espera = self.bucket.take()
+            if estado == HALF_OPEN:
+                self._sonda_desde = agora
+        if espera > 0:
+            time.sleep(espera)
+        return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.opens = 0
+            self.last_error_kind = ""
+            self._sonda_desde = None
+            self.bucket.on_success()
+
+    def record_failure(self, kind: str) -> None:
+        kind = str(kind or "other")
+        with self._lock:
+            agora = time.time()
+            self.last_error_kind = kind
+            self.failures += 1
+            if kind in ("quota_soft", "quota_hard"):
+                self.bucket.on_throttled()
+            if self.state == HALF_OPEN or kind in _ABRE_NA_HORA or self.failures >= _FALHAS_PARA_ABRIR:
+                self.opens += 1
+                base = _COOLDOWN.get(kind, _COOLDOWN_PADRAO)
+                self.state = OPEN
+                self.retry_at = agora + min(_MAX_COOLDOWN, max(base, base * (2 ** (self.opens - 1))))
+                self._sonda_desde = None
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            agora = time.time()
+            estado = self._estado(agora)
+            return {
+                "state": estado,
+                "last_error_kind": self.last_error_kind,
+                "failures": self.failures,
+                "retry_in_s": round(max(0.0, self.retry_at - agora), 1) if estado == OPEN else 0.0,
+                "rate_per_min": round(self.bucket.rate * 60.0, 2),
+            }
+
+
+HealthKey = Tuple[str, str, str]
+
+_SAUDE: Dict[HealthKey, ModelHealth] = {}
+_SAUDE_LOCK = threading.Lock()
+
+
+def health(provider: str, key_fp: str, model: str) -> ModelHealth:
+    """Estado compartilhado pelo processo para (provedor, impressao digital da chave, modelo)."""
+    chave = (str(provider or ""), str(key_fp or ""), str(model or ""))
+    with _SAUDE_LOCK:
+        saude = _SAUDE.get(chave)
+        if saude is None:
+            saude = _SAUDE[chave] = ModelHealth()
+        return saude
+
+
+def snapshot(provider: str, key_fp: str, models: Iterable[str]) -> List[Dict]:
+    return [dict(health(provider, key_fp, m).snapshot(), model=str(m)) for m in models]
+
+
+def quota_exhausted(estados: List[Dict]) -> bool:
+    """Todos os modelos com disjuntor aberto por cota: a UI pode avisar sem chamar a rede."""
+    return bool(estados) and all(
+        e.get("state") == OPEN and e.get("last_error_kind") in ("quota_soft", "quota_hard") for e in estados
+    )
+
+
+def reset(key_fp: Optional[str] = None) -> None:
+    """Esquece o estado de uma chave (ou de todas, sem `key_fp`)."""
+    with _SAUDE_LOCK:
+        for chave in [c for c in _SAUDE if key_fp is None or c[1] == key_fp]:
+            _SAUDE.pop(chave, None)
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""Cache persistente de respostas da IA (SQLite), endereçado pelo conteudo do prompt."""
+
+from __future__ import annotations
+
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+from core.app_paths import get_data_dir
+from core.error_monitor import log_exception
+
+_DIA = 86400
+
+# Validade por tarefa (segundos). Tarefa ausente ou com None nao e cacheada:
+# geracoes "criativas" precisam de variedade (o mesmo prompt de quiz e enviado
+# por varios lotes em paralelo e deve trazer questoes diferentes).
+TTL_PADRAO: Dict[str, Optional[int]] = {
+    "explain_simple": 30 * _DIA,
+    "grade_open_answer": 30 * _DIA,
+    "study_summary": 14 * _DIA,
+    "flashcards": 3 * _DIA,
+    "study_plan": 1 * _DIA,
+    "quiz_batch": None,
+    "open_question": None,
+}
+
+MAX_BYTES_PADRAO = 16 * 1024 * 1024
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Espacos e quebras de linha nao mudam a resposta: colapsa antes do hash."""
+    return re.sub(r"\s+", " ", str(prompt or "")).strip()
+
+
+def cache_key(task: str, provider: str, model: str, prompt: str) -> str:
+    bruto = "\x1f".join((str(task or ""), str(provider or ""), str(model or ""), normalize_prompt(prompt)))
+    return hashlib.sha256(bruto.encode("utf-8", errors="ignore")).hexdigest()
+
+
+class AIResponseCache:
+    """
+    Respostas em texto chaveadas por hash(tarefa, provedor, modelo, prompt
+    normalizado), com validade por tarefa e despejo LRU quando o total passa
+    de `max_bytes`. Compartilhado entre usuarios do aparelho; falhas do
+    SQLite viram "miss" e nunca impedem a chamada ao provedor.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = MAX_BYTES_PADRAO,
+        ttls: Optional[Dict[str, Optional[int]]] = None,
+    ):
+        self.path = str(path)
+        self.max_bytes = max(1024, int(max_bytes))
+        self.ttls = dict(TTL_PADRAO)
+        self.ttls.update(ttls or {})
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._bytes = 0
+        self._hits: Dict[str, int] = {}
+        self._misses: Dict[str, int] = {}
+
+    def _conexao(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+            for pragma in ("PRAGMA journal_mode=WAL", "PRAGMA synchronous=NORMAL", "PRAGMA busy_timeout=5000"):
+                try:
+                    conn.execute(pragma)
+                except sqlite3.DatabaseError:
+                    pass
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS ai_response_cache (
+                    chave TEXT PRIMARY KEY,
+                    tarefa TEXT NOT NULL,
+                    resposta TEXT NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    criado_em REAL NOT NULL,
+                    expira_em REAL NOT NULL,
+                    acessado_em REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_ai_cache_acesso ON ai_response_cache(acessado_em)")
+            conn.commit()
+            self._bytes = int(conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM ai_response_cache").fetchone()[0])
+            self._conn = conn
+        return self._conn
+
+    def ttl_for(self, task: str) -> Optional[int]:
+        ttl = self.ttls.get(str(task or ""))
+        return int(ttl) if ttl else None
+
+    def enabled_for(self, task: str) -> bool:
+        return self.ttl_for(task) is not None
+
+    def get(self, task: str, provider: str, model: str, prompt: str) -> Optional[str]:
+        if not self.enabled_for(task):
+            return None
+        chave = cache_key(task, provider, model, prompt)
+        agora = time.time()
+        resposta = None
+        try:
+            with self._lock:
+                conn = self._conexao()
+                row = conn.execute(
+                    "SELECT resposta, bytes, expira_em FROM ai_response_cache WHERE chave = ?",
+                    (chave,),
+                ).fetchone()
+                if row is not None and float(row[2]) <= agora:
+                    conn.execute("DELETE FROM ai_response_cache WHERE chave = ?", (chave,))
+                    self._bytes = max(0, self._bytes - int(row[1]))
+                    conn.commit()
+                elif row is not None:
+                    conn.execute(
+                        "UPDATE ai_response_cache SET acessado_em = ?, hits = hits + 1 WHERE chave = ?",
+                        (agora, chave),
+                    )
+                    conn.commit()
+                    resposta = str(row[0])
+        except sqlite3.Error as ex:
+            log_exception(ex, "ai_response_cache.get")
+        with self._lock:
+            contadores = self._hits if resposta is not None else self._misses
+            contadores[task] = contadores.get(task, 0) + 1
+        return resposta
+
+    def put(self, task: str, provider: str, model: str, prompt: str, response: str) -> bool:
+        ttl = self.ttl_for(task)
+        if ttl is None or not response:
+            return False
+        texto = str(response)
+        tamanho = len(texto.encode("utf-8", errors="ignore"))
+        if tamanho > self.max_bytes // 4:
+            return False
+        chave = cache_key(task, provider, model, prompt)
+        agora = time.time()
+        try:
+            with self._lock:
+                conn = self._conexao()
+                anterior = conn.execute("SELECT bytes FROM ai_response_cache WHERE chave = ?", (chave,)).fetchone()
+                conn.execute(
+                    """
+                    INSERT INTO ai_response_cache
+                    (chave, tarefa, resposta, bytes, criado_em, expira_em, acessado_em, hits)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+                    ON CONFLICT(chave) DO UPDATE SET
+                        resposta = excluded.resposta,
+                        bytes = excluded.bytes,
+                        criado_em = excluded.criado_em,
+                        expira_em = excluded.expira_em,
+                        acessado_em = excluded.acessado_em
+                    """,
+                    (chave, str(task), texto, tamanho, agora, agora + ttl, agora),
+                )
+                self._bytes += tamanho - (int(anterior[0]) if anterior else 0)
+                if self._bytes > self.max_bytes:
+                    self._despejar(conn, agora)
+                conn.commit()
+            return True
+        except sqlite3.Error as ex:
+            log_exception(ex, "ai_response_cache.put")
+            return False
+
+    def _despejar(self, conn: sqlite3.Connection, agora: float) -> None:
+        """Remove expirados e, se preciso, os menos acessados ate 90% do orcamento."""
+        conn.execute("DELETE FROM ai_response_cache WHERE expira_em <= ?", (agora,))
+        self._bytes = int(conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM ai_response_cache").fetchone()[0])
+        alvo = int(self.max_bytes * 0.9)
+        if self._bytes <= alvo:
+            return
+        remover = []
+        excedente = self._bytes - alvo
+        for chave, tamanho in conn.execute("SELECT chave, bytes FROM ai_response_cache ORDER BY acessado_em ASC"):
+            remover.append((chave,))
+            excedente -= int(tamanho)
+            self._bytes -= int(tamanho)
+            if excedente <= 0:
+                break
+        conn.executemany("DELETE FROM ai_response_cache WHERE chave = ?", remover)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits = sum(self._hits.values())
+            misses = sum(self._misses.values())
+            try:
+                entradas = int(self._conexao().execute("SELECT COUNT(*) FROM ai_response_cache").fetchone()[0])
+            except sqlite3.Error:
+                entradas = 0
+            return {
+                "entries": entradas,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / (hits + misses), 3) if (hits + misses) else 0.0,
+                "per_task": {
+                    tarefa: {"hits": self._hits.get(tarefa, 0), "misses": self._misses.get(tarefa, 0)}
+                    for tarefa in sorted(set(self._hits) | set(self._misses))
+                },
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            conn = self._conexao()
+            conn.execute("DELETE FROM ai_response_cache")
+            conn.commit()
+            self._bytes = 0
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_PADRAO: Optional[AIResponseCache] = None
+_PADRAO_LOCK = threading.Lock()
+
+
+def get_default_cache() -> AIResponseCache:
+    """Cache unico do aparelho, em `<dados>/cache/ai_responses.db`."""
+    global _PADRAO
+    with _PADRAO_LOCK:
+        if _PADRAO is None:
+            pasta = get_data_dir() / "cache"
+            pasta.mkdir(parents=True, exist_ok=True)
+            _PADRAO = AIResponseCache(str(pasta / "ai_responses.db"))
+        return _PADRAO
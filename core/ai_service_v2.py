@@ -5,6 +5,7 @@ Suporta Google Gemini e OpenAI GPT
 """
 
 # -*- coding: utf-8 -*-
+import asyncio
 import json
 import random
 import time
@@ -13,9 +14,17 @@ import warnings
 import sys
 import os
 import re
-from typing import Optional, Dict, List, Any
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, List, Any, Tuple, Iterator, AsyncIterator, Callable
 from abc import ABC, abstractmethod
 
+from core import ai_health
+from core.ai_health import backoff_delay
+from core.chunk_index import ChunkIndex
+from core.json_stream import JsonArrayStreamParser
+
 try:
     from core.error_monitor import log_event
 except Exception:
@@ -70,12 +79,63 @@ class AIProvider(ABC):
     
     def __init__(self, api_key: str, model: str):
         self.api_key = api_key
+        # Modelo preferido (compartilhado): o fallback do Gemini troca para o que respondeu.
         self.model = model
+        # Erro e modelo da ultima chamada *desta thread*: a mesma instancia e
+        # reaproveitada (get_ai_provider) por acoes em threads diferentes.
+        self._chamada = threading.local()
+
+    def _estado_chamada(self) -> threading.local:
+        estado = self.__dict__.get("_chamada")
+        if estado is None:
+            estado = self.__dict__.setdefault("_chamada", threading.local())
+        return estado
+
+    @property
+    def last_error_kind(self) -> str:
+        return getattr(self._estado_chamada(), "error_kind", "")
+
+    @last_error_kind.setter
+    def last_error_kind(self, value: str) -> None:
+        self._estado_chamada().error_kind = str(value or "")
+
+    @property
+    def last_error_message(self) -> str:
+        return getattr(self._estado_chamada(), "error_message", "")
+
+    @last_error_message.setter
+    def last_error_message(self, value: str) -> None:
+        self._estado_chamada().error_message = str(value or "")
+
+    @property
+    def last_model(self) -> str:
+        """Modelo que respondeu a ultima chamada desta thread (sem resposta, o preferido)."""
+        return getattr(self._estado_chamada(), "model", "") or self.model
+
+    @last_model.setter
+    def last_model(self, value: str) -> None:
+        self._estado_chamada().model = str(value or "")
+
+    def _iniciar_chamada(self) -> None:
+        estado = self._estado_chamada()
+        estado.error_kind = ""
+        estado.error_message = ""
+        estado.model = ""
     
     @abstractmethod
     def generate_text(self, prompt: str) -> Optional[str]:
         """Gera texto a partir de um prompt"""
         pass
+
+    def models_health(self) -> List[Dict]:
+        """Estado (disjuntor/taxa) dos modelos deste provider; vazio se nao rastreado."""
+        return []
+
+    def generate_text_stream(self, prompt: str) -> Iterator[str]:
+        """Gera o texto em pedacos; sem suporte a streaming, entrega tudo de uma vez."""
+        text = self.generate_text(prompt)
+        if text:
+            yield text
     
     def extract_json_object(self, text: str) -> Optional[Dict]:
         """Extrai objeto JSON de texto"""
@@ -111,9 +171,8 @@ class GeminiProvider(AIProvider):
         if not _ensure_gemini_available():
             raise ImportError("google-genai nao esta instalado")
         self.client = genai.Client(api_key=api_key)
-        self.last_error_kind = ""
-        self.last_error_message = ""
         self._fallback_models = self._build_fallback_models(model)
+        self._key_fp = api_key_fingerprint(api_key)
 
     def _build_fallback_models(self, model: str) -> List[str]:
         preferred = [
@@ -135,32 +194,107 @@ class GeminiProvider(AIProvider):
             return "transient"
         return "other"
 
+    def _health(self, model: str) -> ai_health.ModelHealth:
+        return ai_health.health("gemini", self._key_fp, model)
+
+    def _candidate_models(self) -> List[str]:
+        """
+        Modelo que respondeu por ultimo primeiro, depois a ordem de fallback,
+        pulando os de disjuntor aberto para esta chave (estado do processo).
+        Lista vazia: todos abertos, a falha sai sem chamada de rede.
+        """
+        ordem = [self.model] + [m for m in self._fallback_models if m != self.model]
+        return [m for m in ordem if self._health(m).available()]
+
+    def _reservar(self, candidatos: List[str], idx: int) -> bool:
+        # Com outro modelo na fila, nao vale esperar o balde deste.
+        return self._health(candidatos[idx]).acquire(max_wait=1.0 if idx < len(candidatos) - 1 else 10.0)
+
+    def _registrar_erro(self, candidate_model: str, e: Exception) -> str:
+        msg = str(e)
+        kind = self._classify_error(msg)
+        self.last_error_kind = kind
+        self.last_error_message = msg
+        self._health(candidate_model).record_failure(kind)
+        return kind
+
+    def _sem_modelo_disponivel(self) -> None:
+        estados = ai_health.snapshot("gemini", self._key_fp, self._fallback_models)
+        kinds = [e["last_error_kind"] for e in estados if e["last_error_kind"]]
+        self.last_error_kind = "quota_hard" if "quota_hard" in kinds else (kinds[0] if kinds else "quota_soft")
+        self.last_error_message = "Limite local: todos os modelos em espera (quota exceeded / rate limit)"
+
     def generate_text(self, prompt: str) -> Optional[str]:
         """Gera texto usando Gemini"""
-        self.last_error_kind = ""
-        self.last_error_message = ""
+        self._iniciar_chamada()
 
-        for idx, candidate_model in enumerate(self._fallback_models):
+        candidatos = self._candidate_models()
+        tentou = False
+        for idx, candidate_model in enumerate(candidatos):
+            if not self._reservar(candidatos, idx):
+                continue
+            tentou = True
             try:
                 response = self.client.models.generate_content(model=candidate_model, contents=prompt)
                 text = getattr(response, "text", None)
                 if text:
-                    self.model = candidate_model
-                    if idx > 0:
+                    self._health(candidate_model).record_success()
+                    if candidate_model != self.model:
                         print(f"[GEMINI] Fallback ativado com sucesso: {candidate_model}")
+                    self.model = candidate_model
+                    self.last_model = candidate_model
                     return text
             except Exception as e:
-                msg = str(e)
-                kind = self._classify_error(msg)
-                self.last_error_kind = kind
-                self.last_error_message = msg
+                kind = self._registrar_erro(candidate_model, e)
                 print(f"[GEMINI] Erro ({candidate_model}): {e}")
-                if kind in ("quota_hard", "quota_soft") and idx < len(self._fallback_models) - 1:
+                if kind in ("quota_hard", "quota_soft"):
                     continue
-                if kind not in ("quota_hard", "quota_soft"):
-                    break
+                break
 
+        if not tentou:
+            self._sem_modelo_disponivel()
         return None
+
+    def generate_text_stream(self, prompt: str) -> Iterator[str]:
+        """Streaming com o mesmo fallback; so troca de modelo antes do primeiro pedaco."""
+        self._iniciar_chamada()
+
+        candidatos = self._candidate_models()
+        tentou = False
+        for idx, candidate_model in enumerate(candidatos):
+            if not self._reservar(candidatos, idx):
+                continue
+            tentou = True
+            recebeu = False
+            try:
+                for chunk in self.client.models.generate_content_stream(model=candidate_model, contents=prompt):
+                    text = getattr(chunk, "text", None)
+                    if not text:
+                        continue
+                    if not recebeu:
+                        recebeu = True
+                        self._health(candidate_model).record_success()
+                        if candidate_model != self.model:
+                            print(f"[GEMINI] Fallback ativado com sucesso: {candidate_model}")
+                        self.model = candidate_model
+                        self.last_model = candidate_model
+                    yield text
+                if recebeu:
+                    return
+            except Exception as e:
+                kind = self._registrar_erro(candidate_model, e)
+                print(f"[GEMINI] Erro no streaming ({candidate_model}): {e}")
+                if recebeu:
+                    return
+                if kind in ("quota_hard", "quota_soft"):
+                    continue
+                return
+
+        if not tentou:
+            self._sem_modelo_disponivel()
+
+    def models_health(self) -> List[Dict]:
+        return ai_health.snapshot("gemini", self._key_fp, self._fallback_models)
 # ========== OPENAI PROVIDER ==========
 class OpenAIProvider(AIProvider):
     """Provider para OpenAI GPT"""
@@ -170,8 +304,27 @@ class OpenAIProvider(AIProvider):
         if not _ensure_openai_available():
             raise ImportError("openai nÃ£o estÃ¡ instalado")
         self.client = OpenAI(api_key=api_key)
-        self.last_error_kind = ""
-        self.last_error_message = ""
+        self._key_fp = api_key_fingerprint(api_key)
+
+    def _health(self) -> ai_health.ModelHealth:
+        return ai_health.health("openai", self._key_fp, self.model)
+
+    def _reservar(self) -> bool:
+        """Disjuntor aberto ou balde vazio: falha na hora, sem chamada de rede."""
+        if self._health().acquire(max_wait=10.0):
+            return True
+        self.last_error_kind = self._health().last_error_kind or "quota_soft"
+        self.last_error_message = "Limite local: modelo em espera (rate limit)"
+        return False
+
+    def _registrar_erro(self, e: Exception) -> None:
+        msg = str(e)
+        self.last_error_kind = self._classify_error(msg)
+        self.last_error_message = msg
+        self._health().record_failure(self.last_error_kind)
+
+    def models_health(self) -> List[Dict]:
+        return ai_health.snapshot("openai", self._key_fp, [self.model])
 
     def _classify_error(self, message: str) -> str:
         msg = (message or "").lower()
@@ -187,8 +340,9 @@ class OpenAIProvider(AIProvider):
     
     def generate_text(self, prompt: str) -> Optional[str]:
         """Gera texto usando OpenAI"""
-        self.last_error_kind = ""
-        self.last_error_message = ""
+        self._iniciar_chamada()
+        if not self._reservar():
+            return None
         try:
             response = self.client.chat.completions.create(
                 model=self.model,
@@ -196,14 +350,40 @@ class OpenAIProvider(AIProvider):
                 temperature=0.7,
                 max_tokens=2000
             )
+            self._health().record_success()
             return response.choices[0].message.content
         except Exception as e:
-            msg = str(e)
-            self.last_error_kind = self._classify_error(msg)
-            self.last_error_message = msg
+            self._registrar_erro(e)
             print(f"[OPENAI] Erro: {e}")
             return None
 
+    def generate_text_stream(self, prompt: str) -> Iterator[str]:
+        """Gera texto usando OpenAI, pedaco a pedaco"""
+        self._iniciar_chamada()
+        if not self._reservar():
+            return
+        recebeu = False
+        try:
+            stream = self.client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.7,
+                max_tokens=2000,
+                stream=True,
+            )
+            for chunk in stream:
+                choices = getattr(chunk, "choices", None) or []
+                delta = getattr(choices[0], "delta", None) if choices else None
+                text = getattr(delta, "content", None) if delta is not None else None
+                if text:
+                    if not recebeu:
+                        recebeu = True
+                        self._health().record_success()
+                    yield text
+        except Exception as e:
+            self._registrar_erro(e)
+            print(f"[OPENAI] Erro no streaming: {e}")
+
 
 # ========== FACTORY ==========
 def create_ai_provider(provider_type: str, api_key: str, model: Optional[str] = None) -> AIProvider:
@@ -228,14 +408,129 @@ def create_ai_provider(provider_type: str, api_key: str, model: Optional[str] =
         raise ValueError(f"Provider desconhecido: {provider_type}")
 
 
+# ========== REGISTRO DE PROVIDERS ==========
+# Clientes ja aquecidos (SDK + conexao TLS) reaproveitados entre acoes, por
+# (provider, impressao digital da chave, modelo). Poucas entradas: um app
+# costuma ter 1-2 usuarios e o modo economia troca o modelo.
+_PROVEDORES: "OrderedDict[Tuple[str, str, str], AIProvider]" = OrderedDict()
+_PROVEDORES_LOCK = threading.Lock()
+_PROVEDORES_MAX = 6
+
+def api_key_fingerprint(api_key: Optional[str]) -> str:
+    return hashlib.sha256(str(api_key or "").encode("utf-8", errors="ignore")).hexdigest()[:16]
+
+
+def get_ai_provider(provider_type: str, api_key: str, model: Optional[str] = None) -> AIProvider:
+    """Como `create_ai_provider`, mas devolve o cliente ja criado para a mesma chave/modelo."""
+    chave = (str(provider_type or "").lower(), api_key_fingerprint(api_key), str(model or ""))
+    with _PROVEDORES_LOCK:
+        provider = _PROVEDORES.get(chave)
+        if provider is not None:
+            _PROVEDORES.move_to_end(chave)
+            return provider
+    provider = create_ai_provider(provider_type, api_key, model)
+    with _PROVEDORES_LOCK:
+        # Outra thread pode ter criado o mesmo cliente no meio tempo: fica o primeiro.
+        provider = _PROVEDORES.setdefault(chave, provider)
+        _PROVEDORES.move_to_end(chave)
+        while len(_PROVEDORES) > _PROVEDORES_MAX:
+            _PROVEDORES.popitem(last=False)
+    return provider
+
+
+def invalidate_ai_providers(api_key: Optional[str] = None) -> None:
+    """Descarta clientes e estado de saude (cota/disjuntor) de uma chave (ou de todas, sem `api_key`)."""
+    fp = api_key_fingerprint(api_key) if api_key is not None else None
+    with _PROVEDORES_LOCK:
+        for chave in [c for c in _PROVEDORES if fp is None or c[1] == fp]:
+            _PROVEDORES.pop(chave, None)
+    ai_health.reset(fp)
+
+
+async def _aiter_in_thread(gerar: Callable[[], Iterator[Dict]]) -> AsyncIterator[Dict]:
+    """Consome um gerador bloqueante numa thread e entrega os itens no event loop."""
+    loop = asyncio.get_running_loop()
+    fila: asyncio.Queue = asyncio.Queue()
+    parar = threading.Event()
+    fim = object()
+
+    def _enviar(item) -> bool:
+        try:
+            loop.call_soon_threadsafe(fila.put_nowait, item)
+            return True
+        except RuntimeError:
+            # Loop encerrado: ninguem mais consome.
+            return False
+
+    def _produzir():
+        try:
+            for item in gerar():
+                if parar.is_set() or not _enviar(item):
+                    break
+        except Exception as ex:
+            _enviar(ex)
+        finally:
+            _enviar(fim)
+
+    threading.Thread(target=_produzir, name="ai-stream", daemon=True).start()
+    try:
+        while True:
+            item = await fila.get()
+            if item is fim:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        parar.set()
+
+
+# Indice so em memoria para quem nao informa `chunk_index`.
+_INDICE_TRECHOS = ChunkIndex()
+
+
 # ========== SERVIÃ‡O DE AI ==========
 class AIService:
     """ServiÃ§o centralizado de AI"""
     
-    def __init__(self, provider: AIProvider, telemetry_opt_in: bool = False, user_anon: str = "anon"):
+    def __init__(
+        self,
+        provider: AIProvider,
+        telemetry_opt_in: bool = False,
+        user_anon: str = "anon",
+        response_cache=None,
+        chunk_index: Optional[ChunkIndex] = None,
+    ):
         self.provider = provider
         self.telemetry_opt_in = bool(telemetry_opt_in)
         self.user_anon = str(user_anon or "anon")
+        # core.ai_response_cache.AIResponseCache (opcional): prompts repetidos nao chamam o provedor.
+        self.response_cache = response_cache
+        # Trechos do material por BM25 (gravados em SQLite se o indice tiver arquivo).
+        self.chunk_index = chunk_index or _INDICE_TRECHOS
+        # Ultimo erro do provedor nas chamadas deste servico: o do provider e por
+        # thread, e a UI le depois de esperar a chamada em outra thread.
+        self.last_error_kind = ""
+        self.last_error_message = ""
+
+    # Orcamento (tokens estimados) do material enviado em cada tarefa.
+    CONTEXT_TOKENS = {"quiz_batch": 1200, "flashcards": 1200, "open_question": 900, "study_summary": 2000}
+
+    def _material_context(self, content: List[str], query: Optional[str], task: str, rng=random) -> str:
+        """Trechos mais relevantes para `query` (ou sorteados, sem consulta) dentro do orcamento da tarefa."""
+        return self.chunk_index.build_context(content, query, self.CONTEXT_TOKENS[task], rng)
+
+    def _provider_name(self) -> str:
+        return str(self.provider.__class__.__name__.replace("Provider", "")).lower()
+
+    def _provider_model(self, respondeu: bool = False) -> str:
+        """Modelo preferido do provider ou, com `respondeu`, o que atendeu a ultima chamada desta thread."""
+        modelo = getattr(self.provider, "last_model", None) if respondeu else None
+        return str(modelo or getattr(self.provider, "model", "") or "")
+
+    def _guardar_erro_provedor(self) -> None:
+        self.last_error_kind = self._provider_error_kind()
+        self.last_error_message = str(getattr(self.provider, "last_error_message", "") or "")
 
     def _emit_ai_event(
         self,
@@ -246,12 +541,12 @@ class AIService:
     ) -> None:
         if not self.telemetry_opt_in:
             return
-        provider_name = str(self.provider.__class__.__name__.replace("Provider", "")).lower()
+        provider_name = self._provider_name()
         payload = {
             "timestamp": datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z",
             "feature_name": str(feature_name or "unknown"),
             "provider": provider_name,
-            "model": str(getattr(self.provider, "model", "") or ""),
+            "model": self._provider_model(respondeu=True),
             "latency_ms": int(max(0, latency_ms or 0)),
             "error_code": str(error_code or ""),
             "user_anon": self.user_anon,
@@ -261,12 +556,25 @@ class AIService:
         except Exception:
             pass
 
-    def _call_provider_text(self, prompt: str, feature_name: str) -> Optional[str]:
+    def _call_provider_text(self, prompt: str, feature_name: str, use_cache: bool = True) -> Optional[str]:
+        """
+        Chama o provedor. Com `use_cache`, uma resposta ja validada para o mesmo
+        prompt volta do cache; as retentativas passam `use_cache=False` para nao
+        repetir uma resposta que acabou de falhar na validacao.
+        """
+        if use_cache and self.response_cache is not None:
+            cached = self.response_cache.get(
+                feature_name, self._provider_name(), self._provider_model(), prompt
+            )
+            if cached is not None:
+                self._emit_ai_event("ai_cache_hit", feature_name=feature_name)
+                return cached
         started = time.perf_counter()
         self._emit_ai_event("ai_call_started", feature_name=feature_name)
         error_code = ""
         try:
             text = self.provider.generate_text(prompt)
+            self._guardar_erro_provedor()
             if not text:
                 error_code = self._provider_error_kind() or "empty_response"
             return text
@@ -281,6 +589,14 @@ class AIService:
                 latency_ms=latency,
                 error_code=error_code,
             )
+
+    def _cache_response(self, prompt: str, feature_name: str, text: Optional[str]) -> None:
+        """Guarda a resposta crua depois que ela passou pela validacao da tarefa."""
+        if self.response_cache is None or not text:
+            return
+        self.response_cache.put(
+            feature_name, self._provider_name(), self._provider_model(respondeu=True), prompt, text
+        )
     
     def _normalize_quiz(self, data: Dict) -> Optional[Dict]:
         """Normaliza dados de quiz"""
@@ -427,15 +743,21 @@ class AIService:
         """Evita repeticao de chamadas quando erro e terminal para a sessao."""
         return self._provider_error_kind() in {"quota_hard", "quota_soft", "auth"}
 
+    def health_snapshot(self) -> List[Dict]:
+        """Disjuntor e taxa aprendida de cada modelo do provider (para a UI)."""
+        try:
+            return list(self.provider.models_health())
+        except Exception:
+            return []
+
+    def quota_exhausted(self) -> bool:
+        """Todos os modelos em espera por cota: responde sem chamada de rede."""
+        return ai_health.quota_exhausted(self.health_snapshot())
+
     def _build_quiz_context(self, content: Optional[List[str]], topic: Optional[str]) -> Optional[str]:
         contexto = ""
         if content:
-            sample_size = min(4, len(content))
-            try:
-                amostra = random.sample(content, sample_size)
-            except Exception:
-                amostra = list(content[:sample_size])
-            texto_base = "\n".join(amostra)[:6000]
+            texto_base = self._material_context(content, topic, "quiz_batch")
             contexto = f"Baseado no texto:\n{texto_base}\n"
             if topic:
                 contexto += f"\nFoque no topico: {topic}."
@@ -472,25 +794,17 @@ class AIService:
                 break
         return result
 
-    def generate_quiz_batch(
+    def _quiz_batch_prompt(
         self,
-        content: Optional[List[str]] = None,
-        topic: Optional[str] = None,
-        difficulty: str = "Medio",
-        quantity: int = 3,
-        retries: int = 2,
-    ) -> List[Dict]:
-        """
-        Gera varias questoes em uma unica chamada para reduzir latencia/custo.
-        """
-        quantidade = max(1, min(10, int(quantity or 1)))
-        tentativas = max(1, int(retries or 1))
+        content: Optional[List[str]],
+        topic: Optional[str],
+        difficulty: str,
+        quantidade: int,
+    ) -> Optional[str]:
         contexto = self._build_quiz_context(content, topic)
         if not contexto:
-            print("[AI] Sem conteudo ou topico")
-            return []
-
-        prompt = f"""
+            return None
+        return f"""
 {contexto}
 
 Crie {quantidade} questoes de multipla escolha nivel {difficulty}.
@@ -508,9 +822,27 @@ Formato JSON obrigatorio:
 ]
 """
 
+    def generate_quiz_batch(
+        self,
+        content: Optional[List[str]] = None,
+        topic: Optional[str] = None,
+        difficulty: str = "Medio",
+        quantity: int = 3,
+        retries: int = 2,
+    ) -> List[Dict]:
+        """
+        Gera varias questoes em uma unica chamada para reduzir latencia/custo.
+        """
+        quantidade = max(1, min(10, int(quantity or 1)))
+        tentativas = max(1, int(retries or 1))
+        prompt = self._quiz_batch_prompt(content, topic, difficulty, quantidade)
+        if not prompt:
+            print("[AI] Sem conteudo ou topico")
+            return []
+
         for attempt in range(tentativas):
             try:
-                text = self._call_provider_text(prompt, "quiz_batch")
+                text = self._call_provider_text(prompt, "quiz_batch", use_cache=attempt == 0)
                 if not text:
                     if self._should_abort_retry():
                         break
@@ -524,6 +856,7 @@ Formato JSON obrigatorio:
                 normalizadas = [q for q in normalizadas if self.validate_task_payload("quiz", q)[0]]
                 if normalizadas:
                     print(f"[AI] [OK] {len(normalizadas)} questoes geradas em lote")
+                    self._cache_response(prompt, "quiz_batch", text)
                     return normalizadas
 
                 print(f"[AI] Tentativa {attempt + 1}: lote invalido")
@@ -533,7 +866,7 @@ Formato JSON obrigatorio:
                     break
 
             if attempt < tentativas - 1:
-                time.sleep(0.35)
+                time.sleep(backoff_delay(attempt))
 
         print("[AI] [ERRO] Falha ao gerar lote de questoes")
         return []
@@ -594,11 +927,170 @@ Formato JSON obrigatorio:
             return None
         return {"frente": frente, "verso": verso}
 
+    def _stream_json_items(
+        self,
+        prompt: str,
+        feature_name: str,
+        normalize: Callable[[Dict], Optional[Dict]],
+        limit: int,
+        retries: int,
+        use_cache: bool = True,
+    ) -> Iterator[Dict]:
+        """
+        Itens de uma lista JSON conforme o provedor escreve: cada objeto sai
+        (ja normalizado) quando sua chave de fechamento chega. Uma resposta
+        cacheada passa pelo mesmo parser; sem `use_cache`, vai sempre ao provedor.
+        So vai para o cache a resposta cuja lista fechou sem erro do provedor:
+        um stream cortado devolveria menos itens a cada repeticao.
+        """
+        tentativas = max(1, int(retries or 1))
+        limite = max(1, int(limit or 1))
+        for attempt in range(tentativas):
+            cached = None
+            if attempt == 0 and use_cache and self.response_cache is not None:
+                cached = self.response_cache.get(
+                    feature_name, self._provider_name(), self._provider_model(), prompt
+                )
+            parser = JsonArrayStreamParser()
+            partes: List[str] = []
+            entregues = 0
+            completo = False
+            started = time.perf_counter()
+            if cached is None:
+                self._emit_ai_event("ai_call_started", feature_name=feature_name)
+            else:
+                self._emit_ai_event("ai_cache_hit", feature_name=feature_name)
+            try:
+                pedacos = [cached] if cached is not None else self.provider.generate_text_stream(prompt)
+                for pedaco in pedacos:
+                    partes.append(pedaco)
+                    for obj in parser.feed(pedaco):
+                        item = normalize(obj)
+                        if item is None:
+                            continue
+                        entregues += 1
+                        yield item
+                        if entregues >= limite:
+                            break
+                    if entregues >= limite:
+                        break
+                completo = parser.closed
+            except Exception as e:
+                print(f"[AI] Tentativa {attempt + 1} erro no streaming ({feature_name}): {e}")
+            finally:
+                if cached is None:
+                    self._guardar_erro_provedor()
+                    self._emit_ai_event(
+                        "ai_call_finished",
+                        feature_name=feature_name,
+                        latency_ms=int(max(0.0, (time.perf_counter() - started) * 1000.0)),
+                        error_code="" if entregues else (self._provider_error_kind() or "empty_response"),
+                    )
+            if entregues:
+                if cached is None and completo and not self._provider_error_kind():
+                    self._cache_response(prompt, feature_name, "".join(partes))
+                print(f"[AI] [OK] {entregues} itens via streaming ({feature_name})")
+                return
+            if self._should_abort_retry():
+                break
+            if attempt < tentativas - 1:
+                time.sleep(backoff_delay(attempt))
+        print(f"[AI] [ERRO] Falha no streaming ({feature_name})")
+
+    def iter_quiz_batch(
+        self,
+        content: Optional[List[str]] = None,
+        topic: Optional[str] = None,
+        difficulty: str = "Medio",
+        quantity: int = 3,
+        retries: int = 2,
+    ) -> Iterator[Dict]:
+        """Como `generate_quiz_batch`, mas entrega cada questao assim que fica completa."""
+        quantidade = max(1, min(10, int(quantity or 1)))
+        prompt = self._quiz_batch_prompt(content, topic, difficulty, quantidade)
+        if not prompt:
+            print("[AI] Sem conteudo ou topico")
+            return
+        vistas = set()
+
+        def _normalizar(obj: Dict) -> Optional[Dict]:
+            lote = self._normalize_quiz_batch_payload([obj], 1)
+            quiz = lote[0] if lote else None
+            if not quiz or not self.validate_task_payload("quiz", quiz)[0]:
+                return None
+            chave = quiz.get("pergunta", "").strip().lower()
+            if chave in vistas:
+                return None
+            vistas.add(chave)
+            return quiz
+
+        yield from self._stream_json_items(prompt, "quiz_batch", _normalizar, quantidade, retries)
+
+    def iter_flashcards(
+        self,
+        content: List[str],
+        quantity: int = 5,
+        retries: int = 2,
+        use_cache: bool = True,
+        avoid: Optional[List[str]] = None,
+    ) -> Iterator[Dict]:
+        """Como `generate_flashcards`, mas entrega cada card assim que fica completo."""
+        if not content:
+            return
+        quantidade = max(1, min(20, int(quantity or 5)))
+        prompt = self._flashcards_prompt(content, quantidade, avoid)
+        vistos = set()
+
+        def _normalizar(obj: Dict) -> Optional[Dict]:
+            card = self._normalize_flashcard(obj)
+            if not card or not self.validate_task_payload("flashcard", card)[0]:
+                return None
+            chave = card["frente"].lower()
+            if chave in vistos:
+                return None
+            vistos.add(chave)
+            return card
+
+        yield from self._stream_json_items(prompt, "flashcards", _normalizar, quantidade, retries, use_cache)
+
+    def generate_quiz_batch_stream(self, *args, **kwargs) -> AsyncIterator[Dict]:
+        """Iterador assincrono de `iter_quiz_batch` (o provedor roda fora do event loop)."""
+        return _aiter_in_thread(lambda: self.iter_quiz_batch(*args, **kwargs))
+
+    def generate_flashcards_stream(self, *args, **kwargs) -> AsyncIterator[Dict]:
+        """Iterador assincrono de `iter_flashcards` (o provedor roda fora do event loop)."""
+        return _aiter_in_thread(lambda: self.iter_flashcards(*args, **kwargs))
+
+    # Frentes recusadas citadas no prompt de reposicao (o resto so aumentaria o prompt).
+    MAX_AVOID = 20
+
+    def _flashcards_prompt(self, content: List[str], quantidade: int, avoid: Optional[List[str]] = None) -> str:
+        texto_amostra = self._material_context(content, None, "flashcards")
+        evitar = [str(x).strip()[:120] for x in (avoid or []) if str(x).strip()][-self.MAX_AVOID:]
+        if evitar:
+            texto_amostra += "\n\nNao repita (nem reformule) estes flashcards:\n" + "\n".join(f"- {x}" for x in evitar)
+        return f"""
+Gere {quantidade} flashcards do texto abaixo.
+
+IMPORTANTE: Responda APENAS com JSON vÃ¡lido, sem texto adicional.
+
+Formato JSON obrigatÃ³rio:
+[
+  {{"frente": "Pergunta ou conceito...", "verso": "Resposta ou explicaÃ§Ã£o..."}},
+  {{"frente": "...", "verso": "..."}}
+]
+
+Texto:
+{texto_amostra}
+"""
+
     def generate_flashcards(
         self,
         content: List[str],
         quantity: int = 5,
-        retries: int = 2
+        retries: int = 2,
+        use_cache: bool = True,
+        avoid: Optional[List[str]] = None,
     ) -> List[Dict]:
         """
         Gera flashcards
@@ -607,6 +1099,8 @@ Formato JSON obrigatorio:
             content: Textos do PDF
             quantity: Quantidade de flashcards
             retries: Tentativas
+            use_cache: Aceitar resposta do cache (desligar para pedir cards novos)
+            avoid: Frentes que a IA nao deve repetir
         
         Returns:
             Lista de dicts com 'frente' e 'verso'
@@ -616,26 +1110,11 @@ Formato JSON obrigatorio:
 
         quantidade = max(1, min(20, int(quantity or 5)))
         tentativas = max(1, int(retries or 1))
-        texto_amostra = "\n".join(random.sample(content, min(4, len(content))))[:6000]
-
-        prompt = f"""
-Gere {quantidade} flashcards do texto abaixo.
-
-IMPORTANTE: Responda APENAS com JSON vÃ¡lido, sem texto adicional.
-
-Formato JSON obrigatÃ³rio:
-[
-  {{"frente": "Pergunta ou conceito...", "verso": "Resposta ou explicaÃ§Ã£o..."}},
-  {{"frente": "...", "verso": "..."}}
-]
-
-Texto:
-{texto_amostra}
-"""
+        prompt = self._flashcards_prompt(content, quantidade, avoid)
 
         for attempt in range(tentativas):
             try:
-                text = self._call_provider_text(prompt, "flashcards")
+                text = self._call_provider_text(prompt, "flashcards", use_cache=use_cache and attempt == 0)
                 if not text:
                     if self._should_abort_retry():
                         break
@@ -668,6 +1147,7 @@ Texto:
                             break
                     if cards:
                         print(f"[AI] [OK] {len(cards)} flashcards gerados")
+                        self._cache_response(prompt, "flashcards", text)
                         return cards
 
                 print(f"[AI] Tentativa {attempt + 1}: Lista JSON invalida")
@@ -678,7 +1158,7 @@ Texto:
                 if self._should_abort_retry():
                     break
             if attempt < tentativas - 1:
-                time.sleep(0.35)
+                time.sleep(backoff_delay(attempt))
 
         print("[AI] [ERRO] Falha ao gerar flashcards")
         return []
@@ -698,7 +1178,7 @@ Texto:
         if not content:
             return None
         
-        texto_amostra = "\n".join(random.sample(content, min(2, len(content))))[:5000]
+        texto_amostra = self._material_context(content, None, "open_question")
         
         prompt = f"""
 Crie 1 pergunta dissertativa nÃ­vel {difficulty}.
@@ -718,7 +1198,7 @@ Texto:
         tentativas = max(1, int(retries or 1))
         for attempt in range(tentativas):
             try:
-                text = self._call_provider_text(prompt, "open_question")
+                text = self._call_provider_text(prompt, "open_question", use_cache=attempt == 0)
                 if not text:
                     if self._should_abort_retry():
                         break
@@ -727,6 +1207,7 @@ Texto:
                 data = self.provider.extract_json_object(text)
                 if data and "pergunta" in data:
                     print("[AI] [OK] Pergunta aberta gerada")
+                    self._cache_response(prompt, "open_question", text)
                     return data
                 
                 print(f"[AI] Tentativa {attempt + 1}: JSON invÃ¡lido")
@@ -737,7 +1218,7 @@ Texto:
                     break
             
             if attempt < tentativas - 1:
-                time.sleep(0.35)
+                time.sleep(backoff_delay(attempt))
         
         print("[AI] [ERRO] Falha ao gerar pergunta aberta")
         return None
@@ -779,7 +1260,7 @@ Nota de 0 a 100. Considere correto se nota >= 70.
         tentativas = max(1, int(retries or 1))
         for attempt in range(tentativas):
             try:
-                text = self._call_provider_text(prompt, "grade_open_answer")
+                text = self._call_provider_text(prompt, "grade_open_answer", use_cache=attempt == 0)
                 if not text:
                     if self._should_abort_retry():
                         break
@@ -788,6 +1269,7 @@ Nota de 0 a 100. Considere correto se nota >= 70.
                 data = self.provider.extract_json_object(text)
                 if data and "nota" in data:
                     print(f"[AI] [OK] Resposta corrigida: {data.get('nota')}")
+                    self._cache_response(prompt, "grade_open_answer", text)
                     return data
                 
                 print(f"[AI] Tentativa {attempt + 1}: JSON invÃ¡lido")
@@ -798,7 +1280,7 @@ Nota de 0 a 100. Considere correto se nota >= 70.
                     break
             
             if attempt < tentativas - 1:
-                time.sleep(0.35)
+                time.sleep(backoff_delay(attempt))
         
         print("[AI] âŒ Falha ao corrigir resposta")
         return {
@@ -829,15 +1311,16 @@ Explique para um estudante iniciante:
         tentativas = max(1, int(retries or 1))
         for attempt in range(tentativas):
             try:
-                text = self._call_provider_text(prompt, "explain_simple")
+                text = self._call_provider_text(prompt, "explain_simple", use_cache=attempt == 0)
                 if text:
+                    self._cache_response(prompt, "explain_simple", text)
                     return text.strip()
             except Exception as e:
                 print(f"[AI] Tentativa {attempt + 1} erro: {e}")
                 if self._should_abort_retry():
                     break
             if attempt < tentativas - 1:
-                time.sleep(0.35)
+                time.sleep(backoff_delay(attempt))
         
         return "Nao foi possivel gerar uma explicacao simplificada no momento."
 
@@ -872,7 +1355,7 @@ Retorne APENAS JSON no formato:
         tentativas = max(1, int(retries or 1))
         for attempt in range(tentativas):
             try:
-                text = self._call_provider_text(prompt, "study_plan")
+                text = self._call_provider_text(prompt, "study_plan", use_cache=attempt == 0)
                 if not text:
                     if self._should_abort_retry():
                         break
@@ -894,12 +1377,13 @@ Retorne APENAS JSON no formato:
                             continue
                         result.append(row)
                     if result:
+                        self._cache_response(prompt, "study_plan", text)
                         return result
             except Exception:
                 if self._should_abort_retry():
                     break
             if attempt < tentativas - 1:
-                time.sleep(0.35)
+                time.sleep(backoff_delay(attempt))
 
         # Fallback deterministico
         dias = ["Seg", "Ter", "Qua", "Qui", "Sex", "Sab", "Dom"]
@@ -1172,7 +1656,9 @@ Retorne APENAS JSON no formato:
         if not content:
             return _normalize_summary_payload({})
 
-        texto = "\n".join(content[:8])[:9000]
+        # Resumo cobre o material todo (trechos espalhados) e sem sorteio: o
+        # mesmo material gera o mesmo prompt e aproveita o cache de respostas.
+        texto = self._material_context(content, None, "study_summary", rng=None)
         prompt = f"""
 Voce e um mentor de estudo para concursos e certificacoes tecnicas.
 Gere um resumo acionavel em JSON.
@@ -1199,7 +1685,7 @@ Material:
         tentativas = max(1, int(retries or 1))
         for attempt in range(tentativas):
             try:
-                text = self._call_provider_text(prompt, "study_summary")
+                text = self._call_provider_text(prompt, "study_summary", use_cache=attempt == 0)
                 if not text:
                     if self._should_abort_retry():
                         break
@@ -1208,12 +1694,13 @@ Material:
                 if isinstance(data, dict):
                     normalized = _normalize_summary_payload(data)
                     if normalized.get("resumo_curto") and self.validate_task_payload("study_summary", normalized)[0]:
+                        self._cache_response(prompt, "study_summary", text)
                         return normalized
             except Exception:
                 if self._should_abort_retry():
                     break
             if attempt < tentativas - 1:
-                time.sleep(0.35)
+                time.sleep(backoff_delay(attempt))
         return _normalize_summary_payload({})
 
 
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""Codificacao compacta (e versionada) dos blobs JSON gravados no SQLite."""
+
+from __future__ import annotations
+
+import json
+import struct
+import zlib
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence, Tuple, Union
+
+# Layout v1: MAGIC | versao (1 byte) | codec (1 byte) | tamanho dos campos leves (u16)
+#            | campos leves (JSON compacto, sem compressao) | corpo (JSON compacto, comprimido)
+# JSON textual nunca comeca com 0xB1 (nem e byte inicial valido em UTF-8), entao
+# linhas antigas gravadas como texto continuam sendo lidas sem ambiguidade.
+_MAGIC = b"\xb1"
+_VERSAO = 1
+_CABECALHO = struct.Struct(">BBH")
+_MAX_LEVES = 0xFFFF
+
+# Abaixo disso a compressao raramente compensa o custo de descomprimir.
+_MIN_COMPRIMIR = 160
+
+# Dicionario pre-definido do codec "zlib-dict": trechos recorrentes nas questoes
+# e pacotes gerados. NUNCA alterar: blobs gravados dependem dele byte a byte
+# (um dicionario novo precisa de um novo id de codec).
+_DICIONARIO_V1 = (
+    '{"enunciado":"","alternativas":["","","",""],"correta_index":0,"explicacao":"",'
+    '"tema":"","dificuldade":"intermediario","assunto":"","fonte":"","questoes":[],'
+    '"flashcards":[{"frente":"","verso":""}],"resumo":"","topicos":[],"respostas":{},'
+    '"current_idx":0,"updated_at":"","Qual das alternativas","Assinale a alternativa correta",'
+    ' de que a da do para com uma um por nao e o os as no na em '
+).encode("utf-8")
+
+Blob = Union[str, bytes, bytearray, memoryview, None]
+
+
+def _zlib_dict_comprimir(dados: bytes) -> bytes:
+    comp = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS, 8, zlib.Z_DEFAULT_STRATEGY, _DICIONARIO_V1)
+    return comp.compress(dados) + comp.flush()
+
+
+def _zlib_dict_descomprimir(dados: bytes) -> bytes:
+    decomp = zlib.decompressobj(zlib.MAX_WBITS, _DICIONARIO_V1)
+    return decomp.decompress(dados) + decomp.flush()
+
+
+def _identidade(dados: bytes) -> bytes:
+    return dados
+
+
+# id -> (nome, comprimir, descomprimir). Ids sao gravados nos blobs: nao reutilizar.
+_CODECS: Dict[int, Tuple[str, Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    0: ("json", _identidade, _identidade),
+    1: ("zlib", lambda d: zlib.compress(d, 6), zlib.decompress),
+    2: ("zlib-dict", _zlib_dict_comprimir, _zlib_dict_descomprimir),
+}
+_CODEC_POR_NOME = {nome: codec_id for codec_id, (nome, _c, _d) in _CODECS.items()}
+
+CODEC_PADRAO = "zlib-dict"
+
+
+def register_codec(
+    codec_id: int,
+    nome: str,
+    comprimir: Callable[[bytes], bytes],
+    descomprimir: Callable[[bytes], bytes],
+) -> None:
+    """Registra um codec extra (ex.: zstd com dicionario treinado)."""
+    codec_id = int(codec_id)
+    if not 0 <= codec_id <= 255:
+        raise ValueError("codec_id deve caber em um byte")
+    if codec_id in _CODECS or nome in _CODEC_POR_NOME:
+        raise ValueError(f"Codec ja registrado: {codec_id}/{nome}")
+    _CODECS[codec_id] = (nome, comprimir, descomprimir)
+    _CODEC_POR_NOME[nome] = codec_id
+
+
+def _json_compacto(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_blob(obj: Any, leves: Sequence[str] = (), codec: Optional[str] = None) -> bytes:
+    """
+    Serializa `obj` no formato versionado.
+
+    Campos listados em `leves` (de um dict) ficam fora da compressao, para que
+    `peek_blob`/`LazyBlob` os leiam sem decodificar o corpo. O codec so e usado
+    quando de fato reduz o tamanho; senao o corpo vai como JSON compacto.
+    """
+    leves_dict: Dict[str, Any] = {}
+    corpo_obj = obj
+    if leves and isinstance(obj, dict):
+        leves_dict = {k: obj[k] for k in leves if k in obj}
+        if leves_dict:
+            corpo_obj = {k: v for k, v in obj.items() if k not in leves_dict}
+    leves_bytes = _json_compacto(leves_dict) if leves_dict else b""
+    if len(leves_bytes) > _MAX_LEVES:
+        leves_bytes, corpo_obj = b"", obj
+    corpo = _json_compacto(corpo_obj)
+
+    codec_id = 0
+    if len(corpo) >= _MIN_COMPRIMIR:
+        candidato = _CODEC_POR_NOME[codec or CODEC_PADRAO]
+        comprimido = _CODECS[candidato][1](corpo)
+        if len(comprimido) < len(corpo):
+            codec_id, corpo = candidato, comprimido
+    return _MAGIC + _CABECALHO.pack(_VERSAO, codec_id, len(leves_bytes)) + leves_bytes + corpo
+
+
+def _como_bytes(valor: Blob) -> Optional[bytes]:
+    if isinstance(valor, (bytes, bytearray, memoryview)):
+        return bytes(valor)
+    return None
+
+
+def _separar(raw: bytes) -> Tuple[int, bytes, bytes]:
+    """Retorna (codec, campos leves, corpo) de um blob versionado."""
+    inicio = len(_MAGIC) + _CABECALHO.size
+    if len(raw) < inicio:
+        raise ValueError("Blob truncado")
+    versao, codec_id, n_leves = _CABECALHO.unpack_from(raw, len(_MAGIC))
+    if versao != _VERSAO:
+        raise ValueError(f"Versao de blob nao suportada: {versao}")
+    if codec_id not in _CODECS:
+        raise ValueError(f"Codec de blob desconhecido: {codec_id}")
+    return codec_id, raw[inicio:inicio + n_leves], raw[inicio + n_leves:]
+
+
+def is_encoded(valor: Blob) -> bool:
+    raw = _como_bytes(valor)
+    return raw is not None and raw.startswith(_MAGIC)
+
+
+def decode_blob(valor: Blob, padrao: Any = None) -> Any:
+    """
+    Decodifica um blob versionado ou o JSON textual das linhas antigas.
+
+    Vazio/NULL retorna `padrao` (por omissao, `{}`).
+    """
+    if padrao is None:
+        padrao = {}
+    if valor is None or valor == "" or valor == b"":
+        return padrao
+    raw = _como_bytes(valor)
+    if raw is None or not raw.startswith(_MAGIC):
+        texto = raw.decode("utf-8") if raw is not None else str(valor)
+        return json.loads(texto)
+    codec_id, leves, corpo = _separar(raw)
+    obj = json.loads(_CODECS[codec_id][2](corpo).decode("utf-8"))
+    if leves:
+        base = json.loads(leves.decode("utf-8"))
+        base.update(obj)
+        obj = base
+    return obj
+
+
+def peek_blob(valor: Blob, *campos: str) -> Dict[str, Any]:
+    """
+    Le apenas `campos` de um blob dict. Se todos estiverem entre os campos
+    leves, o corpo comprimido nao e tocado.
+    """
+    raw = _como_bytes(valor)
+    if raw is not None and raw.startswith(_MAGIC):
+        _codec, leves, _corpo = _separar(raw)
+        base = json.loads(leves.decode("utf-8")) if leves else {}
+        if all(c in base for c in campos):
+            return {c: base[c] for c in campos}
+    obj = decode_blob(valor)
+    if not isinstance(obj, dict):
+        return {}
+    return {c: obj[c] for c in campos if c in obj}
+
+
+class LazyBlob(Mapping):
+    """
+    Visao somente-leitura de um blob dict que adia a decodificacao do corpo
+    ate o primeiro acesso a um campo que nao esteja entre os leves.
+    """
+
+    __slots__ = ("_raw", "_leves", "_cheio")
+
+    def __init__(self, valor: Blob):
+        self._raw = valor
+        self._cheio: Optional[Dict[str, Any]] = None
+        self._leves: Dict[str, Any] = {}
+        raw = _como_bytes(valor)
+        if raw is not None and raw.startswith(_MAGIC):
+            _codec, leves, _corpo = _separar(raw)
+            if leves:
+                self._leves = json.loads(leves.decode("utf-8"))
+
+    def _carregar(self) -> Dict[str, Any]:
+        if self._cheio is None:
+            obj = decode_blob(self._raw)
+            self._cheio = obj if isinstance(obj, dict) else {}
+        return self._cheio
+
+    @property
+    def decoded(self) -> bool:
+        return self._cheio is not None
+
+    def __getitem__(self, chave: str) -> Any:
+        if self._cheio is None and chave in self._leves:
+            return self._leves[chave]
+        return self._carregar()[chave]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._carregar())
+
+    def __len__(self) -> int:
+        return len(self._carregar())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self._carregar())
@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""Recuperacao de trechos do material (BM25) para montar o contexto dos prompts."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from core.app_paths import get_data_dir
+from core.error_monitor import log_exception
+
+CHUNK_CHARS = 1200
+# Elementos curtos do conteudo (linhas de referencia digitadas, dica de
+# filtros, "Tema central: ...") sao instrucoes do pedido: entram sempre.
+FIXO_MAX_CHARS = 400
+K1 = 1.2
+B = 0.75
+
+_SEM_ACENTO = str.maketrans("áàâãäéèêëíìîïóòôõöúùûüç", "aaaaaeeeeiiiiooooouuuuc")
+_PALAVRA = re.compile(r"\w+")
+_FIM_FRASE = re.compile(r"(?<=[.!?;:])\s+")
+_STOPWORDS = frozenset(
+    "de da do das dos a o as os e em no na nos nas um uma uns umas por para com sem que se ao aos "
+    "ou como mais mas sua seu suas seus ser sao foi pelo pela pelos pelas entre sobre isso esta este "
+    "the of and to in is for on with".split()
+)
+
+
+def estimate_tokens(texto: str) -> int:
+    """Estimativa barata (~4 caracteres por token), suficiente para orcamento de prompt."""
+    return max(1, len(str(texto or "")) // 4)
+
+
+def terms(texto: str) -> List[str]:
+    """Termos de busca: minusculas, sem acento, sem stopwords e com plural simples removido."""
+    out = []
+    for token in _PALAVRA.findall(str(texto or "").lower().translate(_SEM_ACENTO)):
+        if len(token) < 2 or token in _STOPWORDS:
+            continue
+        if len(token) > 4 and token.endswith("s"):
+            token = token[:-1]
+        out.append(token)
+    return out
+
+
+def term_counts(texto: str) -> Dict[str, int]:
+    contagem: Dict[str, int] = {}
+    for termo in terms(texto):
+        contagem[termo] = contagem.get(termo, 0) + 1
+    return contagem
+
+
+def _partes(linha: str, max_chars: int) -> List[str]:
+    """Quebra uma linha longa por frase e, se ainda preciso, por espaco."""
+    if len(linha) <= max_chars:
+        return [linha]
+    out: List[str] = []
+    for frase in _FIM_FRASE.split(linha):
+        while len(frase) > max_chars:
+            corte = frase.rfind(" ", 0, max_chars)
+            corte = corte if corte > max_chars // 2 else max_chars
+            out.append(frase[:corte].strip())
+            frase = frase[corte:].strip()
+        if frase:
+            out.append(frase)
+    return out
+
+
+def chunk_text(texto: str, max_chars: int = CHUNK_CHARS) -> List[str]:
+    """Trechos de ate `max_chars`, juntando linhas/paragrafos inteiros sempre que cabem."""
+    trechos: List[str] = []
+    atual: List[str] = []
+    tamanho = 0
+    for linha in str(texto or "").splitlines():
+        for parte in _partes(re.sub(r"\s+", " ", linha).strip(), max_chars):
+            if not parte:
+                continue
+            if atual and tamanho + len(parte) + 1 > max_chars:
+                trechos.append("\n".join(atual))
+                atual, tamanho = [], 0
+            atual.append(parte)
+            tamanho += len(parte) + 1
+    if atual:
+        trechos.append("\n".join(atual))
+    return trechos
+
+
+def document_key(texto: str) -> str:
+    return hashlib.sha256(str(texto or "").encode("utf-8", errors="ignore")).hexdigest()
+
+
+class BM25Index:
+    """
+    Indice invertido BM25 sobre uma lista de trechos. Recebe as contagens de
+    termos prontas (vindas do SQLite) ou calcula a partir do texto.
+    """
+
+    def __init__(self, chunks: Sequence[str], counts: Optional[Sequence[Dict[str, int]]] = None):
+        self.chunks = list(chunks)
+        counts = list(counts) if counts is not None else [term_counts(c) for c in self.chunks]
+        self.tokens = [estimate_tokens(c) for c in self.chunks]
+        tamanhos = [sum(c.values()) for c in counts]
+        media = (sum(tamanhos) / float(len(tamanhos))) if tamanhos else 0.0
+        self._norma = [K1 * (1.0 - B + B * (t / media)) if media else K1 for t in tamanhos]
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        for i, contagem in enumerate(counts):
+            for termo, freq in contagem.items():
+                self._postings.setdefault(termo, []).append((i, int(freq)))
+        n = len(self.chunks)
+        self._idf = {
+            termo: math.log(1.0 + (n - len(lista) + 0.5) / (len(lista) + 0.5))
+            for termo, lista in self._postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def scores(self, query: str) -> Dict[int, float]:
+        """Pontuacao dos trechos que tem ao menos um termo da consulta."""
+        out: Dict[int, float] = {}
+        for termo in set(terms(query)):
+            idf = self._idf.get(termo)
+            if idf is None:
+                continue
+            for i, freq in self._postings[termo]:
+                out[i] = out.get(i, 0.0) + idf * freq * (K1 + 1.0) / (freq + self._norma[i])
+        return out
+
+    def rank(self, query: str) -> List[int]:
+        pontos = self.scores(query)
+        return sorted(pontos, key=lambda i: (-pontos[i], i))
+
+
+def _ordem_espalhada(n: int) -> List[int]:
+    """Posicoes 0..n-1 em ordem de van der Corput: qualquer prefixo cobre o documento todo."""
+    vistos = set()
+    ordem: List[int] = []
+    k = 0
+    while len(ordem) < n:
+        x, f, j = 0.0, 0.5, k
+        while j:
+            x += f * (j & 1)
+            j >>= 1
+            f /= 2.0
+        k += 1
+        i = int(x * n)
+        if i not in vistos:
+            vistos.add(i)
+            ordem.append(i)
+    return ordem
+
+
+class ChunkIndex:
+    """
+    Trechos e contagens de termos de cada documento, gravados por hash do
+    conteudo (um documento da biblioteca e fatiado uma unica vez) e indices
+    BM25 recentes em memoria. Sem `path`, fica so em memoria. Falhas do
+    SQLite nunca impedem a montagem do contexto: o documento e fatiado de novo.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_documents: int = 200, memory_entries: int = 8):
+        self.path = str(path) if path else None
+        self.max_documents = max(1, int(max_documents))
+        self.memory_entries = max(1, int(memory_entries))
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._indices: "OrderedDict[Tuple[str, ...], BM25Index]" = OrderedDict()
+
+    def _conexao(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+            for pragma in ("PRAGMA journal_mode=WAL", "PRAGMA synchronous=NORMAL", "PRAGMA busy_timeout=5000"):
+                try:
+                    conn.execute(pragma)
+                except sqlite3.DatabaseError:
+                    pass
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS chunk_documents (
+                    doc_hash TEXT PRIMARY KEY,
+                    total INTEGER NOT NULL,
+                    acessado_em REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS chunk_entries (
+                    doc_hash TEXT NOT NULL,
+                    ordem INTEGER NOT NULL,
+                    texto TEXT NOT NULL,
+                    termos TEXT NOT NULL,
+                    PRIMARY KEY (doc_hash, ordem)
+                ) WITHOUT ROWID
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk_documents_acesso ON chunk_documents(acessado_em)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _carregar(self, chave: str) -> Optional[Tuple[List[str], List[Dict[str, int]]]]:
+        conn = self._conexao()
+        if conn.execute("SELECT 1 FROM chunk_documents WHERE doc_hash = ?", (chave,)).fetchone() is None:
+            return None
+        rows = conn.execute(
+            "SELECT texto, termos FROM chunk_entries WHERE doc_hash = ? ORDER BY ordem",
+            (chave,),
+        ).fetchall()
+        conn.execute("UPDATE chunk_documents SET acessado_em = ? WHERE doc_hash = ?", (time.time(), chave))
+        conn.commit()
+        return [str(r[0]) for r in rows], [json.loads(r[1]) for r in rows]
+
+    def _gravar(self, chave: str, trechos: List[str], contagens: List[Dict[str, int]]) -> None:
+        conn = self._conexao()
+        conn.execute("DELETE FROM chunk_entries WHERE doc_hash = ?", (chave,))
+        conn.executemany(
+            "INSERT INTO chunk_entries (doc_hash, ordem, texto, termos) VALUES (?, ?, ?, ?)",
+            [(chave, i, t, json.dumps(c, separators=(",", ":"))) for i, (t, c) in enumerate(zip(trechos, contagens))],
+        )
+        conn.execute(
+            """
+            INSERT INTO chunk_documents (doc_hash, total, acessado_em) VALUES (?, ?, ?)
+            ON CONFLICT(doc_hash) DO UPDATE SET total = excluded.total, acessado_em = excluded.acessado_em
+            """,
+            (chave, len(trechos), time.time()),
+        )
+        # Mantem so os documentos usados mais recentemente.
+        antigos = [
+            (r[0],)
+            for r in conn.execute(
+                "SELECT doc_hash FROM chunk_documents ORDER BY acessado_em DESC LIMIT -1 OFFSET ?",
+                (self.max_documents,),
+            )
+        ]
+        if antigos:
+            conn.executemany("DELETE FROM chunk_entries WHERE doc_hash = ?", antigos)
+            conn.executemany("DELETE FROM chunk_documents WHERE doc_hash = ?", antigos)
+        conn.commit()
+
+    def document_chunks(self, texto: str, chave: Optional[str] = None) -> Tuple[List[str], List[Dict[str, int]]]:
+        """Trechos e contagens do documento: do SQLite se ja fatiado, senao fatia e grava."""
+        if self.path and len(texto) > CHUNK_CHARS:
+            chave = chave or document_key(texto)
+            try:
+                with self._lock:
+                    salvo = self._carregar(chave)
+                if salvo is not None:
+                    return salvo
+            except (sqlite3.Error, ValueError) as ex:
+                log_exception(ex, "chunk_index.load")
+        trechos = chunk_text(texto)
+        contagens = [term_counts(t) for t in trechos]
+        if self.path and len(texto) > CHUNK_CHARS:
+            try:
+                with self._lock:
+                    self._gravar(chave or document_key(texto), trechos, contagens)
+            except sqlite3.Error as ex:
+                log_exception(ex, "chunk_index.save")
+        return trechos, contagens
+
+    def index_for(self, documents: Sequence[str]) -> BM25Index:
+        """Indice BM25 unico para o conjunto de documentos (estatisticas de todos juntos)."""
+        chaves = tuple(document_key(d) for d in documents)
+        with self._lock:
+            indice = self._indices.get(chaves)
+            if indice is not None:
+                self._indices.move_to_end(chaves)
+                return indice
+        trechos: List[str] = []
+        contagens: List[Dict[str, int]] = []
+        for documento, chave in zip(documents, chaves):
+            t, c = self.document_chunks(documento, chave)
+            trechos.extend(t)
+            contagens.extend(c)
+        indice = BM25Index(trechos, contagens)
+        with self._lock:
+            self._indices[chaves] = indice
+            while len(self._indices) > self.memory_entries:
+                self._indices.popitem(last=False)
+        return indice
+
+    def select(self, content: Sequence[str], query: Optional[str], budget_tokens: int, rng=None) -> List[str]:
+        """
+        Contexto para o prompt dentro de `budget_tokens`: elementos curtos
+        entram sempre; dos documentos, os trechos de maior BM25 para `query`.
+        Sem consulta (ou sem acerto), trechos sorteados com `rng` ou, sem
+        `rng`, espalhados pelo material. Trechos voltam na ordem do documento.
+        """
+        budget = max(1, int(budget_tokens))
+        itens = [str(x or "").strip() for x in content or []]
+        fixos = [x for x in itens if x and len(x) <= FIXO_MAX_CHARS]
+        documentos = [x for x in itens if len(x) > FIXO_MAX_CHARS]
+
+        saida: List[str] = []
+        usados = 0
+        for texto in fixos:
+            custo = estimate_tokens(texto)
+            if usados + custo > budget // 2:
+                break
+            saida.append(texto)
+            usados += custo
+        if not documentos:
+            return saida
+
+        indice = self.index_for(documentos)
+        consulta = " ".join(x for x in [query or ""] + fixos if x).strip()
+        ordem = indice.rank(consulta) if consulta else []
+        if not ordem:
+            ordem = list(range(len(indice)))
+            if rng is not None:
+                rng.shuffle(ordem)
+            else:
+                ordem = _ordem_espalhada(len(indice))
+        escolhidos: List[int] = []
+        for i in ordem:
+            if usados >= budget:
+                break
+            if usados + indice.tokens[i] > budget:
+                continue
+            escolhidos.append(i)
+            usados += indice.tokens[i]
+        if not escolhidos and ordem:
+            # Trecho unico maior que o orcamento inteiro: vai cortado.
+            return saida + [indice.chunks[ordem[0]][: max(1, budget - usados) * 4]]
+        return saida + [indice.chunks[i] for i in sorted(escolhidos)]
+
+    def build_context(self, content: Sequence[str], query: Optional[str], budget_tokens: int, rng=None) -> str:
+        return "\n\n".join(self.select(content, query, budget_tokens, rng))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._indices.clear()
+            if self.path:
+                conn = self._conexao()
+                conn.execute("DELETE FROM chunk_entries")
+                conn.execute("DELETE FROM chunk_documents")
+                conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_PADRAO: Optional[ChunkIndex] = None
+_PADRAO_LOCK = threading.Lock()
+
+
+def get_default_chunk_index() -> ChunkIndex:
+    """Indice unico do aparelho, em `<dados>/cache/chunk_index.db`."""
+    global _PADRAO
+    with _PADRAO_LOCK:
+        if _PADRAO is None:
+            pasta = get_data_dir() / "cache"
+            pasta.mkdir(parents=True, exist_ok=True)
+            _PADRAO = ChunkIndex(str(pasta / "chunk_index.db"))
+        return _PADRAO
@@ -8,6 +8,7 @@ Sistema de banco de dados SQLite com suporte a:
 - Sistema de gamificaÃ§Ã£o completo
 """
 
+import asyncio
 import sqlite3
 import datetime
 import json
@@ -15,8 +16,19 @@ import hashlib
 import hmac
 import os
 import base64
-from typing import Optional, Dict, List, Tuple, Any
+import re
+import threading
+import unicodedata
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Iterator, Optional, Dict, List, Sequence, Tuple, Any
 from core.app_paths import ensure_runtime_dirs, get_db_path
+from core.blob_codec import LazyBlob, decode_blob, encode_blob, peek_blob
+from core.db_writer import DatabaseWriter
+from core.error_monitor import log_exception
+from core.password_hasher import PasswordHasher
+from core import near_duplicates, srs_engine
+from core.study_journal import StudyEventJournal
 
 try:
     import bcrypt as _bcrypt  # type: ignore
@@ -28,21 +40,195 @@ try:
 except Exception:
     Fernet = None
     InvalidToken = Exception
+
+# Cifras derivadas (PBKDF2 e caro em celular), chaveadas pelo hash da semente:
+# outro db_path ou outro usuario do sistema gera outra entrada.
+_CIFRAS_API_KEY: Dict[bytes, Any] = {}
+_CIFRAS_API_KEY_LOCK = threading.Lock()
+_CIFRAS_API_KEY_MAX = 4
 
 
 class Database:
     """Gerenciador de banco de dados SQLite"""
     _PWD_SCHEME = "pbkdf2_sha256"
     _PWD_ITERS = 210_000
+    # Hashes de senha simultaneos (ver `hasher`).
+    _PWD_MAX_CONCORRENTES = 2
     _API_KEY_PREFIX = "enc1:"
-    
+    # Aplicados a cada conexao aberta. WAL + synchronous=NORMAL evitam fsync
+    # por commit; cache/mmap reduzem leituras de disco em aparelhos modestos.
+    _CONN_PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA cache_size=-8000",
+        "PRAGMA mmap_size=67108864",
+        "PRAGMA busy_timeout=5000",
+    )
+
     def __init__(self, db_path: Optional[str] = None):
         ensure_runtime_dirs()
         self.db_path = db_path or str(get_db_path())
-    
+        self._local = threading.local()
+        self._pool_lock = threading.Lock()
+        self._pool: Dict[int, Tuple[threading.Thread, sqlite3.Connection]] = {}
+        self._pool_generation = 0
+        self._writer: Optional[DatabaseWriter] = None
+        self._hasher: Optional[PasswordHasher] = None
+        self._eventos: Optional[StudyEventJournal] = None
+        self._busca_ativa = False
+        self._quase_dup_ativa = False
+        # Chaves de API ja decifradas nesta sessao (token cifrado -> texto puro).
+        self._segredos_sessao: Dict[str, str] = {}
+
     def conectar(self):
-        """Cria conexÃ£o com banco"""
-        return sqlite3.connect(self.db_path, check_same_thread=False)
+        """Cria conexÃ£o avulsa com banco (o chamador fecha); prefira `conexao()`."""
+        return self._abrir_conexao()
+
+    def _abrir_conexao(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5.0)
+        for pragma in self._CONN_PRAGMAS:
+            try:
+                conn.execute(pragma)
+            except sqlite3.DatabaseError:
+                # Ex.: WAL indisponivel no sistema de arquivos; segue com o padrao.
+                pass
+        return conn
+
+    def _conexao_da_thread(self) -> sqlite3.Connection:
+        local = self._local
+        conn = getattr(local, "conn", None)
+        if (
+            conn is not None
+            and getattr(local, "db_path", None) == self.db_path
+            and getattr(local, "generation", -1) == self._pool_generation
+        ):
+            return conn
+        conn = self._abrir_conexao()
+        local.conn = conn
+        local.db_path = self.db_path
+        local.generation = self._pool_generation
+        local.depth = 0
+        with self._pool_lock:
+            # Fecha conexoes de threads que ja terminaram (pool limitado as threads vivas).
+            for ident, (thread, old) in list(self._pool.items()):
+                if not thread.is_alive():
+                    self._pool.pop(ident, None)
+                    try:
+                        old.close()
+                    except Exception:
+                        pass
+            previous = self._pool.pop(threading.get_ident(), None)
+            if previous is not None and previous[1] is not conn:
+                try:
+                    previous[1].close()
+                except Exception:
+                    pass
+            self._pool[threading.get_ident()] = (threading.current_thread(), conn)
+        return conn
+
+    @contextmanager
+    def conexao(self) -> Iterator[sqlite3.Connection]:
+        """
+        Conexao persistente da thread atual.
+
+        Reentrante: chamadas aninhadas compartilham a mesma transacao, que e
+        confirmada (ou desfeita, em caso de excecao) ao sair do bloco externo.
+        Cada bloco aninhado abre um SAVEPOINT, de modo que uma falha dentro
+        dele desfaz apenas as suas escritas.
+        """
+        conn = self._conexao_da_thread()
+        depth = int(getattr(self._local, "depth", 0) or 0)
+        savepoint = f"sp_{depth}" if depth else None
+        if savepoint:
+            if not conn.in_transaction:
+                # O sqlite3 so abre a transacao implicita antes de um DML: sem
+                # o BEGIN, o SAVEPOINT viraria a transacao e o RELEASE a
+                # confirmaria antes do bloco externo terminar.
+                conn.execute("BEGIN")
+            conn.execute(f"SAVEPOINT {savepoint}")
+        self._local.depth = depth + 1
+        try:
+            yield conn
+        except BaseException:
+            if savepoint:
+                if conn.in_transaction:
+                    conn.execute(f"ROLLBACK TO {savepoint}")
+                    conn.execute(f"RELEASE {savepoint}")
+            elif conn.in_transaction:
+                conn.rollback()
+            raise
+        else:
+            if savepoint:
+                if conn.in_transaction:
+                    conn.execute(f"RELEASE {savepoint}")
+            elif conn.in_transaction:
+                conn.commit()
+        finally:
+            self._local.depth = depth
+
+    def _desfazer(self, conn: sqlite3.Connection) -> None:
+        """Desfaz as escritas do bloco `conexao()` atual, preservando os externos."""
+        depth = int(getattr(self._local, "depth", 0) or 0)
+        if depth > 1:
+            conn.execute(f"ROLLBACK TO sp_{depth - 1}")
+        elif conn.in_transaction:
+            conn.rollback()
+
+    @property
+    def writer(self) -> DatabaseWriter:
+        """Thread unica de escrita em lote (ver `core.db_writer`)."""
+        with self._pool_lock:
+            if self._writer is None:
+                self._writer = DatabaseWriter(self)
+            return self._writer
+
+    @property
+    def hasher(self) -> PasswordHasher:
+        """Executor limitado para hash/verificacao de senha (ver `core.password_hasher`)."""
+        with self._pool_lock:
+            if self._hasher is None:
+                self._hasher = PasswordHasher(
+                    self._hash_password, self._verify_password, self._PWD_MAX_CONCORRENTES
+                )
+            return self._hasher
+
+    @property
+    def eventos(self) -> StudyEventJournal:
+        """Diario de eventos de estudo com gravacao adiada (ver `core.study_journal`)."""
+        with self._pool_lock:
+            if self._eventos is None:
+                self._eventos = StudyEventJournal(self)
+            return self._eventos
+
+    def _eventos_em_dia(self) -> None:
+        """Aplica eventos de estudo pendentes antes de ler os agregados."""
+        eventos = self._eventos
+        if eventos is not None and eventos.busy():
+            eventos.flush()
+
+    def fechar(self) -> None:
+        """Fecha todas as conexoes persistentes (ex.: ao encerrar o app)."""
+        self.limpar_segredos_sessao()
+        if self._eventos is not None:
+            try:
+                self._eventos.flush()
+            except Exception:
+                pass
+        with self._pool_lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+        with self._pool_lock:
+            self._pool_generation += 1
+            pool = list(self._pool.values())
+            self._pool.clear()
+        for _thread, conn in pool:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._local = threading.local()
 
     def _api_key_cipher(self):
         if Fernet is None:
@@ -54,9 +240,23 @@ class Database:
                 str(self.db_path or ""),
             ]
         ).encode("utf-8", errors="ignore")
+        chave_cache = hashlib.sha256(seed).digest()
+        with _CIFRAS_API_KEY_LOCK:
+            cipher = _CIFRAS_API_KEY.get(chave_cache)
+            if cipher is not None:
+                return cipher
         salt = b"quizvance-local-api-key-salt-v1"
         raw_key = hashlib.pbkdf2_hmac("sha256", seed, salt, 180_000, dklen=32)
-        return Fernet(base64.urlsafe_b64encode(raw_key))
+        cipher = Fernet(base64.urlsafe_b64encode(raw_key))
+        with _CIFRAS_API_KEY_LOCK:
+            if len(_CIFRAS_API_KEY) >= _CIFRAS_API_KEY_MAX:
+                _CIFRAS_API_KEY.pop(next(iter(_CIFRAS_API_KEY)))
+            _CIFRAS_API_KEY[chave_cache] = cipher
+        return cipher
+
+    def limpar_segredos_sessao(self) -> None:
+        """Esquece as chaves de API decifradas (ex.: logout)."""
+        self._segredos_sessao.clear()
 
     def _encrypt_api_key(self, value: Optional[str]) -> Optional[str]:
         plain = str(value or "").strip()
@@ -82,11 +282,16 @@ class Database:
         token = raw[len(self._API_KEY_PREFIX):].strip()
         if not token:
             return None
+        plain = self._segredos_sessao.get(token)
+        if plain is not None:
+            return plain
         cipher = self._api_key_cipher()
         if cipher is None:
             return None
         try:
-            return cipher.decrypt(token.encode("utf-8")).decode("utf-8")
+            plain = cipher.decrypt(token.encode("utf-8")).decode("utf-8")
+            self._segredos_sessao[token] = plain
+            return plain
         except InvalidToken:
             return None
         except Exception:
@@ -152,11 +357,55 @@ class Database:
         # Compatibilidade legada extrema: senha em texto puro.
         return hmac.compare_digest(raw_pwd, value)
     
+    # Passos de migracao em ordem, aplicados uma unica vez e registrados em
+    # PRAGMA user_version. Cada passo e idempotente (bancos anteriores ao
+    # versionamento estao em 0 e passam por todos). Para alterar o schema ou as
+    # conquistas de config.CONQUISTAS, acrescente um passo novo ao fim.
+    _MIGRACOES = (
+        (1, "_migracao_schema_base"),
+        (2, "_migracao_indices_revisao"),
+        (3, "_migracao_diario_eventos"),
+        (4, "_migracao_contadores_usuario"),
+        (5, "_migracao_leaderboard"),
+        (6, "_migracao_questoes_conteudo"),
+        (7, "_migracao_banco_questoes_offline"),
+        (8, "_migracao_busca_textual"),
+        (9, "_migracao_xp_diario"),
+        (10, "_migracao_fila_revisao"),
+        (11, "_migracao_versao_agenda"),
+        (12, "_migracao_quase_duplicatas"),
+        (13, "_migracao_estado_srs"),
+        (14, "_migracao_busca_pacotes_resumo"),
+        (15, "_migracao_diario_reaplicavel"),
+    )
+    SCHEMA_VERSION = _MIGRACOES[-1][0]
+
+    def versao_schema(self) -> int:
+        """Versao do schema gravada no arquivo (PRAGMA user_version)."""
+        with self.conexao() as conn:
+            return int(conn.execute("PRAGMA user_version").fetchone()[0])
+
     def iniciar_banco(self):
-        """Cria todas as tabelas necessÃ¡rias"""
-        conn = self.conectar()
-        cursor = conn.cursor()
-        
+        """Cria/migra o schema; com o banco em dia custa uma leitura de PRAGMA."""
+        if self.versao_schema() >= self.SCHEMA_VERSION:
+            return
+        with self.conexao() as conn:
+            if not conn.in_transaction:
+                # Trava de escrita antes de reler a versao: outro processo pode
+                # ter migrado entre a leitura acima e aqui.
+                conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.cursor()
+            cursor.execute("PRAGMA user_version")
+            versao = int(cursor.fetchone()[0])
+            for numero, metodo in self._MIGRACOES:
+                if numero <= versao:
+                    continue
+                getattr(self, metodo)(cursor)
+                cursor.execute(f"PRAGMA user_version = {int(numero)}")
+
+    def _migracao_schema_base(self, cursor):
+        """v1: tabelas base, colunas legadas e conquistas padrao."""
+    
         # Tabela de usuÃ¡rios
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS usuarios (
@@ -179,28 +428,28 @@ class Database:
             )
         """)
         self._migrar_schema(cursor)
-        
+    
         # Tabela de configuraÃ§Ã£o de IA por usuÃ¡rio
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_ai_config (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                provider TEXT DEFAULT 'gemini',
-                model TEXT DEFAULT 'gemini-2.5-flash',
-                economia_mode INTEGER DEFAULT 0,
-                telemetry_opt_in INTEGER DEFAULT 0,
-                api_key TEXT,
-                FOREIGN KEY (user_id) REFERENCES usuarios (id),
-                UNIQUE (user_id)
-            )
-        """)
-        cursor.execute("PRAGMA table_info(user_ai_config)")
-        ai_cols = {row[1] for row in cursor.fetchall()}
-        if "economia_mode" not in ai_cols:
-            cursor.execute("ALTER TABLE user_ai_config ADD COLUMN economia_mode INTEGER DEFAULT 0")
-        if "telemetry_opt_in" not in ai_cols:
-            cursor.execute("ALTER TABLE user_ai_config ADD COLUMN telemetry_opt_in INTEGER DEFAULT 0")
-        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS user_ai_config (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                provider TEXT DEFAULT 'gemini',
+                model TEXT DEFAULT 'gemini-2.5-flash',
+                economia_mode INTEGER DEFAULT 0,
+                telemetry_opt_in INTEGER DEFAULT 0,
+                api_key TEXT,
+                FOREIGN KEY (user_id) REFERENCES usuarios (id),
+                UNIQUE (user_id)
+            )
+        """)
+        cursor.execute("PRAGMA table_info(user_ai_config)")
+        ai_cols = {row[1] for row in cursor.fetchall()}
+        if "economia_mode" not in ai_cols:
+            cursor.execute("ALTER TABLE user_ai_config ADD COLUMN economia_mode INTEGER DEFAULT 0")
+        if "telemetry_opt_in" not in ai_cols:
+            cursor.execute("ALTER TABLE user_ai_config ADD COLUMN telemetry_opt_in INTEGER DEFAULT 0")
+    
         # Tabela de OAuth
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS oauth_users (
@@ -216,7 +465,7 @@ class Database:
                 UNIQUE (provider, provider_id)
             )
         """)
-        
+    
         # Tabela de histÃ³rico de XP
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS historico_xp (
@@ -228,7 +477,7 @@ class Database:
                 FOREIGN KEY (user_id) REFERENCES usuarios (id)
             )
         """)
-        
+    
         # Tabela de questÃµes erradas
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS questoes_erros (
@@ -240,7 +489,7 @@ class Database:
                 FOREIGN KEY (user_id) REFERENCES usuarios (id)
             )
         """)
-        
+    
         # Tabela de conquistas
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS conquistas (
@@ -254,7 +503,7 @@ class Database:
                 criterio_valor INTEGER
             )
         """)
-        
+    
         # Tabela de conquistas do usuÃ¡rio
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS usuario_conquistas (
@@ -267,7 +516,7 @@ class Database:
                 UNIQUE (user_id, conquista_id)
             )
         """)
-        
+    
         # Tabela de tempo de estudo
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS estudo_tempo_diario (
@@ -281,7 +530,7 @@ class Database:
                 UNIQUE (user_id, materia, dia)
             )
         """)
-        
+    
         # Tabela de biblioteca de PDFs
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS biblioteca_pdfs (
@@ -297,7 +546,7 @@ class Database:
                 FOREIGN KEY (user_id) REFERENCES usuarios (id)
             )
         """)
-        
+    
         # Tabela de cache de questÃµes
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS banco_questoes (
@@ -314,13 +563,13 @@ class Database:
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
                 qhash TEXT NOT NULL,
-                dados_json TEXT NOT NULL,
-                tema TEXT DEFAULT 'Geral',
-                dificuldade TEXT DEFAULT 'intermediario',
-                favorita INTEGER DEFAULT 0,
-                marcado_erro INTEGER DEFAULT 0,
-                tentativas INTEGER DEFAULT 0,
-                acertos INTEGER DEFAULT 0,
+                dados_json TEXT NOT NULL,
+                tema TEXT DEFAULT 'Geral',
+                dificuldade TEXT DEFAULT 'intermediario',
+                favorita INTEGER DEFAULT 0,
+                marcado_erro INTEGER DEFAULT 0,
+                tentativas INTEGER DEFAULT 0,
+                acertos INTEGER DEFAULT 0,
                 erros INTEGER DEFAULT 0,
                 revisao_nivel INTEGER DEFAULT 0,
                 proxima_revisao DATETIME,
@@ -547,405 +796,1157 @@ class Database:
                 UNIQUE (user_id, feature_key, day_key)
             )
         """)
-        
-        conn.commit()
-        conn.close()
-        
+    
         # Popular conquistas padrÃ£o
         self._popular_conquistas()
         self._garantir_admin_padrao()
 
-    def _migrar_schema(self, cursor):
-        """Aplica migracoes em bancos antigos sem perder dados."""
-        cursor.execute("PRAGMA table_info(usuarios)")
-        colunas = {row[1] for row in cursor.fetchall()}
-        if "data_nascimento" not in colunas:
-            cursor.execute("ALTER TABLE usuarios ADD COLUMN data_nascimento TEXT")
-        if "meta_questoes_diaria" not in colunas:
-            cursor.execute("ALTER TABLE usuarios ADD COLUMN meta_questoes_diaria INTEGER DEFAULT 20")
-        if "onboarding_seen" not in colunas:
-            cursor.execute("ALTER TABLE usuarios ADD COLUMN onboarding_seen INTEGER DEFAULT 1")
-        cursor.execute("PRAGMA table_info(questoes_usuario)")
-        q_cols = {row[1] for row in cursor.fetchall()}
-        if q_cols:
-            if "revisao_nivel" not in q_cols:
-                cursor.execute("ALTER TABLE questoes_usuario ADD COLUMN revisao_nivel INTEGER DEFAULT 0")
-            if "proxima_revisao" not in q_cols:
-                cursor.execute("ALTER TABLE questoes_usuario ADD COLUMN proxima_revisao DATETIME")
-            if "marked_for_review" not in q_cols:
-                cursor.execute("ALTER TABLE questoes_usuario ADD COLUMN marked_for_review INTEGER DEFAULT 0")
-            if "next_review_at" not in q_cols:
-                cursor.execute("ALTER TABLE questoes_usuario ADD COLUMN next_review_at DATETIME")
-            if "review_level" not in q_cols:
-                cursor.execute("ALTER TABLE questoes_usuario ADD COLUMN review_level INTEGER DEFAULT 0")
-            if "last_attempt_at" not in q_cols:
-                cursor.execute("ALTER TABLE questoes_usuario ADD COLUMN last_attempt_at DATETIME")
-            if "last_result" not in q_cols:
-                cursor.execute("ALTER TABLE questoes_usuario ADD COLUMN last_result TEXT")
-        cursor.execute("PRAGMA table_info(mock_exam_sessions)")
-        ms_cols = {row[1] for row in cursor.fetchall()}
-        if ms_cols and "progress_json" not in ms_cols:
-            cursor.execute("ALTER TABLE mock_exam_sessions ADD COLUMN progress_json TEXT")
-        cursor.execute("PRAGMA table_info(mock_exam_items)")
-        mi_cols = {row[1] for row in cursor.fetchall()}
-        if mi_cols and "meta_json" not in mi_cols:
-            cursor.execute("ALTER TABLE mock_exam_items ADD COLUMN meta_json TEXT")
-    
-    def _popular_conquistas(self):
-        """Popula conquistas padrÃ£o se nÃ£o existirem"""
-        from config import CONQUISTAS
-        
-        conn = self.conectar()
-        cursor = conn.cursor()
-        
-        for conquista in CONQUISTAS:
-            try:
-                cursor.execute("""
-                    INSERT OR IGNORE INTO conquistas 
-                    (codigo, titulo, descricao, icone, xp_bonus, criterio_tipo, criterio_valor)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    conquista['codigo'],
-                    conquista['titulo'],
-                    conquista['descricao'],
-                    conquista['icone'],
-                    conquista['xp_bonus'],
-                    conquista['criterio_tipo'],
-                    conquista['criterio_valor']
-                ))
-            except Exception:
-                pass
-        
-        conn.commit()
-        conn.close()
-
-    def _garantir_admin_padrao(self):
-        """Nao cria credenciais padrao por seguranca."""
-        return
-
-    def atualizar_tema_escuro(self, user_id: int, tema_escuro: bool):
-        """Atualiza preferencia de tema do usuario."""
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE usuarios SET tema_escuro = ? WHERE id = ?",
-            (1 if tema_escuro else 0, user_id),
-        )
-        conn.commit()
-        conn.close()
-
-    def marcar_onboarding_visto(self, user_id: int):
-        """Marca a tela de boas-vindas como concluida para o usuario."""
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE usuarios SET onboarding_seen = 1 WHERE id = ?",
-            (user_id,),
-        )
-        conn.commit()
-        conn.close()
-
-    def criar_conta(self, nome: str, identificador: str, senha: str, data_nascimento: str) -> Tuple[bool, str]:
-        """Cria nova conta usando ID e data de nascimento."""
-        conn = self.conectar()
-        cursor = conn.cursor()
-        
-        try:
-            email = (identificador or "").strip().lower()
-            nome = (nome or "").strip()
-            senha = senha or ""
-            data_nascimento = (data_nascimento or "").strip()
-
-            # Verificar se email jÃ¡ existe
-            cursor.execute("SELECT id FROM usuarios WHERE email = ?", (email,))
-            if cursor.fetchone():
-                conn.close()
-                return False, "ID ja cadastrado"
-            
-            # Hash seguro com sal e iteracoes.
-            senha_hash = self._hash_password(senha)
-            
-            # Inserir usuÃ¡rio
-            cursor.execute("""
-                INSERT INTO usuarios (nome, email, senha, idade, data_nascimento, ultima_atividade, onboarding_seen)
-                VALUES (?, ?, ?, ?, ?, DATE('now'), 0)
-            """, (nome, email, senha_hash, self._calcular_idade(data_nascimento), data_nascimento))
-            
-            user_id = cursor.lastrowid
-            
-            # Criar configuraÃ§Ã£o de IA padrÃ£o
-            cursor.execute("""
-                INSERT INTO user_ai_config (user_id, provider, model)
-                VALUES (?, 'gemini', 'gemini-2.5-flash')
-            """, (user_id,))
+    def _migracao_indices_revisao(self, cursor):
+        """v2: datas de revisao em formato unico e indices compostos."""
+        self._normalizar_datas_revisao(cursor)
+        self._criar_indices(cursor)
 
-            # Trial de premium por 1 dia para novos usuarios
-            cursor.execute(
-                """
-                INSERT INTO user_subscription
-                (user_id, plan_code, premium_until, trial_used, trial_started_at, updated_at)
-                VALUES (?, 'trial', DATETIME('now', '+1 day'), 1, DATETIME('now'), CURRENT_TIMESTAMP)
-                """,
-                (user_id,),
-            )
-            
-            conn.commit()
-            conn.close()
-            return True, "Conta criada com sucesso!"
-            
-        except Exception as e:
-            conn.close()
-            return False, f"Erro ao criar conta: {str(e)}"
-    
-    def fazer_login(self, identificador: str, senha: str) -> Optional[Dict]:
-        """Login tradicional com ID e senha."""
-        conn = self.conectar()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        email = (identificador or "").strip().lower()
-        senha = senha or ""
+    def _migracao_diario_eventos(self, cursor):
+        """v3: diario append-only de eventos de estudo (ver `core.study_journal`)."""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS study_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                payload_json TEXT NOT NULL,
+                created_at DATETIME NOT NULL,
+                applied INTEGER DEFAULT 1,
+                FOREIGN KEY (user_id) REFERENCES usuarios (id)
+            )
+        """)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_study_events_user_created ON study_events (user_id, created_at)"
+        )
 
-        def _row_to_user(row: sqlite3.Row) -> Dict:
-            row_dict = dict(row)
-            row_dict["api_key"] = self._decrypt_api_key(row_dict.get("api_key"))
-            row_dict["oauth_google"] = 0
-            row_dict.update(self.get_subscription_status(int(row_dict["id"])))
-            return row_dict
+    # (tipo, tabela) cujas datas de revisao alimentam user_counters/user_due_buckets.
+    _FILAS_CONTADORES = (
+        ("flashcard", "flashcards"),
+        ("question", "questoes_usuario"),
+    )
 
-        def _validate_row(row: Optional[sqlite3.Row]) -> Optional[Dict]:
-            if not row:
-                return None
-            stored = str(row["senha"] or "")
-            if not self._verify_password(senha, stored):
-                return None
+    @staticmethod
+    def _sql_fila_contadores(tipo: str, ref: str, delta: int) -> str:
+        """
+        Contabiliza a data de revisao de `ref` (NEW/OLD) com `delta` (+1/-1).
 
-            # Migracao suave: hash legado (SHA/plain) -> hash seguro ao logar.
-            if (not stored.startswith(f"{self._PWD_SCHEME}$")) and (not stored.startswith("$2")):
-                try:
-                    cursor.execute(
-                        "UPDATE usuarios SET senha = ? WHERE id = ?",
-                        (self._hash_password(senha), int(row["id"])),
-                    )
-                    conn.commit()
-                except Exception:
-                    pass
-            return _row_to_user(row)
+        Datas anteriores a `rolled_day` ja estao vencidas e vao direto para o
+        contador; as demais ficam no balde do dia, somado ao contador quando o
+        dia vira (ver `obter_contadores`).
+        """
+        campo = "flashcards_pendentes" if tipo == "flashcard" else "questoes_pendentes"
+        return f"""
+            UPDATE user_counters SET {campo} = {campo} + ({delta})
+            WHERE user_id = {ref}.user_id
+              AND {ref}.proxima_revisao IS NOT NULL
+              AND DATE({ref}.proxima_revisao) < rolled_day;
+            INSERT INTO user_due_buckets (user_id, kind, day, n)
+            SELECT {ref}.user_id, '{tipo}', DATE({ref}.proxima_revisao), {delta}
+            FROM user_counters
+            WHERE user_id = {ref}.user_id
+              AND {ref}.proxima_revisao IS NOT NULL
+              AND DATE({ref}.proxima_revisao) >= rolled_day
+            ON CONFLICT(user_id, kind, day) DO UPDATE SET n = n + ({delta});
+        """
 
-        # 1) Prioridade absoluta: ID definido pelo usuario (campo email no schema atual)
-        cursor.execute(
-            """
-            SELECT u.*,
-                   ai.provider, ai.model, ai.api_key, ai.economia_mode, ai.telemetry_opt_in
-            FROM usuarios u
-            LEFT JOIN user_ai_config ai ON u.id = ai.user_id
-            WHERE lower(u.email) = ?
-            LIMIT 1
-            """,
-            (email,),
+    def _criar_triggers_contadores(self, cursor):
+        """(Re)cria os triggers que mantem user_counters e user_due_buckets."""
+        for nome in (
+            "trg_usuarios_contadores_streak",
+            "trg_questoes_usuario_totais_ins",
+            "trg_questoes_usuario_totais_del",
+            "trg_questoes_usuario_totais_upd",
+        ) + tuple(
+            f"trg_{tabela}_contadores_{sufixo}"
+            for _tipo, tabela in self._FILAS_CONTADORES
+            for sufixo in ("ins", "del", "upd")
+        ):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {nome}")
+        # Dentro de trigger, "INSERT OR IGNORE" herda o ON CONFLICT do comando externo
+        # (um UPSERT em questoes_usuario o transforma em ABORT); o UPSERT aqui nao.
+        garante = (
+            "INSERT INTO user_counters (user_id, rolled_day) VALUES ({ref}.user_id, DATE('now')) "
+            "ON CONFLICT(user_id) DO NOTHING;"
         )
-        user_by_email = _validate_row(cursor.fetchone())
-        if user_by_email:
-            conn.close()
-            return user_by_email
+        for tipo, tabela in self._FILAS_CONTADORES:
+            cursor.execute(f"""
+                CREATE TRIGGER trg_{tabela}_contadores_ins AFTER INSERT ON {tabela}
+                BEGIN
+                    {garante.format(ref="NEW")}
+                    {self._sql_fila_contadores(tipo, "NEW", 1)}
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER trg_{tabela}_contadores_del AFTER DELETE ON {tabela}
+                BEGIN
+                    {garante.format(ref="OLD")}
+                    {self._sql_fila_contadores(tipo, "OLD", -1)}
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER trg_{tabela}_contadores_upd AFTER UPDATE OF proxima_revisao ON {tabela}
+                WHEN OLD.proxima_revisao IS NOT NEW.proxima_revisao
+                BEGIN
+                    {garante.format(ref="NEW")}
+                    {self._sql_fila_contadores(tipo, "OLD", -1)}
+                    {self._sql_fila_contadores(tipo, "NEW", 1)}
+                END
+            """)
+
+        cursor.execute(f"""
+            CREATE TRIGGER trg_questoes_usuario_totais_ins AFTER INSERT ON questoes_usuario
+            BEGIN
+                {garante.format(ref="NEW")}
+                UPDATE user_counters
+                SET questoes_marcadas = questoes_marcadas + (COALESCE(NEW.marcado_erro, 0) = 1),
+                    total_respondidas = total_respondidas + COALESCE(NEW.tentativas, 0)
+                WHERE user_id = NEW.user_id;
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER trg_questoes_usuario_totais_del AFTER DELETE ON questoes_usuario
+            BEGIN
+                {garante.format(ref="OLD")}
+                UPDATE user_counters
+                SET questoes_marcadas = questoes_marcadas - (COALESCE(OLD.marcado_erro, 0) = 1),
+                    total_respondidas = total_respondidas - COALESCE(OLD.tentativas, 0)
+                WHERE user_id = OLD.user_id;
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER trg_questoes_usuario_totais_upd
+            AFTER UPDATE OF marcado_erro, tentativas ON questoes_usuario
+            BEGIN
+                {garante.format(ref="NEW")}
+                UPDATE user_counters
+                SET questoes_marcadas = questoes_marcadas
+                        + (COALESCE(NEW.marcado_erro, 0) = 1) - (COALESCE(OLD.marcado_erro, 0) = 1),
+                    total_respondidas = total_respondidas
+                        + COALESCE(NEW.tentativas, 0) - COALESCE(OLD.tentativas, 0)
+                WHERE user_id = NEW.user_id;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER trg_usuarios_contadores_streak AFTER UPDATE OF streak_dias ON usuarios
+            BEGIN
+                INSERT INTO user_counters (user_id, rolled_day, streak)
+                VALUES (NEW.id, DATE('now'), COALESCE(NEW.streak_dias, 0))
+                ON CONFLICT(user_id) DO UPDATE SET streak = excluded.streak;
+            END
+        """)
+
+    def _migracao_contadores_usuario(self, cursor):
+        """v4: contadores por usuario (home/revisao) mantidos por triggers."""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS user_counters (
+                user_id INTEGER PRIMARY KEY,
+                rolled_day DATE NOT NULL,
+                flashcards_pendentes INTEGER NOT NULL DEFAULT 0,
+                questoes_pendentes INTEGER NOT NULL DEFAULT 0,
+                questoes_marcadas INTEGER NOT NULL DEFAULT 0,
+                total_respondidas INTEGER NOT NULL DEFAULT 0,
+                streak INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS user_due_buckets (
+                user_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                day DATE NOT NULL,
+                n INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, kind, day)
+            ) WITHOUT ROWID
+        """)
 
-        # 2) Fallback: ID curto (parte antes do @ do email)
-        if "@" not in email:
+        self._criar_triggers_contadores(cursor)
+
+        # Carga inicial a partir dos dados existentes.
+        cursor.execute("DELETE FROM user_due_buckets")
+        cursor.execute("DELETE FROM user_counters")
+        cursor.execute("""
+            INSERT INTO user_counters
+                (user_id, rolled_day, flashcards_pendentes, questoes_pendentes,
+                 questoes_marcadas, total_respondidas, streak)
+            SELECT ids.user_id, DATE('now'),
+                (SELECT COUNT(*) FROM flashcards f
+                 WHERE f.user_id = ids.user_id AND f.proxima_revisao IS NOT NULL
+                   AND DATE(f.proxima_revisao) < DATE('now')),
+                (SELECT COUNT(*) FROM questoes_usuario q
+                 WHERE q.user_id = ids.user_id AND q.proxima_revisao IS NOT NULL
+                   AND DATE(q.proxima_revisao) < DATE('now')),
+                (SELECT COUNT(*) FROM questoes_usuario q
+                 WHERE q.user_id = ids.user_id AND q.marcado_erro = 1),
+                (SELECT COALESCE(SUM(q.tentativas), 0) FROM questoes_usuario q
+                 WHERE q.user_id = ids.user_id),
+                COALESCE((SELECT u.streak_dias FROM usuarios u WHERE u.id = ids.user_id), 0)
+            FROM (
+                SELECT id AS user_id FROM usuarios
+                UNION SELECT user_id FROM flashcards
+                UNION SELECT user_id FROM questoes_usuario
+            ) AS ids
+        """)
+        for tipo, tabela in self._FILAS_CONTADORES:
             cursor.execute(
-                """
-                SELECT u.*,
-                       ai.provider, ai.model, ai.api_key, ai.economia_mode, ai.telemetry_opt_in
-                FROM usuarios u
-                LEFT JOIN user_ai_config ai ON u.id = ai.user_id
-                WHERE lower(u.email) LIKE ?
-                LIMIT 1
+                f"""
+                INSERT INTO user_due_buckets (user_id, kind, day, n)
+                SELECT user_id, ?, DATE(proxima_revisao), COUNT(*)
+                FROM {tabela}
+                WHERE proxima_revisao IS NOT NULL AND DATE(proxima_revisao) >= DATE('now')
+                GROUP BY user_id, DATE(proxima_revisao)
                 """,
-                (f"{email}@%",),
+                (tipo,),
             )
-            user_by_short = _validate_row(cursor.fetchone())
-            if user_by_short:
-                conn.close()
-                return user_by_short
 
-        # 3) Fallback opcional: login por nome
+    # Periodo do ranking -> expressao SQL da chave do periodo para a data `{d}`.
+    # "Geral" acompanha usuarios.xp; "Hoje"/"Semana" somam o XP ganho no periodo.
+    _PERIODOS_RANKING = {
+        "Geral": "'geral'",
+        "Hoje": "DATE({d})",
+        "Semana": "DATE({d}, '-6 days', 'weekday 1')",
+    }
+
+    @staticmethod
+    def _sql_leaderboard_delta(periodo: str, chave: str, user_expr: str, xp_expr: str, seg_expr: str) -> str:
+        """Soma XP/segundos na linha do periodo; um periodo novo reinicia a linha."""
+        # Em "Geral" o XP e absoluto (espelho de usuarios.xp), nao um delta.
+        xp_mesmo_periodo = "leaderboard.xp" if periodo == "Geral" else "leaderboard.xp + excluded.xp"
+        return f"""
+            INSERT INTO leaderboard (periodo, period_key, user_id, xp, segundos)
+            VALUES ('{periodo}', {chave}, {user_expr}, {xp_expr}, {seg_expr})
+            ON CONFLICT(periodo, user_id) DO UPDATE SET
+                xp = CASE WHEN leaderboard.period_key = excluded.period_key
+                          THEN {xp_mesmo_periodo} ELSE excluded.xp END,
+                segundos = CASE WHEN leaderboard.period_key = excluded.period_key
+                                THEN leaderboard.segundos + excluded.segundos ELSE excluded.segundos END,
+                period_key = excluded.period_key
+            WHERE excluded.period_key >= leaderboard.period_key;
+        """
+
+    def _migracao_leaderboard(self, cursor):
+        """v5: ranking materializado por periodo, mantido por triggers."""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS leaderboard (
+                periodo TEXT NOT NULL,
+                period_key TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                xp INTEGER NOT NULL DEFAULT 0,
+                segundos INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (periodo, user_id)
+            ) WITHOUT ROWID
+        """)
         cursor.execute(
-            """
-            SELECT u.*,
-                   ai.provider, ai.model, ai.api_key, ai.economia_mode, ai.telemetry_opt_in
-            FROM usuarios u
-            LEFT JOIN user_ai_config ai ON u.id = ai.user_id
-            WHERE lower(u.nome) = ?
-            LIMIT 1
-            """,
-            (email,),
+            "CREATE INDEX IF NOT EXISTS idx_leaderboard_ordem ON leaderboard (periodo, period_key, xp, user_id)"
         )
-        user_by_name = _validate_row(cursor.fetchone())
-        conn.close()
-        return user_by_name
-
-    def _calcular_idade(self, data_nascimento: str) -> Optional[int]:
-        """Calcula idade aproximada para manter compatibilidade do campo legado."""
-        try:
-            dt_nasc = datetime.datetime.strptime(data_nascimento, "%d/%m/%Y").date()
-            hoje = datetime.date.today()
-            return hoje.year - dt_nasc.year - ((hoje.month, hoje.day) < (dt_nasc.month, dt_nasc.day))
-        except Exception:
-            return None
-
-    def contar_usuarios(self) -> int:
-        """Retorna quantidade total de usuÃ¡rios cadastrados."""
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM usuarios")
-        total = cursor.fetchone()[0]
-        conn.close()
-        return int(total or 0)
-    
-    def fazer_login_oauth(
-        self,
-        email: str,
-        nome: str,
-        google_id: str,
-        avatar_url: str = None
-    ) -> Optional[Dict]:
-        """Login ou cadastro via Google OAuth"""
-        conn = self.conectar()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        email = (email or "").strip().lower()
-        nome = (nome or "").strip()
-        
-        # Verificar se usuÃ¡rio existe
-        cursor.execute("SELECT id FROM usuarios WHERE email = ?", (email,))
-        row = cursor.fetchone()
-        
-        if row:
-            user_id = row['id']
-        else:
-            # Criar novo usuÃ¡rio
-            senha_random = self._hash_password(str(google_id or os.urandom(8).hex()))
-            cursor.execute("""
-                INSERT INTO usuarios (nome, email, senha, idade, avatar, ultima_atividade, onboarding_seen)
-                VALUES (?, ?, ?, ?, ?, DATE('now'), 0)
-            """, (nome, email, senha_random, 18, avatar_url or 'user'))
-            
-            user_id = cursor.lastrowid
-            
-            # Criar configuraÃ§Ã£o de IA
-            cursor.execute("""
-                INSERT INTO user_ai_config (user_id)
-                VALUES (?)
-            """, (user_id,))
-            cursor.execute(
-                """
-                INSERT INTO user_subscription
-                (user_id, plan_code, premium_until, trial_used, trial_started_at, updated_at)
-                VALUES (?, 'trial', DATETIME('now', '+1 day'), 1, DATETIME('now'), CURRENT_TIMESTAMP)
-                """,
+
+        geral_xp = """
+            INSERT INTO leaderboard (periodo, period_key, user_id, xp, segundos)
+            VALUES ('Geral', 'geral', NEW.id, COALESCE(NEW.xp, 0), 0)
+            ON CONFLICT(periodo, user_id) DO UPDATE SET xp = excluded.xp;
+        """
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_usuarios_leaderboard_ins AFTER INSERT ON usuarios
+            BEGIN {geral_xp} END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_usuarios_leaderboard_xp AFTER UPDATE OF xp ON usuarios
+            WHEN OLD.xp IS NOT NEW.xp
+            BEGIN {geral_xp} END
+        """)
+
+        periodos_xp = "".join(
+            self._sql_leaderboard_delta(
+                periodo, chave.format(d="NEW.data_hora"), "NEW.user_id", "COALESCE(NEW.xp_ganho, 0)", "0"
+            )
+            for periodo, chave in self._PERIODOS_RANKING.items()
+            if periodo != "Geral"
+        )
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_historico_xp_leaderboard AFTER INSERT ON historico_xp
+            BEGIN {periodos_xp} END
+        """)
+
+        for evento, delta in (
+            ("AFTER INSERT", "COALESCE(NEW.tempo_segundos, 0)"),
+            ("AFTER UPDATE OF tempo_segundos", "COALESCE(NEW.tempo_segundos, 0) - COALESCE(OLD.tempo_segundos, 0)"),
+        ):
+            periodos_tempo = "".join(
+                self._sql_leaderboard_delta(
+                    periodo,
+                    chave.format(d="NEW.dia"),
+                    "NEW.user_id",
+                    "0" if periodo != "Geral" else "(SELECT COALESCE(xp, 0) FROM usuarios WHERE id = NEW.user_id)",
+                    delta,
+                )
+                for periodo, chave in self._PERIODOS_RANKING.items()
+            )
+            sufixo = "ins" if evento == "AFTER INSERT" else "upd"
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_estudo_progresso_leaderboard_{sufixo}
+                {evento} ON estudo_progresso_diario
+                WHEN ({delta}) <> 0
+                BEGIN {periodos_tempo} END
+            """)
+
+        # Carga inicial.
+        cursor.execute("DELETE FROM leaderboard")
+        cursor.execute("""
+            INSERT INTO leaderboard (periodo, period_key, user_id, xp, segundos)
+            SELECT 'Geral', 'geral', u.id, COALESCE(u.xp, 0),
+                   COALESCE((SELECT SUM(tempo_segundos) FROM estudo_progresso_diario e WHERE e.user_id = u.id), 0)
+            FROM usuarios u
+        """)
+        for periodo, chave in self._PERIODOS_RANKING.items():
+            if periodo == "Geral":
+                continue
+            agora = chave.format(d="'now'")
+            cursor.execute(f"""
+                INSERT INTO leaderboard (periodo, period_key, user_id, xp, segundos)
+                SELECT '{periodo}', {agora}, user_id, SUM(xp), SUM(segundos)
+                FROM (
+                    SELECT user_id, xp_ganho AS xp, 0 AS segundos
+                    FROM historico_xp WHERE {chave.format(d="data_hora")} = {agora}
+                    UNION ALL
+                    SELECT user_id, 0, tempo_segundos
+                    FROM estudo_progresso_diario WHERE {chave.format(d="dia")} = {agora}
+                )
+                GROUP BY user_id
+            """)
+
+    def _migracao_questoes_conteudo(self, cursor):
+        """
+        v6: conteudo das questoes guardado uma vez em `questions` (chave: hash).
+
+        `questoes_usuario` e `banco_questoes` passam a apontar via question_id
+        (dados_json fica vazio) e os pacotes de estudo guardam so os hashes.
+        Tambem recria os triggers de v4, que falhavam sob UPSERT em questoes_usuario.
+        """
+        self._criar_triggers_contadores(cursor)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS questions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                qhash TEXT NOT NULL UNIQUE,
+                dados_json TEXT NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        colunas_banco = set()
+        for tabela in ("questoes_usuario", "banco_questoes"):
+            cursor.execute(f"PRAGMA table_info({tabela})")
+            colunas = {row[1] for row in cursor.fetchall()}
+            if tabela == "banco_questoes":
+                colunas_banco = colunas
+            if "question_id" not in colunas:
+                cursor.execute(f"ALTER TABLE {tabela} ADD COLUMN question_id INTEGER REFERENCES questions (id)")
+
+        # Mais recente primeiro: em hashes repetidos vale o conteudo mais novo.
+        cursor.execute("""
+            INSERT OR IGNORE INTO questions (qhash, dados_json)
+            SELECT qhash, dados_json
+            FROM questoes_usuario
+            WHERE question_id IS NULL AND dados_json <> ''
+            ORDER BY ultima_pratica DESC
+        """)
+        cursor.execute("""
+            UPDATE questoes_usuario
+            SET question_id = (SELECT id FROM questions WHERE questions.qhash = questoes_usuario.qhash),
+                dados_json = ''
+            WHERE question_id IS NULL AND dados_json <> ''
+        """)
+
+        # Sem dados_json o banco ja esta no formato de v7.
+        if "dados_json" in colunas_banco:
+            cursor.execute("SELECT id, dados_json FROM banco_questoes WHERE question_id IS NULL AND dados_json <> ''")
+            for row_id, dados_json in cursor.fetchall():
+                try:
+                    questao = decode_blob(dados_json)
+                except Exception:
+                    continue
+                question_id = self._salvar_conteudo_questao(cursor, questao)
+                cursor.execute(
+                    "UPDATE banco_questoes SET question_id = ?, dados_json = '' WHERE id = ?",
+                    (question_id, row_id),
+                )
+
+        cursor.execute("SELECT id, dados_json FROM study_packages")
+        for row_id, dados_json in cursor.fetchall():
+            try:
+                dados = decode_blob(dados_json)
+            except Exception:
+                continue
+            if not isinstance(dados, dict) or not isinstance(dados.get("questoes"), list):
+                continue
+            compacto = self._compactar_pacote(cursor, dados)
+            cursor.execute(
+                "UPDATE study_packages SET dados_json = ? WHERE id = ?",
+                (encode_blob(compacto, leves=self._CAMPOS_LEVES_PACOTE), row_id),
+            )
+
+    def _migracao_banco_questoes_offline(self, cursor):
+        """
+        v7: banco offline com chaves normalizadas, uma linha por questao/tema/dificuldade
+        e contadores de uso para servir variado e aplicar o limite por tema.
+        """
+        cursor.execute("PRAGMA table_info(banco_questoes)")
+        if "tema_key" not in {row[1] for row in cursor.fetchall()}:
+            self._recriar_banco_questoes(cursor)
+        # Cobre filtro + ordem de entrega + question_id: escolher as questoes nao le a tabela.
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_banco_questoes_servir
+            ON banco_questoes (tema_key, dificuldade_key, served_count, last_served_at, question_id)
+        """)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_questoes_usuario_user_question ON questoes_usuario (user_id, question_id)"
+        )
+        cursor.execute("SELECT DISTINCT tema_key, dificuldade_key FROM banco_questoes")
+        for tema_key, dificuldade_key in cursor.fetchall():
+            self._podar_banco_questoes(cursor, tema_key, dificuldade_key)
+
+    def _recriar_banco_questoes(self, cursor):
+        cursor.execute("""
+            CREATE TABLE banco_questoes_v7 (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tema TEXT NOT NULL,
+                dificuldade TEXT NOT NULL,
+                tema_key TEXT NOT NULL,
+                dificuldade_key TEXT NOT NULL,
+                question_id INTEGER NOT NULL REFERENCES questions (id),
+                served_count INTEGER NOT NULL DEFAULT 0,
+                last_served_at DATETIME,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (tema_key, dificuldade_key, question_id)
+            )
+        """)
+        cursor.execute("""
+            SELECT tema, dificuldade, question_id, created_at
+            FROM banco_questoes
+            WHERE question_id IS NOT NULL
+            ORDER BY created_at DESC, id DESC
+        """)
+        cursor.executemany(
+            """
+            INSERT OR IGNORE INTO banco_questoes_v7
+            (tema, dificuldade, tema_key, dificuldade_key, question_id, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (tema, dificuldade, self._chave_banco(tema, "geral"),
+                 self._chave_banco(dificuldade, "intermediario"), question_id, created_at)
+                for tema, dificuldade, question_id, created_at in cursor.fetchall()
+            ],
+        )
+        cursor.execute("DROP TABLE banco_questoes")
+        cursor.execute("ALTER TABLE banco_questoes_v7 RENAME TO banco_questoes")
+
+    def _migracao_xp_diario(self, cursor):
+        """
+        v9: `estudo_progresso_diario` vira o resumo diario completo (XP incluso),
+        mantido por trigger; graficos deixam de agrupar `historico_xp` bruto.
+        """
+        cursor.execute("PRAGMA table_info(estudo_progresso_diario)")
+        if "xp" not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute("ALTER TABLE estudo_progresso_diario ADD COLUMN xp INTEGER NOT NULL DEFAULT 0")
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_historico_xp_diario AFTER INSERT ON historico_xp
+            BEGIN
+                INSERT INTO estudo_progresso_diario (user_id, dia, xp)
+                VALUES (NEW.user_id, DATE(NEW.data_hora), COALESCE(NEW.xp_ganho, 0))
+                ON CONFLICT(user_id, dia) DO UPDATE SET xp = estudo_progresso_diario.xp + excluded.xp;
+            END
+        """)
+        cursor.execute("""
+            INSERT INTO estudo_progresso_diario (user_id, dia, xp)
+            SELECT user_id, DATE(data_hora), SUM(COALESCE(xp_ganho, 0))
+            FROM historico_xp
+            GROUP BY user_id, DATE(data_hora)
+            ON CONFLICT(user_id, dia) DO UPDATE SET xp = excluded.xp
+        """)
+
+    def _migracao_fila_revisao(self, cursor):
+        """
+        v10: `updated_at` em questoes_usuario (mantido por trigger) e indices
+        (user_id, updated_at), para a fila de revisao em memoria buscar so o delta.
+        """
+        cursor.execute("PRAGMA table_info(questoes_usuario)")
+        if "updated_at" not in {row[1] for row in cursor.fetchall()}:
+            # ADD COLUMN nao aceita DEFAULT CURRENT_TIMESTAMP: o trigger de insert preenche.
+            cursor.execute("ALTER TABLE questoes_usuario ADD COLUMN updated_at DATETIME")
+        cursor.execute("""
+            UPDATE questoes_usuario
+            SET updated_at = COALESCE(last_attempt_at, ultima_pratica, CURRENT_TIMESTAMP)
+            WHERE updated_at IS NULL
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_questoes_usuario_updated_ins AFTER INSERT ON questoes_usuario
+            BEGIN
+                UPDATE questoes_usuario SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_questoes_usuario_updated_upd
+            AFTER UPDATE OF next_review_at, proxima_revisao, review_level, revisao_nivel ON questoes_usuario
+            BEGIN
+                UPDATE questoes_usuario SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_flashcards_updated_upd
+            AFTER UPDATE OF proxima_revisao, revisao_nivel ON flashcards
+            BEGIN
+                UPDATE flashcards SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+            END
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_questoes_usuario_user_updated ON questoes_usuario (user_id, updated_at)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_flashcards_user_updated ON flashcards (user_id, updated_at)")
+
+    def _migracao_versao_agenda(self, cursor):
+        """
+        v11: contador por usuario incrementado por trigger a cada mudanca na
+        agenda de revisao (updated_at tem resolucao de segundos e nao serve
+        para invalidar caches de forma exata).
+        """
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS agenda_revisao_versao (
+                user_id INTEGER PRIMARY KEY,
+                versao INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        incrementa = (
+            "INSERT INTO agenda_revisao_versao (user_id, versao) VALUES ({ref}.user_id, 1) "
+            "ON CONFLICT(user_id) DO UPDATE SET versao = versao + 1;"
+        )
+        for tabela, colunas in (
+            ("flashcards", "proxima_revisao, revisao_nivel"),
+            ("questoes_usuario", "next_review_at, proxima_revisao, review_level, revisao_nivel"),
+        ):
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{tabela}_agenda_ins AFTER INSERT ON {tabela}
+                BEGIN
+                    {incrementa.format(ref="NEW")}
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{tabela}_agenda_del AFTER DELETE ON {tabela}
+                BEGIN
+                    {incrementa.format(ref="OLD")}
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{tabela}_agenda_upd AFTER UPDATE OF {colunas} ON {tabela}
+                BEGIN
+                    {incrementa.format(ref="NEW")}
+                END
+            """)
+
+    def _migracao_quase_duplicatas(self, cursor):
+        """
+        v12: assinaturas MinHash por hash de conteudo (questions.qhash e
+        flashcards.card_hash), gravadas junto com o conteudo. Sem linhas orfas
+        a limpar: a leitura sempre parte das tabelas de origem.
+        """
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS assinaturas_quase_dup (
+                hash TEXT PRIMARY KEY,
+                assinatura BLOB NOT NULL
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            SELECT q.qhash, q.dados_json FROM questions q
+            WHERE NOT EXISTS (SELECT 1 FROM assinaturas_quase_dup s WHERE s.hash = q.qhash)
+        """)
+        linhas = []
+        for qhash, dados_json in cursor.fetchall():
+            try:
+                sig = near_duplicates.signature(near_duplicates.question_text(decode_blob(dados_json)))
+            except Exception:
+                continue
+            if sig is not None:
+                linhas.append((qhash, near_duplicates.pack(sig)))
+        cursor.execute("""
+            SELECT f.card_hash, MIN(f.frente) FROM flashcards f
+            WHERE NOT EXISTS (SELECT 1 FROM assinaturas_quase_dup s WHERE s.hash = f.card_hash)
+            GROUP BY f.card_hash
+        """)
+        for card_hash, frente in cursor.fetchall():
+            sig = near_duplicates.signature(frente)
+            if sig is not None:
+                linhas.append((card_hash, near_duplicates.pack(sig)))
+        cursor.executemany(
+            "INSERT INTO assinaturas_quase_dup (hash, assinatura) VALUES (?, ?) ON CONFLICT(hash) DO NOTHING",
+            linhas,
+        )
+
+    def _migracao_estado_srs(self, cursor):
+        """
+        v13: estado das estrategias SM-2/FSRS por item (flashcards e
+        questoes_usuario) e a estrategia escolhida por usuario e tipo.
+        Sem linha em estrategia_revisao vale a estrategia padrao do app.
+        """
+        for tabela in ("flashcards", "questoes_usuario"):
+            cursor.execute(f"PRAGMA table_info({tabela})")
+            existentes = {row[1] for row in cursor.fetchall()}
+            for coluna, _chave in self._COLUNAS_SRS:
+                if coluna not in existentes:
+                    cursor.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} REAL")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS estrategia_revisao (
+                user_id INTEGER NOT NULL,
+                tipo TEXT NOT NULL,
+                estrategia TEXT NOT NULL,
+                PRIMARY KEY (user_id, tipo)
+            ) WITHOUT ROWID
+        """)
+
+    def _migracao_busca_pacotes_resumo(self, cursor):
+        """
+        v14: busca de pacotes tambem no resumo e nos topicos. Eles ficam no blob
+        comprimido, que o SQL nao le: `busca_pacotes` deixa de ser de conteudo
+        externo e passa a ser alimentada em `salvar_study_package`, como
+        `busca_questoes` (remocoes e renomeacoes por trigger).
+        """
+        if not self._tem_busca(cursor):
+            return
+        for sufixo in ("ins", "upd", "del"):
+            cursor.execute(f"DROP TRIGGER IF EXISTS trg_study_packages_busca_{sufixo}")
+        cursor.execute("DROP TABLE IF EXISTS busca_pacotes")
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE busca_pacotes
+            USING fts5(titulo, source_nome, resumo, topicos, tokenize = '{self._TOKENIZADOR_BUSCA}')
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_study_packages_busca_del AFTER DELETE ON study_packages
+            BEGIN
+                DELETE FROM busca_pacotes WHERE rowid = old.id;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_study_packages_busca_upd AFTER UPDATE OF titulo, source_nome ON study_packages
+            BEGIN
+                UPDATE busca_pacotes SET titulo = new.titulo, source_nome = new.source_nome WHERE rowid = new.id;
+            END
+        """)
+        cursor.execute("SELECT id, titulo, source_nome, dados_json FROM study_packages")
+        for package_id, titulo, source_nome, dados_json in cursor.fetchall():
+            try:
+                dados = peek_blob(dados_json, "resumo", "topicos")
+            except Exception:
+                dados = {}
+            self._indexar_pacote(cursor, package_id, titulo, source_nome, dados)
+
+    def _migracao_diario_reaplicavel(self, cursor):
+        """
+        v15: eventos do diario ficam gravados por completo ate serem aplicados
+        e sao reaplicados em lotes seguintes (`tentativas` limita as repeticoes).
+        """
+        cursor.execute("PRAGMA table_info(study_events)")
+        if "tentativas" not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute("ALTER TABLE study_events ADD COLUMN tentativas INTEGER DEFAULT 0")
+            # Linhas antigas nao aplicadas guardavam so o hash: nao da para reaplicar.
+            cursor.execute("UPDATE study_events SET tentativas = NULL WHERE applied = 0")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_study_events_pendentes ON study_events (id) WHERE applied = 0"
+        )
+
+    # PT-BR: "acao" encontra "ação" (e vice-versa).
+    _TOKENIZADOR_BUSCA = "unicode61 remove_diacritics 2"
+
+    def _migracao_busca_textual(self, cursor):
+        """
+        v8: indices FTS5 para busca local.
+
+        Flashcards e pacotes usam tabelas de conteudo externo sincronizadas por
+        triggers. O conteudo das questoes fica comprimido em `questions`, que o
+        SQL nao decodifica: `busca_questoes` e alimentada em `_salvar_conteudo_questao`
+        (remocoes por trigger). Sem FTS5 no SQLite, a busca fica desativada.
+        """
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS temp.fts5_teste USING fts5(x)")
+            cursor.execute("DROP TABLE temp.fts5_teste")
+        except sqlite3.OperationalError:
+            return
+        tokenize = self._TOKENIZADOR_BUSCA
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS busca_questoes
+            USING fts5(tema, enunciado, corpo, tokenize = '{tokenize}')
+        """)
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS busca_flashcards
+            USING fts5(frente, verso, tema, content = 'flashcards', content_rowid = 'id', tokenize = '{tokenize}')
+        """)
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS busca_pacotes
+            USING fts5(titulo, source_nome, content = 'study_packages', content_rowid = 'id', tokenize = '{tokenize}')
+        """)
+
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_banco_questoes_question ON banco_questoes (question_id)")
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_questions_busca_del AFTER DELETE ON questions
+            BEGIN
+                DELETE FROM busca_questoes WHERE rowid = old.id;
+            END
+        """)
+        for tabela, fts, colunas in (
+            ("flashcards", "busca_flashcards", ("frente", "verso", "tema")),
+            ("study_packages", "busca_pacotes", ("titulo", "source_nome")),
+        ):
+            lista = ", ".join(colunas)
+            novos = ", ".join(f"new.{c}" for c in colunas)
+            velhos = ", ".join(f"old.{c}" for c in colunas)
+            mudou = " OR ".join(f"old.{c} IS NOT new.{c}" for c in colunas)
+            insere = f"INSERT INTO {fts} (rowid, {lista}) VALUES (new.id, {novos});"
+            remove = f"INSERT INTO {fts} ({fts}, rowid, {lista}) VALUES ('delete', old.id, {velhos});"
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{tabela}_busca_ins AFTER INSERT ON {tabela}
+                BEGIN {insere} END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{tabela}_busca_del AFTER DELETE ON {tabela}
+                BEGIN {remove} END
+            """)
+            # So quando o texto muda: revisoes de flashcard atualizam a linha o tempo todo.
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{tabela}_busca_upd AFTER UPDATE OF {lista} ON {tabela}
+                WHEN {mudou}
+                BEGIN {remove} {insere} END
+            """)
+            cursor.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+        cursor.execute("DELETE FROM busca_questoes")
+        cursor.execute("""
+            SELECT q.id, q.dados_json,
+                   COALESCE(
+                       (SELECT tema FROM banco_questoes WHERE question_id = q.id LIMIT 1),
+                       (SELECT tema FROM questoes_usuario WHERE question_id = q.id LIMIT 1)
+                   )
+            FROM questions q
+        """)
+        for question_id, dados_json, tema in cursor.fetchall():
+            try:
+                questao = decode_blob(dados_json)
+            except Exception:
+                continue
+            self._indexar_questao(cursor, question_id, questao, tema)
+        self._busca_ativa = True
+
+    def _migrar_schema(self, cursor):
+        """Aplica migracoes em bancos antigos sem perder dados."""
+        cursor.execute("PRAGMA table_info(usuarios)")
+        colunas = {row[1] for row in cursor.fetchall()}
+        if "data_nascimento" not in colunas:
+            cursor.execute("ALTER TABLE usuarios ADD COLUMN data_nascimento TEXT")
+        if "meta_questoes_diaria" not in colunas:
+            cursor.execute("ALTER TABLE usuarios ADD COLUMN meta_questoes_diaria INTEGER DEFAULT 20")
+        if "onboarding_seen" not in colunas:
+            cursor.execute("ALTER TABLE usuarios ADD COLUMN onboarding_seen INTEGER DEFAULT 1")
+        cursor.execute("PRAGMA table_info(questoes_usuario)")
+        q_cols = {row[1] for row in cursor.fetchall()}
+        if q_cols:
+            if "revisao_nivel" not in q_cols:
+                cursor.execute("ALTER TABLE questoes_usuario ADD COLUMN revisao_nivel INTEGER DEFAULT 0")
+            if "proxima_revisao" not in q_cols:
+                cursor.execute("ALTER TABLE questoes_usuario ADD COLUMN proxima_revisao DATETIME")
+            if "marked_for_review" not in q_cols:
+                cursor.execute("ALTER TABLE questoes_usuario ADD COLUMN marked_for_review INTEGER DEFAULT 0")
+            if "next_review_at" not in q_cols:
+                cursor.execute("ALTER TABLE questoes_usuario ADD COLUMN next_review_at DATETIME")
+            if "review_level" not in q_cols:
+                cursor.execute("ALTER TABLE questoes_usuario ADD COLUMN review_level INTEGER DEFAULT 0")
+            if "last_attempt_at" not in q_cols:
+                cursor.execute("ALTER TABLE questoes_usuario ADD COLUMN last_attempt_at DATETIME")
+            if "last_result" not in q_cols:
+                cursor.execute("ALTER TABLE questoes_usuario ADD COLUMN last_result TEXT")
+        cursor.execute("PRAGMA table_info(mock_exam_sessions)")
+        ms_cols = {row[1] for row in cursor.fetchall()}
+        if ms_cols and "progress_json" not in ms_cols:
+            cursor.execute("ALTER TABLE mock_exam_sessions ADD COLUMN progress_json TEXT")
+        cursor.execute("PRAGMA table_info(mock_exam_items)")
+        mi_cols = {row[1] for row in cursor.fetchall()}
+        if mi_cols and "meta_json" not in mi_cols:
+            cursor.execute("ALTER TABLE mock_exam_items ADD COLUMN meta_json TEXT")
+    
+    # Indices compostos das consultas quentes (filas de revisao, home, historicos).
+    _INDICES = (
+        ("idx_flashcards_user_revisao", "flashcards", "user_id, proxima_revisao"),
+        ("idx_questoes_usuario_user_next", "questoes_usuario", "user_id, next_review_at"),
+        ("idx_questoes_usuario_user_revisao", "questoes_usuario", "user_id, proxima_revisao"),
+        ("idx_questoes_usuario_user_erro", "questoes_usuario", "user_id, marcado_erro"),
+        ("idx_questoes_usuario_user_tema", "questoes_usuario", "user_id, tema"),
+        ("idx_questoes_usuario_user_pratica", "questoes_usuario", "user_id, ultima_pratica"),
+        ("idx_historico_xp_user_data", "historico_xp", "user_id, data_hora"),
+        ("idx_review_sessions_user_created", "review_sessions", "user_id, created_at"),
+        ("idx_review_session_items_session", "review_session_items", "session_id"),
+        ("idx_mock_exam_sessions_user_created", "mock_exam_sessions", "user_id, created_at"),
+        ("idx_mock_exam_items_session", "mock_exam_items", "session_id, ordem"),
+        ("idx_quiz_filtros_user_created", "quiz_filtros_salvos", "user_id, created_at"),
+        ("idx_study_packages_user_created", "study_packages", "user_id, created_at"),
+        ("idx_study_plan_runs_user_status", "study_plan_runs", "user_id, status"),
+        ("idx_study_plan_items_plan", "study_plan_items", "plan_id"),
+        ("idx_biblioteca_pdfs_user_upload", "biblioteca_pdfs", "user_id, data_upload"),
+    )
+
+    def _criar_indices(self, cursor):
+        for nome, tabela, colunas in self._INDICES:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {nome} ON {tabela} ({colunas})")
+
+    def _normalizar_datas_revisao(self, cursor):
+        """
+        Converte datas de revisao para 'YYYY-MM-DD HH:MM:SS' (formato de DATETIME()).
+
+        Com um formato unico as consultas comparam a coluna crua, sem envolver em
+        DATETIME(...), e os indices de (user_id, data) passam a ser usados.
+        """
+        for tabela, coluna in (
+            ("flashcards", "proxima_revisao"),
+            ("questoes_usuario", "proxima_revisao"),
+            ("questoes_usuario", "next_review_at"),
+        ):
+            cursor.execute(
+                f"""
+                UPDATE {tabela}
+                SET {coluna} = DATETIME({coluna})
+                WHERE {coluna} IS NOT NULL
+                  AND DATETIME({coluna}) IS NOT NULL
+                  AND {coluna} <> DATETIME({coluna})
+                """
+            )
+
+    def _popular_conquistas(self):
+        """Popula conquistas padrÃ£o se nÃ£o existirem"""
+        from config import CONQUISTAS
+        
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+        
+            for conquista in CONQUISTAS:
+                try:
+                    cursor.execute("""
+                        INSERT OR IGNORE INTO conquistas 
+                        (codigo, titulo, descricao, icone, xp_bonus, criterio_tipo, criterio_valor)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """, (
+                        conquista['codigo'],
+                        conquista['titulo'],
+                        conquista['descricao'],
+                        conquista['icone'],
+                        conquista['xp_bonus'],
+                        conquista['criterio_tipo'],
+                        conquista['criterio_valor']
+                    ))
+                except Exception:
+                    pass
+
+    def _garantir_admin_padrao(self):
+        """Nao cria credenciais padrao por seguranca."""
+        return
+
+    def atualizar_tema_escuro(self, user_id: int, tema_escuro: bool):
+        """Atualiza preferencia de tema do usuario."""
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE usuarios SET tema_escuro = ? WHERE id = ?",
+                (1 if tema_escuro else 0, user_id),
+            )
+
+    def marcar_onboarding_visto(self, user_id: int):
+        """Marca a tela de boas-vindas como concluida para o usuario."""
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE usuarios SET onboarding_seen = 1 WHERE id = ?",
                 (user_id,),
             )
+
+    def criar_conta(self, nome: str, identificador: str, senha: str, data_nascimento: str) -> Tuple[bool, str]:
+        """Cria nova conta usando ID e data de nascimento."""
+        senha_hash = self.hasher.hash(senha or "").result()
+        return self._inserir_conta(nome, identificador, senha_hash, data_nascimento)
+
+    async def criar_conta_async(
+        self, nome: str, identificador: str, senha: str, data_nascimento: str
+    ) -> Tuple[bool, str]:
+        """Como `criar_conta`, sem bloquear o loop: o hash roda no executor de senhas."""
+        senha_hash = await self.hasher.hash_async(senha or "")
+        return await asyncio.to_thread(self._inserir_conta, nome, identificador, senha_hash, data_nascimento)
+
+    def _inserir_conta(self, nome: str, identificador: str, senha_hash: str, data_nascimento: str) -> Tuple[bool, str]:
+        with self.conexao() as conn:
+            cursor = conn.cursor()
         
-        # Salvar/atualizar OAuth info
-        cursor.execute("""
-            INSERT OR REPLACE INTO oauth_users (user_id, provider, provider_id)
-            VALUES (?, 'google', ?)
-        """, (user_id, google_id))
+            try:
+                email = (identificador or "").strip().lower()
+                nome = (nome or "").strip()
+                data_nascimento = (data_nascimento or "").strip()
+
+                # Verificar se email jÃ¡ existe
+                cursor.execute("SELECT id FROM usuarios WHERE email = ?", (email,))
+                if cursor.fetchone():
+                    return False, "ID ja cadastrado"
+            
+                # Inserir usuÃ¡rio
+                cursor.execute("""
+                    INSERT INTO usuarios (nome, email, senha, idade, data_nascimento, ultima_atividade, onboarding_seen)
+                    VALUES (?, ?, ?, ?, ?, DATE('now'), 0)
+                """, (nome, email, senha_hash, self._calcular_idade(data_nascimento), data_nascimento))
+            
+                user_id = cursor.lastrowid
+            
+                # Criar configuraÃ§Ã£o de IA padrÃ£o
+                cursor.execute("""
+                    INSERT INTO user_ai_config (user_id, provider, model)
+                    VALUES (?, 'gemini', 'gemini-2.5-flash')
+                """, (user_id,))
+
+                # Trial de premium por 1 dia para novos usuarios
+                cursor.execute(
+                    """
+                    INSERT INTO user_subscription
+                    (user_id, plan_code, premium_until, trial_used, trial_started_at, updated_at)
+                    VALUES (?, 'trial', DATETIME('now', '+1 day'), 1, DATETIME('now'), CURRENT_TIMESTAMP)
+                    """,
+                    (user_id,),
+                )
+            
+                return True, "Conta criada com sucesso!"
+            
+            except Exception as e:
+                self._desfazer(conn)
+                return False, f"Erro ao criar conta: {str(e)}"
+    
+    _SQL_LOGIN_USUARIO = """
+        SELECT u.*,
+               ai.provider, ai.model, ai.api_key, ai.economia_mode, ai.telemetry_opt_in
+        FROM usuarios u
+        LEFT JOIN user_ai_config ai ON u.id = ai.user_id
+    """
+
+    def _candidatos_login(self, email: str) -> List[Dict]:
+        """Linhas que podem corresponder ao identificador, em ordem de prioridade."""
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            consultas = [("WHERE lower(u.email) = ?", email)]
+            # 2) Fallback: ID curto (parte antes do @ do email)
+            if "@" not in email:
+                consultas.append(("WHERE lower(u.email) LIKE ?", f"{email}@%"))
+            # 3) Fallback opcional: login por nome
+            consultas.append(("WHERE lower(u.nome) = ?", email))
+            candidatos = []
+            for where, valor in consultas:
+                cursor.execute(f"{self._SQL_LOGIN_USUARIO} {where} LIMIT 1", (valor,))
+                row = cursor.fetchone()
+                if row is not None:
+                    candidatos.append(dict(row))
+            return candidatos
+
+    def _usuario_logado(self, row: Dict, senha: str) -> Dict:
+        stored = str(row.get("senha") or "")
+        # Migracao suave: hash legado (SHA/plain) -> hash seguro, fora do login.
+        if (not stored.startswith(f"{self._PWD_SCHEME}$")) and (not stored.startswith("$2")):
+            self._rehash_em_segundo_plano(int(row["id"]), senha, stored)
+        row_dict = dict(row)
+        row_dict["api_key"] = self._decrypt_api_key(row_dict.get("api_key"))
+        row_dict["oauth_google"] = 0
+        row_dict.update(self.get_subscription_status(int(row_dict["id"])))
+        return row_dict
+
+    def _rehash_em_segundo_plano(self, user_id: int, senha: str, stored: str) -> Future:
+        """Gera o hash novo no executor de senhas e grava pelo writer."""
+
+        def _gravar(hash_futuro: Future) -> None:
+            try:
+                novo = hash_futuro.result()
+            except Exception as ex:
+                log_exception(ex, "database.rehash_senha")
+                return
+            self.writer.send(self._trocar_hash_senha, user_id, stored, novo, where="database.rehash_senha")
+
+        fut = self.hasher.hash(senha)
+        fut.add_done_callback(_gravar)
+        return fut
+
+    def _trocar_hash_senha(self, user_id: int, antigo: str, novo: str) -> None:
+        with self.conexao() as conn:
+            # So troca se a senha nao mudou nesse meio tempo.
+            conn.execute("UPDATE usuarios SET senha = ? WHERE id = ? AND senha = ?", (novo, int(user_id), antigo))
+
+    def fazer_login(self, identificador: str, senha: str) -> Optional[Dict]:
+        """Login tradicional com ID e senha."""
+        senha = senha or ""
+        for row in self._candidatos_login((identificador or "").strip().lower()):
+            if self.hasher.verify(senha, str(row.get("senha") or "")).result():
+                return self._usuario_logado(row, senha)
+        return None
+
+    async def fazer_login_async(self, identificador: str, senha: str) -> Optional[Dict]:
+        """Como `fazer_login`, sem bloquear o loop durante a verificacao da senha."""
+        senha = senha or ""
+        candidatos = await asyncio.to_thread(self._candidatos_login, (identificador or "").strip().lower())
+        for row in candidatos:
+            if await self.hasher.verify_async(senha, str(row.get("senha") or "")):
+                return await asyncio.to_thread(self._usuario_logado, row, senha)
+        return None
+
+    def _calcular_idade(self, data_nascimento: str) -> Optional[int]:
+        """Calcula idade aproximada para manter compatibilidade do campo legado."""
+        try:
+            dt_nasc = datetime.datetime.strptime(data_nascimento, "%d/%m/%Y").date()
+            hoje = datetime.date.today()
+            return hoje.year - dt_nasc.year - ((hoje.month, hoje.day) < (dt_nasc.month, dt_nasc.day))
+        except Exception:
+            return None
+
+    def contar_usuarios(self) -> int:
+        """Retorna quantidade total de usuÃ¡rios cadastrados."""
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM usuarios")
+            total = cursor.fetchone()[0]
+            return int(total or 0)
+    
+    def fazer_login_oauth(
+        self,
+        email: str,
+        nome: str,
+        google_id: str,
+        avatar_url: str = None
+    ) -> Optional[Dict]:
+        """Login ou cadastro via Google OAuth"""
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            email = (email or "").strip().lower()
+            nome = (nome or "").strip()
         
-        conn.commit()
+            # Verificar se usuÃ¡rio existe
+            cursor.execute("SELECT id FROM usuarios WHERE email = ?", (email,))
+            row = cursor.fetchone()
         
-        # Retornar dados do usuÃ¡rio
-        cursor.execute("""
-            SELECT u.*, 
-                   ai.provider, ai.model, ai.api_key, ai.economia_mode, ai.telemetry_opt_in
-            FROM usuarios u
-            LEFT JOIN user_ai_config ai ON u.id = ai.user_id
-            WHERE u.id = ?
-        """, (user_id,))
+            if row:
+                user_id = row['id']
+            else:
+                # Criar novo usuÃ¡rio
+                senha_random = self._hash_password(str(google_id or os.urandom(8).hex()))
+                cursor.execute("""
+                    INSERT INTO usuarios (nome, email, senha, idade, avatar, ultima_atividade, onboarding_seen)
+                    VALUES (?, ?, ?, ?, ?, DATE('now'), 0)
+                """, (nome, email, senha_random, 18, avatar_url or 'user'))
+            
+                user_id = cursor.lastrowid
+            
+                # Criar configuraÃ§Ã£o de IA
+                cursor.execute("""
+                    INSERT INTO user_ai_config (user_id)
+                    VALUES (?)
+                """, (user_id,))
+                cursor.execute(
+                    """
+                    INSERT INTO user_subscription
+                    (user_id, plan_code, premium_until, trial_used, trial_started_at, updated_at)
+                    VALUES (?, 'trial', DATETIME('now', '+1 day'), 1, DATETIME('now'), CURRENT_TIMESTAMP)
+                    """,
+                    (user_id,),
+                )
+        
+            # Salvar/atualizar OAuth info
+            cursor.execute("""
+                INSERT OR REPLACE INTO oauth_users (user_id, provider, provider_id)
+                VALUES (?, 'google', ?)
+            """, (user_id, google_id))
+        
+            # Retornar dados do usuÃ¡rio
+            cursor.execute("""
+                SELECT u.*, 
+                       ai.provider, ai.model, ai.api_key, ai.economia_mode, ai.telemetry_opt_in
+                FROM usuarios u
+                LEFT JOIN user_ai_config ai ON u.id = ai.user_id
+                WHERE u.id = ?
+            """, (user_id,))
         
-        row = cursor.fetchone()
-        conn.close()
+            row = cursor.fetchone()
         
-        if row:
-            row_dict = dict(row)
-            row_dict["api_key"] = self._decrypt_api_key(row_dict.get("api_key"))
-            row_dict["oauth_google"] = 1
-            row_dict.update(self.get_subscription_status(int(row_dict["id"])))
-            return row_dict
-        return None
+            if row:
+                row_dict = dict(row)
+                row_dict["api_key"] = self._decrypt_api_key(row_dict.get("api_key"))
+                row_dict["oauth_google"] = 1
+                row_dict.update(self.get_subscription_status(int(row_dict["id"])))
+                return row_dict
+            return None
 
     def sync_cloud_user(self, backend_user_id: int, email: str, nome: str) -> Optional[Dict]:
         """
         Sincroniza um usuario autenticado no backend para uso local (cache/perfil),
         sem usar autenticacao local por senha.
         """
-        conn = self.conectar()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        email_clean = (email or "").strip().lower()
-        nome_clean = (nome or "").strip() or (email_clean.split("@")[0] if "@" in email_clean else "Usuario")
-        if not email_clean:
-            conn.close()
-            return None
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            email_clean = (email or "").strip().lower()
+            nome_clean = (nome or "").strip() or (email_clean.split("@")[0] if "@" in email_clean else "Usuario")
+            if not email_clean:
+                return None
+
+            try:
+                cursor.execute("SELECT id FROM usuarios WHERE lower(email) = ? LIMIT 1", (email_clean,))
+                row = cursor.fetchone()
+                if row:
+                    user_id = int(row["id"])
+                    cursor.execute(
+                        """
+                        UPDATE usuarios
+                        SET nome = ?, email = ?, ultima_atividade = DATE('now')
+                        WHERE id = ?
+                        """,
+                        (nome_clean, email_clean, user_id),
+                    )
+                else:
+                    pwd_seed = f"cloud-{int(backend_user_id or 0)}-{os.urandom(8).hex()}"
+                    senha_random = self._hash_password(pwd_seed)
+                    cursor.execute(
+                        """
+                        INSERT INTO usuarios (nome, email, senha, idade, avatar, ultima_atividade, onboarding_seen)
+                        VALUES (?, ?, ?, ?, ?, DATE('now'), 0)
+                        """,
+                        (nome_clean, email_clean, senha_random, 18, "user"),
+                    )
+                    user_id = int(cursor.lastrowid or 0)
 
-        try:
-            cursor.execute("SELECT id FROM usuarios WHERE lower(email) = ? LIMIT 1", (email_clean,))
-            row = cursor.fetchone()
-            if row:
-                user_id = int(row["id"])
                 cursor.execute(
                     """
-                    UPDATE usuarios
-                    SET nome = ?, email = ?, ultima_atividade = DATE('now')
-                    WHERE id = ?
+                    INSERT OR IGNORE INTO user_ai_config (user_id, provider, model)
+                    VALUES (?, 'gemini', 'gemini-2.5-flash')
                     """,
-                    (nome_clean, email_clean, user_id),
+                    (user_id,),
                 )
-            else:
-                pwd_seed = f"cloud-{int(backend_user_id or 0)}-{os.urandom(8).hex()}"
-                senha_random = self._hash_password(pwd_seed)
+                self._ensure_subscription_row(cursor, user_id)
+
                 cursor.execute(
                     """
-                    INSERT INTO usuarios (nome, email, senha, idade, avatar, ultima_atividade, onboarding_seen)
-                    VALUES (?, ?, ?, ?, ?, DATE('now'), 0)
-                    """,
-                    (nome_clean, email_clean, senha_random, 18, "user"),
-                )
-                user_id = int(cursor.lastrowid or 0)
-
-            cursor.execute(
-                """
-                INSERT OR IGNORE INTO user_ai_config (user_id, provider, model)
-                VALUES (?, 'gemini', 'gemini-2.5-flash')
-                """,
-                (user_id,),
-            )
-            self._ensure_subscription_row(cursor, user_id)
-            conn.commit()
-
-            cursor.execute(
-                """
-                SELECT u.*,
-                       ai.provider, ai.model, ai.api_key, ai.economia_mode, ai.telemetry_opt_in
-                FROM usuarios u
-                LEFT JOIN user_ai_config ai ON u.id = ai.user_id
-                WHERE u.id = ?
-                LIMIT 1
-                """,
-                (user_id,),
-            )
-            user_row = cursor.fetchone()
-            if not user_row:
+                    SELECT u.*,
+                           ai.provider, ai.model, ai.api_key, ai.economia_mode, ai.telemetry_opt_in
+                    FROM usuarios u
+                    LEFT JOIN user_ai_config ai ON u.id = ai.user_id
+                    WHERE u.id = ?
+                    LIMIT 1
+                    """,
+                    (user_id,),
+                )
+                user_row = cursor.fetchone()
+                if not user_row:
+                    return None
+                row_dict = dict(user_row)
+                row_dict["api_key"] = self._decrypt_api_key(row_dict.get("api_key"))
+                row_dict["oauth_google"] = 0
+                row_dict["backend_user_id"] = int(backend_user_id or 0)
+                row_dict.update(self.get_subscription_status(user_id))
+                return row_dict
+            except Exception:
+                self._desfazer(conn)
                 return None
-            row_dict = dict(user_row)
-            row_dict["api_key"] = self._decrypt_api_key(row_dict.get("api_key"))
-            row_dict["oauth_google"] = 0
-            row_dict["backend_user_id"] = int(backend_user_id or 0)
-            row_dict.update(self.get_subscription_status(user_id))
-            return row_dict
-        except Exception:
-            return None
-        finally:
-            conn.close()
 
     def _ensure_subscription_row(self, cursor, user_id: int):
         cursor.execute(
@@ -988,107 +1989,100 @@ class Database:
         premium_until: Optional[str],
         trial_used: int,
     ) -> bool:
-        conn = self.conectar()
-        cursor = conn.cursor()
-        try:
-            self._ensure_subscription_row(cursor, int(user_id))
-            normalized_until = self._normalize_subscription_datetime(premium_until)
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            try:
+                self._ensure_subscription_row(cursor, int(user_id))
+                normalized_until = self._normalize_subscription_datetime(premium_until)
+                cursor.execute(
+                    """
+                    UPDATE user_subscription
+                    SET plan_code = ?,
+                        premium_until = ?,
+                        trial_used = ?,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE user_id = ?
+                    """,
+                    (
+                        str(plan_code or "free"),
+                        normalized_until,
+                        1 if int(trial_used or 0) else 0,
+                        int(user_id),
+                    ),
+                )
+                return True
+            except Exception:
+                self._desfazer(conn)
+                return False
+
+    def get_subscription_status(self, user_id: int) -> Dict:
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            self._ensure_subscription_row(cursor, user_id)
             cursor.execute(
                 """
-                UPDATE user_subscription
-                SET plan_code = ?,
-                    premium_until = ?,
-                    trial_used = ?,
-                    updated_at = CURRENT_TIMESTAMP
+                SELECT plan_code, premium_until, trial_used, trial_started_at
+                FROM user_subscription
                 WHERE user_id = ?
                 """,
-                (
-                    str(plan_code or "free"),
-                    normalized_until,
-                    1 if int(trial_used or 0) else 0,
-                    int(user_id),
-                ),
+                (user_id,),
             )
-            conn.commit()
-            return True
-        except Exception:
-            return False
-        finally:
-            conn.close()
-
-    def get_subscription_status(self, user_id: int) -> Dict:
-        conn = self.conectar()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        self._ensure_subscription_row(cursor, user_id)
-        conn.commit()
-        cursor.execute(
-            """
-            SELECT plan_code, premium_until, trial_used, trial_started_at
-            FROM user_subscription
-            WHERE user_id = ?
-            """,
-            (user_id,),
-        )
-        row = cursor.fetchone()
-        conn.close()
-        if not row:
+            row = cursor.fetchone()
+            if not row:
+                return {
+                    "plan_code": "free",
+                    "premium_active": 0,
+                    "premium_until": None,
+                    "trial_used": 0,
+                }
+            premium_until = row["premium_until"]
+            premium_active = 0
+            if premium_until:
+                try:
+                    dt = datetime.datetime.strptime(str(premium_until), "%Y-%m-%d %H:%M:%S")
+                    premium_active = 1 if dt > datetime.datetime.now() else 0
+                except Exception:
+                    premium_active = 0
             return {
-                "plan_code": "free",
-                "premium_active": 0,
-                "premium_until": None,
-                "trial_used": 0,
+                "plan_code": row["plan_code"] or "free",
+                "premium_active": int(premium_active),
+                "premium_until": premium_until,
+                "trial_used": int(row["trial_used"] or 0),
             }
-        premium_until = row["premium_until"]
-        premium_active = 0
-        if premium_until:
-            try:
-                dt = datetime.datetime.strptime(str(premium_until), "%Y-%m-%d %H:%M:%S")
-                premium_active = 1 if dt > datetime.datetime.now() else 0
-            except Exception:
-                premium_active = 0
-        return {
-            "plan_code": row["plan_code"] or "free",
-            "premium_active": int(premium_active),
-            "premium_until": premium_until,
-            "trial_used": int(row["trial_used"] or 0),
-        }
 
     def ativar_plano_premium(self, user_id: int, plano: str) -> Tuple[bool, str]:
         dias = 15 if plano == "premium_15" else 30 if plano == "premium_30" else 0
         if dias <= 0:
             return False, "Plano invalido."
-        conn = self.conectar()
-        cursor = conn.cursor()
-        try:
-            self._ensure_subscription_row(cursor, user_id)
-            cursor.execute(
-                """
-                UPDATE user_subscription
-                SET plan_code = ?,
-                    premium_until = CASE
-                        WHEN premium_until IS NOT NULL AND DATETIME(premium_until) > DATETIME('now')
-                            THEN DATETIME(premium_until, '+' || ? || ' days')
-                        ELSE DATETIME('now', '+' || ? || ' days')
-                    END,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-                """,
-                (plano, dias, dias, user_id),
-            )
-            conn.commit()
-            return True, "Plano ativado com sucesso."
-        except Exception as ex:
-            return False, f"Falha ao ativar plano: {ex}"
-        finally:
-            conn.close()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            try:
+                self._ensure_subscription_row(cursor, user_id)
+                cursor.execute(
+                    """
+                    UPDATE user_subscription
+                    SET plan_code = ?,
+                        premium_until = CASE
+                            WHEN premium_until IS NOT NULL AND DATETIME(premium_until) > DATETIME('now')
+                                THEN DATETIME(premium_until, '+' || ? || ' days')
+                            ELSE DATETIME('now', '+' || ? || ' days')
+                        END,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE user_id = ?
+                    """,
+                    (plano, dias, dias, user_id),
+                )
+                return True, "Plano ativado com sucesso."
+            except Exception as ex:
+                self._desfazer(conn)
+                return False, f"Falha ao ativar plano: {ex}"
 
     def consumir_limite_diario(self, user_id: int, feature_key: str, limite: int) -> Tuple[bool, int]:
         if limite <= 0:
             return True, 0
-        conn = self.conectar()
-        cursor = conn.cursor()
-        try:
+        with self.conexao() as conn:
+            cursor = conn.cursor()
             cursor.execute(
                 """
                 INSERT INTO usage_daily (user_id, feature_key, day_key, used_count, updated_at)
@@ -1108,7 +2102,6 @@ class Database:
             row = cursor.fetchone()
             used = int((row[0] if row else 0) or 0)
             if used >= limite:
-                conn.commit()
                 return False, used
             cursor.execute(
                 """
@@ -1118,16 +2111,12 @@ class Database:
                 """,
                 (user_id, feature_key),
             )
-            conn.commit()
             return True, used + 1
-        finally:
-            conn.close()
 
     def obter_uso_diario(self, user_id: int, feature_key: str) -> int:
         """Retorna o consumo do recurso no dia atual sem incrementar uso."""
-        conn = self.conectar()
-        cursor = conn.cursor()
-        try:
+        with self.conexao() as conn:
+            cursor = conn.cursor()
             cursor.execute(
                 """
                 SELECT used_count
@@ -1139,155 +2128,138 @@ class Database:
             )
             row = cursor.fetchone()
             return int((row[0] if row else 0) or 0)
-        finally:
-            conn.close()
     
     def atualizar_api_key(self, user_id: int, api_key: str):
         """Atualiza API key do usuÃ¡rio"""
-        conn = self.conectar()
-        cursor = conn.cursor()
-        encrypted = self._encrypt_api_key(api_key)
-        cursor.execute(
-            """
-            INSERT OR IGNORE INTO user_ai_config (user_id, provider, model, economia_mode, api_key)
-            VALUES (?, 'gemini', 'gemini-2.5-flash', 0, NULL)
-            """,
-            (user_id,),
-        )
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            encrypted = self._encrypt_api_key(api_key)
+            cursor.execute(
+                """
+                INSERT OR IGNORE INTO user_ai_config (user_id, provider, model, economia_mode, api_key)
+                VALUES (?, 'gemini', 'gemini-2.5-flash', 0, NULL)
+                """,
+                (user_id,),
+            )
         
-        cursor.execute("""
-            UPDATE user_ai_config
-            SET api_key = ?
-            WHERE user_id = ?
-        """, (encrypted, user_id))
-        
-        conn.commit()
-        conn.close()
+            cursor.execute("""
+                UPDATE user_ai_config
+                SET api_key = ?
+                WHERE user_id = ?
+            """, (encrypted, user_id))
     
     def atualizar_provider_ia(self, user_id: int, provider: str, model: str):
         """Atualiza configuraÃ§Ã£o de IA do usuÃ¡rio"""
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT OR IGNORE INTO user_ai_config (user_id, provider, model, economia_mode, api_key)
-            VALUES (?, 'gemini', 'gemini-2.5-flash', 0, NULL)
-            """,
-            (user_id,),
-        )
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT OR IGNORE INTO user_ai_config (user_id, provider, model, economia_mode, api_key)
+                VALUES (?, 'gemini', 'gemini-2.5-flash', 0, NULL)
+                """,
+                (user_id,),
+            )
         
-        cursor.execute("""
-            UPDATE user_ai_config
-            SET provider = ?, model = ?
-            WHERE user_id = ?
-        """, (provider, model, user_id))
-        
-        conn.commit()
-        conn.close()
+            cursor.execute("""
+                UPDATE user_ai_config
+                SET provider = ?, model = ?
+                WHERE user_id = ?
+            """, (provider, model, user_id))
     
     def registrar_ganho_xp(self, user_id: int, xp: int, motivo: str = ""):
         """Registra ganho de XP"""
-        conn = self.conectar()
-        cursor = conn.cursor()
-        
-        # Inserir no histÃ³rico
-        cursor.execute("""
-            INSERT INTO historico_xp (user_id, xp_ganho, motivo)
-            VALUES (?, ?, ?)
-        """, (user_id, xp, motivo))
+        with self.conexao() as conn:
+            cursor = conn.cursor()
         
-        # Atualizar XP total
-        cursor.execute("""
-            UPDATE usuarios
-            SET xp = xp + ?,
-                ultima_atividade = DATE('now')
-            WHERE id = ?
-        """, (xp, user_id))
+            # Inserir no histÃ³rico
+            cursor.execute("""
+                INSERT INTO historico_xp (user_id, xp_ganho, motivo)
+                VALUES (?, ?, ?)
+            """, (user_id, xp, motivo))
         
-        conn.commit()
-        conn.close()
+            # Atualizar XP total
+            cursor.execute("""
+                UPDATE usuarios
+                SET xp = xp + ?,
+                    ultima_atividade = DATE('now')
+                WHERE id = ?
+            """, (xp, user_id))
 
     def registrar_resultado_quiz(self, user_id: int, acertos: int, total: int, xp: int):
         """Atualiza estatisticas de quiz e XP."""
-        conn = self.conectar()
-        cursor = conn.cursor()
-        novo_streak = self._calcular_streak(cursor, user_id)
-        cursor.execute("""
-            UPDATE usuarios
-            SET xp = xp + ?,
-                acertos = acertos + ?,
-                total_questoes = total_questoes + ?,
-                streak_dias = ?,
-                ultima_atividade = DATE('now')
-            WHERE id = ?
-        """, (xp, acertos, total, novo_streak, user_id))
-        cursor.execute(
-            """
-            INSERT INTO historico_xp (user_id, xp_ganho, motivo)
-            VALUES (?, ?, ?)
-            """,
-            (user_id, xp, f"Quiz {acertos}/{total}"),
-        )
-        self._registrar_progresso_diario_cursor(
-            cursor,
-            user_id,
-            questoes=max(0, int(total or 0)),
-            acertos=max(0, int(acertos or 0)),
-        )
-        conn.commit()
-        conn.close()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            novo_streak = self._calcular_streak(cursor, user_id)
+            cursor.execute("""
+                UPDATE usuarios
+                SET xp = xp + ?,
+                    acertos = acertos + ?,
+                    total_questoes = total_questoes + ?,
+                    streak_dias = ?,
+                    ultima_atividade = DATE('now')
+                WHERE id = ?
+            """, (xp, acertos, total, novo_streak, user_id))
+            cursor.execute(
+                """
+                INSERT INTO historico_xp (user_id, xp_ganho, motivo)
+                VALUES (?, ?, ?)
+                """,
+                (user_id, xp, f"Quiz {acertos}/{total}"),
+            )
+            self._registrar_progresso_diario_cursor(
+                cursor,
+                user_id,
+                questoes=max(0, int(total or 0)),
+                acertos=max(0, int(acertos or 0)),
+            )
 
     def atualizar_identificador(self, user_id: int, novo_identificador: str) -> Tuple[bool, str]:
         """Atualiza o ID (campo email) do usuario com validacao de unicidade."""
-        conn = self.conectar()
-        cursor = conn.cursor()
-        try:
-            novo_id = (novo_identificador or "").strip().lower()
-            if not novo_id:
-                return False, "ID nao pode ficar vazio."
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            try:
+                novo_id = (novo_identificador or "").strip().lower()
+                if not novo_id:
+                    return False, "ID nao pode ficar vazio."
 
-            cursor.execute(
-                "SELECT id FROM usuarios WHERE lower(email) = ? AND id <> ?",
-                (novo_id, user_id),
-            )
-            if cursor.fetchone():
-                return False, "Este ID ja esta em uso por outra conta."
+                cursor.execute(
+                    "SELECT id FROM usuarios WHERE lower(email) = ? AND id <> ?",
+                    (novo_id, user_id),
+                )
+                if cursor.fetchone():
+                    return False, "Este ID ja esta em uso por outra conta."
 
-            cursor.execute(
-                "UPDATE usuarios SET email = ? WHERE id = ?",
-                (novo_id, user_id),
-            )
-            if cursor.rowcount == 0:
-                return False, "Usuario nao encontrado."
+                cursor.execute(
+                    "UPDATE usuarios SET email = ? WHERE id = ?",
+                    (novo_id, user_id),
+                )
+                if cursor.rowcount == 0:
+                    return False, "Usuario nao encontrado."
 
-            conn.commit()
-            return True, "ID atualizado com sucesso."
-        except Exception as ex:
-            return False, f"Erro ao atualizar ID: {str(ex)}"
-        finally:
-            conn.close()
+                return True, "ID atualizado com sucesso."
+            except Exception as ex:
+                self._desfazer(conn)
+                return False, f"Erro ao atualizar ID: {str(ex)}"
 
     def atualizar_economia_ia(self, user_id: int, economia_mode: bool):
         """Atualiza modo economia da IA do usuario."""
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT OR IGNORE INTO user_ai_config (user_id, provider, model, economia_mode, api_key)
-            VALUES (?, 'gemini', 'gemini-2.5-flash', 0, NULL)
-            """,
-            (user_id,),
-        )
-        cursor.execute(
-            """
-            UPDATE user_ai_config
-            SET economia_mode = ?
-            WHERE user_id = ?
-            """,
-            (1 if economia_mode else 0, user_id),
-        )
-        conn.commit()
-        conn.close()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT OR IGNORE INTO user_ai_config (user_id, provider, model, economia_mode, api_key)
+                VALUES (?, 'gemini', 'gemini-2.5-flash', 0, NULL)
+                """,
+                (user_id,),
+            )
+            cursor.execute(
+                """
+                UPDATE user_ai_config
+                SET economia_mode = ?
+                WHERE user_id = ?
+                """,
+                (1 if economia_mode else 0, user_id),
+            )
 
     def _calcular_streak(self, cursor, user_id: int) -> int:
         cursor.execute(
@@ -1354,95 +2326,90 @@ class Database:
         discursivas: int = 0,
         tempo_segundos: int = 0,
     ) -> None:
-        conn = self.conectar()
-        cursor = conn.cursor()
-        self._registrar_progresso_diario_cursor(
-            cursor,
-            user_id,
-            questoes=questoes,
-            acertos=acertos,
-            flashcards=flashcards,
-            discursivas=discursivas,
-            tempo_segundos=tempo_segundos,
-        )
-        novo_streak = self._calcular_streak(cursor, user_id)
-        cursor.execute(
-            """
-            UPDATE usuarios
-            SET streak_dias = ?, ultima_atividade = DATE('now')
-            WHERE id = ?
-            """,
-            (novo_streak, user_id),
-        )
-        conn.commit()
-        conn.close()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            self._registrar_progresso_diario_cursor(
+                cursor,
+                user_id,
+                questoes=questoes,
+                acertos=acertos,
+                flashcards=flashcards,
+                discursivas=discursivas,
+                tempo_segundos=tempo_segundos,
+            )
+            novo_streak = self._calcular_streak(cursor, user_id)
+            cursor.execute(
+                """
+                UPDATE usuarios
+                SET streak_dias = ?, ultima_atividade = DATE('now')
+                WHERE id = ?
+                """,
+                (novo_streak, user_id),
+            )
 
     def obter_progresso_diario(self, user_id: int) -> Dict:
-        conn = self.conectar()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT meta_questoes_diaria, streak_dias
-            FROM usuarios
-            WHERE id = ?
-            """,
-            (user_id,),
-        )
-        user_row = cursor.fetchone()
-        meta = int((user_row["meta_questoes_diaria"] if user_row else 20) or 20)
-        streak = int((user_row["streak_dias"] if user_row else 0) or 0)
-        cursor.execute(
-            """
-            SELECT questoes_respondidas, acertos, flashcards_revisados, discursivas_corrigidas, tempo_segundos
-            FROM estudo_progresso_diario
-            WHERE user_id = ? AND dia = DATE('now')
-            """,
-            (user_id,),
-        )
-        row = cursor.fetchone()
-        conn.close()
-        feitos = int((row["questoes_respondidas"] if row else 0) or 0)
-        acertos = int((row["acertos"] if row else 0) or 0)
-        return {
-            "meta_questoes": max(5, meta),
-            "questoes_respondidas": feitos,
-            "acertos": acertos,
-            "flashcards_revisados": int((row["flashcards_revisados"] if row else 0) or 0),
-            "discursivas_corrigidas": int((row["discursivas_corrigidas"] if row else 0) or 0),
-            "tempo_segundos": int((row["tempo_segundos"] if row else 0) or 0),
-            "progresso_meta": min(1.0, feitos / max(1, meta)),
-            "streak_dias": streak,
-        }
+        self._eventos_em_dia()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute(
+                """
+                SELECT meta_questoes_diaria, streak_dias
+                FROM usuarios
+                WHERE id = ?
+                """,
+                (user_id,),
+            )
+            user_row = cursor.fetchone()
+            meta = int((user_row["meta_questoes_diaria"] if user_row else 20) or 20)
+            streak = int((user_row["streak_dias"] if user_row else 0) or 0)
+            cursor.execute(
+                """
+                SELECT questoes_respondidas, acertos, flashcards_revisados, discursivas_corrigidas, tempo_segundos
+                FROM estudo_progresso_diario
+                WHERE user_id = ? AND dia = DATE('now')
+                """,
+                (user_id,),
+            )
+            row = cursor.fetchone()
+            feitos = int((row["questoes_respondidas"] if row else 0) or 0)
+            acertos = int((row["acertos"] if row else 0) or 0)
+            return {
+                "meta_questoes": max(5, meta),
+                "questoes_respondidas": feitos,
+                "acertos": acertos,
+                "flashcards_revisados": int((row["flashcards_revisados"] if row else 0) or 0),
+                "discursivas_corrigidas": int((row["discursivas_corrigidas"] if row else 0) or 0),
+                "tempo_segundos": int((row["tempo_segundos"] if row else 0) or 0),
+                "progresso_meta": min(1.0, feitos / max(1, meta)),
+                "streak_dias": streak,
+            }
     
     def obter_dados_grafico(self, user_id: int, dias: int = 7) -> Tuple[List[Dict], int]:
         """ObtÃ©m dados para grÃ¡fico de XP"""
-        conn = self.conectar()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT DATE(data_hora) as dia, SUM(xp_ganho) as xp
-            FROM historico_xp
-            WHERE user_id = ? AND data_hora >= DATE('now', '-' || ? || ' days')
-            GROUP BY DATE(data_hora)
-            ORDER BY dia ASC
-        """, (user_id, dias))
-        
-        resultados = cursor.fetchall()
-        conn.close()
-        
+        self._eventos_em_dia()
+        dias = int(max(1, min(366, dias)))
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT dia, xp
+                FROM estudo_progresso_diario
+                WHERE user_id = ? AND dia >= DATE('now', ?)
+                """,
+                (user_id, f"-{dias - 1} days"),
+            )
+            data_dict = {r[0]: int(r[1] or 0) for r in cursor.fetchall()}
+
         # Preencher todos os dias
         dados = []
         total_xp = 0
         hoje = datetime.date.today()
-        
-        data_dict = {r[0]: r[1] for r in resultados}
-        
         for i in range(dias - 1, -1, -1):
             dia = (hoje - datetime.timedelta(days=i)).strftime("%Y-%m-%d")
             xp = data_dict.get(dia, 0)
             total_xp += xp
-            
+
             # Label do dia
             if dias <= 7:
                 label = ["Seg", "Ter", "Qua", "Qui", "Sex", "SÃ¡b", "Dom"][
@@ -1450,88 +2417,178 @@ class Database:
                 ]
             else:
                 label = f"{dia.split('-')[2]}/{dia.split('-')[1]}"
-            
+
             dados.append({"dia": label, "xp": xp})
-        
+
         return dados, total_xp
-    
+
+    _AGRUPAMENTOS_RESUMO = {
+        "dia": "dia",
+        "semana": "STRFTIME('%Y-W%W', dia)",
+        "mes": "STRFTIME('%Y-%m', dia)",
+    }
+
+    def obter_resumo_estudo(self, user_id: int, dias: int = 30, agrupar: str = "dia") -> List[Dict]:
+        """
+        XP, questoes, acertos/precisao, flashcards e tempo por dia, semana ou mes,
+        a partir do resumo diario (ate 366 linhas lidas, qualquer que seja o historico).
+        """
+        if agrupar not in self._AGRUPAMENTOS_RESUMO:
+            raise ValueError(f"Agrupamento invalido: {agrupar}")
+        self._eventos_em_dia()
+        dias = int(max(1, min(366, dias)))
+        chave = self._AGRUPAMENTOS_RESUMO[agrupar]
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT {chave} AS periodo,
+                       SUM(xp), SUM(questoes_respondidas), SUM(acertos),
+                       SUM(flashcards_revisados), SUM(tempo_segundos)
+                FROM estudo_progresso_diario
+                WHERE user_id = ? AND dia >= DATE('now', ?)
+                GROUP BY periodo
+                ORDER BY periodo
+                """,
+                (int(user_id), f"-{dias - 1} days"),
+            )
+            out = []
+            for periodo, xp, questoes, acertos, flashcards, tempo in cursor.fetchall():
+                questoes = int(questoes or 0)
+                acertos = int(acertos or 0)
+                out.append(
+                    {
+                        "periodo": periodo,
+                        "xp": int(xp or 0),
+                        "questoes": questoes,
+                        "acertos": acertos,
+                        "precisao": round(acertos / questoes, 4) if questoes else 0.0,
+                        "flashcards": int(flashcards or 0),
+                        "tempo_segundos": int(tempo or 0),
+                    }
+                )
+            return out
+
+    def compactar_historico_xp(self, manter_dias: int = 90) -> int:
+        """
+        Apaga linhas brutas de `historico_xp` ja refletidas no resumo diario.
+        Guarda ao menos 62 dias (ranking semanal/mensal e auditoria recente).
+        """
+        manter_dias = int(max(62, manter_dias))
+        with self.conexao() as conn:
+            cursor = conn.execute(
+                "DELETE FROM historico_xp WHERE data_hora < DATE('now', ?)",
+                (f"-{manter_dias} days",),
+            )
+            return int(cursor.rowcount or 0)
+
     # Adicionar mais mÃ©todos conforme necessÃ¡rio...
     
-    def obter_ranking(self, periodo: str = "Geral") -> List[Dict]:
-        """ObtÃ©m ranking de usuÃ¡rios"""
-        conn = self.conectar()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        if periodo == "Hoje":
-            cursor.execute(
-                """
-                SELECT
-                    u.nome,
-                    u.avatar,
-                    u.nivel,
-                    u.xp,
-                    u.acertos,
-                    u.total_questoes,
-                    COALESCE((
-                        SELECT SUM(epd.tempo_segundos)
-                        FROM estudo_progresso_diario epd
-                        WHERE epd.user_id = u.id
-                          AND epd.dia = DATE('now')
-                    ), 0) AS segundos_estudo
-                FROM usuarios u
-                WHERE u.ultima_atividade = DATE('now')
-                ORDER BY u.xp DESC
-                LIMIT 50
-                """
-            )
-        else:
-            cursor.execute(
-                """
-                SELECT
-                    u.nome,
-                    u.avatar,
-                    u.nivel,
-                    u.xp,
-                    u.acertos,
-                    u.total_questoes,
-                    COALESCE((
-                        SELECT SUM(epd.tempo_segundos)
-                        FROM estudo_progresso_diario epd
-                        WHERE epd.user_id = u.id
-                    ), 0) AS segundos_estudo
-                FROM usuarios u
-                ORDER BY u.xp DESC
-                LIMIT 50
-                """
-            )
-        
-        rows = cursor.fetchall()
-        conn.close()
-        
-        ranking = []
-        for row in rows:
-            user_dict = dict(row)
-            # Calcular mÃ©tricas
-            total = int(user_dict.get("total_questoes") or 0)
-            acertos = int(user_dict.get("acertos") or 0)
-            segundos_estudo = int(user_dict.pop("segundos_estudo", 0) or 0)
-            user_dict["taxa_acerto"] = (acertos / total * 100) if total > 0 else 0
-            user_dict["horas_estudo"] = round(segundos_estudo / 3600.0, 2)
-            user_dict["pontuacao"] = int(user_dict.get("xp") or 0)
-            ranking.append(user_dict)
-        
-        return ranking
-
+    _SQL_RANKING_COLUNAS = """
+        SELECT l.user_id, u.nome, u.avatar, u.nivel, u.xp, u.acertos, u.total_questoes,
+               l.xp AS xp_periodo, l.segundos AS segundos_estudo
+        FROM leaderboard l
+        JOIN usuarios u ON u.id = l.user_id
+    """
+
+    def _chave_periodo_ranking(self, periodo: str) -> Tuple[str, str]:
+        periodo = periodo if periodo in self._PERIODOS_RANKING else "Geral"
+        return periodo, self._PERIODOS_RANKING[periodo].format(d="'now'")
+
+    @staticmethod
+    def _linha_ranking(row: sqlite3.Row, posicao: int) -> Dict:
+        user_dict = dict(row)
+        total = int(user_dict.get("total_questoes") or 0)
+        acertos = int(user_dict.get("acertos") or 0)
+        segundos_estudo = int(user_dict.pop("segundos_estudo", 0) or 0)
+        user_dict["taxa_acerto"] = (acertos / total * 100) if total > 0 else 0
+        user_dict["horas_estudo"] = round(segundos_estudo / 3600.0, 2)
+        user_dict["pontuacao"] = int(user_dict.pop("xp_periodo", 0) or 0)
+        user_dict["posicao"] = int(posicao)
+        return user_dict
+
+    def obter_ranking(self, periodo: str = "Geral") -> List[Dict]:
+        """Top 50 do periodo ("Hoje", "Semana" ou "Geral") a partir de `leaderboard`."""
+        self._eventos_em_dia()
+        periodo, chave = self._chave_periodo_ranking(periodo)
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute(
+                f"""
+                {self._SQL_RANKING_COLUNAS}
+                WHERE l.periodo = ? AND l.period_key = {chave}
+                ORDER BY l.xp DESC, l.user_id DESC
+                LIMIT 50
+                """,
+                (periodo,),
+            )
+            return [self._linha_ranking(row, idx) for idx, row in enumerate(cursor.fetchall(), 1)]
+
+    def obter_posicao_ranking(self, user_id: int, periodo: str = "Geral", vizinhos: int = 5) -> Optional[Dict]:
+        """
+        Posicao do usuario no periodo e ate `vizinhos` colocados acima/abaixo.
+
+        Tudo sai do indice (periodo, period_key, xp, user_id): busca pela chave
+        do usuario, contagem do trecho acima dele e duas leituras curtas ao redor.
+        """
+        self._eventos_em_dia()
+        periodo, chave = self._chave_periodo_ranking(periodo)
+        uid = int(user_id)
+        vizinhos = max(0, int(vizinhos))
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute(
+                f"SELECT xp FROM leaderboard WHERE periodo = ? AND user_id = ? AND period_key = {chave}",
+                (periodo, uid),
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            xp = int(row["xp"] or 0)
+            filtro = f"l.periodo = ? AND l.period_key = {chave}"
+            cursor.execute(
+                f"SELECT COUNT(*) FROM leaderboard l WHERE {filtro} AND (l.xp, l.user_id) > (?, ?)",
+                (periodo, xp, uid),
+            )
+            posicao = int(cursor.fetchone()[0] or 0) + 1
+            cursor.execute(
+                f"""
+                {self._SQL_RANKING_COLUNAS}
+                WHERE {filtro} AND (l.xp, l.user_id) > (?, ?)
+                ORDER BY l.xp ASC, l.user_id ASC
+                LIMIT ?
+                """,
+                (periodo, xp, uid, vizinhos),
+            )
+            acima = list(reversed(cursor.fetchall()))
+            cursor.execute(
+                f"""
+                {self._SQL_RANKING_COLUNAS}
+                WHERE {filtro} AND (l.xp, l.user_id) <= (?, ?)
+                ORDER BY l.xp DESC, l.user_id DESC
+                LIMIT ?
+                """,
+                (periodo, xp, uid, vizinhos + 1),
+            )
+            abaixo = cursor.fetchall()
+            primeira = posicao - len(acima)
+            return {
+                "periodo": periodo,
+                "posicao": posicao,
+                "pontuacao": xp,
+                "vizinhos": [self._linha_ranking(r, primeira + i) for i, r in enumerate(acima + abaixo)],
+            }
+
     def execute_query(self, query: str, params: Optional[Tuple[Any, ...]] = None) -> List[Dict]:
         """Executa SELECT generico e retorna lista de dicts."""
-        conn = self.conectar()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute(query, params or ())
-        rows = cursor.fetchall()
-        conn.close()
-        return [dict(r) for r in rows]
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute(query, params or ())
+            rows = cursor.fetchall()
+            return [dict(r) for r in rows]
 
     def _flashcard_hash(self, card: Dict) -> str:
         base = {
@@ -1545,39 +2602,39 @@ class Database:
     def salvar_flashcards_gerados(self, user_id: int, tema: str, cards: List[Dict], dificuldade: str = "intermediario") -> int:
         if not cards:
             return 0
-        conn = self.conectar()
-        cursor = conn.cursor()
-        added = 0
-        for card in cards:
-            frente = str(card.get("frente") or "").strip()
-            verso = str(card.get("verso") or "").strip()
-            if not frente or not verso:
-                continue
-            card_hash = self._flashcard_hash({"frente": frente, "verso": verso, "tema": tema})
-            cursor.execute(
-                """
-                INSERT INTO flashcards
-                (user_id, card_hash, frente, verso, tema, dificuldade, revisao_nivel, proxima_revisao, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, 0, DATETIME('now', '+1 day'), CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                ON CONFLICT(user_id, card_hash) DO UPDATE SET
-                    frente = excluded.frente,
-                    verso = excluded.verso,
-                    tema = excluded.tema,
-                    dificuldade = excluded.dificuldade,
-                    updated_at = CURRENT_TIMESTAMP
-                """,
-                (
-                    user_id,
-                    card_hash,
-                    frente,
-                    verso,
-                    str(tema or "Geral"),
-                    str(dificuldade or "intermediario"),
-                ),
-            )
-            added += 1
-        conn.commit()
-        conn.close()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            added = 0
+            for card in cards:
+                frente = str(card.get("frente") or "").strip()
+                verso = str(card.get("verso") or "").strip()
+                if not frente or not verso:
+                    continue
+                card_hash = self._flashcard_hash({"frente": frente, "verso": verso, "tema": tema})
+                self._salvar_assinatura_quase_dup(cursor, card_hash, frente)
+                cursor.execute(
+                    """
+                    INSERT INTO flashcards
+                    (user_id, card_hash, frente, verso, tema, dificuldade, revisao_nivel, proxima_revisao, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, 0, DATETIME('now', '+1 day'), CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                    ON CONFLICT(user_id, card_hash) DO UPDATE SET
+                        frente = excluded.frente,
+                        verso = excluded.verso,
+                        tema = excluded.tema,
+                        dificuldade = excluded.dificuldade,
+                        updated_at = CURRENT_TIMESTAMP
+                    """,
+                    (
+                        user_id,
+                        card_hash,
+                        frente,
+                        verso,
+                        str(tema or "Geral"),
+                        str(dificuldade or "intermediario"),
+                    ),
+                )
+                added += 1
+            return added
 
     def sync_ai_preferences(
         self,
@@ -1589,88 +2646,72 @@ class Database:
         telemetry_opt_in: bool,
     ) -> bool:
         """Sincroniza preferencias de IA vindas do backend para cache local."""
-        conn = self.conectar()
-        cursor = conn.cursor()
-        try:
-            provider_clean = str(provider or "gemini").strip().lower() or "gemini"
-            model_clean = str(model or "gemini-2.5-flash").strip() or "gemini-2.5-flash"
-            encrypted = self._encrypt_api_key(api_key)
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            try:
+                provider_clean = str(provider or "gemini").strip().lower() or "gemini"
+                model_clean = str(model or "gemini-2.5-flash").strip() or "gemini-2.5-flash"
+                encrypted = self._encrypt_api_key(api_key)
+                cursor.execute(
+                    """
+                    INSERT OR IGNORE INTO user_ai_config (user_id, provider, model, economia_mode, api_key, telemetry_opt_in)
+                    VALUES (?, 'gemini', 'gemini-2.5-flash', 0, NULL, 0)
+                    """,
+                    (int(user_id),),
+                )
+                cursor.execute(
+                    """
+                    UPDATE user_ai_config
+                    SET provider = ?,
+                        model = ?,
+                        api_key = ?,
+                        economia_mode = ?,
+                        telemetry_opt_in = ?
+                    WHERE user_id = ?
+                    """,
+                    (
+                        provider_clean,
+                        model_clean,
+                        encrypted,
+                        1 if bool(economia_mode) else 0,
+                        1 if bool(telemetry_opt_in) else 0,
+                        int(user_id),
+                    ),
+                )
+                return True
+            except Exception:
+                self._desfazer(conn)
+                return False
+
+    def atualizar_telemetria_opt_in(self, user_id: int, telemetry_opt_in: bool):
+        """Atualiza consentimento de telemetria anonima (opt-in)."""
+        with self.conexao() as conn:
+            cursor = conn.cursor()
             cursor.execute(
                 """
-                INSERT OR IGNORE INTO user_ai_config (user_id, provider, model, economia_mode, api_key, telemetry_opt_in)
-                VALUES (?, 'gemini', 'gemini-2.5-flash', 0, NULL, 0)
+                INSERT OR IGNORE INTO user_ai_config (user_id, provider, model, economia_mode, api_key)
+                VALUES (?, 'gemini', 'gemini-2.5-flash', 0, NULL)
                 """,
-                (int(user_id),),
+                (user_id,),
             )
             cursor.execute(
                 """
                 UPDATE user_ai_config
-                SET provider = ?,
-                    model = ?,
-                    api_key = ?,
-                    economia_mode = ?,
-                    telemetry_opt_in = ?
+                SET telemetry_opt_in = ?
                 WHERE user_id = ?
                 """,
-                (
-                    provider_clean,
-                    model_clean,
-                    encrypted,
-                    1 if bool(economia_mode) else 0,
-                    1 if bool(telemetry_opt_in) else 0,
-                    int(user_id),
-                ),
+                (1 if telemetry_opt_in else 0, user_id),
             )
-            conn.commit()
-            return True
-        except Exception:
-            return False
-        finally:
-            conn.close()
-        return added
-
-    def atualizar_telemetria_opt_in(self, user_id: int, telemetry_opt_in: bool):
-        """Atualiza consentimento de telemetria anonima (opt-in)."""
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT OR IGNORE INTO user_ai_config (user_id, provider, model, economia_mode, api_key)
-            VALUES (?, 'gemini', 'gemini-2.5-flash', 0, NULL)
-            """,
-            (user_id,),
-        )
-        cursor.execute(
-            """
-            UPDATE user_ai_config
-            SET telemetry_opt_in = ?
-            WHERE user_id = ?
-            """,
-            (1 if telemetry_opt_in else 0, user_id),
-        )
-        conn.commit()
-        conn.close()
 
     def registrar_revisao_flashcard(self, user_id: int, card: Dict, lembrei: bool) -> None:
         card_hash = self._flashcard_hash(card)
-        conn = self.conectar()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT id, revisao_nivel, total_revisoes, total_acertos, total_erros
-            FROM flashcards
-            WHERE user_id = ? AND card_hash = ?
-            LIMIT 1
-            """,
-            (user_id, card_hash),
-        )
-        row = cursor.fetchone()
-        if not row:
-            self.salvar_flashcards_gerados(user_id, str(card.get("tema") or "Geral"), [card], str(card.get("dificuldade") or "intermediario"))
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
             cursor.execute(
                 """
-                SELECT id, revisao_nivel, total_revisoes, total_acertos, total_erros
+                SELECT id, revisao_nivel, total_revisoes, total_acertos, total_erros, ultima_revisao_em,
+                       srs_ease, srs_intervalo, srs_estabilidade, srs_dificuldade
                 FROM flashcards
                 WHERE user_id = ? AND card_hash = ?
                 LIMIT 1
@@ -1678,54 +2719,277 @@ class Database:
                 (user_id, card_hash),
             )
             row = cursor.fetchone()
-        if not row:
-            conn.close()
-            return
+            if not row:
+                self.salvar_flashcards_gerados(user_id, str(card.get("tema") or "Geral"), [card], str(card.get("dificuldade") or "intermediario"))
+                cursor.execute(
+                    """
+                    SELECT id, revisao_nivel, total_revisoes, total_acertos, total_erros, ultima_revisao_em,
+                           srs_ease, srs_intervalo, srs_estabilidade, srs_dificuldade
+                    FROM flashcards
+                    WHERE user_id = ? AND card_hash = ?
+                    LIMIT 1
+                    """,
+                    (user_id, card_hash),
+                )
+                row = cursor.fetchone()
+            if not row:
+                return
 
-        nivel_atual = int(row["revisao_nivel"] or 0)
-        total_rev = int(row["total_revisoes"] or 0) + 1
-        total_acertos = int(row["total_acertos"] or 0) + (1 if lembrei else 0)
-        total_erros = int(row["total_erros"] or 0) + (0 if lembrei else 1)
+            nivel_atual = int(row["revisao_nivel"] or 0)
+            total_rev = int(row["total_revisoes"] or 0) + 1
+            total_acertos = int(row["total_acertos"] or 0) + (1 if lembrei else 0)
+            total_erros = int(row["total_erros"] or 0) + (0 if lembrei else 1)
 
-        intervalos = [1, 2, 4, 7, 14, 30, 60, 120, 180]
-        if lembrei:
-            novo_nivel = min(len(intervalos) - 1, nivel_atual + 1)
-            dias = intervalos[novo_nivel]
-        else:
-            novo_nivel = max(0, nivel_atual - 1)
-            dias = 1
+            estado = self.estrategia_revisao(user_id, "flashcard").schedule_batch(
+                [
+                    self._estado_srs(
+                        row,
+                        level=nivel_atual,
+                        hits=int(row["total_acertos"] or 0),
+                        attempts=int(row["total_revisoes"] or 0),
+                        last_review=row["ultima_revisao_em"],
+                    )
+                ],
+                [bool(lembrei)],
+            )[0]
+
+            cursor.execute(
+                """
+                UPDATE flashcards
+                SET revisao_nivel = ?,
+                    proxima_revisao = ?,
+                    ultima_revisao_em = CURRENT_TIMESTAMP,
+                    total_revisoes = ?,
+                    total_acertos = ?,
+                    total_erros = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                """,
+                (int(estado["level"]), estado["due"], total_rev, total_acertos, total_erros, int(row["id"])),
+            )
+            self._gravar_estado_srs(cursor, "flashcards", estado, "id = ?", (int(row["id"]),))
+
+    # colunas do estado SM-2/FSRS -> chaves de srs_engine.STATE_FIELDS
+    _COLUNAS_SRS = (
+        ("srs_ease", "ease"),
+        ("srs_intervalo", "interval_days"),
+        ("srs_estabilidade", "stability"),
+        ("srs_dificuldade", "difficulty"),
+    )
+    # estrategia de cada tipo enquanto o usuario nao migra
+    _ESTRATEGIA_PADRAO = {"flashcard": "ladder", "questao": "mistakes"}
+
+    def estrategia_revisao(
+        self,
+        user_id: int,
+        tipo: str,
+        padrao: Optional[srs_engine.SchedulingStrategy] = None,
+    ) -> srs_engine.SchedulingStrategy:
+        """
+        Estrategia de agendamento do usuario para o tipo ("flashcard" ou
+        "questao"), gravada por reagendar_revisoes("migrar"); sem escolha
+        gravada, `padrao` (ou a padrao do app para o tipo).
+        """
+        with self.conexao() as conn:
+            row = conn.execute(
+                "SELECT estrategia FROM estrategia_revisao WHERE user_id = ? AND tipo = ?",
+                (int(user_id), str(tipo)),
+            ).fetchone()
+        if row:
+            try:
+                return srs_engine.get_strategy(row[0])
+            except ValueError:
+                pass
+        return padrao or srs_engine.get_strategy(self._ESTRATEGIA_PADRAO[tipo])
 
+    def _estado_srs(self, row, **estado) -> Dict[str, Any]:
+        """Estado para o srs_engine: `estado` mais as colunas SM-2/FSRS da linha."""
+        for coluna, chave in self._COLUNAS_SRS:
+            estado[chave] = row[coluna]
+        return estado
+
+    def _gravar_estado_srs(self, cursor, tabela: str, estado: Dict[str, Any], filtro: str, params: Sequence[Any]) -> None:
+        atribuicoes = ", ".join(f"{coluna} = ?" for coluna, _chave in self._COLUNAS_SRS)
         cursor.execute(
+            f"UPDATE {tabela} SET {atribuicoes} WHERE {filtro}",
+            (*(estado.get(chave) for _coluna, chave in self._COLUNAS_SRS), *params),
+        )
+
+    # tipo -> (SELECT do estado SRS, UPDATE do novo estado)
+    _SRS_LOTE = {
+        "flashcard": (
+            """
+            SELECT id, revisao_nivel AS level, proxima_revisao AS due, ultima_revisao_em AS last_review,
+                   total_acertos AS hits, total_revisoes AS attempts,
+                   srs_ease AS ease, srs_intervalo AS interval_days,
+                   srs_estabilidade AS stability, srs_dificuldade AS difficulty
+            FROM flashcards
+            """,
             """
             UPDATE flashcards
-            SET revisao_nivel = ?,
-                proxima_revisao = DATETIME('now', '+' || ? || ' days'),
-                ultima_revisao_em = CURRENT_TIMESTAMP,
-                total_revisoes = ?,
-                total_acertos = ?,
-                total_erros = ?,
-                updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
+            SET revisao_nivel = ?1, proxima_revisao = ?2, srs_ease = ?3, srs_intervalo = ?4,
+                srs_estabilidade = ?5, srs_dificuldade = ?6, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?7
             """,
-            (novo_nivel, dias, total_rev, total_acertos, total_erros, int(row["id"])),
-        )
-        conn.commit()
-        conn.close()
-
-    def iniciar_review_session(self, user_id: int, session_type: str, total_items: int) -> int:
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
+        ),
+        "questao": (
             """
-            INSERT INTO review_sessions (user_id, session_type, status, total_items, created_at)
-            VALUES (?, ?, 'in_progress', ?, CURRENT_TIMESTAMP)
+            SELECT id, revisao_nivel AS level, proxima_revisao AS due, ultima_pratica AS last_review,
+                   acertos AS hits, tentativas AS attempts,
+                   srs_ease AS ease, srs_intervalo AS interval_days,
+                   srs_estabilidade AS stability, srs_dificuldade AS difficulty
+            FROM questoes_usuario
             """,
-            (user_id, str(session_type or "daily"), int(max(0, total_items))),
-        )
-        sid = int(cursor.lastrowid or 0)
-        conn.commit()
-        conn.close()
-        return sid
+            """
+            UPDATE questoes_usuario
+            SET revisao_nivel = ?1, review_level = ?1, proxima_revisao = ?2, next_review_at = ?2,
+                srs_ease = ?3, srs_intervalo = ?4, srs_estabilidade = ?5, srs_dificuldade = ?6
+            WHERE id = ?7
+            """,
+        ),
+    }
+
+    def reagendar_revisoes(
+        self,
+        user_id: int,
+        operacao: str,
+        tipo: str = "flashcard",
+        tema: Optional[str] = None,
+        dias: float = 1,
+        estrategia: Optional[str] = None,
+    ) -> int:
+        """
+        Reagenda em lote os itens de revisao do usuario (opcionalmente de um tema):
+        "adiar" empurra a fila em `dias`, "resetar" volta tudo ao nivel zero e
+        "migrar" recalcula as datas com outra `estrategia` do srs_engine e a
+        grava como a estrategia do usuario para o tipo (revisoes seguintes a
+        usam, inclusive fora do `tema`).
+        Um SELECT, um calculo em memoria e um executemany na mesma transacao.
+        Retorna quantos itens foram alterados.
+        """
+        if tipo not in self._SRS_LOTE:
+            raise ValueError(f"Tipo de revisao desconhecido: {tipo}")
+        operacao = str(operacao or "").strip().lower()
+        if operacao not in ("adiar", "resetar", "migrar"):
+            raise ValueError(f"Operacao de reagendamento desconhecida: {operacao}")
+        nova_estrategia = srs_engine.get_strategy(estrategia or "") if operacao == "migrar" else None
+
+        sql_select, sql_update = self._SRS_LOTE[tipo]
+        sql_select += " WHERE user_id = ?"
+        params: List[Any] = [int(user_id)]
+        if tema:
+            sql_select += " AND tema = ?"
+            params.append(str(tema))
+        if operacao == "adiar":
+            sql_select += " AND proxima_revisao IS NOT NULL"
+
+        self._eventos_em_dia()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            if nova_estrategia is not None:
+                cursor.execute(
+                    """
+                    INSERT INTO estrategia_revisao (user_id, tipo, estrategia) VALUES (?, ?, ?)
+                    ON CONFLICT(user_id, tipo) DO UPDATE SET estrategia = excluded.estrategia
+                    """,
+                    (int(user_id), tipo, nova_estrategia.name),
+                )
+                # a previsao de carga depende da estrategia, mesmo sem datas alteradas
+                cursor.execute(
+                    """
+                    INSERT INTO agenda_revisao_versao (user_id, versao) VALUES (?, 1)
+                    ON CONFLICT(user_id) DO UPDATE SET versao = versao + 1
+                    """,
+                    (int(user_id),),
+                )
+            cursor.execute(sql_select, params)
+            estados = [dict(r) for r in cursor.fetchall()]
+            if not estados:
+                return 0
+            agora = datetime.datetime.utcnow()
+            if operacao == "adiar":
+                novos = srs_engine.postpone_batch(estados, dias, agora)
+            elif operacao == "resetar":
+                novos = srs_engine.reset_batch(estados, agora)
+            else:
+                novos = nova_estrategia.reschedule_batch(estados, agora)
+            campos = ("level", "due", *srs_engine.STATE_FIELDS)
+            alterados = [
+                (int(novo.get("level") or 0), *(novo.get(c) for c in campos[1:]), int(novo["id"]))
+                for antigo, novo in zip(estados, novos)
+                if tuple(antigo.get(c) for c in campos) != tuple(novo.get(c) for c in campos)
+            ]
+            if alterados:
+                cursor.executemany(sql_update, alterados)
+            return len(alterados)
+
+    def versao_agenda_revisao(self, user_id: int) -> Tuple[Any, ...]:
+        """Muda sempre que a agenda de revisao do usuario muda (e na virada do dia)."""
+        self._eventos_em_dia()
+        with self.conexao() as conn:
+            row = conn.execute(
+                """
+                SELECT DATE('now'),
+                       (SELECT versao FROM agenda_revisao_versao WHERE user_id = ?)
+                """,
+                (int(user_id),),
+            ).fetchone()
+        return tuple(row)
+
+    def carga_revisoes_agendadas(self, user_id: int, dias: int) -> Dict[str, Any]:
+        """
+        Revisoes agendadas nos proximos `dias` agrupadas por (tipo, dia, nivel)
+        numa unica consulta (atrasadas contam no dia 0), mais a taxa de acerto
+        historica de cada tipo.
+        """
+        dias = max(1, int(dias))
+        self._eventos_em_dia()
+        out: Dict[str, Any] = {
+            "flashcard": {"agendadas": {}, "taxa_acerto": None},
+            "question": {"agendadas": {}, "taxa_acerto": None},
+        }
+        with self.conexao() as conn:
+            rows = conn.execute(
+                """
+                SELECT 'flashcard', MAX(0, CAST(JULIANDAY(DATE(proxima_revisao)) - JULIANDAY(DATE('now')) AS INTEGER)),
+                       COALESCE(revisao_nivel, 0), COUNT(*)
+                FROM flashcards
+                WHERE user_id = ?1 AND proxima_revisao IS NOT NULL AND proxima_revisao < DATE('now', '+' || ?2 || ' days')
+                GROUP BY 1, 2, 3
+                UNION ALL
+                SELECT 'question', MAX(0, CAST(JULIANDAY(DATE(next_review_at)) - JULIANDAY(DATE('now')) AS INTEGER)),
+                       COALESCE(review_level, 0), COUNT(*)
+                FROM questoes_usuario
+                WHERE user_id = ?1 AND next_review_at IS NOT NULL AND next_review_at < DATE('now', '+' || ?2 || ' days')
+                GROUP BY 1, 2, 3
+                """,
+                (int(user_id), dias),
+            ).fetchall()
+            for tipo, dia, nivel, total in rows:
+                out[tipo]["agendadas"][(int(dia), int(nivel))] = int(total)
+            taxas = conn.execute(
+                """
+                SELECT (SELECT 1.0 * SUM(total_acertos) / NULLIF(SUM(total_revisoes), 0) FROM flashcards WHERE user_id = ?1),
+                       (SELECT 1.0 * SUM(acertos) / NULLIF(SUM(tentativas), 0) FROM questoes_usuario WHERE user_id = ?1)
+                """,
+                (int(user_id),),
+            ).fetchone()
+        out["flashcard"]["taxa_acerto"], out["question"]["taxa_acerto"] = taxas
+        return out
+
+    def iniciar_review_session(self, user_id: int, session_type: str, total_items: int) -> int:
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO review_sessions (user_id, session_type, status, total_items, created_at)
+                VALUES (?, ?, 'in_progress', ?, CURRENT_TIMESTAMP)
+                """,
+                (user_id, str(session_type or "daily"), int(max(0, total_items))),
+            )
+            sid = int(cursor.lastrowid or 0)
+            return sid
 
     def registrar_review_session_item(
         self,
@@ -1736,50 +3000,47 @@ class Database:
         is_correct: Optional[bool],
         response_time_ms: int = 0,
     ) -> None:
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO review_session_items
-            (session_id, item_type, item_ref, resultado, is_correct, response_time_ms, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            """,
-            (
-                int(session_id),
-                str(item_type or "question"),
-                str(item_ref or ""),
-                str(resultado or ""),
-                None if is_correct is None else (1 if is_correct else 0),
-                int(max(0, response_time_ms or 0)),
-            ),
-        )
-        conn.commit()
-        conn.close()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO review_session_items
+                (session_id, item_type, item_ref, resultado, is_correct, response_time_ms, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                """,
+                (
+                    int(session_id),
+                    str(item_type or "question"),
+                    str(item_ref or ""),
+                    str(resultado or ""),
+                    None if is_correct is None else (1 if is_correct else 0),
+                    int(max(0, response_time_ms or 0)),
+                ),
+            )
 
     def finalizar_review_session(self, session_id: int, acertos: int, erros: int, puladas: int, total_time_ms: int) -> None:
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            UPDATE review_sessions
-            SET status = 'finished',
-                acertos = ?,
-                erros = ?,
-                puladas = ?,
-                total_time_ms = ?,
-                finished_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-            """,
-            (
-                int(max(0, acertos)),
-                int(max(0, erros)),
-                int(max(0, puladas)),
-                int(max(0, total_time_ms)),
-                int(session_id),
-            ),
-        )
-        conn.commit()
-        conn.close()
+        self._eventos_em_dia()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                UPDATE review_sessions
+                SET status = 'finished',
+                    acertos = ?,
+                    erros = ?,
+                    puladas = ?,
+                    total_time_ms = ?,
+                    finished_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                """,
+                (
+                    int(max(0, acertos)),
+                    int(max(0, erros)),
+                    int(max(0, puladas)),
+                    int(max(0, total_time_ms)),
+                    int(session_id),
+                ),
+            )
 
     def criar_mock_exam_session(
         self,
@@ -1789,26 +3050,24 @@ class Database:
         tempo_total_s: int,
         modo: str = "timed",
     ) -> int:
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO mock_exam_sessions
-            (user_id, filtro_snapshot_json, progress_json, total_questoes, tempo_total_s, modo, status, created_at)
-            VALUES (?, ?, NULL, ?, ?, ?, 'in_progress', CURRENT_TIMESTAMP)
-            """,
-            (
-                int(user_id),
-                json.dumps(filtro_snapshot or {}, ensure_ascii=False),
-                int(max(0, total_questoes)),
-                int(max(0, tempo_total_s)),
-                str(modo or "timed"),
-            ),
-        )
-        sid = int(cursor.lastrowid or 0)
-        conn.commit()
-        conn.close()
-        return sid
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO mock_exam_sessions
+                (user_id, filtro_snapshot_json, progress_json, total_questoes, tempo_total_s, modo, status, created_at)
+                VALUES (?, ?, NULL, ?, ?, ?, 'in_progress', CURRENT_TIMESTAMP)
+                """,
+                (
+                    int(user_id),
+                    json.dumps(filtro_snapshot or {}, ensure_ascii=False),
+                    int(max(0, total_questoes)),
+                    int(max(0, tempo_total_s)),
+                    str(modo or "timed"),
+                ),
+            )
+            sid = int(cursor.lastrowid or 0)
+            return sid
 
     def registrar_mock_exam_item(
         self,
@@ -1823,27 +3082,25 @@ class Database:
         resultado = "skip"
         if resposta_index is not None and correta_index is not None:
             resultado = "correct" if int(resposta_index) == int(correta_index) else "wrong"
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO mock_exam_items
-            (session_id, ordem, qhash, meta_json, resposta_index, correta_index, resultado, tempo_ms, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            """,
-            (
-                int(session_id),
-                int(max(0, ordem)),
-                self._question_hash(question),
-                json.dumps(meta or {}, ensure_ascii=False),
-                None if resposta_index is None else int(resposta_index),
-                None if correta_index is None else int(correta_index),
-                resultado,
-                int(max(0, tempo_ms or 0)),
-            ),
-        )
-        conn.commit()
-        conn.close()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO mock_exam_items
+                (session_id, ordem, qhash, meta_json, resposta_index, correta_index, resultado, tempo_ms, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                """,
+                (
+                    int(session_id),
+                    int(max(0, ordem)),
+                    self._question_hash(question),
+                    json.dumps(meta or {}, ensure_ascii=False),
+                    None if resposta_index is None else int(resposta_index),
+                    None if correta_index is None else int(correta_index),
+                    resultado,
+                    int(max(0, tempo_ms or 0)),
+                ),
+            )
 
     def salvar_mock_exam_progresso(self, session_id: int, current_idx: int, respostas: Dict[int, Optional[int]]) -> None:
         payload = {
@@ -1851,18 +3108,16 @@ class Database:
             "respostas": {str(k): (None if v is None else int(v)) for k, v in (respostas or {}).items()},
             "updated_at": datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z",
         }
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            UPDATE mock_exam_sessions
-            SET progress_json = ?
-            WHERE id = ?
-            """,
-            (json.dumps(payload, ensure_ascii=False), int(session_id)),
-        )
-        conn.commit()
-        conn.close()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                UPDATE mock_exam_sessions
+                SET progress_json = ?
+                WHERE id = ?
+                """,
+                (encode_blob(payload), int(session_id)),
+            )
 
     def finalizar_mock_exam_session(
         self,
@@ -1873,164 +3128,484 @@ class Database:
         score_pct: float,
         tempo_gasto_s: int,
     ) -> None:
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            UPDATE mock_exam_sessions
-            SET status = 'finished',
-                acertos = ?,
-                erros = ?,
-                puladas = ?,
-                score_pct = ?,
-                tempo_gasto_s = ?,
-                finished_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-            """,
-            (
-                int(max(0, acertos)),
-                int(max(0, erros)),
-                int(max(0, puladas)),
-                float(max(0.0, min(100.0, score_pct))),
-                int(max(0, tempo_gasto_s)),
-                int(session_id),
-            ),
-        )
-        conn.commit()
-        conn.close()
+        self._eventos_em_dia()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                UPDATE mock_exam_sessions
+                SET status = 'finished',
+                    acertos = ?,
+                    erros = ?,
+                    puladas = ?,
+                    score_pct = ?,
+                    tempo_gasto_s = ?,
+                    finished_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                """,
+                (
+                    int(max(0, acertos)),
+                    int(max(0, erros)),
+                    int(max(0, puladas)),
+                    float(max(0.0, min(100.0, score_pct))),
+                    int(max(0, tempo_gasto_s)),
+                    int(session_id),
+                ),
+            )
 
     def contar_simulados_hoje(self, user_id: int) -> int:
-        conn = self.conectar()
-        cursor = conn.cursor()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT COUNT(*)
+                FROM mock_exam_sessions
+                WHERE user_id = ? AND created_at >= DATE('now') AND created_at < DATE('now', '+1 day')
+                """,
+                (int(user_id),),
+            )
+            total = cursor.fetchone()[0]
+            return int(total or 0)
+
+    def listar_historico_simulados(self, user_id: int, limite: int = 20) -> List[Dict]:
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute(
+                """
+                SELECT id, modo, status, total_questoes, acertos, erros, puladas, score_pct,
+                       tempo_total_s, tempo_gasto_s, created_at, finished_at
+                FROM mock_exam_sessions
+                WHERE user_id = ?
+                ORDER BY created_at DESC
+                LIMIT ?
+                """,
+                (int(user_id), int(max(1, limite))),
+            )
+            rows = [dict(r) for r in cursor.fetchall()]
+            return rows
+
+    def contadores_revisao(self, user_id: int) -> Dict[str, int]:
+        contadores = self.obter_contadores(user_id)
+        return {
+            "flashcards_pendentes": contadores["flashcards_pendentes"],
+            "questoes_pendentes": contadores["questoes_pendentes"],
+            "questoes_marcadas": contadores["questoes_marcadas"],
+        }
+
+    def obter_contadores(self, user_id: int) -> Dict[str, int]:
+        """
+        Contadores da home e da revisao a partir de `user_counters`.
+
+        Alem das leituras por chave primaria (contadores, meta e progresso de
+        hoje), so conta os itens agendados para hoje que ja venceram (faixa
+        curta do indice user_id + proxima_revisao).
+        """
+        self._eventos_em_dia()
+        uid = int(user_id)
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            sql_linha = "SELECT *, DATE('now') AS hoje FROM user_counters WHERE user_id = ?"
+            row = cursor.execute(sql_linha, (uid,)).fetchone()
+            if row is None or str(row["rolled_day"]) < str(row["hoje"]):
+                self._virar_dia_contadores(cursor, uid)
+                row = cursor.execute(sql_linha, (uid,)).fetchone()
+
+            vencidos_hoje = {}
+            for tipo, tabela in self._FILAS_CONTADORES:
+                cursor.execute(
+                    f"""
+                    SELECT COUNT(*)
+                    FROM {tabela}
+                    WHERE user_id = ?
+                      AND proxima_revisao >= DATE('now')
+                      AND proxima_revisao <= DATETIME('now')
+                    """,
+                    (uid,),
+                )
+                vencidos_hoje[tipo] = int(cursor.fetchone()[0] or 0)
+
+            hoje = cursor.execute(
+                """
+                SELECT u.meta_questoes_diaria AS meta, p.questoes_respondidas, p.acertos
+                FROM usuarios u
+                LEFT JOIN estudo_progresso_diario p ON p.user_id = u.id AND p.dia = DATE('now')
+                WHERE u.id = ?
+                """,
+                (uid,),
+            ).fetchone()
+
+            return {
+                "flashcards_pendentes": max(0, int(row["flashcards_pendentes"] or 0) + vencidos_hoje["flashcard"]),
+                "questoes_pendentes": max(0, int(row["questoes_pendentes"] or 0) + vencidos_hoje["question"]),
+                "questoes_marcadas": max(0, int(row["questoes_marcadas"] or 0)),
+                "total_respondidas": max(0, int(row["total_respondidas"] or 0)),
+                "streak": max(0, int(row["streak"] or 0)),
+                "meta_questoes": max(5, int((hoje["meta"] if hoje else 20) or 20)),
+                "questoes_hoje": int((hoje["questoes_respondidas"] if hoje else 0) or 0),
+                "acertos_hoje": int((hoje["acertos"] if hoje else 0) or 0),
+            }
+
+    def _virar_dia_contadores(self, cursor, user_id: int) -> None:
+        """Soma ao contador os baldes de dias que ja passaram (uma vez por dia)."""
+        cursor.execute(
+            "INSERT OR IGNORE INTO user_counters (user_id, rolled_day) VALUES (?, DATE('now'))",
+            (user_id,),
+        )
         cursor.execute(
             """
-            SELECT COUNT(*)
-            FROM mock_exam_sessions
-            WHERE user_id = ? AND DATE(created_at) = DATE('now')
+            UPDATE user_counters
+            SET flashcards_pendentes = flashcards_pendentes + COALESCE((
+                    SELECT SUM(n) FROM user_due_buckets
+                    WHERE user_id = ? AND kind = 'flashcard' AND day < DATE('now')
+                ), 0),
+                questoes_pendentes = questoes_pendentes + COALESCE((
+                    SELECT SUM(n) FROM user_due_buckets
+                    WHERE user_id = ? AND kind = 'question' AND day < DATE('now')
+                ), 0),
+                rolled_day = DATE('now')
+            WHERE user_id = ? AND rolled_day < DATE('now')
             """,
-            (int(user_id),),
+            (user_id, user_id, user_id),
+        )
+        cursor.execute(
+            "DELETE FROM user_due_buckets WHERE user_id = ? AND day < DATE('now')",
+            (user_id,),
         )
-        total = cursor.fetchone()[0]
-        conn.close()
-        return int(total or 0)
 
-    def listar_historico_simulados(self, user_id: int, limite: int = 20) -> List[Dict]:
-        conn = self.conectar()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+    def _question_hash(self, question: Dict) -> str:
+        base = {
+            "enunciado": question.get("enunciado", ""),
+            "alternativas": question.get("alternativas", []),
+            "correta_index": question.get("correta_index", question.get("correta", 0)),
+        }
+        payload = json.dumps(base, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # Chaves transitorias anexadas na leitura (fila de revisao); nao fazem
+    # parte do conteudo da questao.
+    _CHAVES_TRANSITORIAS_QUESTAO = ("_srs",)
+
+    # Guardados fora da compressao: listas que so mostram tema/enunciado nao
+    # decodificam o resto (ver `listar_questoes_usuario(campos=...)`).
+    _CAMPOS_LEVES_QUESTAO = ("tema", "enunciado")
+
+    def _salvar_conteudo_questao(
+        self,
+        cursor,
+        question: Dict,
+        qhash: Optional[str] = None,
+        tema: Optional[str] = None,
+    ) -> int:
+        """Grava o conteudo em `questions` (so reescreve se mudou) e retorna o id."""
+        qhash = qhash or self._question_hash(question)
+        conteudo = {k: v for k, v in question.items() if k not in self._CHAVES_TRANSITORIAS_QUESTAO}
         cursor.execute(
             """
-            SELECT id, modo, status, total_questoes, acertos, erros, puladas, score_pct,
-                   tempo_total_s, tempo_gasto_s, created_at, finished_at
-            FROM mock_exam_sessions
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-            LIMIT ?
+            INSERT INTO questions (qhash, dados_json)
+            VALUES (?, ?)
+            ON CONFLICT(qhash) DO UPDATE SET
+                dados_json = excluded.dados_json,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE questions.dados_json IS NOT excluded.dados_json
             """,
-            (int(user_id), int(max(1, limite))),
+            (str(qhash), encode_blob(conteudo, leves=self._CAMPOS_LEVES_QUESTAO)),
         )
-        rows = [dict(r) for r in cursor.fetchall()]
-        conn.close()
-        return rows
+        mudou = cursor.rowcount > 0
+        cursor.execute("SELECT id FROM questions WHERE qhash = ?", (str(qhash),))
+        question_id = int(cursor.fetchone()[0])
+        if mudou:
+            self._indexar_questao(cursor, question_id, conteudo, tema)
+            self._salvar_assinatura_quase_dup(cursor, str(qhash), near_duplicates.question_text(conteudo), True)
+        return question_id
 
-    def contadores_revisao(self, user_id: int) -> Dict[str, int]:
-        conn = self.conectar()
-        cursor = conn.cursor()
+    def _salvar_assinatura_quase_dup(self, cursor, chave: str, texto: str, substituir: bool = False) -> None:
+        """Assinatura MinHash do conteudo; sem `substituir`, so calcula se ainda nao existe."""
+        if not self._quase_dup_ativa:
+            # Migracoes antigas gravam questoes antes da v12 criar a tabela (a v12 preenche depois).
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'assinaturas_quase_dup'")
+            self._quase_dup_ativa = cursor.fetchone() is not None
+            if not self._quase_dup_ativa:
+                return
+        if not substituir:
+            cursor.execute("SELECT 1 FROM assinaturas_quase_dup WHERE hash = ?", (chave,))
+            if cursor.fetchone() is not None:
+                return
+        sig = near_duplicates.signature(texto)
+        if sig is None:
+            return
         cursor.execute(
             """
-            SELECT COUNT(*)
-            FROM flashcards
-            WHERE user_id = ?
-              AND proxima_revisao IS NOT NULL
-              AND DATETIME(proxima_revisao) <= DATETIME('now')
+            INSERT INTO assinaturas_quase_dup (hash, assinatura) VALUES (?, ?)
+            ON CONFLICT(hash) DO UPDATE SET assinatura = excluded.assinatura
             """,
-            (int(user_id),),
+            (chave, near_duplicates.pack(sig)),
         )
-        flashcards_pendentes = int((cursor.fetchone() or [0])[0] or 0)
 
+    def listar_assinaturas_quase_dup(self, user_id: int, desde: Optional[str] = None, banco_desde_id: int = 0) -> Dict:
+        """
+        Assinaturas do que o usuario ja tem (questoes e flashcards alterados
+        desde `desde`) e do banco offline (linhas com id > `banco_desde_id`).
+        """
+        filtro = " AND {t}.updated_at >= ?" if desde else ""
+        extra = (str(desde),) if desde else ()
+        with self.conexao() as conn:
+            questoes = conn.execute(
+                f"""
+                SELECT q.id, s.assinatura, qu.updated_at
+                FROM questoes_usuario qu
+                JOIN questions q ON q.id = qu.question_id
+                JOIN assinaturas_quase_dup s ON s.hash = q.qhash
+                WHERE qu.user_id = ?{filtro.format(t="qu")}
+                """,
+                (int(user_id),) + extra,
+            ).fetchall()
+            flashcards = conn.execute(
+                f"""
+                SELECT f.id, s.assinatura, f.updated_at
+                FROM flashcards f
+                JOIN assinaturas_quase_dup s ON s.hash = f.card_hash
+                WHERE f.user_id = ?{filtro.format(t="f")}
+                """,
+                (int(user_id),) + extra,
+            ).fetchall()
+            banco = conn.execute(
+                """
+                SELECT bq.id, q.id, s.assinatura
+                FROM banco_questoes bq
+                JOIN questions q ON q.id = bq.question_id
+                JOIN assinaturas_quase_dup s ON s.hash = q.qhash
+                WHERE bq.id > ?
+                """,
+                (int(banco_desde_id or 0),),
+            ).fetchall()
+        return {"questoes": questoes, "flashcards": flashcards, "banco": banco}
+
+    def _tem_busca(self, cursor) -> bool:
+        if not self._busca_ativa:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'busca_questoes'")
+            self._busca_ativa = cursor.fetchone() is not None
+        return self._busca_ativa
+
+    def _indexar_questao(self, cursor, question_id: int, question: Dict, tema: Optional[str] = None) -> None:
+        if not self._tem_busca(cursor):
+            return
+        alternativas = question.get("alternativas") or []
+        corpo = " ".join(
+            [str(a) for a in alternativas if isinstance(a, (str, int, float))]
+            + [str(question.get("explicacao") or "")]
+        )
+        cursor.execute("DELETE FROM busca_questoes WHERE rowid = ?", (int(question_id),))
         cursor.execute(
-            """
-            SELECT COUNT(*)
-            FROM questoes_usuario
-            WHERE user_id = ?
-              AND proxima_revisao IS NOT NULL
-              AND DATETIME(proxima_revisao) <= DATETIME('now')
-            """,
-            (int(user_id),),
+            "INSERT INTO busca_questoes (rowid, tema, enunciado, corpo) VALUES (?, ?, ?, ?)",
+            (
+                int(question_id),
+                str(tema or question.get("tema") or ""),
+                str(question.get("enunciado") or ""),
+                corpo,
+            ),
         )
-        questoes_pendentes = int((cursor.fetchone() or [0])[0] or 0)
 
+    def _indexar_pacote(self, cursor, package_id: int, titulo: str, source_nome: str, dados: Dict) -> None:
+        if not self._tem_busca(cursor):
+            return
+        topicos = dados.get("topicos") or []
+        cursor.execute("DELETE FROM busca_pacotes WHERE rowid = ?", (int(package_id),))
         cursor.execute(
-            """
-            SELECT COUNT(*)
-            FROM questoes_usuario
-            WHERE user_id = ? AND marcado_erro = 1
-            """,
-            (int(user_id),),
+            "INSERT INTO busca_pacotes (rowid, titulo, source_nome, resumo, topicos) VALUES (?, ?, ?, ?, ?)",
+            (
+                int(package_id),
+                str(titulo or ""),
+                str(source_nome or ""),
+                str(dados.get("resumo") or ""),
+                " ".join(str(t) for t in topicos if isinstance(t, (str, int, float))) if isinstance(topicos, list) else "",
+            ),
         )
-        questoes_marcadas = int((cursor.fetchone() or [0])[0] or 0)
 
-        conn.close()
-        return {
-            "flashcards_pendentes": flashcards_pendentes,
-            "questoes_pendentes": questoes_pendentes,
-            "questoes_marcadas": questoes_marcadas,
-        }
+    def _compactar_pacote(self, cursor, dados: Dict) -> Dict:
+        """Troca as questoes do pacote por referencias (hash) em `questions`."""
+        if not isinstance(dados.get("questoes"), list):
+            return dados
+        compacto = dict(dados)
+        refs = []
+        for questao in dados.get("questoes") or []:
+            if not isinstance(questao, dict):
+                continue
+            qhash = self._question_hash(questao)
+            self._salvar_conteudo_questao(cursor, questao, qhash)
+            refs.append(qhash)
+        compacto.pop("questoes", None)
+        compacto["questoes_ref"] = refs
+        compacto["total_flashcards"] = len(dados.get("flashcards") or [])
+        return compacto
 
-    def _question_hash(self, question: Dict) -> str:
-        base = {
-            "enunciado": question.get("enunciado", ""),
-            "alternativas": question.get("alternativas", []),
-            "correta_index": question.get("correta_index", question.get("correta", 0)),
-        }
-        payload = json.dumps(base, ensure_ascii=False, sort_keys=True)
-        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    def _expandir_pacotes(self, cursor, pacotes: List[Dict]) -> None:
+        """Recoloca `questoes` nos pacotes compactados, numa unica consulta."""
+        hashes = {h for dados in pacotes for h in (dados.get("questoes_ref") or [])}
+        conteudo: Dict[str, Dict] = {}
+        if hashes:
+            marcadores = ",".join("?" for _ in hashes)
+            cursor.execute(
+                f"SELECT qhash, dados_json FROM questions WHERE qhash IN ({marcadores})",
+                tuple(hashes),
+            )
+            for qhash, dados_json in cursor.fetchall():
+                try:
+                    conteudo[qhash] = decode_blob(dados_json)
+                except Exception:
+                    continue
+        for dados in pacotes:
+            dados.pop("total_flashcards", None)
+            refs = dados.pop("questoes_ref", None)
+            if refs is not None:
+                dados["questoes"] = [dict(conteudo[h]) for h in refs if h in conteudo]
+
+    # Questoes guardadas por tema/dificuldade no banco offline; acima disso sai
+    # quem esta ha mais tempo sem ser servido (LRU).
+    _LIMITE_BANCO_POR_TEMA = 300
 
-    def salvar_questao_cache(self, tema: str, dificuldade: str, questao: Dict) -> None:
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO banco_questoes (tema, dificuldade, dados_json)
-            VALUES (?, ?, ?)
-            """,
-            (
-                str((tema or "Geral").strip() or "Geral"),
-                str((dificuldade or "intermediario").strip() or "intermediario"),
-                json.dumps(questao, ensure_ascii=False),
-            ),
-        )
-        conn.commit()
-        conn.close()
+    @staticmethod
+    def _chave_banco(valor: Optional[str], padrao: str) -> str:
+        """Chave de busca do banco offline: minusculas, sem acentos, espacos colapsados."""
+        texto = unicodedata.normalize("NFKD", str(valor or "")).encode("ascii", "ignore").decode("ascii")
+        return " ".join(texto.lower().split()) or padrao
 
-    def listar_questoes_cache(self, tema: str, dificuldade: str, limite: int = 10) -> List[Dict]:
-        conn = self.conectar()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+    def _podar_banco_questoes(self, cursor, tema_key: str, dificuldade_key: str) -> None:
         cursor.execute(
             """
-            SELECT dados_json
-            FROM banco_questoes
-            WHERE lower(tema) = lower(?)
-              AND lower(dificuldade) = lower(?)
-            ORDER BY created_at DESC
-            LIMIT ?
+            DELETE FROM banco_questoes
+            WHERE id IN (
+                SELECT id FROM banco_questoes
+                WHERE tema_key = ? AND dificuldade_key = ?
+                ORDER BY COALESCE(last_served_at, created_at) DESC, served_count, id DESC
+                LIMIT -1 OFFSET ?
+            )
             """,
-            (
-                str((tema or "Geral").strip() or "Geral"),
-                str((dificuldade or "intermediario").strip() or "intermediario"),
-                int(max(1, limite)),
-            ),
+            (tema_key, dificuldade_key, int(self._LIMITE_BANCO_POR_TEMA)),
         )
-        rows = cursor.fetchall()
-        conn.close()
+
+    def salvar_questao_cache(self, tema: str, dificuldade: str, questao: Dict) -> None:
+        tema = str((tema or "Geral").strip() or "Geral")
+        dificuldade = str((dificuldade or "intermediario").strip() or "intermediario")
+        tema_key = self._chave_banco(tema, "geral")
+        dificuldade_key = self._chave_banco(dificuldade, "intermediario")
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            question_id = self._salvar_conteudo_questao(cursor, questao, tema=tema)
+            cursor.execute(
+                """
+                INSERT INTO banco_questoes (tema, dificuldade, tema_key, dificuldade_key, question_id)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(tema_key, dificuldade_key, question_id) DO NOTHING
+                """,
+                (tema, dificuldade, tema_key, dificuldade_key, question_id),
+            )
+            if cursor.rowcount:
+                self._podar_banco_questoes(cursor, tema_key, dificuldade_key)
+
+    def listar_questoes_cache(
+        self,
+        tema: str,
+        dificuldade: str,
+        limite: int = 10,
+        user_id: Optional[int] = None,
+    ) -> List[Dict]:
+        """
+        Questoes do banco offline, menos servidas primeiro. Com `user_id`, as que o
+        usuario ainda nao respondeu vem antes; so completa com repetidas se faltar.
+        """
+        tema_key = self._chave_banco(tema, "geral")
+        dificuldade_key = self._chave_banco(dificuldade, "intermediario")
+        limite = int(max(1, limite))
+        if user_id is not None:
+            self._eventos_em_dia()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            escolhidas: List[Tuple[int, int]] = []
+            if user_id is not None:
+                cursor.execute(
+                    """
+                    SELECT bq.id, bq.question_id
+                    FROM banco_questoes bq
+                    WHERE bq.tema_key = ? AND bq.dificuldade_key = ?
+                      AND NOT EXISTS (
+                          SELECT 1 FROM questoes_usuario qu
+                          WHERE qu.user_id = ? AND qu.question_id = bq.question_id
+                      )
+                    ORDER BY bq.served_count, bq.last_served_at
+                    LIMIT ?
+                    """,
+                    (tema_key, dificuldade_key, int(user_id), limite),
+                )
+                escolhidas = cursor.fetchall()
+            if len(escolhidas) < limite:
+                ja = {row_id for row_id, _qid in escolhidas}
+                cursor.execute(
+                    """
+                    SELECT bq.id, bq.question_id
+                    FROM banco_questoes bq
+                    WHERE bq.tema_key = ? AND bq.dificuldade_key = ?
+                    ORDER BY bq.served_count, bq.last_served_at
+                    LIMIT ?
+                    """,
+                    (tema_key, dificuldade_key, limite + len(ja)),
+                )
+                for row_id, question_id in cursor.fetchall():
+                    if row_id not in ja and len(escolhidas) < limite:
+                        escolhidas.append((row_id, question_id))
+            if not escolhidas and self._tem_busca(cursor):
+                # Tema sem correspondencia exata: questoes do banco cujo tema/enunciado
+                # mais se aproxima (ex.: "Historia" -> "História do Brasil").
+                consulta = self._consulta_busca(tema, operador="OR", minimo=3)
+                if consulta:
+                    cursor.execute(
+                        """
+                        SELECT bq.id, bq.question_id
+                        FROM busca_questoes b
+                        JOIN banco_questoes bq ON bq.question_id = b.rowid
+                        WHERE busca_questoes MATCH ? AND bq.dificuldade_key = ?
+                        ORDER BY bm25(busca_questoes, 4.0, 2.0, 1.0), bq.served_count
+                        LIMIT ?
+                        """,
+                        (consulta, dificuldade_key, limite),
+                    )
+                    escolhidas = cursor.fetchall()
+            if not escolhidas:
+                return []
+            ids_questoes = [question_id for _row_id, question_id in escolhidas]
+            marcadores = ",".join("?" for _ in ids_questoes)
+            cursor.execute(f"SELECT id, dados_json FROM questions WHERE id IN ({marcadores})", ids_questoes)
+            conteudo = dict(cursor.fetchall())
+
+        self._registrar_servidas([row_id for row_id, _qid in escolhidas])
         out = []
-        for row in rows:
+        for question_id in ids_questoes:
             try:
-                out.append(json.loads(row["dados_json"] or "{}"))
+                out.append(decode_blob(conteudo.get(question_id)))
             except Exception:
                 continue
-        return out
+        return [q for q in out if q]
+
+    def _registrar_servidas(self, ids: List[int]) -> None:
+        """Atualiza o uso das questoes servidas (pelo writer; nao bloqueia a leitura)."""
+
+        def _marcar():
+            marcadores = ",".join("?" for _ in ids)
+            with self.conexao() as conn:
+                conn.execute(
+                    f"""
+                    UPDATE banco_questoes
+                    SET served_count = served_count + 1, last_served_at = CURRENT_TIMESTAMP
+                    WHERE id IN ({marcadores})
+                    """,
+                    ids,
+                )
+
+        if self.writer.closed or self.writer.in_writer_thread():
+            _marcar()
+        else:
+            self.writer.send(_marcar, where="database.listar_questoes_cache.servidas")
 
     def registrar_questao_usuario(
         self,
@@ -2042,19 +3617,20 @@ class Database:
         favorita: Optional[bool] = None,
         marcado_erro: Optional[bool] = None,
     ) -> None:
-        conn = self.conectar()
-        cursor = conn.cursor()
-        try:
+        with self.conexao() as conn:
+            cursor = conn.cursor()
             qhash = self._question_hash(question)
             cursor.execute(
                 """
-                SELECT favorita, marcado_erro, tentativas, acertos, erros, revisao_nivel
+                SELECT favorita, marcado_erro, tentativas, acertos, erros, revisao_nivel, ultima_pratica,
+                       srs_ease, srs_intervalo, srs_estabilidade, srs_dificuldade, proxima_revisao, next_review_at
                 FROM questoes_usuario
                 WHERE user_id = ? AND qhash = ?
                 """,
                 (user_id, qhash),
             )
             row = cursor.fetchone()
+            estado = None
 
             fav = int(bool(favorita)) if favorita is not None else (row[0] if row else 0)
             mark = int(bool(marcado_erro)) if marcado_erro is not None else (row[1] if row else 0)
@@ -2062,38 +3638,42 @@ class Database:
             acertos = row[3] if row else 0
             erros = row[4] if row else 0
             revisao_nivel = row[5] if row else 0
-            proxima_revisao_expr = None
+            proxima_revisao = row[11] if row else None
+            next_review_at = row[12] if row else None
             last_result = None
 
-            if tentativa_correta is True:
-                tentativas += 1
-                acertos += 1
-                mark = 0
-                revisao_nivel = min(4, int(revisao_nivel or 0) + 1)
-                dias_map = [1, 3, 7, 14, 30]
-                dias = dias_map[revisao_nivel]
-                proxima_revisao_expr = f"DATETIME('now', '+{dias} days')"
-                last_result = "correct"
-            elif tentativa_correta is False:
+            if tentativa_correta is not None:
+                atual = {"level": int(revisao_nivel or 0), "hits": acertos, "attempts": tentativas}
+                if row:
+                    atual["last_review"] = row[6]
+                    atual.update(zip(srs_engine.STATE_FIELDS, row[7:11]))
+                # Mesma estrategia da fila de revisao (QuestionProgressRepository):
+                # os dois caminhos gravam o mesmo nivel e a mesma data.
+                estrategia = self.estrategia_revisao(user_id, "questao")
+                estado = estrategia.schedule_batch([atual], [bool(tentativa_correta)])[0]
+                revisao_nivel = int(estado["level"])
+                proxima_revisao = next_review_at = estado["due"]
                 tentativas += 1
-                erros += 1
-                revisao_nivel = 0
-                mark = 1
-                proxima_revisao_expr = "DATETIME('now', '+1 day')"
-                last_result = "wrong"
-
-            proxima_revisao_sql = proxima_revisao_expr or "NULL"
-            next_review_sql = proxima_revisao_sql
+                if tentativa_correta:
+                    acertos += 1
+                    mark = 0
+                    last_result = "correct"
+                else:
+                    erros += 1
+                    mark = 1
+                    last_result = "wrong"
+
             review_level = int(revisao_nivel or 0)
 
             cursor.execute(
-                f"""
+                """
                 INSERT INTO questoes_usuario
-                (user_id, qhash, dados_json, tema, dificuldade, favorita, marcado_erro, tentativas, acertos, erros,
+                (user_id, qhash, question_id, dados_json, tema, dificuldade, favorita, marcado_erro, tentativas, acertos, erros,
                  revisao_nivel, proxima_revisao, ultima_pratica, marked_for_review, next_review_at, review_level, last_attempt_at, last_result)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, {proxima_revisao_sql}, CURRENT_TIMESTAMP, ?, {next_review_sql}, ?, CURRENT_TIMESTAMP, ?)
+                VALUES (?, ?, ?, '', ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?, ?, ?, CURRENT_TIMESTAMP, ?)
                 ON CONFLICT(user_id, qhash) DO UPDATE SET
-                    dados_json = excluded.dados_json,
+                    question_id = excluded.question_id,
+                    dados_json = '',
                     tema = excluded.tema,
                     dificuldade = excluded.dificuldade,
                     favorita = excluded.favorita,
@@ -2102,10 +3682,10 @@ class Database:
                     acertos = excluded.acertos,
                     erros = excluded.erros,
                     revisao_nivel = excluded.revisao_nivel,
-                    proxima_revisao = COALESCE(excluded.proxima_revisao, questoes_usuario.proxima_revisao),
+                    proxima_revisao = excluded.proxima_revisao,
                     ultima_pratica = CURRENT_TIMESTAMP,
                     marked_for_review = excluded.marked_for_review,
-                    next_review_at = COALESCE(excluded.next_review_at, questoes_usuario.next_review_at),
+                    next_review_at = excluded.next_review_at,
                     review_level = excluded.review_level,
                     last_attempt_at = CURRENT_TIMESTAMP,
                     last_result = COALESCE(excluded.last_result, questoes_usuario.last_result)
@@ -2113,7 +3693,7 @@ class Database:
                 (
                     user_id,
                     qhash,
-                    json.dumps(question, ensure_ascii=False),
+                    self._salvar_conteudo_questao(cursor, question, qhash, tema=tema),
                     tema or "Geral",
                     dificuldade or "intermediario",
                     fav,
@@ -2122,167 +3702,158 @@ class Database:
                     acertos,
                     erros,
                     revisao_nivel,
+                    proxima_revisao,
                     mark,
-                    review_level,
-                    last_result,
-                ),
-            )
-            conn.commit()
-        finally:
-            conn.close()
-
-    def listar_questoes_usuario(self, user_id: int, modo: str = "all", limite: int = 20) -> List[Dict]:
-        conn = self.conectar()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        where = "user_id = ?"
-        if modo == "favoritas":
-            where += " AND favorita = 1"
-        elif modo == "erradas":
-            where += " AND (marcado_erro = 1 OR erros > acertos)"
-        elif modo == "nao_resolvidas":
-            where += " AND tentativas = 0"
-
-        order_by = "ultima_pratica DESC"
-        if modo == "erradas":
-            order_by = "CASE WHEN proxima_revisao IS NULL THEN 1 WHEN DATETIME(proxima_revisao) <= DATETIME('now') THEN 0 ELSE 1 END, DATETIME(proxima_revisao) ASC, ultima_pratica DESC"
+                    next_review_at,
+                    review_level,
+                    last_result,
+                ),
+            )
+            if estado is not None:
+                self._gravar_estado_srs(cursor, "questoes_usuario", estado, "user_id = ? AND qhash = ?", (user_id, qhash))
 
-        cursor.execute(
-            f"""
-            SELECT dados_json, tema, dificuldade, favorita, marcado_erro, tentativas, acertos, erros, revisao_nivel, proxima_revisao
-            FROM questoes_usuario
-            WHERE {where}
-            ORDER BY {order_by}
-            LIMIT ?
-            """,
-            (user_id, int(max(1, limite))),
-        )
-        rows = cursor.fetchall()
-        conn.close()
+    def listar_questoes_usuario(
+        self,
+        user_id: int,
+        modo: str = "all",
+        limite: int = 20,
+        campos: Optional[Tuple[str, ...]] = None,
+    ) -> List[Dict]:
+        """Questoes do usuario; com `campos` (ex.: ("tema", "enunciado")) so esses sao decodificados."""
+        self._eventos_em_dia()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            where = "user_id = ?"
+            if modo == "favoritas":
+                where += " AND favorita = 1"
+            elif modo == "erradas":
+                where += " AND (marcado_erro = 1 OR erros > acertos)"
+            elif modo == "nao_resolvidas":
+                where += " AND tentativas = 0"
 
-        result = []
-        for row in rows:
-            try:
-                q = json.loads(row["dados_json"] or "{}")
-            except Exception:
-                continue
-            q["_meta"] = {
-                "tema": row["tema"],
-                "dificuldade": row["dificuldade"],
-                "favorita": bool(row["favorita"]),
-                "marcado_erro": bool(row["marcado_erro"]),
-                "tentativas": int(row["tentativas"] or 0),
-                "acertos": int(row["acertos"] or 0),
-                "erros": int(row["erros"] or 0),
-                "revisao_nivel": int(row["revisao_nivel"] or 0),
-                "proxima_revisao": row["proxima_revisao"],
-            }
-            result.append(q)
-        return result
+            order_by = "ultima_pratica DESC"
+            if modo == "erradas":
+                order_by = "CASE WHEN proxima_revisao IS NULL THEN 1 WHEN proxima_revisao <= DATETIME('now') THEN 0 ELSE 1 END, proxima_revisao ASC, ultima_pratica DESC"
+
+            cursor.execute(
+                f"""
+                SELECT COALESCE(qc.dados_json, qu.dados_json) AS dados_json,
+                       qu.tema, qu.dificuldade, qu.favorita, qu.marcado_erro, qu.tentativas, qu.acertos, qu.erros,
+                       qu.revisao_nivel, qu.proxima_revisao
+                FROM questoes_usuario qu
+                LEFT JOIN questions qc ON qc.id = qu.question_id
+                WHERE {where}
+                ORDER BY {order_by}
+                LIMIT ?
+                """,
+                (user_id, int(max(1, limite))),
+            )
+            rows = cursor.fetchall()
+
+            result = []
+            for row in rows:
+                try:
+                    if campos:
+                        q = peek_blob(row["dados_json"], *campos)
+                    else:
+                        q = decode_blob(row["dados_json"])
+                except Exception:
+                    continue
+                q["_meta"] = {
+                    "tema": row["tema"],
+                    "dificuldade": row["dificuldade"],
+                    "favorita": bool(row["favorita"]),
+                    "marcado_erro": bool(row["marcado_erro"]),
+                    "tentativas": int(row["tentativas"] or 0),
+                    "acertos": int(row["acertos"] or 0),
+                    "erros": int(row["erros"] or 0),
+                    "revisao_nivel": int(row["revisao_nivel"] or 0),
+                    "proxima_revisao": row["proxima_revisao"],
+                }
+                result.append(q)
+            return result
 
     def salvar_filtro_quiz(self, user_id: int, nome: str, filtro: Dict) -> None:
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO quiz_filtros_salvos (user_id, nome, filtro_json)
-            VALUES (?, ?, ?)
-            """,
-            (user_id, nome, json.dumps(filtro, ensure_ascii=False)),
-        )
-        conn.commit()
-        conn.close()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO quiz_filtros_salvos (user_id, nome, filtro_json)
+                VALUES (?, ?, ?)
+                """,
+                (user_id, nome, encode_blob(filtro)),
+            )
 
     def atualizar_meta_diaria(self, user_id: int, meta_questoes: int):
         """Atualiza meta diaria de questoes do usuario."""
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE usuarios SET meta_questoes_diaria = ? WHERE id = ?",
-            (int(max(5, min(200, meta_questoes))), user_id),
-        )
-        conn.commit()
-        conn.close()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE usuarios SET meta_questoes_diaria = ? WHERE id = ?",
+                (int(max(5, min(200, meta_questoes))), user_id),
+            )
 
     def listar_filtros_quiz(self, user_id: int) -> List[Dict]:
-        conn = self.conectar()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT id, nome, filtro_json, created_at
-            FROM quiz_filtros_salvos
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-            LIMIT 20
-            """,
-            (user_id,),
-        )
-        rows = cursor.fetchall()
-        conn.close()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute(
+                """
+                SELECT id, nome, filtro_json, created_at
+                FROM quiz_filtros_salvos
+                WHERE user_id = ?
+                ORDER BY created_at DESC
+                LIMIT 20
+                """,
+                (user_id,),
+            )
+            rows = cursor.fetchall()
 
-        out = []
-        for row in rows:
-            try:
-                filtro = json.loads(row["filtro_json"] or "{}")
-            except Exception:
-                filtro = {}
-            out.append({"id": row["id"], "nome": row["nome"], "filtro": filtro, "created_at": row["created_at"]})
-        return out
+            out = []
+            for row in rows:
+                try:
+                    filtro = decode_blob(row["filtro_json"])
+                except Exception:
+                    filtro = {}
+                out.append({"id": row["id"], "nome": row["nome"], "filtro": filtro, "created_at": row["created_at"]})
+            return out
 
     def excluir_filtro_quiz(self, filtro_id: int, user_id: int) -> None:
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM quiz_filtros_salvos WHERE id = ? AND user_id = ?", (filtro_id, user_id))
-        conn.commit()
-        conn.close()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM quiz_filtros_salvos WHERE id = ? AND user_id = ?", (filtro_id, user_id))
 
     def renomear_filtro_quiz(self, filtro_id: int, user_id: int, novo_nome: str) -> None:
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE quiz_filtros_salvos SET nome = ? WHERE id = ? AND user_id = ?",
-            (str(novo_nome or "").strip(), int(filtro_id), int(user_id)),
-        )
-        conn.commit()
-        conn.close()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE quiz_filtros_salvos SET nome = ? WHERE id = ? AND user_id = ?",
+                (str(novo_nome or "").strip(), int(filtro_id), int(user_id)),
+            )
 
     def topicos_revisao(self, user_id: int, limite: int = 3) -> List[Dict]:
-        conn = self.conectar()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT tema, SUM(erros) AS erros_total, SUM(acertos) AS acertos_total, SUM(tentativas) AS tentativas_total
-            FROM questoes_usuario
-            WHERE user_id = ?
-            GROUP BY tema
-            HAVING tentativas_total > 0
-            ORDER BY (erros_total - acertos_total) DESC, erros_total DESC, tentativas_total DESC
-            LIMIT ?
-            """,
-            (user_id, int(max(1, limite))),
-        )
-        rows = cursor.fetchall()
-        conn.close()
-        return [dict(r) for r in rows]
+        self._eventos_em_dia()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute(
+                """
+                SELECT tema, SUM(erros) AS erros_total, SUM(acertos) AS acertos_total, SUM(tentativas) AS tentativas_total
+                FROM questoes_usuario
+                WHERE user_id = ?
+                GROUP BY tema
+                HAVING tentativas_total > 0
+                ORDER BY (erros_total - acertos_total) DESC, erros_total DESC, tentativas_total DESC
+                LIMIT ?
+                """,
+                (user_id, int(max(1, limite))),
+            )
+            rows = cursor.fetchall()
+            return [dict(r) for r in rows]
 
     def revisoes_pendentes(self, user_id: int) -> int:
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT COUNT(*)
-            FROM questoes_usuario
-            WHERE user_id = ?
-              AND proxima_revisao IS NOT NULL
-              AND DATETIME(proxima_revisao) <= DATETIME('now')
-            """,
-            (user_id,),
-        )
-        total = cursor.fetchone()[0]
-        conn.close()
-        return int(total or 0)
+        return int(self.obter_contadores(user_id)["questoes_pendentes"])
 
     def sugerir_estudo_agora(self, user_id: int) -> Dict:
         topicos = self.topicos_revisao(user_id, limite=1)
@@ -2311,119 +3882,153 @@ class Database:
         tempo_diario_min: int,
         itens: List[Dict],
     ) -> int:
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            UPDATE study_plan_runs SET status = 'arquivado'
-            WHERE user_id = ? AND status = 'ativo'
-            """,
-            (user_id,),
-        )
-        cursor.execute(
-            """
-            INSERT INTO study_plan_runs (user_id, objetivo, data_prova, tempo_diario_min, status)
-            VALUES (?, ?, ?, ?, 'ativo')
-            """,
-            (user_id, objetivo, data_prova, int(max(30, tempo_diario_min))),
-        )
-        plan_id = int(cursor.lastrowid or 0)
-        for item in itens:
+        with self.conexao() as conn:
+            cursor = conn.cursor()
             cursor.execute(
                 """
-                INSERT INTO study_plan_items (plan_id, dia, tema, atividade, duracao_min, prioridade, concluido)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
+                UPDATE study_plan_runs SET status = 'arquivado'
+                WHERE user_id = ? AND status = 'ativo'
                 """,
-                (
-                    plan_id,
-                    str(item.get("dia") or "Dia"),
-                    str(item.get("tema") or "Geral"),
-                    str(item.get("atividade") or "Resolver questoes"),
-                    int(item.get("duracao_min") or 60),
-                    int(item.get("prioridade") or 1),
-                    1 if item.get("concluido") else 0,
-                ),
+                (user_id,),
+            )
+            cursor.execute(
+                """
+                INSERT INTO study_plan_runs (user_id, objetivo, data_prova, tempo_diario_min, status)
+                VALUES (?, ?, ?, ?, 'ativo')
+                """,
+                (user_id, objetivo, data_prova, int(max(30, tempo_diario_min))),
             )
-        conn.commit()
-        conn.close()
-        return plan_id
+            plan_id = int(cursor.lastrowid or 0)
+            for item in itens:
+                cursor.execute(
+                    """
+                    INSERT INTO study_plan_items (plan_id, dia, tema, atividade, duracao_min, prioridade, concluido)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        plan_id,
+                        str(item.get("dia") or "Dia"),
+                        str(item.get("tema") or "Geral"),
+                        str(item.get("atividade") or "Resolver questoes"),
+                        int(item.get("duracao_min") or 60),
+                        int(item.get("prioridade") or 1),
+                        1 if item.get("concluido") else 0,
+                    ),
+                )
+            return plan_id
 
     def obter_plano_ativo(self, user_id: int) -> Dict:
-        conn = self.conectar()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT *
-            FROM study_plan_runs
-            WHERE user_id = ? AND status = 'ativo'
-            ORDER BY created_at DESC
-            LIMIT 1
-            """,
-            (user_id,),
-        )
-        plan = cursor.fetchone()
-        if not plan:
-            conn.close()
-            return {"plan": None, "itens": []}
-        cursor.execute(
-            """
-            SELECT *
-            FROM study_plan_items
-            WHERE plan_id = ?
-            ORDER BY id ASC
-            """,
-            (plan["id"],),
-        )
-        itens = [dict(r) for r in cursor.fetchall()]
-        conn.close()
-        return {"plan": dict(plan), "itens": itens}
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute(
+                """
+                SELECT *
+                FROM study_plan_runs
+                WHERE user_id = ? AND status = 'ativo'
+                ORDER BY created_at DESC
+                LIMIT 1
+                """,
+                (user_id,),
+            )
+            plan = cursor.fetchone()
+            if not plan:
+                return {"plan": None, "itens": []}
+            cursor.execute(
+                """
+                SELECT *
+                FROM study_plan_items
+                WHERE plan_id = ?
+                ORDER BY id ASC
+                """,
+                (plan["id"],),
+            )
+            itens = [dict(r) for r in cursor.fetchall()]
+            return {"plan": dict(plan), "itens": itens}
 
     def marcar_item_plano(self, item_id: int, concluido: bool) -> None:
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE study_plan_items SET concluido = ? WHERE id = ?",
-            (1 if concluido else 0, item_id),
-        )
-        conn.commit()
-        conn.close()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE study_plan_items SET concluido = ? WHERE id = ?",
+                (1 if concluido else 0, item_id),
+            )
+
+    # Fora da compressao: a lista de pacotes mostra resumo e contagens sem
+    # decodificar questoes/flashcards (ver `listar_study_packages(resumido=True)`).
+    _CAMPOS_LEVES_PACOTE = ("resumo", "topicos", "questoes_ref", "total_flashcards")
 
     def salvar_study_package(self, user_id: int, titulo: str, source_nome: str, dados: Dict) -> int:
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO study_packages (user_id, titulo, source_nome, dados_json)
-            VALUES (?, ?, ?, ?)
-            """,
-            (user_id, titulo, source_nome, json.dumps(dados, ensure_ascii=False)),
-        )
-        package_id = int(cursor.lastrowid or 0)
-        conn.commit()
-        conn.close()
-        return package_id
-
-    def listar_study_packages(self, user_id: int, limite: int = 20) -> List[Dict]:
-        conn = self.conectar()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT id, titulo, source_nome, dados_json, created_at
-            FROM study_packages
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-            LIMIT ?
-            """,
-            (user_id, int(max(1, limite))),
-        )
-        rows = cursor.fetchall()
-        conn.close()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            compacto = self._compactar_pacote(cursor, dados)
+            cursor.execute(
+                """
+                INSERT INTO study_packages (user_id, titulo, source_nome, dados_json)
+                VALUES (?, ?, ?, ?)
+                """,
+                (user_id, titulo, source_nome, encode_blob(compacto, leves=self._CAMPOS_LEVES_PACOTE)),
+            )
+            package_id = int(cursor.lastrowid or 0)
+            self._indexar_pacote(cursor, package_id, titulo, source_nome, dados)
+            return package_id
+
+    @staticmethod
+    def _resumo_pacote(valor) -> Dict:
+        """Resumo, topicos e contagens; pacotes antigos (sem campos leves) decodificam tudo."""
+        dados = LazyBlob(valor)
+        refs = dados.get("questoes_ref")
+        total_flashcards = dados.get("total_flashcards")
+        if total_flashcards is None:
+            total_flashcards = len(dados.get("flashcards") or [])
+        return {
+            "resumo": dados.get("resumo") or "",
+            "topicos": list(dados.get("topicos") or []),
+            "total_questoes": len(refs if refs is not None else dados.get("questoes") or []),
+            "total_flashcards": int(total_flashcards),
+        }
+
+    def listar_study_packages(self, user_id: int, limite: int = 20, resumido: bool = False) -> List[Dict]:
+        """
+        Pacotes do usuario, mais recentes primeiro. Com `resumido`, `dados` traz
+        so resumo, topicos e contagens (sem descomprimir nem buscar as questoes);
+        o pacote inteiro vem de `obter_study_package`.
+        """
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute(
+                """
+                SELECT id, titulo, source_nome, dados_json, created_at
+                FROM study_packages
+                WHERE user_id = ?
+                ORDER BY created_at DESC
+                LIMIT ?
+                """,
+                (user_id, int(max(1, limite))),
+            )
+            return self._pacotes_das_linhas(cursor, cursor.fetchall(), resumido)
+
+    def obter_study_package(self, user_id: int, package_id: int) -> Optional[Dict]:
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute(
+                """
+                SELECT id, titulo, source_nome, dados_json, created_at
+                FROM study_packages
+                WHERE user_id = ? AND id = ?
+                """,
+                (user_id, int(package_id)),
+            )
+            pacotes = self._pacotes_das_linhas(cursor, cursor.fetchall())
+            return pacotes[0] if pacotes else None
+
+    def _pacotes_das_linhas(self, cursor, rows, resumido: bool = False) -> List[Dict]:
         out = []
         for row in rows:
             try:
-                dados = json.loads(row["dados_json"] or "{}")
+                dados = self._resumo_pacote(row["dados_json"]) if resumido else decode_blob(row["dados_json"])
             except Exception:
                 dados = {}
             out.append(
@@ -2431,90 +4036,176 @@ class Database:
                     "id": row["id"],
                     "titulo": row["titulo"],
                     "source_nome": row["source_nome"],
-                    "dados": dados,
+                    "dados": dados if isinstance(dados, dict) else {},
                     "created_at": row["created_at"],
                 }
-            )
-        return out
+            )
+        if not resumido:
+            self._expandir_pacotes(cursor, [p["dados"] for p in out])
+        return out
+
+    _TIPOS_BUSCA = ("questao", "flashcard", "pacote")
+
+    @staticmethod
+    def _consulta_busca(termo: str, operador: str = "AND", minimo: int = 1) -> str:
+        """Converte texto livre numa consulta FTS5 segura (termos entre aspas, por prefixo)."""
+        termos = [t for t in re.findall(r"\w+", str(termo or "")) if len(t) >= minimo]
+        return f" {operador} ".join(f'"{t}"*' for t in termos[:12])
+
+    def buscar(
+        self,
+        user_id: int,
+        termo: str,
+        tipos: Optional[Tuple[str, ...]] = None,
+        limite: int = 20,
+    ) -> List[Dict]:
+        """
+        Busca textual (sem acentos, por prefixo) em questoes, flashcards e pacotes do
+        usuario; questoes do banco offline tambem entram. Ordenado por relevancia (bm25).
+        """
+        consulta = self._consulta_busca(termo)
+        tipos = tuple(tipos or self._TIPOS_BUSCA)
+        limite = int(max(1, limite))
+        if not consulta:
+            return []
+        self._eventos_em_dia()
+        resultados: List[Dict] = []
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            if not self._tem_busca(cursor):
+                return []
+            if "questao" in tipos:
+                cursor.execute(
+                    """
+                    SELECT b.rowid, b.tema, b.enunciado,
+                           snippet(busca_questoes, -1, '', '', '...', 16),
+                           bm25(busca_questoes, 4.0, 2.0, 1.0) AS score
+                    FROM busca_questoes b
+                    WHERE busca_questoes MATCH ?
+                      AND (
+                          EXISTS (SELECT 1 FROM questoes_usuario qu WHERE qu.user_id = ? AND qu.question_id = b.rowid)
+                          OR EXISTS (SELECT 1 FROM banco_questoes bq WHERE bq.question_id = b.rowid)
+                      )
+                    ORDER BY score
+                    LIMIT ?
+                    """,
+                    (consulta, int(user_id), limite),
+                )
+                resultados.extend(
+                    {"tipo": "questao", "id": row_id, "titulo": enunciado, "tema": tema, "trecho": trecho, "score": score}
+                    for row_id, tema, enunciado, trecho, score in cursor.fetchall()
+                )
+            if "flashcard" in tipos:
+                cursor.execute(
+                    """
+                    SELECT f.id, f.tema, f.frente,
+                           snippet(busca_flashcards, -1, '', '', '...', 16),
+                           bm25(busca_flashcards, 2.0, 1.0, 4.0) AS score
+                    FROM busca_flashcards
+                    JOIN flashcards f ON f.id = busca_flashcards.rowid
+                    WHERE busca_flashcards MATCH ? AND f.user_id = ?
+                    ORDER BY score
+                    LIMIT ?
+                    """,
+                    (consulta, int(user_id), limite),
+                )
+                resultados.extend(
+                    {"tipo": "flashcard", "id": row_id, "titulo": frente, "tema": tema, "trecho": trecho, "score": score}
+                    for row_id, tema, frente, trecho, score in cursor.fetchall()
+                )
+            if "pacote" in tipos:
+                cursor.execute(
+                    """
+                    SELECT p.id, p.titulo,
+                           snippet(busca_pacotes, -1, '', '', '...', 16),
+                           bm25(busca_pacotes, 4.0, 1.0, 2.0, 2.0) AS score
+                    FROM busca_pacotes
+                    JOIN study_packages p ON p.id = busca_pacotes.rowid
+                    WHERE busca_pacotes MATCH ? AND p.user_id = ?
+                    ORDER BY score
+                    LIMIT ?
+                    """,
+                    (consulta, int(user_id), limite),
+                )
+                resultados.extend(
+                    {"tipo": "pacote", "id": row_id, "titulo": titulo, "tema": None, "trecho": trecho, "score": score}
+                    for row_id, titulo, trecho, score in cursor.fetchall()
+                )
+        resultados.sort(key=lambda r: r["score"])
+        return resultados[:limite]
 
     def obter_resumo_por_hash(self, user_id: int, source_hash: str) -> Optional[Dict]:
         if not source_hash:
             return None
-        conn = self.conectar()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT summary_json
-            FROM study_summary_cache
-            WHERE user_id = ? AND source_hash = ?
-            LIMIT 1
-            """,
-            (int(user_id), str(source_hash)),
-        )
-        row = cursor.fetchone()
-        conn.close()
-        if not row:
-            return None
-        try:
-            data = json.loads(row["summary_json"] or "{}")
-            return data if isinstance(data, dict) else None
-        except Exception:
-            return None
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute(
+                """
+                SELECT summary_json
+                FROM study_summary_cache
+                WHERE user_id = ? AND source_hash = ?
+                LIMIT 1
+                """,
+                (int(user_id), str(source_hash)),
+            )
+            row = cursor.fetchone()
+            if not row:
+                return None
+            try:
+                data = decode_blob(row["summary_json"])
+                return data if isinstance(data, dict) else None
+            except Exception:
+                return None
 
     def salvar_resumo_por_hash(self, user_id: int, source_hash: str, topic: str, summary: Dict) -> None:
         if not source_hash or not isinstance(summary, dict):
             return
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO study_summary_cache
-            (user_id, source_hash, topic, summary_json, created_at, updated_at)
-            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-            ON CONFLICT(user_id, source_hash) DO UPDATE SET
-                topic = excluded.topic,
-                summary_json = excluded.summary_json,
-                updated_at = CURRENT_TIMESTAMP
-            """,
-            (
-                int(user_id),
-                str(source_hash),
-                str(topic or ""),
-                json.dumps(summary, ensure_ascii=False),
-            ),
-        )
-        conn.commit()
-        conn.close()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO study_summary_cache
+                (user_id, source_hash, topic, summary_json, created_at, updated_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                ON CONFLICT(user_id, source_hash) DO UPDATE SET
+                    topic = excluded.topic,
+                    summary_json = excluded.summary_json,
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                (
+                    int(user_id),
+                    str(source_hash),
+                    str(topic or ""),
+                    encode_blob(summary),
+                ),
+            )
 
     def salvar_nota_questao(self, user_id: int, question: Dict, nota: str) -> None:
         qhash = self._question_hash(question)
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO questoes_notas (user_id, qhash, nota, updated_at)
-            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-            ON CONFLICT(user_id, qhash) DO UPDATE SET
-                nota = excluded.nota,
-                updated_at = CURRENT_TIMESTAMP
-            """,
-            (user_id, qhash, nota or ""),
-        )
-        conn.commit()
-        conn.close()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO questoes_notas (user_id, qhash, nota, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(user_id, qhash) DO UPDATE SET
+                    nota = excluded.nota,
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                (user_id, qhash, nota or ""),
+            )
 
     def obter_nota_questao(self, user_id: int, question: Dict) -> str:
         qhash = self._question_hash(question)
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT nota FROM questoes_notas WHERE user_id = ? AND qhash = ?",
-            (user_id, qhash),
-        )
-        row = cursor.fetchone()
-        conn.close()
-        return str(row[0]) if row and row[0] is not None else ""
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT nota FROM questoes_notas WHERE user_id = ? AND qhash = ?",
+                (user_id, qhash),
+            )
+            row = cursor.fetchone()
+            return str(row[0]) if row and row[0] is not None else ""
 
 
 # Nao criar instancia global em import para evitar inicializacao prematura
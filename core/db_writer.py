@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Thread única de escrita no SQLite, com comandos em lote."""
+
+from __future__ import annotations
+
+import asyncio
+import atexit
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple
+
+from core.error_monitor import log_exception
+
+_PARAR = object()
+
+
+class DatabaseWriter:
+    """
+    Ator de escrita: os comandos entram numa fila e uma thread dedicada os
+    aplica em lotes, cada lote numa unica transacao.
+
+    Cada comando roda dentro de um `db.conexao()` aninhado (SAVEPOINT), entao
+    uma falha desfaz so o proprio comando. O Future de cada comando e resolvido
+    depois do COMMIT do lote, portanto aguardar o resultado garante que a
+    escrita ja e visivel para as demais conexoes.
+    """
+
+    def __init__(self, db, max_lote: int = 64, janela_s: float = 0.005):
+        self.db = db
+        self.max_lote = max(1, int(max_lote))
+        self.janela_s = max(0.0, float(janela_s))
+        self._fila: "queue.Queue[Any]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._fechado = False
+
+    def _garantir_thread(self) -> None:
+        with self._lock:
+            if self._fechado:
+                raise RuntimeError("DatabaseWriter encerrado")
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def submit(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """Enfileira `func(*args, **kwargs)` e devolve um Future com o resultado."""
+        fut: Future = Future()
+        self._garantir_thread()
+        self._fila.put((fut, func, args, kwargs))
+        return fut
+
+    async def run(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Versao aguardavel de `submit` para handlers async (nao bloqueia o loop)."""
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    def send(self, func: Callable[..., Any], *args: Any, where: str = "", **kwargs: Any) -> Future:
+        """Dispara a escrita sem aguardar; falhas vao para o log com `where`."""
+        fut = self.submit(func, *args, **kwargs)
+
+        def _log_falha(done: Future) -> None:
+            ex = done.exception()
+            if ex is not None:
+                log_exception(ex, where or "db_writer")
+
+        fut.add_done_callback(_log_falha)
+        return fut
+
+    @property
+    def closed(self) -> bool:
+        return self._fechado
+
+    def in_writer_thread(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """Bloqueia ate que tudo o que foi enfileirado antes esteja gravado."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self.submit(lambda: None).result(timeout=timeout)
+
+    def close(self, timeout: Optional[float] = 5.0) -> None:
+        """Grava o que estiver pendente e encerra a thread de escrita."""
+        with self._lock:
+            if self._fechado:
+                return
+            self._fechado = True
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._fila.put(_PARAR)
+            thread.join(timeout=timeout)
+
+    def _loop(self) -> None:
+        parar = False
+        while not parar:
+            item = self._fila.get()
+            if item is _PARAR:
+                break
+            lote = [item]
+            while len(lote) < self.max_lote:
+                try:
+                    if self.janela_s:
+                        item = self._fila.get(timeout=self.janela_s)
+                    else:
+                        item = self._fila.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _PARAR:
+                    parar = True
+                    break
+                lote.append(item)
+            self._aplicar(lote)
+
+    def _aplicar(self, lote: List[Tuple[Future, Callable[..., Any], tuple, dict]]) -> None:
+        resultados: List[Tuple[Future, Any, Optional[BaseException]]] = []
+        try:
+            with self.db.conexao():
+                for fut, func, args, kwargs in lote:
+                    if not fut.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with self.db.conexao():
+                            resultados.append((fut, func(*args, **kwargs), None))
+                    except Exception as ex:
+                        resultados.append((fut, None, ex))
+        except Exception as ex:
+            # Falha no COMMIT: o lote inteiro foi desfeito (o primeiro SAVEPOINT
+            # abre a transacao com BEGIN, entao nenhum comando confirmou sozinho).
+            for fut, _res, _err in resultados:
+                fut.set_exception(ex)
+            return
+        for fut, res, err in resultados:
+            if err is not None:
+                fut.set_exception(err)
+            else:
+                fut.set_result(res)
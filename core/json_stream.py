@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Parser incremental de listas JSON vindas em pedacos (streaming da IA)."""
+
+from __future__ import annotations
+
+import json
+from typing import Dict, List, Optional
+
+
+class JsonArrayStreamParser:
+    """
+    Recebe o texto aos pedacos (`feed`) e devolve cada objeto `{...}` que e
+    item de uma lista assim que a chave de fechamento chega. Aceita cercas
+    ```json, texto antes/depois da lista e listas dentro de um objeto
+    envelope (ex.: {"flashcards": [...]}). Itens com JSON invalido sao pulados.
+
+    So o trecho do item em aberto fica no buffer: o custo e linear no texto.
+    `closed` indica se a estrutura de fora (lista ou envelope) ja fechou, ou
+    seja, se o texto recebido nao foi cortado no meio.
+    """
+
+    def __init__(self):
+        self._pilha: List[str] = []
+        self._em_string = False
+        self._escape = False
+        self._buffer: List[str] = []
+        self._profundidade_item: Optional[int] = None
+        self.items_emitted = 0
+        self.closed = False
+
+    def feed(self, chunk: str) -> List[Dict]:
+        prontos: List[Dict] = []
+        for ch in str(chunk or ""):
+            if self._profundidade_item is not None:
+                self._buffer.append(ch)
+            if self._em_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._em_string = False
+                continue
+            if ch == '"':
+                if self._pilha:
+                    self._em_string = True
+            elif ch in "[{":
+                if ch == "{" and self._profundidade_item is None and self._pilha and self._pilha[-1] == "[":
+                    self._profundidade_item = len(self._pilha)
+                    self._buffer = [ch]
+                self._pilha.append(ch)
+            elif ch in "]}":
+                if self._pilha:
+                    self._pilha.pop()
+                    if not self._pilha:
+                        self.closed = True
+                if ch == "}" and self._profundidade_item is not None and len(self._pilha) == self._profundidade_item:
+                    item = self._decodificar("".join(self._buffer))
+                    self._buffer = []
+                    self._profundidade_item = None
+                    if item is not None:
+                        self.items_emitted += 1
+                        prontos.append(item)
+        return prontos
+
+    @staticmethod
+    def _decodificar(texto: str) -> Optional[Dict]:
+        try:
+            item = json.loads(texto)
+        except ValueError:
+            return None
+        return item if isinstance(item, dict) else None
@@ -39,16 +39,14 @@ class LibraryService:
                     pass
             
             # Salvar no BD
-            conn = self.db.conectar()
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO biblioteca_pdfs 
-                (user_id, nome_arquivo, caminho_arquivo, categoria, total_paginas)
-                VALUES (?, ?, ?, ?, ?)
-            """, (user_id, filename, dest_path, categoria, total_paginas))
-            file_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
+            with self.db.conexao() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO biblioteca_pdfs 
+                    (user_id, nome_arquivo, caminho_arquivo, categoria, total_paginas)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (user_id, filename, dest_path, categoria, total_paginas))
+                file_id = cursor.lastrowid
             
             return {
                 "id": file_id,
@@ -65,36 +63,32 @@ class LibraryService:
 
     def listar_arquivos(self, user_id: int) -> List[Dict]:
         """Lista arquivos do usuario."""
-        conn = self.db.conectar()
-        conn.row_factory = dict_factory
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT * FROM biblioteca_pdfs 
-            WHERE user_id = ? 
-            ORDER BY data_upload DESC
-        """, (user_id,))
-        rows = cursor.fetchall()
-        conn.close()
+        with self.db.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = dict_factory
+            cursor.execute("""
+                SELECT * FROM biblioteca_pdfs 
+                WHERE user_id = ? 
+                ORDER BY data_upload DESC
+            """, (user_id,))
+            rows = cursor.fetchall()
         return rows
 
     def excluir_arquivo(self, file_id: int, user_id: int) -> bool:
         """Remove arquivo do banco e do disco."""
-        conn = self.db.conectar()
-        cursor = conn.cursor()
-        
-        # Pegar caminho
-        cursor.execute("SELECT caminho_arquivo FROM biblioteca_pdfs WHERE id = ? AND user_id = ?", (file_id, user_id))
-        row = cursor.fetchone()
-        if not row:
-            conn.close()
-            return False
-            
-        caminho = row[0]
-        
-        # Remover do BD
-        cursor.execute("DELETE FROM biblioteca_pdfs WHERE id = ?", (file_id,))
-        conn.commit()
-        conn.close()
+        with self.db.conexao() as conn:
+            cursor = conn.cursor()
+
+            # Pegar caminho
+            cursor.execute("SELECT caminho_arquivo FROM biblioteca_pdfs WHERE id = ? AND user_id = ?", (file_id, user_id))
+            row = cursor.fetchone()
+            if not row:
+                return False
+
+            caminho = row[0]
+
+            # Remover do BD
+            cursor.execute("DELETE FROM biblioteca_pdfs WHERE id = ?", (file_id,))
         
         # Remover do disco
         if caminho and os.path.exists(caminho):
@@ -107,11 +101,10 @@ class LibraryService:
 
     def get_conteudo_arquivo(self, file_id: int) -> str:
         """Lê o texto do arquivo."""
-        conn = self.db.conectar()
-        cursor = conn.cursor()
-        cursor.execute("SELECT caminho_arquivo FROM biblioteca_pdfs WHERE id = ?", (file_id,))
-        row = cursor.fetchone()
-        conn.close()
+        with self.db.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT caminho_arquivo FROM biblioteca_pdfs WHERE id = ?", (file_id,))
+            row = cursor.fetchone()
         
         if not row:
             return ""
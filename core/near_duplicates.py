@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Deteccao de quase-duplicatas por MinHash (shingles de palavras) com indice LSH."""
+
+from __future__ import annotations
+
+import random
+import re
+import struct
+import zlib
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+# 32 permutacoes = 8 bandas x 4 linhas: pares com Jaccard ~0.75 viram
+# candidatos com ~95% de chance; com 0.5, ~40% (e a verificacao descarta).
+NUM_PERM = 32
+BANDAS = 8
+LINHAS = NUM_PERM // BANDAS
+LIMIAR_PADRAO = 0.75
+
+_MASCARA = (1 << 64) - 1
+# Sementes fixas: as assinaturas ficam gravadas no banco e precisam ser
+# reproduziveis entre execucoes (NUNCA alterar sem recalcular a tabela).
+_RNG = random.Random(0x51D0)
+_PERM_A = [_RNG.getrandbits(64) | 1 for _ in range(NUM_PERM)]
+_PERM_B = [_RNG.getrandbits(64) for _ in range(NUM_PERM)]
+_FORMATO = struct.Struct(f">{NUM_PERM}I")
+
+_SEM_ACENTO = str.maketrans("áàâãäéèêëíìîïóòôõöúùûüç", "aaaaaeeeeiiiiooooouuuuc")
+_PALAVRA = re.compile(r"\w+")
+
+Signature = Tuple[int, ...]
+
+
+def shingles(texto: str) -> List[int]:
+    """Bigramas de palavras (minusculas, sem acento) como hashes de 32 bits."""
+    tokens = _PALAVRA.findall(str(texto or "").lower().translate(_SEM_ACENTO))
+    if len(tokens) < 2:
+        return [zlib.crc32(" ".join(tokens).encode("utf-8"))] if tokens else []
+    return [zlib.crc32(f"{tokens[i]} {tokens[i + 1]}".encode("utf-8")) for i in range(len(tokens) - 1)]
+
+
+def signature(texto: str) -> Optional[Signature]:
+    """Assinatura MinHash do texto (None para texto vazio)."""
+    hashes = shingles(texto)
+    if not hashes:
+        return None
+    return tuple(min([(a * x + b) & _MASCARA for x in hashes]) >> 32 for a, b in zip(_PERM_A, _PERM_B))
+
+
+def similarity(a: Sequence[int], b: Sequence[int]) -> float:
+    """Jaccard estimado: fracao de posicoes iguais nas assinaturas."""
+    return sum(1 for x, y in zip(a, b) if x == y) / float(NUM_PERM)
+
+
+def pack(sig: Signature) -> bytes:
+    return _FORMATO.pack(*sig)
+
+
+def unpack(blob) -> Optional[Signature]:
+    try:
+        return _FORMATO.unpack(bytes(blob))
+    except (struct.error, TypeError):
+        return None
+
+
+def question_text(questao: Dict) -> str:
+    return str(questao.get("enunciado") or questao.get("pergunta") or "")
+
+
+def flashcard_text(card: Dict) -> str:
+    return str(card.get("frente") or "")
+
+
+class NearDuplicateIndex:
+    """
+    Indice LSH em memoria: cada banda da assinatura vira uma chave de
+    dicionario; consulta = ate BANDAS buscas + verificacao dos candidatos.
+    """
+
+    def __init__(self, threshold: float = LIMIAR_PADRAO):
+        self.threshold = float(threshold)
+        self._bandas: List[Dict[Tuple[int, ...], List[Hashable]]] = [{} for _ in range(BANDAS)]
+        self._sigs: Dict[Hashable, Signature] = {}
+
+    def add(self, key: Hashable, sig: Optional[Signature]) -> None:
+        if sig is None or key in self._sigs:
+            return
+        self._sigs[key] = sig
+        for i, banda in enumerate(self._bandas):
+            banda.setdefault(sig[i * LINHAS:(i + 1) * LINHAS], []).append(key)
+
+    def find(self, sig: Optional[Signature]) -> Optional[Hashable]:
+        """Chave de um item ja indexado com similaridade >= threshold, ou None."""
+        if sig is None:
+            return None
+        vistos = set()
+        for i, banda in enumerate(self._bandas):
+            for key in banda.get(sig[i * LINHAS:(i + 1) * LINHAS], ()):
+                if key in vistos:
+                    continue
+                vistos.add(key)
+                if similarity(sig, self._sigs[key]) >= self.threshold:
+                    return key
+        return None
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._sigs
+
+    def __len__(self) -> int:
+        return len(self._sigs)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Executor dedicado e limitado para hash/verificacao de senha."""
+
+from __future__ import annotations
+
+import asyncio
+import atexit
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+
+class PasswordHasher:
+    """
+    Roda `hash_fn`/`verify_fn` (bcrypt/PBKDF2, centenas de ms) fora da thread
+    chamadora, com no maximo `max_concorrentes` hashes ao mesmo tempo.
+
+    PBKDF2 e bcrypt liberam o GIL, entao o limite e o que impede uma rajada de
+    logins de ocupar todos os nucleos do aparelho; pedidos excedentes esperam
+    na fila do executor.
+    """
+
+    def __init__(
+        self,
+        hash_fn: Callable[[str], str],
+        verify_fn: Callable[[str, str], bool],
+        max_concorrentes: int = 2,
+    ):
+        self._hash_fn = hash_fn
+        self._verify_fn = verify_fn
+        self.max_concorrentes = max(1, int(max_concorrentes))
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_concorrentes,
+                    thread_name_prefix="pwd-hash",
+                )
+                atexit.register(self.close)
+            return self._executor
+
+    def hash(self, senha: str) -> Future:
+        return self._pool().submit(self._hash_fn, senha)
+
+    def verify(self, senha: str, stored: str) -> Future:
+        return self._pool().submit(self._verify_fn, senha, stored)
+
+    async def hash_async(self, senha: str) -> str:
+        return await asyncio.wrap_future(self.hash(senha))
+
+    async def verify_async(self, senha: str, stored: str) -> bool:
+        return bool(await asyncio.wrap_future(self.verify(senha, stored)))
+
+    def close(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
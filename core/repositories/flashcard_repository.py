@@ -7,61 +7,81 @@ import datetime
 import json
 from typing import Dict, List, Optional
 
+from core.srs_engine import AGAIN, GOOD, normalize_outcome
 
-class FlashcardRepository:
-    _INTERVALS_DAYS = [1, 2, 4, 7, 14, 30, 60, 120, 180]
 
+class FlashcardRepository:
     def __init__(self, db):
         self.db = db
 
+    def _row_to_card(self, row) -> Dict:
+        return {
+            "frente": str(row["frente"] or ""),
+            "verso": str(row["verso"] or ""),
+            "tema": str(row["tema"] or "Geral"),
+            "dificuldade": str(row["dificuldade"] or "intermediario"),
+            "_srs": {
+                "id": int(row["id"]),
+                "nivel": int(row["revisao_nivel"] or 0),
+                "proxima_revisao": row["proxima_revisao"],
+            },
+        }
+
     def list_due(self, user_id: int, limit: int = 120) -> List[Dict]:
-        conn = self.db.conectar()
-        try:
-            conn.row_factory = __import__("sqlite3").Row
+        self.db._eventos_em_dia()
+        with self.db.conexao() as conn:
             cur = conn.cursor()
+            cur.row_factory = __import__("sqlite3").Row
             cur.execute(
                 """
-                SELECT frente, verso, tema, dificuldade, revisao_nivel, proxima_revisao
+                SELECT id, frente, verso, tema, dificuldade, revisao_nivel, proxima_revisao
                 FROM flashcards
                 WHERE user_id = ?
                   AND proxima_revisao IS NOT NULL
-                  AND DATETIME(proxima_revisao) <= DATETIME('now')
-                ORDER BY DATETIME(proxima_revisao) ASC
+                  AND proxima_revisao <= DATETIME('now')
+                ORDER BY proxima_revisao ASC
                 LIMIT ?
                 """,
                 (int(user_id), int(max(1, limit))),
             )
-            rows = cur.fetchall()
-            out = []
-            for row in rows:
-                out.append(
-                    {
-                        "frente": str(row["frente"] or ""),
-                        "verso": str(row["verso"] or ""),
-                        "tema": str(row["tema"] or "Geral"),
-                        "dificuldade": str(row["dificuldade"] or "intermediario"),
-                        "_srs": {
-                            "nivel": int(row["revisao_nivel"] or 0),
-                            "proxima_revisao": row["proxima_revisao"],
-                        },
-                    }
-                )
-            return out
-        finally:
-            conn.close()
+            return [self._row_to_card(row) for row in cur.fetchall()]
 
-    def _next_schedule_expr(self, action: str, current_level: int) -> tuple[int, str]:
-        action_norm = str(action or "").strip().lower()
-        level = int(max(0, current_level or 0))
-        if action_norm in {"lembrei", "remembered", "correct"}:
-            level = min(len(self._INTERVALS_DAYS) - 1, level + 1)
-            days = self._INTERVALS_DAYS[level]
-            return level, f"DATETIME('now', '+{days} days')"
-        if action_norm in {"rever", "again", "wrong"}:
-            level = max(0, level - 1)
-            return level, "DATETIME('now', '+1 day')"
-        # pular/skip
-        return level, "DATETIME('now', '+12 hours')"
+    def list_schedule(self, user_id: int, since: Optional[str] = None) -> List[tuple]:
+        """(id, proxima_revisao, updated_at) de todos os cards agendados, ou so dos alterados desde `since`."""
+        self.db._eventos_em_dia()
+        with self.db.conexao() as conn:
+            if since is None:
+                return conn.execute(
+                    """
+                    SELECT id, proxima_revisao, updated_at FROM flashcards
+                    WHERE user_id = ? AND proxima_revisao IS NOT NULL
+                    """,
+                    (int(user_id),),
+                ).fetchall()
+            return conn.execute(
+                "SELECT id, proxima_revisao, updated_at FROM flashcards WHERE user_id = ? AND updated_at >= ?",
+                (int(user_id), str(since)),
+            ).fetchall()
+
+    def get_many(self, user_id: int, ids: List[int]) -> Dict[int, Dict]:
+        out: Dict[int, Dict] = {}
+        ids = [int(i) for i in ids]
+        with self.db.conexao() as conn:
+            cur = conn.cursor()
+            cur.row_factory = __import__("sqlite3").Row
+            for inicio in range(0, len(ids), 500):
+                lote = ids[inicio:inicio + 500]
+                cur.execute(
+                    f"""
+                    SELECT id, frente, verso, tema, dificuldade, revisao_nivel, proxima_revisao
+                    FROM flashcards
+                    WHERE user_id = ? AND id IN ({",".join("?" * len(lote))})
+                    """,
+                    (int(user_id), *lote),
+                )
+                for row in cur.fetchall():
+                    out[int(row["id"])] = self._row_to_card(row)
+        return out
 
     def register_action(self, user_id: int, card: Dict, action: str) -> None:
         frente = str(card.get("frente") or "").strip()
@@ -75,13 +95,13 @@ class FlashcardRepository:
         self.db.salvar_flashcards_gerados(int(user_id), tema, [{"frente": frente, "verso": verso}], dificuldade)
         card_hash = self.db._flashcard_hash({"frente": frente, "verso": verso, "tema": tema})
 
-        conn = self.db.conectar()
-        try:
-            conn.row_factory = __import__("sqlite3").Row
+        with self.db.conexao() as conn:
             cur = conn.cursor()
+            cur.row_factory = __import__("sqlite3").Row
             cur.execute(
                 """
-                SELECT id, revisao_nivel, total_revisoes, total_acertos, total_erros
+                SELECT id, revisao_nivel, total_revisoes, total_acertos, total_erros, ultima_revisao_em,
+                       srs_ease, srs_intervalo, srs_estabilidade, srs_dificuldade
                 FROM flashcards
                 WHERE user_id = ? AND card_hash = ?
                 LIMIT 1
@@ -92,17 +112,25 @@ class FlashcardRepository:
             if not row:
                 return
 
-            current_level = int(row["revisao_nivel"] or 0)
-            next_level, next_expr = self._next_schedule_expr(action, current_level)
+            state = self.db._estado_srs(
+                row,
+                level=int(row["revisao_nivel"] or 0),
+                hits=int(row["total_acertos"] or 0),
+                attempts=int(row["total_revisoes"] or 0),
+                last_review=row["ultima_revisao_em"],
+            )
+            state = self.db.estrategia_revisao(int(user_id), "flashcard").schedule_batch([state], [action])[0]
+            next_level, next_due = int(state["level"]), state["due"]
+            outcome = normalize_outcome(action)
             total_rev = int(row["total_revisoes"] or 0) + 1
-            total_hits = int(row["total_acertos"] or 0) + (1 if str(action).lower() in {"lembrei", "remembered", "correct"} else 0)
-            total_miss = int(row["total_erros"] or 0) + (1 if str(action).lower() in {"rever", "again", "wrong"} else 0)
+            total_hits = int(row["total_acertos"] or 0) + (1 if outcome == GOOD else 0)
+            total_miss = int(row["total_erros"] or 0) + (1 if outcome == AGAIN else 0)
 
             cur.execute(
-                f"""
+                """
                 UPDATE flashcards
                 SET revisao_nivel = ?,
-                    proxima_revisao = {next_expr},
+                    proxima_revisao = ?,
                     ultima_revisao_em = CURRENT_TIMESTAMP,
                     total_revisoes = ?,
                     total_acertos = ?,
@@ -110,9 +138,7 @@ class FlashcardRepository:
                     updated_at = CURRENT_TIMESTAMP
                 WHERE id = ?
                 """,
-                (int(next_level), int(total_rev), int(total_hits), int(total_miss), int(row["id"])),
+                (int(next_level), next_due, int(total_rev), int(total_hits), int(total_miss), int(row["id"])),
             )
-            conn.commit()
-        finally:
-            conn.close()
+            self.db._gravar_estado_srs(cur, "flashcards", state, "id = ?", (int(row["id"]),))
 
@@ -3,22 +3,23 @@
 
 from __future__ import annotations
 
-import json
-from typing import Dict, List
+from typing import Dict, List, Optional
 
+from core.blob_codec import decode_blob
+from core.srs_engine import AGAIN, GOOD, MARK, normalize_outcome
 
-class QuestionProgressRepository:
-    _INTERVALS_DAYS = [1, 2, 4, 7, 14, 30]
 
+class QuestionProgressRepository:
     def __init__(self, db):
         self.db = db
 
     def _row_to_question(self, row) -> Dict:
         try:
-            question = json.loads(row["dados_json"] or "{}")
+            question = decode_blob(row["dados_json"])
         except Exception:
             question = {}
         meta = question.setdefault("_srs", {})
+        meta["id"] = int(row["id"])
         meta["nivel"] = int(row["review_level"] or 0)
         meta["tema"] = str(row["tema"] or "Geral")
         meta["marcado_erro"] = bool(row["marcado_erro"] or 0)
@@ -26,35 +27,37 @@ class QuestionProgressRepository:
         return question
 
     def list_due(self, user_id: int, limit: int = 120) -> List[Dict]:
-        conn = self.db.conectar()
-        try:
-            conn.row_factory = __import__("sqlite3").Row
+        self.db._eventos_em_dia()
+        with self.db.conexao() as conn:
             cur = conn.cursor()
+            cur.row_factory = __import__("sqlite3").Row
             cur.execute(
                 """
-                SELECT dados_json, tema, review_level, marcado_erro, next_review_at
-                FROM questoes_usuario
+                SELECT qu.id, COALESCE(qc.dados_json, qu.dados_json) AS dados_json,
+                       qu.tema, qu.review_level, qu.marcado_erro, qu.next_review_at
+                FROM questoes_usuario qu
+                LEFT JOIN questions qc ON qc.id = qu.question_id
                 WHERE user_id = ?
                   AND next_review_at IS NOT NULL
-                  AND DATETIME(next_review_at) <= DATETIME('now')
-                ORDER BY DATETIME(next_review_at) ASC, ultima_pratica DESC
+                  AND next_review_at <= DATETIME('now')
+                ORDER BY next_review_at ASC, ultima_pratica DESC
                 LIMIT ?
                 """,
                 (int(user_id), int(max(1, limit))),
             )
             return [self._row_to_question(r) for r in cur.fetchall()]
-        finally:
-            conn.close()
 
     def list_errors(self, user_id: int, limit: int = 120) -> List[Dict]:
-        conn = self.db.conectar()
-        try:
-            conn.row_factory = __import__("sqlite3").Row
+        self.db._eventos_em_dia()
+        with self.db.conexao() as conn:
             cur = conn.cursor()
+            cur.row_factory = __import__("sqlite3").Row
             cur.execute(
                 """
-                SELECT dados_json, tema, review_level, marcado_erro, next_review_at
-                FROM questoes_usuario
+                SELECT qu.id, COALESCE(qc.dados_json, qu.dados_json) AS dados_json,
+                       qu.tema, qu.review_level, qu.marcado_erro, qu.next_review_at
+                FROM questoes_usuario qu
+                LEFT JOIN questions qc ON qc.id = qu.question_id
                 WHERE user_id = ?
                   AND (marcado_erro = 1 OR erros > acertos)
                 ORDER BY ultima_pratica DESC
@@ -63,18 +66,18 @@ class QuestionProgressRepository:
                 (int(user_id), int(max(1, limit))),
             )
             return [self._row_to_question(r) for r in cur.fetchall()]
-        finally:
-            conn.close()
 
     def list_marked(self, user_id: int, limit: int = 120) -> List[Dict]:
-        conn = self.db.conectar()
-        try:
-            conn.row_factory = __import__("sqlite3").Row
+        self.db._eventos_em_dia()
+        with self.db.conexao() as conn:
             cur = conn.cursor()
+            cur.row_factory = __import__("sqlite3").Row
             cur.execute(
                 """
-                SELECT dados_json, tema, review_level, marcado_erro, next_review_at
-                FROM questoes_usuario
+                SELECT qu.id, COALESCE(qc.dados_json, qu.dados_json) AS dados_json,
+                       qu.tema, qu.review_level, qu.marcado_erro, qu.next_review_at
+                FROM questoes_usuario qu
+                LEFT JOIN questions qc ON qc.id = qu.question_id
                 WHERE user_id = ?
                   AND (marcado_erro = 1 OR marked_for_review = 1)
                 ORDER BY ultima_pratica DESC
@@ -83,23 +86,60 @@ class QuestionProgressRepository:
                 (int(user_id), int(max(1, limit))),
             )
             return [self._row_to_question(r) for r in cur.fetchall()]
-        finally:
-            conn.close()
+
+    def list_schedule(self, user_id: int, since: Optional[str] = None) -> List[tuple]:
+        """(id, next_review_at, updated_at) das questoes agendadas, ou so das alteradas desde `since`."""
+        self.db._eventos_em_dia()
+        with self.db.conexao() as conn:
+            if since is None:
+                return conn.execute(
+                    """
+                    SELECT id, next_review_at, updated_at FROM questoes_usuario
+                    WHERE user_id = ? AND next_review_at IS NOT NULL
+                    """,
+                    (int(user_id),),
+                ).fetchall()
+            return conn.execute(
+                "SELECT id, next_review_at, updated_at FROM questoes_usuario WHERE user_id = ? AND updated_at >= ?",
+                (int(user_id), str(since)),
+            ).fetchall()
+
+    def get_many(self, user_id: int, ids: List[int]) -> Dict[int, Dict]:
+        out: Dict[int, Dict] = {}
+        ids = [int(i) for i in ids]
+        with self.db.conexao() as conn:
+            cur = conn.cursor()
+            cur.row_factory = __import__("sqlite3").Row
+            for inicio in range(0, len(ids), 500):
+                lote = ids[inicio:inicio + 500]
+                cur.execute(
+                    f"""
+                    SELECT qu.id, COALESCE(qc.dados_json, qu.dados_json) AS dados_json,
+                           qu.tema, qu.review_level, qu.marcado_erro, qu.next_review_at
+                    FROM questoes_usuario qu
+                    LEFT JOIN questions qc ON qc.id = qu.question_id
+                    WHERE qu.user_id = ? AND qu.id IN ({",".join("?" * len(lote))})
+                    """,
+                    (int(user_id), *lote),
+                )
+                for row in cur.fetchall():
+                    out[int(row["id"])] = self._row_to_question(row)
+        return out
 
     def register_result(self, user_id: int, question: Dict, action: str) -> None:
         action_norm = str(action or "").strip().lower()
         qhash = self.db._question_hash(question)
         tema = str(question.get("tema") or question.get("_srs", {}).get("tema") or "Geral")
         dificuldade = str(question.get("dificuldade") or "intermediario")
-        dados_json = json.dumps(question, ensure_ascii=False)
 
-        conn = self.db.conectar()
-        try:
-            conn.row_factory = __import__("sqlite3").Row
+        with self.db.conexao() as conn:
             cur = conn.cursor()
+            cur.row_factory = __import__("sqlite3").Row
+            question_id = self.db._salvar_conteudo_questao(cur, question, qhash, tema=tema)
             cur.execute(
                 """
-                SELECT tentativas, acertos, erros, review_level, marked_for_review, marcado_erro
+                SELECT tentativas, acertos, erros, review_level, marked_for_review, marcado_erro, ultima_pratica,
+                       srs_ease, srs_intervalo, srs_estabilidade, srs_dificuldade
                 FROM questoes_usuario
                 WHERE user_id = ? AND qhash = ?
                 LIMIT 1
@@ -112,11 +152,11 @@ class QuestionProgressRepository:
                 cur.execute(
                     """
                     INSERT INTO questoes_usuario
-                    (user_id, qhash, dados_json, tema, dificuldade, tentativas, acertos, erros,
+                    (user_id, qhash, question_id, dados_json, tema, dificuldade, tentativas, acertos, erros,
                      revisao_nivel, proxima_revisao, ultima_pratica, marked_for_review, next_review_at, review_level, last_attempt_at, last_result)
-                    VALUES (?, ?, ?, ?, ?, 0, 0, 0, 0, NULL, CURRENT_TIMESTAMP, 0, NULL, 0, CURRENT_TIMESTAMP, NULL)
+                    VALUES (?, ?, ?, '', ?, ?, 0, 0, 0, 0, NULL, CURRENT_TIMESTAMP, 0, NULL, 0, CURRENT_TIMESTAMP, NULL)
                     """,
-                    (int(user_id), str(qhash), dados_json, tema, dificuldade),
+                    (int(user_id), str(qhash), question_id, tema, dificuldade),
                 )
                 tentativas = 0
                 acertos = 0
@@ -124,6 +164,7 @@ class QuestionProgressRepository:
                 level = 0
                 marked = 0
                 marcado_erro = 0
+                state = {}
             else:
                 tentativas = int(row["tentativas"] or 0)
                 acertos = int(row["acertos"] or 0)
@@ -131,43 +172,34 @@ class QuestionProgressRepository:
                 level = int(row["review_level"] or 0)
                 marked = int(row["marked_for_review"] or 0)
                 marcado_erro = int(row["marcado_erro"] or 0)
+                state = self.db._estado_srs(row, last_review=row["ultima_pratica"])
 
-            next_expr = "NULL"
-            if action_norm in {"correct", "acerto"}:
+            outcome = normalize_outcome(action_norm)
+            state.update(level=level, hits=acertos, attempts=tentativas)
+            state = self.db.estrategia_revisao(int(user_id), "questao").schedule_batch([state], [outcome])[0]
+            level = int(state["level"])
+            next_due = state["due"]
+            if outcome == GOOD:
                 tentativas += 1
                 acertos += 1
-                level = max(0, level - 1)
                 marcado_erro = 0
-                if level <= 0:
-                    marked = 0
-                    next_expr = "NULL"
-                else:
-                    days = self._INTERVALS_DAYS[min(level, len(self._INTERVALS_DAYS) - 1)]
-                    marked = 1
-                    next_expr = f"DATETIME('now', '+{days} days')"
-            elif action_norm in {"wrong", "erro"}:
+                marked = 1 if level > 0 else 0
+            elif outcome == AGAIN:
                 tentativas += 1
                 erros += 1
-                level = min(len(self._INTERVALS_DAYS) - 1, level + 1)
                 marked = 1
                 marcado_erro = 1
-                days = self._INTERVALS_DAYS[level]
-                next_expr = f"DATETIME('now', '+{days} days')"
-            elif action_norm in {"mark", "marcar"}:
+            elif outcome == MARK:
                 marked = 1
                 marcado_erro = 1
-                level = max(1, level)
-                next_expr = "DATETIME('now')"
             else:
                 # skip
                 marked = 1
-                days = self._INTERVALS_DAYS[min(max(level, 0), len(self._INTERVALS_DAYS) - 1)]
-                next_expr = f"DATETIME('now', '+{max(1, int(days))} days')"
 
             cur.execute(
-                f"""
+                """
                 UPDATE questoes_usuario
-                SET dados_json = ?,
+                SET question_id = ?,
                     tema = ?,
                     dificuldade = ?,
                     tentativas = ?,
@@ -177,15 +209,15 @@ class QuestionProgressRepository:
                     revisao_nivel = ?,
                     marked_for_review = ?,
                     marcado_erro = ?,
-                    next_review_at = {next_expr},
-                    proxima_revisao = {next_expr},
+                    next_review_at = ?,
+                    proxima_revisao = ?,
                     ultima_pratica = CURRENT_TIMESTAMP,
                     last_attempt_at = CURRENT_TIMESTAMP,
                     last_result = ?
                 WHERE user_id = ? AND qhash = ?
                 """,
                 (
-                    dados_json,
+                    question_id,
                     tema,
                     dificuldade,
                     int(tentativas),
@@ -195,12 +227,12 @@ class QuestionProgressRepository:
                     int(level),
                     int(marked),
                     int(marcado_erro),
+                    next_due,
+                    next_due,
                     str(action_norm),
                     int(user_id),
                     str(qhash),
                 ),
             )
-            conn.commit()
-        finally:
-            conn.close()
+            self.db._gravar_estado_srs(cur, "questoes_usuario", state, "user_id = ? AND qhash = ?", (int(user_id), str(qhash)))
 
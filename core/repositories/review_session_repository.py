@@ -31,6 +31,28 @@ class ReviewSessionRepository:
             response_time_ms=int(max(0, response_time_ms or 0)),
         )
 
+    def queue_item(
+        self,
+        user_id: int,
+        session_id: int,
+        item_type: str,
+        item_ref: str,
+        resultado: str,
+        is_correct: Optional[bool],
+        response_time_ms: int = 0,
+    ) -> None:
+        """Mesmo que `add_item`, mas gravado no proximo lote do diario de eventos."""
+        self.db.eventos.record(
+            int(user_id),
+            "review_item",
+            session_id=int(session_id),
+            item_type=str(item_type or "question"),
+            item_ref=str(item_ref or ""),
+            resultado=str(resultado or ""),
+            is_correct=is_correct,
+            response_time_ms=int(max(0, response_time_ms or 0)),
+        )
+
     def finish(self, session_id: int, acertos: int, erros: int, puladas: int, total_time_ms: int) -> None:
         self.db.finalizar_review_session(
             int(session_id),
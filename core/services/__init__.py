@@ -5,8 +5,10 @@ from .daily_review_service import DailyReviewService
 from .flashcards_service import FlashcardsService
 from .mock_exam_report_service import MockExamReportService
 from .mock_exam_service import MockExamService
+from .near_duplicate_service import NearDuplicateService
 from .open_quiz_service import OpenQuizService
 from .quiz_filter_service import QuizFilterService
+from .quiz_generation_service import QuizGenerationService
 from .question_review_service import QuestionReviewService
 from .review_session_service import ReviewSessionService
 from .spaced_repetition_service import SpacedRepetitionService
@@ -18,8 +20,10 @@ __all__ = [
     "FlashcardsService",
     "MockExamReportService",
     "MockExamService",
+    "NearDuplicateService",
     "OpenQuizService",
     "QuizFilterService",
+    "QuizGenerationService",
     "QuestionReviewService",
     "ReviewSessionService",
     "SpacedRepetitionService",
@@ -3,37 +3,201 @@
 
 from __future__ import annotations
 
-from typing import Dict, List
+import datetime
+import heapq
+import threading
+import weakref
+from collections.abc import Sequence
+from typing import Callable, Dict, List, Optional, Tuple
 
 from core.repositories.flashcard_repository import FlashcardRepository
 from core.repositories.question_progress_repository import QuestionProgressRepository
 
+ItemKey = Tuple[str, int]
+
+
+class DueQueue:
+    """
+    Fila de vencimentos de um usuario em memoria: heap de
+    (due_at, item_type, item_id), carregada uma vez (so chaves, sem JSON) e
+    atualizada por delta (`updated_at >= ultima sincronizacao`).
+
+    Entradas antigas do heap sao descartadas de forma preguicosa: vale a data
+    registrada em `_due` para a chave.
+    """
+
+    def __init__(self, flash_repo: FlashcardRepository, question_repo: QuestionProgressRepository, user_id: int):
+        self.user_id = int(user_id)
+        self._repos = {"flashcard": flash_repo, "question": question_repo}
+        self._heap: List[Tuple[str, str, int]] = []
+        self._due: Dict[ItemKey, str] = {}
+        self._last_sync: Dict[str, Optional[str]] = {tipo: None for tipo in self._repos}
+        self._lock = threading.Lock()
+
+    def _set(self, item_type: str, item_id: int, due: Optional[str]) -> None:
+        chave = (item_type, int(item_id))
+        if not due:
+            self._due.pop(chave, None)
+            return
+        due = str(due)
+        if self._due.get(chave) == due:
+            return
+        self._due[chave] = due
+        heapq.heappush(self._heap, (due, item_type, int(item_id)))
+
+    def sync(self) -> None:
+        """Primeira chamada carrega tudo; as seguintes so o que mudou."""
+        for item_type, repo in self._repos.items():
+            rows = repo.list_schedule(self.user_id, since=self._last_sync[item_type])
+            with self._lock:
+                ultimo = self._last_sync[item_type]
+                for item_id, due, updated_at in rows:
+                    self._set(item_type, item_id, due)
+                    if updated_at and (ultimo is None or str(updated_at) > ultimo):
+                        ultimo = str(updated_at)
+                self._last_sync[item_type] = ultimo or datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        if len(self._heap) > 2 * len(self._due) + 64:
+            with self._lock:
+                self._heap = [(due, tipo, item_id) for (tipo, item_id), due in self._due.items()]
+                heapq.heapify(self._heap)
+
+    def forget(self, keys) -> None:
+        """Tira da fila itens que nao existem mais (apagados nao aparecem no delta)."""
+        with self._lock:
+            for item_type, item_id in keys:
+                self._due.pop((item_type, int(item_id)), None)
+
+    def reviewed(self, item_type: str, item_id: int, due: Optional[str] = None) -> None:
+        """Atualiza o item no lugar apos uma revisao (sem `due`, sai da fila ate o proximo delta)."""
+        with self._lock:
+            self._set(item_type, item_id, due)
+
+    def due_keys(self, now: Optional[str] = None) -> Dict[str, List[int]]:
+        """Ids vencidos ate `now` por tipo, do mais atrasado para o mais recente."""
+        now = now or datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        out: Dict[str, List[int]] = {tipo: [] for tipo in self._repos}
+        with self._lock:
+            vencidos = []
+            while self._heap and self._heap[0][0] <= now:
+                due, item_type, item_id = heapq.heappop(self._heap)
+                if self._due.get((item_type, item_id)) != due:
+                    continue
+                vencidos.append((due, item_type, item_id))
+                out[item_type].append(item_id)
+            for entrada in vencidos:
+                heapq.heappush(self._heap, entrada)
+        return out
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+
+class LazyReviewQueue(Sequence):
+    """
+    Sequencia de itens da sessao de revisao; os payloads (com JSON
+    decodificado) so sao buscados ao chegar perto deles, `prefetch` por vez.
+    Itens apagados desde a montagem da fila saem dela ao carregar (o tamanho
+    pode diminuir) e sao repassados a `on_missing`.
+    """
+
+    def __init__(
+        self,
+        keys: List[ItemKey],
+        repos: Dict[str, object],
+        user_id: int,
+        prefetch: int = 8,
+        on_missing: Optional[Callable[[List[ItemKey]], None]] = None,
+    ):
+        self._keys = list(keys)
+        self._repos = repos
+        self.user_id = int(user_id)
+        self.prefetch = max(1, int(prefetch))
+        self.on_missing = on_missing
+        self._payloads: Dict[ItemKey, Dict] = {}
+
+    def _carregar(self, inicio: int) -> None:
+        pendentes: Dict[str, List[int]] = {}
+        for chave in self._keys[inicio:inicio + self.prefetch]:
+            if chave not in self._payloads:
+                pendentes.setdefault(chave[0], []).append(chave[1])
+        sumidos: List[ItemKey] = []
+        for item_type, ids in pendentes.items():
+            achados = self._repos[item_type].get_many(self.user_id, ids)
+            for item_id in ids:
+                if item_id in achados:
+                    self._payloads[(item_type, item_id)] = achados[item_id]
+                else:
+                    sumidos.append((item_type, item_id))
+        if sumidos:
+            fora = set(sumidos)
+            self._keys = [chave for chave in self._keys if chave not in fora]
+            if self.on_missing is not None:
+                self.on_missing(sumidos)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self._keys)))]
+        # Cada carga acha o item ou o tira da fila; IndexError se a fila encolheu ate aqui.
+        while True:
+            chave = self._keys[idx]
+            if chave in self._payloads:
+                return {"item_type": chave[0], "payload": dict(self._payloads[chave])}
+            self._carregar(idx if idx >= 0 else len(self._keys) + idx)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+# Filas por banco e usuario: sobrevivem a reconstrucao da tela de revisao.
+_FILAS: "weakref.WeakKeyDictionary[object, Dict[int, DueQueue]]" = weakref.WeakKeyDictionary()
+_FILAS_LOCK = threading.Lock()
+
 
 class DailyReviewService:
     def __init__(self, flash_repo: FlashcardRepository, question_repo: QuestionProgressRepository):
         self.flash_repo = flash_repo
         self.question_repo = question_repo
 
-    def build_daily_queue(self, user_id: int, premium: bool, free_limit: int = 30) -> List[Dict]:
-        flashcards = self.flash_repo.list_due(int(user_id), limit=220)
-        questions = self.question_repo.list_due(int(user_id), limit=220)
+    def due_queue(self, user_id: int) -> DueQueue:
+        with _FILAS_LOCK:
+            filas = _FILAS.setdefault(self.flash_repo.db, {})
+            fila = filas.get(int(user_id))
+            if fila is None:
+                fila = filas[int(user_id)] = DueQueue(self.flash_repo, self.question_repo, int(user_id))
+        return fila
+
+    def mark_reviewed(self, user_id: int, item_type: str, payload: Dict) -> None:
+        item_id = (payload.get("_srs") or {}).get("id")
+        if item_id is not None:
+            self.due_queue(user_id).reviewed(str(item_type), int(item_id))
 
-        queue: List[Dict] = []
+    def build_daily_queue(self, user_id: int, premium: bool, free_limit: int = 30) -> LazyReviewQueue:
+        fila = self.due_queue(user_id)
+        fila.sync()
+        vencidos = fila.due_keys()
+        flashcards = vencidos["flashcard"]
+        questions = vencidos["question"]
+
+        keys: List[ItemKey] = []
         fi = 0
         qi = 0
         while fi < len(flashcards) or qi < len(questions):
             for _ in range(3):
                 if fi >= len(flashcards):
                     break
-                queue.append({"item_type": "flashcard", "payload": dict(flashcards[fi])})
+                keys.append(("flashcard", flashcards[fi]))
                 fi += 1
             for _ in range(2):
                 if qi >= len(questions):
                     break
-                queue.append({"item_type": "question", "payload": dict(questions[qi])})
+                keys.append(("question", questions[qi]))
                 qi += 1
-            if not premium and len(queue) >= int(max(1, free_limit)):
-                queue = queue[: int(max(1, free_limit))]
+            if not premium and len(keys) >= int(max(1, free_limit)):
+                keys = keys[: int(max(1, free_limit))]
                 break
-        return queue
-
+        return LazyReviewQueue(
+            keys,
+            {"flashcard": self.flash_repo, "question": self.question_repo},
+            int(user_id),
+            on_missing=fila.forget,
+        )
@@ -3,7 +3,7 @@
 
 from __future__ import annotations
 
-from typing import Dict, List
+from typing import AsyncIterator, Callable, Dict, List, Optional
 
 
 class FlashcardsService:
@@ -19,3 +19,49 @@ class FlashcardsService:
                 out.append({"frente": frente, "verso": verso})
         return out
 
+    @staticmethod
+    async def stream_new(
+        ai_service,
+        content: List[str],
+        quantity: int,
+        accept: Optional[Callable[[Dict], bool]] = None,
+        rounds: int = 2,
+    ) -> AsyncIterator[Dict]:
+        """
+        Cards novos conforme a IA os escreve. Os recusados por `accept` (ex.:
+        quase-duplicatas) sao repostos numa rodada extra que pede so o que
+        faltou e cita os recusados no prompt. Com `accept`, o cache de
+        respostas e ignorado: a resposta guardada traria os mesmos cards.
+        """
+        quantity = max(0, int(quantity or 0))
+        vistos = set()
+        recusados: List[str] = []
+        entregues = 0
+        for rodada in range(max(1, int(rounds))):
+            faltam = quantity - entregues
+            if faltam <= 0:
+                break
+            cards = ai_service.generate_flashcards_stream(
+                content,
+                faltam,
+                use_cache=accept is None and rodada == 0,
+                avoid=recusados or None,
+            )
+            try:
+                async for card in cards:
+                    chave = str(card.get("frente") or "").strip().lower()
+                    if not chave or chave in vistos:
+                        continue
+                    vistos.add(chave)
+                    if accept is not None and not accept(card):
+                        recusados.append(str(card.get("frente") or ""))
+                        continue
+                    entregues += 1
+                    yield card
+                    if entregues >= quantity:
+                        break
+            finally:
+                await cards.aclose()
+            verificar = getattr(ai_service, "_should_abort_retry", None)
+            if callable(verificar) and verificar():
+                break
@@ -3,7 +3,7 @@
 
 from __future__ import annotations
 
-from typing import Tuple
+from typing import Dict, Tuple
 
 
 class MockExamService:
@@ -63,3 +63,14 @@ class MockExamService:
         )
         return bool(allowed), int(used_after), self.FREE_DAILY_LIMIT
 
+    def save_progress(self, user_id: int, session_id: int, current_idx: int, respostas: Dict) -> None:
+        """Estado parcial do simulado, gravado pelo diario de eventos (ultimo estado vence)."""
+        if not self.db or not user_id or not session_id:
+            return
+        self.db.eventos.record(
+            int(user_id),
+            "mock_progress",
+            session_id=int(session_id),
+            current_idx=int(max(0, current_idx or 0)),
+            respostas=dict(respostas or {}),
+        )
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Filtro de quase-duplicatas para o que a IA gera (questoes e flashcards)."""
+
+from __future__ import annotations
+
+import datetime
+import threading
+import weakref
+from typing import Callable, Dict, Optional
+
+from core import near_duplicates
+from core.near_duplicates import NearDuplicateIndex
+
+
+class UserNearDuplicates:
+    """
+    Indices LSH de um usuario (questoes = suas + banco offline; flashcards =
+    seus), carregados das assinaturas gravadas e atualizados por delta.
+    """
+
+    def __init__(self, db, user_id: int, threshold: float = near_duplicates.LIMIAR_PADRAO):
+        self.db = db
+        self.user_id = int(user_id)
+        self.questions = NearDuplicateIndex(threshold)
+        self.flashcards = NearDuplicateIndex(threshold)
+        self._desde: Optional[str] = None
+        self._banco_desde_id = 0
+        self._gerados = 0
+        self._lock = threading.Lock()
+
+    def sync(self) -> None:
+        inicio = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        dados = self.db.listar_assinaturas_quase_dup(self.user_id, self._desde, self._banco_desde_id)
+        with self._lock:
+            for question_id, blob, _updated in dados["questoes"]:
+                self.questions.add(("questao", int(question_id)), near_duplicates.unpack(blob))
+            for banco_id, question_id, blob in dados["banco"]:
+                self.questions.add(("questao", int(question_id)), near_duplicates.unpack(blob))
+                self._banco_desde_id = max(self._banco_desde_id, int(banco_id))
+            for card_id, blob, _updated in dados["flashcards"]:
+                self.flashcards.add(("flashcard", int(card_id)), near_duplicates.unpack(blob))
+            self._desde = inicio
+
+    def _aceitar(self, indice: NearDuplicateIndex, texto: str) -> bool:
+        sig = near_duplicates.signature(texto)
+        if sig is None:
+            return False
+        with self._lock:
+            if indice.find(sig) is not None:
+                return False
+            # O que ja foi gerado nesta sessao tambem conta (ainda nao esta no banco).
+            self._gerados += 1
+            indice.add(("gerado", self._gerados), sig)
+        return True
+
+    def accept_question(self, questao: Dict) -> bool:
+        return self._aceitar(self.questions, near_duplicates.question_text(questao))
+
+    def accept_flashcard(self, card: Dict) -> bool:
+        return self._aceitar(self.flashcards, near_duplicates.flashcard_text(card))
+
+
+# Indices por banco e usuario, como as filas de revisao.
+_INDICES: "weakref.WeakKeyDictionary[object, Dict[int, UserNearDuplicates]]" = weakref.WeakKeyDictionary()
+_INDICES_LOCK = threading.Lock()
+
+
+class NearDuplicateService:
+    def __init__(self, db):
+        self.db = db
+
+    def for_user(self, user_id: int) -> UserNearDuplicates:
+        """Indice do usuario ja sincronizado com o banco."""
+        with _INDICES_LOCK:
+            indices = _INDICES.setdefault(self.db, {})
+            indice = indices.get(int(user_id))
+            if indice is None:
+                indice = indices[int(user_id)] = UserNearDuplicates(self.db, int(user_id))
+        indice.sync()
+        return indice
+
+    def question_filter(self, user_id: int) -> Callable[[Dict], bool]:
+        return self.for_user(user_id).accept_question
+
+    def flashcard_filter(self, user_id: int) -> Callable[[Dict], bool]:
+        return self.for_user(user_id).accept_flashcard
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Geracao de quiz em lotes concorrentes, com limite por provedor e entrega incremental."""
+
+from __future__ import annotations
+
+import asyncio
+import re
+import threading
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+from core.error_monitor import log_exception
+
+# Chamadas simultaneas por provedor (todas as telas/servicos compartilham o limite).
+_LIMITES_PROVEDOR = {"gemini": 3, "openai": 3}
+_LIMITE_PADRAO = 2
+_SEMAFOROS: Dict[str, threading.BoundedSemaphore] = {}
+_SEMAFOROS_LOCK = threading.Lock()
+
+
+def provider_name(ai_service) -> str:
+    provider = getattr(ai_service, "provider", None)
+    return str(provider.__class__.__name__.replace("Provider", "")).lower() if provider else "default"
+
+
+def _semaforo(nome: str) -> threading.BoundedSemaphore:
+    with _SEMAFOROS_LOCK:
+        if nome not in _SEMAFOROS:
+            _SEMAFOROS[nome] = threading.BoundedSemaphore(_LIMITES_PROVEDOR.get(nome, _LIMITE_PADRAO))
+        return _SEMAFOROS[nome]
+
+
+def _chave_questao(questao: Dict) -> str:
+    texto = str(questao.get("pergunta") or questao.get("enunciado") or "")
+    return re.sub(r"\s+", " ", texto).strip().lower()
+
+
+class QuizGenerationService:
+    """
+    Divide um pedido de N questoes em chamadas de `generate_quiz_batch`
+    (ate `batch_size` cada), roda os lotes em paralelo respeitando o limite do
+    provedor e entrega as questoes novas (sem duplicatas) conforme chegam:
+    uma a uma quando o servico oferece `iter_quiz_batch` (streaming), senao
+    lote a lote. Se faltar questao (lote falho, repetido ou recusado por
+    `accept`, ex.: quase-duplicata do que o usuario ja viu), faz uma rodada
+    extra pedindo so as que faltam.
+    """
+
+    BATCH_SIZE = 5
+    MAX_BATCH = 10
+    RODADAS = 2
+
+    def __init__(self, ai_service, batch_size: int = BATCH_SIZE, accept: Optional[Callable[[Dict], bool]] = None):
+        self.ai_service = ai_service
+        self.accept = accept
+        self.batch_size = max(1, min(self.MAX_BATCH, int(batch_size or self.BATCH_SIZE)))
+
+    def plan_batches(self, quantity: int) -> List[int]:
+        quantity = max(0, int(quantity or 0))
+        lotes = [self.batch_size] * (quantity // self.batch_size)
+        if quantity % self.batch_size:
+            lotes.append(quantity % self.batch_size)
+        return lotes
+
+    def _gerar_lote(self, quantidade: int, content, topic, difficulty, retries: int, entregar, parar) -> None:
+        """Roda numa thread: entrega as questoes (uma a uma, se a IA faz streaming)."""
+        with _semaforo(provider_name(self.ai_service)):
+            iterar = getattr(self.ai_service, "iter_quiz_batch", None)
+            if not callable(iterar):
+                entregar(self.ai_service.generate_quiz_batch(content, topic, difficulty, quantidade, retries) or [])
+                return
+            for questao in iterar(content, topic, difficulty, quantidade, retries):
+                if parar.is_set() or not entregar([questao]):
+                    break
+
+    def _abortar(self) -> bool:
+        verificar = getattr(self.ai_service, "_should_abort_retry", None)
+        return bool(verificar()) if callable(verificar) else False
+
+    async def stream(
+        self,
+        quantity: int,
+        content: Optional[List[str]] = None,
+        topic: Optional[str] = None,
+        difficulty: str = "Medio",
+        retries: int = 1,
+    ) -> AsyncIterator[List[Dict]]:
+        """Gera lotes de questoes novas; a soma nunca passa de `quantity`."""
+        quantity = max(0, int(quantity or 0))
+        loop = asyncio.get_running_loop()
+        fila: asyncio.Queue = asyncio.Queue()
+        parar = threading.Event()
+
+        def _entregar(lote) -> bool:
+            try:
+                loop.call_soon_threadsafe(fila.put_nowait, list(lote))
+                return True
+            except RuntimeError:
+                return False
+
+        vistas = set()
+        entregues = 0
+        try:
+            for _rodada in range(self.RODADAS):
+                lotes = self.plan_batches(quantity - entregues)
+                if not lotes:
+                    break
+                tarefas = [
+                    asyncio.ensure_future(
+                        asyncio.to_thread(self._gerar_lote, n, content, topic, difficulty, retries, _entregar, parar)
+                    )
+                    for n in lotes
+                ]
+                # O fim de cada tarefa entra na fila depois das questoes que ela entregou.
+                for tarefa in tarefas:
+                    tarefa.add_done_callback(lambda _t: fila.put_nowait(None))
+                pendentes = len(tarefas)
+                while pendentes and entregues < quantity:
+                    lote = await fila.get()
+                    if lote is None:
+                        pendentes -= 1
+                        continue
+                    novas = []
+                    for questao in lote:
+                        chave = _chave_questao(questao)
+                        if not chave or chave in vistas:
+                            continue
+                        vistas.add(chave)
+                        if self.accept is not None and not self.accept(questao):
+                            continue
+                        novas.append(questao)
+                    novas = novas[: quantity - entregues]
+                    if novas:
+                        entregues += len(novas)
+                        yield novas
+                for tarefa in tarefas:
+                    if tarefa.done() and not tarefa.cancelled() and tarefa.exception() is not None:
+                        log_exception(tarefa.exception(), "quiz_generation_service.stream")
+                if entregues >= quantity or self._abortar():
+                    break
+        finally:
+            parar.set()
+
+    async def generate(self, quantity: int, *args, **kwargs) -> List[Dict]:
+        """Mesmo que `stream`, mas devolve tudo de uma vez."""
+        out: List[Dict] = []
+        async for lote in self.stream(quantity, *args, **kwargs):
+            out.extend(lote)
+        return out
@@ -33,6 +33,26 @@ class ReviewSessionService:
             response_time_ms=int(max(0, response_time_ms)),
         )
 
+    def record_later(
+        self,
+        user_id: int,
+        session_id: int,
+        item_type: str,
+        item_ref: str,
+        resultado: str,
+        is_correct: Optional[bool],
+        response_time_ms: int = 0,
+    ) -> None:
+        self.repo.queue_item(
+            int(user_id),
+            int(session_id),
+            item_type=str(item_type or "question"),
+            item_ref=str(item_ref or ""),
+            resultado=str(resultado or ""),
+            is_correct=is_correct,
+            response_time_ms=int(max(0, response_time_ms)),
+        )
+
     def finish(self, session_id: int, acertos: int, erros: int, puladas: int, total_time_ms: int) -> None:
         self.repo.finish(
             int(session_id),
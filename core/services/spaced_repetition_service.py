@@ -3,11 +3,22 @@
 
 from __future__ import annotations
 
-from typing import Dict, List
+import datetime
+import threading
+import weakref
+from typing import Dict, List, Optional
 
+from core import srs_engine
 from core.repositories.flashcard_repository import FlashcardRepository
 from core.repositories.question_progress_repository import QuestionProgressRepository
 
+# Taxa de acerto usada na projecao enquanto o usuario nao tem historico.
+_TAXA_ACERTO_PADRAO = 0.85
+
+# Previsoes por banco: {(user_id, dias): (versao da agenda, resultado)}.
+_PREVISOES: "weakref.WeakKeyDictionary[object, Dict[tuple, tuple]]" = weakref.WeakKeyDictionary()
+_PREVISOES_LOCK = threading.Lock()
+
 
 class SpacedRepetitionService:
     def __init__(self, flash_repo: FlashcardRepository, question_repo: QuestionProgressRepository):
@@ -34,9 +45,86 @@ class SpacedRepetitionService:
         action = "correct" if bool(acertou) else "wrong"
         self.question_repo.register_result(int(user_id), question, action)
 
+    # Versoes adiadas: vao pelo diario de eventos (um lote por transacao) e
+    # tambem contam no progresso diario.
+    def record_flashcard_review(self, user_id: int, card: Dict, action: str) -> None:
+        eventos = self.flash_repo.db.eventos
+        eventos.record(int(user_id), "flashcard", card=dict(card), action=str(action or "pular"))
+        eventos.record(int(user_id), "progresso", flashcards=1)
+
+    def record_question_review(self, user_id: int, question: Dict, acertou: bool) -> None:
+        eventos = self.question_repo.db.eventos
+        eventos.record(int(user_id), "question", question=dict(question), action="correct" if acertou else "wrong")
+        eventos.record(int(user_id), "progresso", questoes=1, acertos=1 if acertou else 0)
+
+    def record_question_skip(self, user_id: int, question: Dict) -> None:
+        self.question_repo.db.eventos.record(int(user_id), "question", question=dict(question), action="skip")
+
     def mark_question(self, user_id: int, question: Dict) -> None:
         self.question_repo.register_result(int(user_id), question, "mark")
 
     def skip_question(self, user_id: int, question: Dict) -> None:
         self.question_repo.register_result(int(user_id), question, "skip")
 
+    def postpone(self, user_id: int, days: float, kind: str = "flashcard", tema: Optional[str] = None) -> int:
+        return self.flash_repo.db.reagendar_revisoes(int(user_id), "adiar", tipo=kind, tema=tema, dias=float(days))
+
+    def reset_topic(self, user_id: int, tema: str, kind: str = "flashcard") -> int:
+        return self.flash_repo.db.reagendar_revisoes(int(user_id), "resetar", tipo=kind, tema=tema)
+
+    def migrate_algorithm(self, user_id: int, strategy: str, kind: str = "flashcard") -> int:
+        return self.flash_repo.db.reagendar_revisoes(int(user_id), "migrar", tipo=kind, estrategia=strategy)
+
+    def forecast_review_load(self, user_id: int, days: int = 30) -> Dict:
+        """
+        Revisoes esperadas por dia nos proximos `days` dias: o que ja esta
+        agendado mais as revisoes seguintes projetadas pelos intervalos das
+        estrategias. Fica em cache ate a proxima mudanca na agenda.
+        """
+        db = self.flash_repo.db
+        user_id = int(user_id)
+        days = int(max(1, days))
+        versao = db.versao_agenda_revisao(user_id)
+        with _PREVISOES_LOCK:
+            cache = _PREVISOES.setdefault(db, {})
+            guardado = cache.get((user_id, days))
+        if guardado and guardado[0] == versao:
+            return guardado[1]
+
+        carga = db.carga_revisoes_agendadas(user_id, days)
+        # Mesmo relogio dos baldes: DATE('now') do SQLite (UTC), lido junto com a versao.
+        hoje = datetime.date.fromisoformat(str(versao[0]))
+        por_tipo = {}
+        for tipo, estrategia in (
+            ("flashcard", db.estrategia_revisao(user_id, "flashcard")),
+            ("question", db.estrategia_revisao(user_id, "questao")),
+        ):
+            dados = carga[tipo]
+            taxa = dados["taxa_acerto"]
+            por_tipo[tipo] = srs_engine.forecast_load(
+                estrategia,
+                dados["agendadas"],
+                days,
+                success_rate=_TAXA_ACERTO_PADRAO if taxa is None else float(taxa),
+            )
+        per_day = []
+        for dia in range(days):
+            flashcards = int(round(por_tipo["flashcard"][dia]))
+            questions = int(round(por_tipo["question"][dia]))
+            per_day.append(
+                {
+                    "date": (hoje + datetime.timedelta(days=dia)).isoformat(),
+                    "flashcards": flashcards,
+                    "questions": questions,
+                    "total": flashcards + questions,
+                }
+            )
+        resultado = {
+            "days": days,
+            "scheduled": sum(sum(carga[t]["agendadas"].values()) for t in ("flashcard", "question")),
+            "total": sum(d["total"] for d in per_day),
+            "per_day": per_day,
+        }
+        with _PREVISOES_LOCK:
+            _PREVISOES.setdefault(db, {})[(user_id, days)] = (versao, resultado)
+        return resultado
@@ -16,3 +16,32 @@ class StudyPlanService:
         topics = [t for t in from_db if t]
         return topics or [str(default_topic or "Geral")]
 
+
+    @staticmethod
+    def balance_review_load(
+        items: List[Dict],
+        forecast: Dict,
+        daily_minutes: int,
+        minutes_per_review: float = 1.0,
+        max_review_share: float = 0.6,
+    ) -> List[Dict]:
+        """
+        Reserva, em cada dia do plano, o tempo das revisoes previstas
+        (`forecast_review_load`) e deixa o resto para conteudo novo. A revisao
+        ocupa no maximo `max_review_share` do tempo diario.
+        """
+        per_day = list((forecast or {}).get("per_day") or [])
+        out = []
+        for i, item in enumerate(items or []):
+            item = dict(item)
+            minutes = int(item.get("duracao_min") or daily_minutes)
+            reviews = int(per_day[i]["total"]) if i < len(per_day) else 0
+            review_min = min(int(round(reviews * minutes_per_review)), int(minutes * max_review_share))
+            if reviews > 0:
+                item["revisoes_previstas"] = reviews
+                item["revisao_min"] = review_min
+                item["atividade"] = f"{reviews} revisoes (~{review_min} min) + {item.get('atividade') or 'conteudo novo'}"
+                if review_min >= minutes * max_review_share and int(item.get("prioridade") or 2) > 1:
+                    item["prioridade"] = 1
+            out.append(item)
+        return out
@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+"""Motor unico de agendamento da revisao espacada (estrategias plugaveis)."""
+
+from __future__ import annotations
+
+import datetime
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+GOOD = "good"
+AGAIN = "again"
+SKIP = "skip"
+MARK = "mark"
+
+_ALIASES = {
+    GOOD: {"good", "lembrei", "remembered", "correct", "acerto", "acertou", "true"},
+    AGAIN: {"again", "rever", "wrong", "erro", "errou", "false"},
+    MARK: {"mark", "marcar"},
+}
+
+_FORMATO_SQL = "%Y-%m-%d %H:%M:%S"
+
+State = Dict[str, Any]
+
+# Estado proprio das estrategias (SM-2/FSRS), gravado junto com o nivel.
+STATE_FIELDS = ("ease", "interval_days", "stability", "difficulty")
+
+
+def normalize_outcome(action: Any) -> str:
+    """Converte as acoes usadas nas telas (PT/EN, bool) em GOOD/AGAIN/SKIP/MARK."""
+    if isinstance(action, bool):
+        return GOOD if action else AGAIN
+    norm = str(action or "").strip().lower()
+    for outcome, aliases in _ALIASES.items():
+        if norm in aliases:
+            return outcome
+    return SKIP
+
+
+def format_due(now: datetime.datetime, days: Optional[float]) -> Optional[str]:
+    """Data no mesmo formato de DATETIME('now') do SQLite (UTC); None = fora da fila."""
+    if days is None:
+        return None
+    return (now + datetime.timedelta(days=float(days))).strftime(_FORMATO_SQL)
+
+
+def parse_sql_datetime(value: Any) -> Optional[datetime.datetime]:
+    if isinstance(value, datetime.datetime):
+        return value
+    texto = str(value or "").strip()
+    if not texto:
+        return None
+    for formato in (_FORMATO_SQL, "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(texto[:19], formato)
+        except ValueError:
+            continue
+    return None
+
+
+class SchedulingStrategy:
+    """
+    Estrategia de agendamento. `schedule_batch` e pura: recebe estados
+    (`level`, e campos proprios da estrategia) e resultados e devolve novos
+    estados com `due` (texto UTC ou None), sem tocar no banco.
+    """
+
+    name = ""
+
+    def step(self, state: State, outcome: str, now: datetime.datetime) -> Tuple[State, Optional[float]]:
+        """Novo estado e atraso em dias (None = sai da fila)."""
+        raise NotImplementedError
+
+    def interval_for(self, state: State) -> Optional[float]:
+        """Intervalo (dias) que a estrategia daria ao estado atual; usado em migracoes."""
+        raise NotImplementedError
+
+    def seed_state(self, state: State) -> State:
+        """Preenche o estado proprio da estrategia que ainda falta (ex.: ao migrar)."""
+        return state
+
+    def schedule_batch(
+        self,
+        states: Sequence[State],
+        outcomes: Sequence[Any],
+        now: Optional[datetime.datetime] = None,
+    ) -> List[State]:
+        if len(states) != len(outcomes):
+            raise ValueError("states e outcomes devem ter o mesmo tamanho")
+        now = now or datetime.datetime.utcnow()
+        out = []
+        for state, outcome in zip(states, outcomes):
+            novo, dias = self.step(dict(state), normalize_outcome(outcome), now)
+            novo["due"] = format_due(now, dias)
+            out.append(novo)
+        return out
+
+    def reschedule_batch(self, states: Sequence[State], now: Optional[datetime.datetime] = None) -> List[State]:
+        """Recalcula `due` a partir da ultima revisao (ex.: troca de algoritmo)."""
+        now = now or datetime.datetime.utcnow()
+        out = []
+        for state in states:
+            novo = self.seed_state(dict(state))
+            dias = self.interval_for(novo)
+            base = parse_sql_datetime(novo.get("last_review")) or now
+            novo["due"] = format_due(base, dias)
+            out.append(novo)
+        return out
+
+
+class LadderStrategy(SchedulingStrategy):
+    """
+    Escada fixa de intervalos: acerto sobe um degrau e usa o intervalo dele;
+    erro desce um degrau (ou volta a zero com `reset_on_again`).
+    """
+
+    name = "ladder"
+
+    def __init__(
+        self,
+        intervals: Sequence[float],
+        again_days: float = 1,
+        skip_days: float = 0.5,
+        reset_on_again: bool = False,
+    ):
+        self.intervals = [float(d) for d in intervals]
+        self.again_days = float(again_days)
+        self.skip_days = float(skip_days)
+        self.reset_on_again = bool(reset_on_again)
+
+    def _topo(self) -> int:
+        return len(self.intervals) - 1
+
+    def step(self, state: State, outcome: str, now: datetime.datetime) -> Tuple[State, Optional[float]]:
+        level = min(self._topo(), max(0, int(state.get("level") or 0)))
+        if outcome == GOOD:
+            state["level"] = min(self._topo(), level + 1)
+            return state, self.intervals[state["level"]]
+        if outcome == AGAIN:
+            state["level"] = 0 if self.reset_on_again else max(0, level - 1)
+            return state, self.again_days
+        if outcome == MARK:
+            state["level"] = max(1, level)
+            return state, 0.0
+        state["level"] = level
+        return state, self.skip_days
+
+    def interval_for(self, state: State) -> Optional[float]:
+        return self.intervals[min(self._topo(), max(0, int(state.get("level") or 0)))]
+
+
+class MistakeLadderStrategy(SchedulingStrategy):
+    """
+    Fila de erros: o nivel mede quanto a questao precisa de revisao. Erro sobe
+    o nivel (intervalo do degrau); acerto desce e, no zero, tira da fila.
+    """
+
+    name = "mistakes"
+
+    def __init__(self, intervals: Sequence[float]):
+        self.intervals = [float(d) for d in intervals]
+
+    def _intervalo(self, level: int) -> float:
+        return self.intervals[min(max(level, 0), len(self.intervals) - 1)]
+
+    def step(self, state: State, outcome: str, now: datetime.datetime) -> Tuple[State, Optional[float]]:
+        level = max(0, int(state.get("level") or 0))
+        if outcome == GOOD:
+            state["level"] = max(0, level - 1)
+            return state, (None if state["level"] <= 0 else self._intervalo(state["level"]))
+        if outcome == AGAIN:
+            state["level"] = min(len(self.intervals) - 1, level + 1)
+            return state, self._intervalo(state["level"])
+        if outcome == MARK:
+            state["level"] = max(1, level)
+            return state, 0.0
+        state["level"] = level
+        return state, max(1.0, self._intervalo(level))
+
+    def interval_for(self, state: State) -> Optional[float]:
+        level = max(0, int(state.get("level") or 0))
+        return None if level <= 0 else self._intervalo(level)
+
+
+class SM2Strategy(SchedulingStrategy):
+    """
+    SM-2 simplificado: 1, 1, 6 dias e depois intervalo anterior x fator de
+    facilidade (derivado da taxa de acerto, minimo 1.3).
+    """
+
+    name = "sm2"
+    EASE_INICIAL = 2.5
+    EASE_MIN = 1.3
+
+    def _ease(self, state: State) -> float:
+        tentativas = int(state.get("attempts") or 0)
+        if tentativas <= 0:
+            return self.EASE_INICIAL
+        acertos = int(state.get("hits") or 0)
+        return round((acertos / tentativas) * (self.EASE_INICIAL - self.EASE_MIN) + self.EASE_MIN, 2)
+
+    def _intervalo(self, level: int, anterior: Optional[float], ease: float) -> float:
+        if level <= 1:
+            return 1.0
+        if level == 2:
+            return 6.0
+        return float(max(1, round((anterior or 6) * max(ease, self.EASE_MIN))))
+
+    def step(self, state: State, outcome: str, now: datetime.datetime) -> Tuple[State, Optional[float]]:
+        level = max(0, int(state.get("level") or 0))
+        if outcome in (GOOD, AGAIN):
+            state["attempts"] = int(state.get("attempts") or 0) + 1
+            state["hits"] = int(state.get("hits") or 0) + (1 if outcome == GOOD else 0)
+            state["level"] = level + 1 if outcome == GOOD else max(0, level - 1)
+        elif outcome == MARK:
+            state["level"] = max(1, level)
+            return state, 0.0
+        else:
+            state["level"] = level
+        state["ease"] = self._ease(state)
+        ultima = parse_sql_datetime(state.get("last_review"))
+        anterior = max(1, (now - ultima).days) if ultima else state.get("interval_days")
+        dias = self._intervalo(state["level"], anterior, state["ease"])
+        state["interval_days"] = dias
+        return state, dias
+
+    def interval_for(self, state: State) -> Optional[float]:
+        return self._intervalo(max(0, int(state.get("level") or 0)), state.get("interval_days"), self._ease(state))
+
+    def seed_state(self, state: State) -> State:
+        if state.get("ease") is None:
+            state["ease"] = self._ease(state)
+        if state.get("interval_days") is None:
+            state["interval_days"] = self.interval_for(state)
+        return state
+
+
+class FSRSStrategy(SchedulingStrategy):
+    """
+    Estilo FSRS (v4.5, pesos padrao): estabilidade e dificuldade por item;
+    o intervalo e o tempo ate a retencao prevista cair para `retention`.
+    Sem estabilidade gravada, parte de uma estimativa pelo nivel.
+    """
+
+    name = "fsrs"
+    W = (0.4872, 1.4003, 3.7145, 13.8206, 5.1618, 1.2298, 0.8975, 0.031, 1.6474,
+         0.1367, 1.0461, 2.1072, 0.0793, 0.3246, 1.587, 0.2272, 2.8755)
+    DECAY = -0.5
+    FACTOR = 19 / 81
+    _NOTAS = {AGAIN: 1, GOOD: 3}
+
+    def __init__(self, retention: float = 0.9, max_days: float = 365):
+        self.retention = min(0.99, max(0.5, float(retention)))
+        self.max_days = float(max_days)
+
+    def _dificuldade_inicial(self, nota: int) -> float:
+        return min(10.0, max(1.0, self.W[4] - math.exp(self.W[5] * (nota - 1)) + 1))
+
+    def _retencao(self, dias: float, estabilidade: float) -> float:
+        return (1 + self.FACTOR * dias / max(estabilidade, 0.01)) ** self.DECAY
+
+    def _intervalo(self, estabilidade: float) -> float:
+        dias = estabilidade / self.FACTOR * (self.retention ** (1 / self.DECAY) - 1)
+        return float(min(self.max_days, max(1, round(dias))))
+
+    def _estado_inicial(self, state: State) -> Tuple[Optional[float], float]:
+        estabilidade = state.get("stability")
+        dificuldade = state.get("difficulty")
+        level = max(0, int(state.get("level") or 0))
+        if estabilidade is None and level > 0:
+            estabilidade = float(2 ** (level - 1)) * self.W[2] / 2
+        if dificuldade is None:
+            dificuldade = self._dificuldade_inicial(3)
+        return (None if estabilidade is None else float(estabilidade)), float(dificuldade)
+
+    def step(self, state: State, outcome: str, now: datetime.datetime) -> Tuple[State, Optional[float]]:
+        level = max(0, int(state.get("level") or 0))
+        if outcome == MARK:
+            state["level"] = max(1, level)
+            return state, 0.0
+        if outcome not in self._NOTAS:
+            state["level"] = level
+            return state, 0.5
+        nota = self._NOTAS[outcome]
+        estabilidade, dificuldade = self._estado_inicial(state)
+        w = self.W
+        if estabilidade is None:
+            estabilidade = w[nota - 1]
+            dificuldade = self._dificuldade_inicial(nota)
+        else:
+            ultima = parse_sql_datetime(state.get("last_review"))
+            decorridos = max(0.0, (now - ultima).total_seconds() / 86400) if ultima else estabilidade
+            r = self._retencao(decorridos, estabilidade)
+            if outcome == GOOD:
+                estabilidade = estabilidade * (
+                    1 + math.exp(w[8]) * (11 - dificuldade) * estabilidade ** (-w[9]) * (math.exp(w[10] * (1 - r)) - 1)
+                )
+            else:
+                esquecida = w[11] * dificuldade ** (-w[12]) * ((estabilidade + 1) ** w[13] - 1) * math.exp(w[14] * (1 - r))
+                estabilidade = min(estabilidade, esquecida)
+            dificuldade = dificuldade - w[6] * (nota - 3)
+            dificuldade = w[7] * self._dificuldade_inicial(4) + (1 - w[7]) * dificuldade
+            dificuldade = min(10.0, max(1.0, dificuldade))
+        state["stability"] = round(estabilidade, 4)
+        state["difficulty"] = round(dificuldade, 4)
+        state["level"] = level + 1 if outcome == GOOD else max(0, level - 1)
+        if outcome == AGAIN:
+            return state, 1.0
+        return state, self._intervalo(estabilidade)
+
+    def interval_for(self, state: State) -> Optional[float]:
+        estabilidade, _dificuldade = self._estado_inicial(state)
+        return self._intervalo(estabilidade if estabilidade is not None else self.W[2])
+
+    def seed_state(self, state: State) -> State:
+        estabilidade, dificuldade = self._estado_inicial(state)
+        state["stability"] = round(estabilidade if estabilidade is not None else self.W[2], 4)
+        state["difficulty"] = round(dificuldade, 4)
+        return state
+
+
+# Estrategias em uso no app (mesmos intervalos de antes da unificacao).
+FLASHCARD_STRATEGY = LadderStrategy([1, 2, 4, 7, 14, 30, 60, 120, 180], again_days=1, skip_days=0.5)
+REVIEW_QUEUE_STRATEGY = MistakeLadderStrategy([1, 2, 4, 7, 14, 30])
+
+STRATEGIES = {
+    "ladder": FLASHCARD_STRATEGY,
+    "mistakes": REVIEW_QUEUE_STRATEGY,
+    "sm2": SM2Strategy(),
+    "fsrs": FSRSStrategy(),
+}
+
+
+def get_strategy(name: str) -> SchedulingStrategy:
+    try:
+        return STRATEGIES[str(name or "").strip().lower()]
+    except KeyError:
+        raise ValueError(f"Estrategia de revisao desconhecida: {name}") from None
+
+
+def postpone_batch(states: Sequence[State], days: float, now: Optional[datetime.datetime] = None) -> List[State]:
+    """Empurra `due` em `days` dias (itens fora da fila continuam fora)."""
+    now = now or datetime.datetime.utcnow()
+    out = []
+    for state in states:
+        novo = dict(state)
+        atual = parse_sql_datetime(novo.get("due"))
+        novo["due"] = None if atual is None else format_due(max(atual, now), days)
+        out.append(novo)
+    return out
+
+
+def reset_batch(states: Sequence[State], now: Optional[datetime.datetime] = None) -> List[State]:
+    """Volta os itens ao nivel zero, vencendo agora (sem o estado das estrategias)."""
+    now = now or datetime.datetime.utcnow()
+    agora = format_due(now, 0)
+    limpo = dict.fromkeys(STATE_FIELDS)
+    return [dict(state, level=0, due=agora, **limpo) for state in states]
+
+
+def forecast_load(
+    strategy: SchedulingStrategy,
+    due_counts: Dict[Tuple[int, int], float],
+    days: int,
+    success_rate: float = 0.85,
+    now: Optional[datetime.datetime] = None,
+) -> List[float]:
+    """
+    Carga esperada de revisoes por dia nos proximos `days` dias.
+
+    `due_counts` agrega o que ja esta agendado: {(dia, nivel): quantidade}.
+    A simulacao anda sobre esses contadores (nao sobre itens): cada revisao
+    gera, com probabilidade `success_rate`, a proxima revisao do acerto e,
+    no restante, a do erro, usando os intervalos da propria estrategia.
+    """
+    days = max(0, int(days))
+    now = now or datetime.datetime.utcnow()
+    acerto = min(1.0, max(0.0, float(success_rate)))
+    transicoes: Dict[int, List[Tuple[float, int, int]]] = {}
+
+    def _transicoes(level: int) -> List[Tuple[float, int, int]]:
+        if level not in transicoes:
+            saidas = []
+            for outcome, prob in ((GOOD, acerto), (AGAIN, 1.0 - acerto)):
+                if prob <= 0:
+                    continue
+                novo, atraso = strategy.step({"level": level}, outcome, now)
+                if atraso is not None:
+                    saidas.append((prob, int(novo["level"]), max(1, int(round(atraso)))))
+            transicoes[level] = saidas
+        return transicoes[level]
+
+    pendentes: List[Dict[int, float]] = [{} for _ in range(days)]
+    for (dia, level), quantidade in due_counts.items():
+        dia = max(0, int(dia))
+        if dia < days:
+            pendentes[dia][int(level)] = pendentes[dia].get(int(level), 0.0) + float(quantidade)
+
+    carga = [0.0] * days
+    for dia in range(days):
+        for level, quantidade in pendentes[dia].items():
+            carga[dia] += quantidade
+            for prob, novo, atraso in _transicoes(level):
+                alvo = dia + atraso
+                if alvo < days:
+                    pendentes[alvo][novo] = pendentes[alvo].get(novo, 0.0) + quantidade * prob
+    return carga
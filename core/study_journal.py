@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""Diario de eventos de estudo com gravacao adiada (write-behind)."""
+
+from __future__ import annotations
+
+import atexit
+import datetime
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.error_monitor import log_exception
+from core.repositories.flashcard_repository import FlashcardRepository
+from core.repositories.question_progress_repository import QuestionProgressRepository
+
+_CAMPOS_PROGRESSO = ("questoes", "acertos", "flashcards", "discursivas", "tempo_segundos")
+
+
+class StudyEventJournal:
+    """
+    Acumula respostas, avaliacoes de flashcards e progresso em memoria e os
+    aplica em lote, numa unica transacao do writer do banco: a cada
+    `max_eventos`, apos `intervalo_s` segundos ou quando `flush()` e chamado
+    (ex.: app indo para segundo plano).
+
+    Cada lote grava primeiro os eventos completos em `study_events` e aplica a
+    partir de la; `applied` so vira 1 depois que o evento foi aplicado. Eventos
+    que falharem continuam la e sao reaplicados nos lotes seguintes (ate
+    `max_tentativas`); se o COMMIT do lote falhar, os eventos voltam para a fila.
+    Leituras que dependem dos agregados chamam `db._eventos_em_dia()` antes de
+    consultar, entao quem grava sempre enxerga as proprias escritas.
+    """
+
+    KINDS = ("flashcard", "question", "progresso", "review_item", "mock_progress", "quiz_result")
+
+    def __init__(self, db, max_eventos: int = 25, intervalo_s: float = 3.0, max_tentativas: int = 5):
+        self.db = db
+        self.max_eventos = max(1, int(max_eventos))
+        self.intervalo_s = max(0.0, float(intervalo_s))
+        self.max_tentativas = max(1, int(max_tentativas))
+        self._lock = threading.Lock()
+        self._pendentes: List[Tuple[int, str, Dict[str, Any], str]] = []
+        self._timer: Optional[threading.Timer] = None
+        # Ultimo lote enviado ao writer: lotes sao aplicados em ordem, entao
+        # quando ele termina todos os anteriores tambem terminaram.
+        self._ultimo: Optional[Future] = None
+        # Eventos de uma execucao anterior podem ter ficado sem aplicar.
+        self._reaplicar = True
+        atexit.register(self.flush)
+
+    def record(self, user_id: int, kind: str, **dados: Any) -> None:
+        """Enfileira um evento; a gravacao acontece no proximo lote."""
+        if kind not in self.KINDS:
+            raise ValueError(f"Evento de estudo desconhecido: {kind}")
+        criado_em = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            self._pendentes.append((int(user_id), kind, dados, criado_em))
+            cheio = len(self._pendentes) >= self.max_eventos
+            if not cheio and self._timer is None and self.intervalo_s:
+                self._timer = threading.Timer(self.intervalo_s, self.flush, kwargs={"wait": False})
+                self._timer.daemon = True
+                self._timer.start()
+        if cheio or not self.intervalo_s:
+            self.flush(wait=False)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pendentes)
+
+    def busy(self) -> bool:
+        """Ha eventos na fila ou um lote ainda sendo gravado pelo writer?"""
+        with self._lock:
+            return (
+                bool(self._pendentes)
+                or self._reaplicar
+                or (self._ultimo is not None and not self._ultimo.done())
+            )
+
+    def flush(self, wait: bool = True, timeout: Optional[float] = None) -> None:
+        """
+        Aplica os eventos pendentes; com `wait` bloqueia ate o COMMIT deste
+        lote e dos que ja estavam no writer.
+        """
+        writer = self.db.writer
+        with self._lock:
+            eventos, self._pendentes = self._pendentes, []
+            timer, self._timer = self._timer, None
+            if timer is not None:
+                timer.cancel()
+            aplicar = bool(eventos) or self._reaplicar
+            self._reaplicar = False
+            fut = None
+            if aplicar and not (writer.closed or writer.in_writer_thread()):
+                # Enfileirado ainda sob o lock: lotes chegam ao writer na ordem.
+                fut = self._ultimo = writer.submit(self._aplicar, eventos)
+            ultimo = self._ultimo
+        if fut is not None:
+
+            def _se_falhou(done: Future) -> None:
+                if done.cancelled() or done.exception() is not None:
+                    self._devolver(eventos)
+
+            fut.add_done_callback(_se_falhou)
+        elif aplicar:
+            try:
+                self._aplicar(eventos)
+            except Exception:
+                self._devolver(eventos)
+                raise
+        if wait and ultimo is not None and not ultimo.done() and not writer.in_writer_thread():
+            ultimo.result(timeout=timeout)
+
+    def _devolver(self, eventos: List[Tuple[int, str, Dict[str, Any], str]]) -> None:
+        """Lote desfeito (ex.: falha no COMMIT): os eventos voltam para a frente da fila."""
+        with self._lock:
+            self._pendentes[:0] = eventos
+            self._reaplicar = True
+
+    def _payload_diario(self, kind: str, dados: Dict[str, Any]) -> str:
+        # Depois de aplicado, o conteudo de questoes/cards ja esta nas tabelas
+        # proprias: o diario passa a guardar so o hash.
+        if kind == "question" and isinstance(dados.get("question"), dict):
+            dados = {"qhash": self.db._question_hash(dados["question"]), "action": dados.get("action")}
+        elif kind == "flashcard" and isinstance(dados.get("card"), dict):
+            dados = {"card_hash": self.db._flashcard_hash(dados["card"]), "action": dados.get("action")}
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+    def _aplicar(self, eventos: List[Tuple[int, str, Dict[str, Any], str]]) -> None:
+        flash_repo = FlashcardRepository(self.db)
+        question_repo = QuestionProgressRepository(self.db)
+        # Por usuario/simulado: (dados agregados, [(id, payload)] dos eventos).
+        progresso: Dict[int, Tuple[Dict[str, int], List[Tuple[int, str]]]] = {}
+        mock_progress: Dict[int, Tuple[Dict[str, Any], List[Tuple[int, str]]]] = {}
+        aplicados: List[Tuple[str, int]] = []
+        falhas: List[Tuple[int]] = []
+
+        def _falhou(ex: Exception, kind: str, ids: List[int]) -> None:
+            log_exception(ex, f"study_journal.{kind}")
+            falhas.extend((event_id,) for event_id in ids)
+
+        with self.db.conexao() as conn:
+            conn.executemany(
+                """
+                INSERT INTO study_events (user_id, kind, payload_json, created_at, applied, tentativas)
+                VALUES (?, ?, ?, ?, 0, 0)
+                """,
+                [
+                    (user_id, kind, json.dumps(dados, ensure_ascii=False, default=str), criado_em)
+                    for user_id, kind, dados, criado_em in eventos
+                ],
+            )
+            linhas = conn.execute(
+                """
+                SELECT id, user_id, kind, payload_json
+                FROM study_events
+                WHERE applied = 0 AND tentativas < ?
+                ORDER BY id
+                """,
+                (self.max_tentativas,),
+            ).fetchall()
+            for event_id, user_id, kind, payload in linhas:
+                try:
+                    dados = json.loads(payload)
+                    if kind == "progresso":
+                        # Somados por usuario: um UPSERT e um calculo de streak por lote.
+                        tot, ids = progresso.setdefault(user_id, (dict.fromkeys(_CAMPOS_PROGRESSO, 0), []))
+                        for campo in _CAMPOS_PROGRESSO:
+                            tot[campo] += max(0, int(dados.get(campo) or 0))
+                        ids.append((event_id, payload))
+                        continue
+                    if kind == "mock_progress":
+                        # Ultimo estado vence.
+                        session_id = int(dados["session_id"])
+                        ids = mock_progress.get(session_id, (None, []))[1]
+                        mock_progress[session_id] = (dados, ids + [(event_id, payload)])
+                        continue
+                    with self.db.conexao():
+                        if kind == "flashcard":
+                            flash_repo.register_action(user_id, dados["card"], dados["action"])
+                        elif kind == "question":
+                            question_repo.register_result(user_id, dados["question"], dados["action"])
+                        elif kind == "review_item":
+                            self.db.registrar_review_session_item(**dados)
+                        elif kind == "quiz_result":
+                            self.db.registrar_resultado_quiz(user_id, **dados)
+                except Exception as ex:
+                    _falhou(ex, kind, [event_id])
+                    continue
+                aplicados.append((self._payload_diario(kind, dados), event_id))
+            for user_id, (tot, ids) in progresso.items():
+                try:
+                    with self.db.conexao():
+                        self.db.registrar_progresso_diario(user_id, **tot)
+                except Exception as ex:
+                    _falhou(ex, "progresso", [event_id for event_id, _ in ids])
+                    continue
+                aplicados.extend((payload, event_id) for event_id, payload in ids)
+            for dados, ids in mock_progress.values():
+                try:
+                    with self.db.conexao():
+                        self.db.salvar_mock_exam_progresso(**dados)
+                except Exception as ex:
+                    _falhou(ex, "mock_progress", [event_id for event_id, _ in ids])
+                    continue
+                aplicados.extend((payload, event_id) for event_id, payload in ids)
+            conn.executemany("UPDATE study_events SET applied = 1, payload_json = ? WHERE id = ?", aplicados)
+            conn.executemany("UPDATE study_events SET tentativas = tentativas + 1 WHERE id = ?", falhas)
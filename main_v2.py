@@ -20,15 +20,22 @@ from core.database_v2 import Database
 from core.backend_client import BackendClient
 from core.error_monitor import log_exception, log_event
 from core.app_paths import ensure_runtime_dirs, get_db_path, get_data_dir
-from core.ai_service_v2 import AIService, create_ai_provider
+from core.ai_service_v2 import AIService, get_ai_provider, invalidate_ai_providers
+from core.ai_response_cache import get_default_cache
+from core.chunk_index import get_default_chunk_index
 from core.sounds import create_sound_manager
 from core.library_service import LibraryService
 from core.platform_helper import is_android, is_desktop, get_platform
 from core.filter_taxonomy import get_quiz_filter_taxonomy
 from core.repositories.question_progress_repository import QuestionProgressRepository
 from core.services.mock_exam_report_service import MockExamReportService
+from core.services.flashcards_service import FlashcardsService
 from core.services.mock_exam_service import MockExamService
+from core.services.near_duplicate_service import NearDuplicateService
 from core.services.quiz_filter_service import QuizFilterService
+from core.services.quiz_generation_service import QuizGenerationService
+from core.services.spaced_repetition_service import SpacedRepetitionService
+from core.services.study_plan_service import StudyPlanService
 from ui.views.login_view_v2 import LoginView
 from ui.views.review_session_view_v2 import build_review_session_body
 from ui.design_system import DS, ds_card, ds_btn_primary, ds_btn_ghost, ds_empty_state, ds_toast, ds_bottom_sheet, ds_section_title, ds_stat_card, ds_badge, ds_divider, ds_skeleton, ds_skeleton_card, ds_chip, ds_btn_secondary, ds_progress_bar, ds_icon_btn
@@ -383,15 +390,31 @@ def _create_user_ai_service(usuario: dict, force_economic: bool = False) -> Opti
     telemetry_opt_in = bool(usuario.get("telemetry_opt_in"))
     try:
         return AIService(
-            create_ai_provider(provider_type, api_key, model_value),
+            get_ai_provider(provider_type, api_key, model_value),
             telemetry_opt_in=telemetry_opt_in,
             user_anon=user_anon,
+            response_cache=get_default_cache(),
+            chunk_index=get_default_chunk_index(),
         )
     except Exception as ex:
         log_exception(ex, "main._create_user_ai_service")
         return None
 
 
+def _near_duplicate_filter(db, usuario: Optional[dict], kind: str):
+    """Filtro de quase-duplicatas do usuario (questoes ou flashcards); None sem banco/usuario."""
+    if not db or not (usuario or {}).get("id"):
+        return None
+    try:
+        service = NearDuplicateService(db)
+        if kind == "flashcard":
+            return service.flashcard_filter(int(usuario["id"]))
+        return service.question_filter(int(usuario["id"]))
+    except Exception as ex:
+        log_exception(ex, "main._near_duplicate_filter")
+        return None
+
+
 def _emit_opt_in_event(
     usuario: Optional[dict],
     event_name: str,
@@ -434,11 +457,13 @@ def _build_focus_header(title: str, flow: str, etapa_control: ft.Control, dark:
 def _is_ai_quota_exceeded(service: Optional[AIService]) -> bool:
     if not service:
         return False
-    provider = getattr(service, "provider", None)
-    kind = str(getattr(provider, "last_error_kind", "") or "").lower()
+    if service.quota_exhausted():
+        return True
+    # Erro guardado pelo servico: o do provider e por thread (chamadas rodam fora do loop).
+    kind = str(getattr(service, "last_error_kind", "") or "").lower()
     if kind in {"quota_hard", "quota_soft"}:
         return True
-    msg = str(getattr(provider, "last_error_message", "") or "").lower()
+    msg = str(getattr(service, "last_error_message", "") or "").lower()
     return ("quota exceeded" in msg) or ("429" in msg) or ("rate limit" in msg)
 
 
@@ -1162,11 +1187,17 @@ def _build_home_body(state: dict, navigate, dark: bool):
     }
     if db and usuario.get("id"):
         try:
-            pd = db.obter_progresso_diario(usuario["id"])
-            if pd:
-                progresso.update(pd)
-            rev = db.revisoes_pendentes(usuario["id"])
-            progresso["revisoes_pendentes"] = int(rev or 0)
+            # Uma leitura: contadores materializados + meta e progresso de hoje.
+            contadores = db.obter_contadores(usuario["id"])
+            progresso.update(
+                {
+                    "meta_questoes": contadores["meta_questoes"],
+                    "questoes_respondidas": contadores["questoes_hoje"],
+                    "acertos": contadores["acertos_hoje"],
+                    "streak_dias": contadores["streak"],
+                    "revisoes_pendentes": contadores["questoes_pendentes"],
+                }
+            )
         except Exception as ex:
             log_exception(ex, "home.progresso_diario")
 
@@ -1760,10 +1791,25 @@ def _build_library_body(state, navigate, dark: bool):
                 ds_toast(page, "Erro ao exportar PDF.", tipo="erro")
                 page.update()
 
+    def _with_full_package(package_id: int, acao):
+        # A lista so tem o resumo: o pacote inteiro e decodificado no clique.
+        try:
+            pkg = db.obter_study_package(user["id"], package_id)
+        except Exception as ex:
+            log_exception(ex, "_with_full_package")
+            pkg = None
+        if not pkg:
+            status_text.value = "Pacote nao encontrado."
+            status_text.color = CORES["warning"]
+            if page:
+                page.update()
+            return
+        acao(pkg)
+
     def _refresh_packages():
         package_list.controls.clear()
         try:
-            packs = db.listar_study_packages(user["id"], limite=8)
+            packs = db.listar_study_packages(user["id"], limite=8, resumido=True)
         except Exception as ex:
             log_exception(ex, "_refresh_packages")
             packs = []
@@ -1775,8 +1821,8 @@ def _build_library_body(state, navigate, dark: bool):
             return
         for p in packs:
             dados = p.get("dados") or {}
-            qcount = len(dados.get("questoes") or [])
-            fcount = len(dados.get("flashcards") or [])
+            qcount = int(dados.get("total_questoes") or 0)
+            fcount = int(dados.get("total_flashcards") or 0)
             package_list.controls.append(
                 ft.Container(
                     padding=8,
@@ -1801,27 +1847,27 @@ def _build_library_body(state, navigate, dark: bool):
                                     ft.TextButton(
                                         "Usar no Quiz",
                                         icon=ft.Icons.PLAY_ARROW,
-                                        on_click=lambda _, d=dados: _start_quiz_from_package(d),
+                                        on_click=lambda _, pid=p["id"]: _with_full_package(pid, lambda pkg: _start_quiz_from_package(pkg["dados"])),
                                     ),
                                     ft.TextButton(
                                         "Flashcards",
                                         icon=ft.Icons.STYLE_OUTLINED,
-                                        on_click=lambda _, d=dados: _start_flashcards_from_package(d),
+                                        on_click=lambda _, pid=p["id"]: _with_full_package(pid, lambda pkg: _start_flashcards_from_package(pkg["dados"])),
                                     ),
                                     ft.TextButton(
                                         "Plano 7d",
                                         icon=ft.Icons.CALENDAR_MONTH_OUTLINED,
-                                        on_click=lambda _, item=p: _start_plan_from_package(item),
+                                        on_click=lambda _, pid=p["id"]: _with_full_package(pid, _start_plan_from_package),
                                     ),
                                     ft.TextButton(
                                         "Exportar MD",
                                         icon=ft.Icons.DOWNLOAD_OUTLINED,
-                                        on_click=lambda _, p=p: _export_package_markdown(p),
+                                        on_click=lambda _, pid=p["id"]: _with_full_package(pid, _export_package_markdown),
                                     ),
                                     ft.TextButton(
                                         "Exportar PDF",
                                         icon=ft.Icons.PICTURE_AS_PDF,
-                                        on_click=lambda _, p=p: _export_package_pdf(p),
+                                        on_click=lambda _, pid=p["id"]: _with_full_package(pid, _export_package_pdf),
                                     ),
                                 ],
                                 wrap=True,
@@ -1846,7 +1892,8 @@ def _build_library_body(state, navigate, dark: bool):
                 status_text.value = "Arquivo sem texto para pacote."
                 status_text.color = CORES["warning"]
                 return
-            chunks = [line.strip() for line in content_txt.splitlines() if line.strip()]
+            # O documento inteiro: o AIService fatia (uma vez, por hash) e escolhe os trechos.
+            material = [content_txt]
             source_hash = hashlib.sha256(
                 f"{file_name}\n{content_txt[:180000]}".encode("utf-8", errors="ignore")
             ).hexdigest()
@@ -1883,15 +1930,22 @@ def _build_library_body(state, navigate, dark: bool):
                             status_text.color = CORES["warning"]
                             _show_upgrade_dialog(page, navigate, "No Premium voce gera resumos ilimitados por dia.")
                             return
-                    summary = await asyncio.to_thread(service.generate_study_summary, chunks, file_name, 1)
+                    summary = await asyncio.to_thread(service.generate_study_summary, material, file_name, 1)
                     if db and user.get("id"):
                         try:
-                            db.salvar_resumo_por_hash(int(user["id"]), source_hash, file_name, summary)
+                            db.writer.send(
+                                db.salvar_resumo_por_hash,
+                                int(user["id"]),
+                                source_hash,
+                                file_name,
+                                summary,
+                                where="_generate_package_async.save_summary_cache",
+                            )
                         except Exception as ex:
                             log_exception(ex, "_generate_package_async.save_summary_cache")
                 lote_quiz = await asyncio.to_thread(
                     service.generate_quiz_batch,
-                    chunks,
+                    material,
                     file_name,
                     "Intermediario",
                     3,
@@ -1905,19 +1959,21 @@ def _build_library_body(state, navigate, dark: bool):
                             "correta_index": q.get("correta_index", 0),
                         })
                     )
-                flashcards = await asyncio.to_thread(service.generate_flashcards, chunks, 5, 1)
+                flashcards = await asyncio.to_thread(service.generate_flashcards, material, 5, 1)
             if not questoes:
                 questoes = random.sample(DEFAULT_QUIZ_QUESTIONS, min(3, len(DEFAULT_QUIZ_QUESTIONS)))
             if db and user.get("id"):
-                try:
+                def _persist_package():
                     if flashcards:
                         db.salvar_flashcards_gerados(int(user["id"]), str(file_name or "Geral"), flashcards, "intermediario")
                     if questoes:
-                        from core.repositories.question_progress_repository import QuestionProgressRepository
                         qrepo = QuestionProgressRepository(db)
                         for q in questoes:
                             if isinstance(q, dict):
                                 qrepo.register_result(int(user["id"]), q, "mark")
+
+                try:
+                    await db.writer.run(_persist_package)
                 except Exception as ex:
                     log_exception(ex, "_generate_package_async.integrate_review_flow")
             resumo_curto = str(summary.get("resumo_curto") or summary.get("resumo") or "").strip()
@@ -1931,7 +1987,17 @@ def _build_library_body(state, navigate, dark: bool):
                 "questoes": questoes,
                 "flashcards": flashcards,
             }
-            db.salvar_study_package(user["id"], f"Pacote - {file_name}", file_name, pacote)
+            # Grava na thread do writer; espera sem travar o loop para a lista ja mostrar o pacote.
+            await asyncio.wrap_future(
+                db.writer.send(
+                    db.salvar_study_package,
+                    int(user["id"]),
+                    f"Pacote - {file_name}",
+                    file_name,
+                    pacote,
+                    where="_generate_package_async.save_package",
+                )
+            )
             status_text.value = "Pacote gerado e salvo."
             status_text.color = CORES["sucesso"]
             _refresh_packages()
@@ -2832,14 +2898,16 @@ def _build_quiz_body(state, navigate, dark: bool):
         tema = (topic_field.value or "").strip() or q.get("tema", "Geral")
         dificuldade = difficulty_dropdown.value or dificuldade_padrao
         try:
-            db.registrar_questao_usuario(
+            db.writer.send(
+                db.registrar_questao_usuario,
                 user["id"],
-                q,
+                dict(q),
                 tema=tema,
                 dificuldade=dificuldade,
                 tentativa_correta=tentativa_correta,
                 favorita=(qidx in estado["favoritas"]),
                 marcado_erro=(qidx in estado["marcadas_erro"]),
+                where="main._build_quiz_body._persist_question_flags",
             )
         except Exception as ex:
             log_exception(ex, "main._build_quiz_body._persist_question_flags")
@@ -2960,7 +3028,8 @@ def _build_quiz_body(state, navigate, dark: bool):
         if not (db and user.get("id") and estado.get("simulado_mode") and estado.get("mock_exam_session_id")):
             return
         try:
-            db.salvar_mock_exam_progresso(
+            MockExamService(db).save_progress(
+                int(user["id"]),
                 int(estado.get("mock_exam_session_id")),
                 int(estado.get("current_idx") or 0),
                 dict(estado.get("respostas") or {}),
@@ -3471,14 +3540,20 @@ def _build_quiz_body(state, navigate, dark: bool):
                     if db:
                         try:
                             tema_cache = topic or "Geral"
-                            db.salvar_questao_cache(tema_cache, difficulty_key, qnorm)
+                            db.writer.send(
+                                db.salvar_questao_cache,
+                                tema_cache,
+                                difficulty_key,
+                                dict(qnorm),
+                                where="main._build_quiz_body.prefetch.salvar_questao_cache",
+                            )
                         except Exception as ex:
                             log_exception(ex, "main._build_quiz_body.prefetch.salvar_questao_cache")
             except Exception as ex:
                 log_exception(ex, "main._build_quiz_body.prefetch")
         if not nova and topic and db:
             try:
-                cached = db.listar_questoes_cache(topic, difficulty_key, 1)
+                cached = db.listar_questoes_cache(topic, difficulty_key, 1, user_id=user.get("id"))
                 cached = [q for q in (_normalize_question_for_ui(x) for x in cached) if q]
                 if cached:
                     nova = cached[0]
@@ -3550,7 +3625,7 @@ def _build_quiz_body(state, navigate, dark: bool):
         xp = acertos * 10
         db_local = state["db"]
         if state.get("usuario"):
-            db_local.registrar_resultado_quiz(state["usuario"]["id"], acertos, total, xp)
+            db_local.eventos.record(int(state["usuario"]["id"]), "quiz_result", acertos=acertos, total=total, xp=xp)
             state["usuario"]["xp"] += xp
             state["usuario"]["acertos"] += acertos
             state["usuario"]["total_questoes"] += total
@@ -3875,31 +3950,33 @@ def _build_quiz_body(state, navigate, dark: bool):
 
         if gen_profile.get("delay_s", 0) > 0:
             await asyncio.sleep(float(gen_profile["delay_s"]))
+        estado["geracao_token"] = int(estado.get("geracao_token") or 0) + 1
+        lotes_restantes = None
         if not geradas and service and (topic or referencia):
-            for _ in range(quantidade):
-                try:
-                    questao = await asyncio.to_thread(
-                        service.generate_quiz,
-                        referencia or None,
-                        topic or None,
-                        DIFICULDADES.get(difficulty_key, {}).get("nome", "Intermediario"),
-                    )
-                    if questao:
-                        qnorm = _normalize_question_for_ui(questao)
-                        if qnorm:
-                            geradas.append(qnorm)
-                            if db:
-                                try:
-                                    tema_cache = topic or "Geral"
-                                    db.salvar_questao_cache(tema_cache, difficulty_key, qnorm)
-                                except Exception as ex:
-                                    log_exception(ex, "main._build_quiz_body.salvar_questao_cache")
-                except Exception as ex:
-                    log_exception(ex, "main._build_quiz_body")
+            # Lotes concorrentes: a sessao abre com o primeiro lote (fora do simulado,
+            # que precisa do total fixo) e o restante chega em segundo plano.
+            # So entra o que o usuario ainda nao viu (nem quase igual); o que cair e reposto.
+            aceitar = await asyncio.to_thread(_near_duplicate_filter, db, user, "question")
+            lotes = QuizGenerationService(service, accept=aceitar).stream(
+                quantidade,
+                referencia or None,
+                topic or None,
+                DIFICULDADES.get(difficulty_key, {}).get("nome", "Intermediario"),
+            )
+            try:
+                async for lote in lotes:
+                    geradas.extend(_aceitar_lote_gerado(lote, topic, difficulty_key))
+                    if geradas and not estado["simulado_mode"] and len(geradas) < quantidade:
+                        lotes_restantes = lotes
+                        break
+            except Exception as ex:
+                log_exception(ex, "main._build_quiz_body")
+            if lotes_restantes is None:
+                await lotes.aclose()
         if not geradas:
             if topic and db:
                 try:
-                    geradas = db.listar_questoes_cache(topic, difficulty_key, quantidade)
+                    geradas = db.listar_questoes_cache(topic, difficulty_key, quantidade, user_id=user.get("id"))
                     geradas = [q for q in (_normalize_question_for_ui(x) for x in geradas) if q]
                 except Exception as ex:
                     log_exception(ex, "main._build_quiz_body.listar_questoes_cache")
@@ -3927,9 +4004,11 @@ def _build_quiz_body(state, navigate, dark: bool):
             else:
                 _set_feedback_text(status_text, f"Modo offline: {len(geradas)} questoes prontas.", "info")
         else:
-            while len(geradas) < quantidade:
+            while lotes_restantes is None and len(geradas) < quantidade:
                 geradas.append(random.choice(DEFAULT_QUIZ_QUESTIONS))
-            if session_mode == "nova":
+            if lotes_restantes is not None:
+                _set_feedback_text(status_text, f"IA: {len(geradas)}/{quantidade} questoes prontas, gerando o restante...", "info")
+            elif session_mode == "nova":
                 _set_feedback_text(status_text, f"IA: {len(geradas)} questoes geradas.", "success")
             else:
                 _set_feedback_text(status_text, f"Sessao rapida ({session_mode}): {len(geradas)} questoes.", "success")
@@ -3982,6 +4061,62 @@ def _build_quiz_body(state, navigate, dark: bool):
         carregando.visible = False
         generate_button.disabled = False
         page.update()
+        if lotes_restantes is not None:
+            page.run_task(_receber_lotes_async, lotes_restantes, quantidade, int(estado["geracao_token"]))
+
+    def _aceitar_lote_gerado(lote: list, topic: str, difficulty_key: str) -> list:
+        aceitas = []
+        for questao in lote or []:
+            qnorm = _normalize_question_for_ui(questao)
+            if not qnorm:
+                continue
+            aceitas.append(qnorm)
+            if db:
+                try:
+                    db.writer.send(
+                        db.salvar_questao_cache,
+                        topic or "Geral",
+                        difficulty_key,
+                        dict(qnorm),
+                        where="main._build_quiz_body.salvar_questao_cache",
+                    )
+                except Exception as ex:
+                    log_exception(ex, "main._build_quiz_body.salvar_questao_cache")
+        return aceitas
+
+    async def _receber_lotes_async(lotes, quantidade: int, token: int):
+        """Anexa os lotes que ainda estavam em voo enquanto o usuario ja responde."""
+        filtro = estado.get("ultimo_filtro") or {}
+
+        def _ativo() -> bool:
+            return estado.get("geracao_token") == token and not estado.get("corrigido")
+
+        try:
+            async for lote in lotes:
+                if not _ativo():
+                    break
+                novas = _aceitar_lote_gerado(lote, filtro.get("topic") or "", filtro.get("difficulty") or dificuldade_padrao)
+                inicio = len(questoes)
+                questoes.extend(dict(q) for q in novas)
+                if db and user.get("id"):
+                    for idx in range(inicio, len(questoes)):
+                        _persist_question_flags(idx, None)
+                _set_feedback_text(status_text, f"IA: {len(questoes)}/{quantidade} questoes prontas, gerando o restante...", "info")
+                _rebuild_cards()
+                if page:
+                    page.update()
+        except Exception as ex:
+            log_exception(ex, "main._build_quiz_body.receber_lotes")
+        finally:
+            await lotes.aclose()
+        if not _ativo():
+            return
+        while len(questoes) < quantidade:
+            questoes.append(dict(random.choice(DEFAULT_QUIZ_QUESTIONS)))
+        _set_feedback_text(status_text, f"IA: {len(questoes)} questoes geradas.", "success")
+        _rebuild_cards()
+        if page:
+            page.update()
 
     def _on_gerar_clique(e):
         if not page:
@@ -4305,7 +4440,6 @@ def _build_flashcards_body(state, navigate, dark: bool):
     flashcards = []
     if isinstance(seed_cards, list) and seed_cards:
         try:
-            from core.services.flashcards_service import FlashcardsService
             flashcards = FlashcardsService.normalize_seed_cards(seed_cards)
         except Exception:
             flashcards = []
@@ -4664,13 +4798,22 @@ def _build_flashcards_body(state, navigate, dark: bool):
         profile = _generation_profile(user, "flashcards")
         service = _create_user_ai_service(user, force_economic=bool(profile.get("force_economic")))
         novos = []
+        gerados_ia = []
         try:
             if service and base_content:
                 try:
-                    novos = await asyncio.to_thread(service.generate_flashcards, base_content, prefetch_qtd)
+                    aceitar = await asyncio.to_thread(_near_duplicate_filter, db, user, "flashcard")
+
+                    def _aceitar(card):
+                        gerados_ia.append(card)
+                        return aceitar is None or aceitar(card)
+
+                    # Mesmo caminho da geracao principal: repoe os recusados e ignora o cache.
+                    async for card in FlashcardsService.stream_new(service, base_content, prefetch_qtd, accept=_aceitar):
+                        novos.append(card)
                 except Exception as ex:
                     log_exception(ex, "main._build_flashcards_body.prefetch")
-            if not novos:
+            if not gerados_ia:
                 base_idx = len(flashcards)
                 novos = [
                     {
@@ -4756,11 +4899,25 @@ def _build_flashcards_body(state, navigate, dark: bool):
 
         if gen_profile.get("delay_s", 0) > 0:
             await asyncio.sleep(float(gen_profile["delay_s"]))
+        estado["geracao_token"] = int(estado.get("geracao_token") or 0) + 1
+        cards_restantes = None
         if service and base_content:
+            # Streaming: o estudo comeca com o primeiro card e o restante chega em segundo plano.
+            aceitar = await asyncio.to_thread(_near_duplicate_filter, db, user, "flashcard")
+            cards_stream = FlashcardsService.stream_new(service, base_content, quantidade, accept=aceitar)
             try:
-                gerados = await asyncio.to_thread(service.generate_flashcards, base_content, quantidade)
+                async for card in cards_stream:
+                    gerados.append(card)
+                    if len(gerados) < quantidade:
+                        cards_restantes = cards_stream
+                        break
             except Exception as ex:
                 log_exception(ex, "main._build_flashcards_body")
+            if cards_restantes is None:
+                await cards_stream.aclose()
+            else:
+                # Enquanto o streaming entrega cards, o modo continuo nao pede mais.
+                estado["cont_prefetching"] = True
         if not gerados:
             base = tema or "Conceito"
             gerados = [
@@ -4772,6 +4929,8 @@ def _build_flashcards_body(state, navigate, dark: bool):
                 _show_quota_dialog(page, navigate)
             else:
                 _set_feedback_text(status_text, "Flashcards offline prontos.", "info")
+        elif cards_restantes is not None:
+            _set_feedback_text(status_text, f"IA: {len(gerados)}/{quantidade} flashcards prontos, gerando o restante...", "info")
         else:
             _set_feedback_text(status_text, f"{len(gerados)} flashcards gerados com IA.", "success")
         gerados = _sanitize_payload_texts(list(gerados or []))
@@ -4790,6 +4949,33 @@ def _build_flashcards_body(state, navigate, dark: bool):
         carregando.visible = False
         gerar_button.disabled = False
         page.update()
+        if cards_restantes is not None:
+            page.run_task(_receber_flashcards_async, cards_restantes, int(estado["geracao_token"]))
+
+    async def _receber_flashcards_async(cards_stream, token: int):
+        """Anexa os cards que o streaming ainda entrega enquanto o usuario ja estuda."""
+        try:
+            async for card in cards_stream:
+                if estado.get("geracao_token") != token:
+                    break
+                novos = _sanitize_payload_texts([dict(card)])
+                flashcards.extend(dict(c) for c in novos if isinstance(c, dict))
+                _render_flashcards()
+                if page:
+                    page.update()
+        except Exception as ex:
+            log_exception(ex, "main._build_flashcards_body.receber_cards")
+        finally:
+            await cards_stream.aclose()
+        if estado.get("geracao_token") != token:
+            return
+        estado["cont_prefetching"] = False
+        _set_feedback_text(status_text, f"{len(flashcards)} flashcards gerados com IA.", "success")
+        if not estado.get("modo_continuo"):
+            status_estudo.value = status_text.value
+        _maybe_prefetch_more()
+        if page:
+            page.update()
 
     def _on_gerar(e):
         if not page:
@@ -5350,6 +5536,18 @@ def _build_study_plan_body(state, navigate, dark: bool):
                 ),
             )
         )
+        try:
+            previsao = SpacedRepetitionService.from_db(db).forecast_review_load(user["id"], 90)
+            por_dia = [d["total"] for d in previsao["per_day"]]
+            itens_column.controls.append(
+                ft.Text(
+                    f"Revisoes previstas: 7 dias {sum(por_dia[:7])} | 30 dias {sum(por_dia[:30])} | 90 dias {sum(por_dia)}",
+                    size=12,
+                    color=_color("texto_sec", dark),
+                )
+            )
+        except Exception as ex:
+            log_exception(ex, "main._build_study_plan_body.previsao_revisoes")
         for item in itens:
             def _mk_toggle(iid):
                 def _on_change(e):
@@ -5424,6 +5622,11 @@ def _build_study_plan_body(state, navigate, dark: bool):
                     for i, d in enumerate(dias_semana[:limite_dias])
                 ]
             itens = _normalize_plan_items(itens, topicos, tempo_diario, limite_dias)
+            try:
+                previsao = SpacedRepetitionService.from_db(db).forecast_review_load(user["id"], limite_dias)
+                itens = StudyPlanService.balance_review_load(itens, previsao, tempo_diario)
+            except Exception as ex:
+                log_exception(ex, "main._build_study_plan_body.balancear_revisoes")
             db.salvar_plano_semanal(user["id"], objetivo, data_prova, tempo_diario, itens)
             if limite_dias < 7:
                 status_text.value = f"Plano ajustado ao prazo real: {limite_dias} dia(s) ate a prova."
@@ -5881,11 +6084,13 @@ def _build_ranking_body(state, navigate, dark: bool):
     ranking = db.obter_ranking()
     total_participantes = len(ranking)
     top_xp = int((ranking[0]["xp"] if ranking else 0) or 0)
-    meu_nome = str(user.get("nome", "") or "").strip().lower()
-    minha_posicao = next(
-        (idx for idx, r in enumerate(ranking, 1) if str(r.get("nome", "")).strip().lower() == meu_nome),
-        None,
-    )
+    meu_id = int(user.get("id") or 0)
+    minha_posicao = None
+    if meu_id:
+        try:
+            minha_posicao = (db.obter_posicao_ranking(meu_id) or {}).get("posicao")
+        except Exception as ex:
+            log_exception(ex, "main._build_ranking_body.posicao")
 
     resumo = ft.ResponsiveRow(
         controls=[
@@ -5951,7 +6156,7 @@ def _build_ranking_body(state, navigate, dark: bool):
     ranking_rows = []
     for idx, r in enumerate(ranking, 1):
         medalha_texto, medalha_cor = medalhas.get(idx, (str(idx), _color("texto_sec", dark)))
-        destaque_me = str(r.get("nome", "")).strip().lower() == meu_nome
+        destaque_me = bool(meu_id) and int(r.get("user_id") or 0) == meu_id
         ranking_rows.append(
             ft.Container(
                 padding=12,
@@ -6763,6 +6968,7 @@ def _build_settings_body(state, navigate, dark: bool):
             selected_model = model_dropdown_ref.get("control").value if model_dropdown_ref.get("control") else None
             model_value = selected_model if selected_model in modelos_validos else AI_PROVIDERS.get(provider_value, {}).get("default_model")
             api_value = (api_key_field.value or "").strip() or None
+            chave_anterior = (state["usuario"].get("api_key") or "").strip()
             db.atualizar_provider_ia(user_id, provider_value, model_value)
             db.atualizar_api_key(user_id, api_value)
             db.atualizar_economia_ia(user_id, bool(economia_mode_switch.value))
@@ -6772,6 +6978,11 @@ def _build_settings_body(state, navigate, dark: bool):
             state["usuario"]["api_key"] = api_value
             state["usuario"]["economia_mode"] = 1 if economia_mode_switch.value else 0
             state["usuario"]["telemetry_opt_in"] = 1 if telemetry_opt_in_switch.value else 0
+            # Clientes e estado de cota da chave antiga nao servem mais.
+            if chave_anterior:
+                invalidate_ai_providers(chave_anterior)
+            if api_value and api_value != chave_anterior:
+                invalidate_ai_providers(api_value)
 
             backend_ref = state.get("backend")
             backend_uid = _backend_user_id(state.get("usuario") or {})
@@ -7793,6 +8004,7 @@ def main(page: ft.Page):
                 ensure_runtime_dirs()
                 db = Database()
                 db.iniciar_banco()
+                db.writer.send(db.compactar_historico_xp, where="main.async_init.compactar_historico_xp")
                 state["db"] = db
                 log_event("db_ready", str(get_db_path()))
                 state["backend"] = BackendClient()
@@ -7977,6 +8189,8 @@ def main(page: ft.Page):
 
     def on_logout(_):
         state["usuario"] = None
+        if state.get("db") is not None:
+            state["db"].limpar_segredos_sessao()
         state["view_cache"].clear()
         state["route_history"] = []
         log_event("logout", "user logout")
@@ -8214,9 +8428,28 @@ def main(page: ft.Page):
         except Exception as ex:
             log_exception(ex, "main.on_resized")
 
+    def on_app_lifecycle(e):
+        # App indo para segundo plano: grava o que o diario de estudo acumulou.
+        if getattr(e, "state", None) not in {
+            ft.AppLifecycleState.HIDE,
+            ft.AppLifecycleState.INACTIVE,
+            ft.AppLifecycleState.PAUSE,
+            ft.AppLifecycleState.DETACH,
+        }:
+            return
+        db_ref = state.get("db")
+        if db_ref is None:
+            return
+        try:
+            # Aguarda o COMMIT (com limite): em segundo plano o SO pode encerrar o app.
+            db_ref.eventos.flush(timeout=2.0)
+        except Exception as ex:
+            log_exception(ex, "main.on_app_lifecycle")
+
     page.on_route_change = route_change
     page.on_view_pop = view_pop
     page.on_resized = on_resized
+    page.on_app_lifecycle_state_change = on_app_lifecycle
     page.update()
     # Splash e runtime em paralelo para reduzir percepcao de lentidao:
     # 1) mostra splash
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark da revisao espacada com logs sinteticos.
+
+Gera um log deterministico de revisoes (usuarios x itens, modelo de
+lembranca configuravel) e o reexecuta pelo codigo real dos repositorios
+contra um SQLite temporario. Reporta vazao, p95 por operacao, crescimento
+do banco e distribuicao do tamanho das filas.
+
+    python scripts/srs_benchmark.py --users 50 --items 500 --events 20000
+    python scripts/srs_benchmark.py --users 10000 --items 5000 --events 2000000 --out baseline.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.database_v2 import Database
+from core.repositories.flashcard_repository import FlashcardRepository
+from core.repositories.question_progress_repository import QuestionProgressRepository
+from core.services.daily_review_service import DailyReviewService
+from services.spaced_repetition import SpacedRepetitionService as LegacySM2Service
+
+# operacao -> peso padrao no log
+_MIX_PADRAO = {"flashcard": 0.5, "question": 0.4, "legacy_sm2": 0.1}
+_TEMAS = ("Matematica", "Portugues", "Historia", "Biologia", "Direito")
+
+Event = Tuple[str, int, int, bool]
+
+
+class RecallModel:
+    """
+    Probabilidade de lembrar: logistica de (habilidade do usuario - dificuldade
+    do item + ganho por repeticao). `base` fixa a taxa media na 1a tentativa.
+    """
+
+    def __init__(self, base: float = 0.7, repetition_gain: float = 0.35, spread: float = 1.0):
+        self.base = min(0.99, max(0.01, float(base)))
+        self.repetition_gain = float(repetition_gain)
+        self.spread = max(0.0, float(spread))
+        self._logit_base = math.log(self.base / (1 - self.base))
+
+    def probability(self, skill: float, difficulty: float, repetitions: int) -> float:
+        x = self._logit_base + self.spread * (skill - difficulty) + self.repetition_gain * repetitions
+        return 1.0 / (1.0 + math.exp(-x))
+
+
+def generate_workload(
+    users: int,
+    items: int,
+    events: int,
+    recall: Optional[RecallModel] = None,
+    mix: Optional[Dict[str, float]] = None,
+    seed: int = 42,
+) -> Iterator[Event]:
+    """
+    Log sintetico (operacao, usuario, item, lembrou). Deterministico por
+    `seed`; itens mais antigos de cada usuario sao revisados com mais
+    frequencia (distribuicao aproximadamente Zipf).
+    """
+    rng = random.Random(seed)
+    recall = recall or RecallModel()
+    mix = dict(mix or _MIX_PADRAO)
+    operacoes = list(mix)
+    pesos = [max(0.0, float(mix[o])) for o in operacoes]
+    skills = [rng.gauss(0, 1) for _ in range(users)]
+    repeticoes: Dict[Tuple[int, int], int] = {}
+    for _ in range(int(events)):
+        user = rng.randrange(users)
+        item = min(items - 1, int(rng.paretovariate(1.2)) - 1)
+        item = (item * 7919 + user) % items
+        rng_item = random.Random(seed * 1_000_003 + item)
+        reps = repeticoes.get((user, item), 0)
+        lembrou = rng.random() < recall.probability(skills[user], rng_item.gauss(0, 1), reps)
+        repeticoes[(user, item)] = reps + 1
+        yield rng.choices(operacoes, pesos)[0], user, item, lembrou
+
+
+def _card(user: int, item: int) -> Dict:
+    return {"frente": f"u{user} card {item}", "verso": f"resposta {item}", "tema": _TEMAS[item % len(_TEMAS)]}
+
+
+def _question(user: int, item: int) -> Dict:
+    return {
+        "enunciado": f"u{user} questao {item}?",
+        "alternativas": ["a", "b", "c", "d"],
+        "correta_index": item % 4,
+        "tema": _TEMAS[item % len(_TEMAS)],
+    }
+
+
+def _tamanho_banco(db: Database) -> int:
+    with db.conexao() as conn:
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    wal = db.db_path + "-wal"
+    return int(page_count * page_size) + (os.path.getsize(wal) if os.path.exists(wal) else 0)
+
+
+def _percentil(valores: List[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(math.ceil(p * len(ordenados))) - 1)]
+
+
+def _resumo(amostras: List[float]) -> Dict:
+    return {
+        "count": len(amostras),
+        "mean_ms": round(1000 * sum(amostras) / max(1, len(amostras)), 3),
+        "p50_ms": round(1000 * _percentil(amostras, 0.50), 3),
+        "p95_ms": round(1000 * _percentil(amostras, 0.95), 3),
+        "max_ms": round(1000 * max(amostras, default=0.0), 3),
+    }
+
+
+def _distribuicao_filas(db: Database, horizontes=(0, 1, 7)) -> Dict:
+    out = {}
+    with db.conexao() as conn:
+        for dias in horizontes:
+            limite = f"+{int(dias)} days"
+            rows = conn.execute(
+                """
+                SELECT u.id,
+                       (SELECT COUNT(*) FROM flashcards f
+                        WHERE f.user_id = u.id AND f.proxima_revisao <= DATETIME('now', ?1))
+                     + (SELECT COUNT(*) FROM questoes_usuario q
+                        WHERE q.user_id = u.id AND q.next_review_at <= DATETIME('now', ?1))
+                FROM usuarios u
+                """,
+                (limite,),
+            ).fetchall()
+            tamanhos = [float(r[1]) for r in rows]
+            out[f"due_in_{int(dias)}d"] = {
+                "users": len(tamanhos),
+                "p50": _percentil(tamanhos, 0.50),
+                "p95": _percentil(tamanhos, 0.95),
+                "max": max(tamanhos, default=0.0),
+            }
+    return out
+
+
+def run_benchmark(
+    users: int = 20,
+    items: int = 200,
+    events: int = 2000,
+    recall: Optional[RecallModel] = None,
+    mix: Optional[Dict[str, float]] = None,
+    read_every: int = 100,
+    seed: int = 42,
+    db_path: Optional[str] = None,
+) -> Dict:
+    """
+    Reexecuta o log pelos repositorios reais. A cada `read_every` eventos
+    mede tambem `list_due` e a montagem da fila diaria de um usuario.
+    """
+    tmp_dir = None
+    if db_path is None:
+        tmp_dir = tempfile.TemporaryDirectory(prefix="srs_bench_")
+        db_path = os.path.join(tmp_dir.name, "bench.db")
+    db = Database(db_path=db_path)
+    try:
+        db.iniciar_banco()
+        for u in range(int(users)):
+            # Conta criada sem hash real: o custo do PBKDF2 nao e o que se mede aqui.
+            db._inserir_conta(f"bench {u}", f"bench{u}@bench.local", "bench", "01/01/2000")
+        with db.conexao() as conn:
+            user_ids = [int(r[0]) for r in conn.execute("SELECT id FROM usuarios ORDER BY id").fetchall()]
+
+        flash_repo = FlashcardRepository(db)
+        question_repo = QuestionProgressRepository(db)
+        legacy = LegacySM2Service(db)
+        daily = DailyReviewService(flash_repo, question_repo)
+        latencias: Dict[str, List[float]] = {}
+
+        def _medir(nome: str, fn, *args) -> None:
+            inicio = time.perf_counter()
+            fn(*args)
+            latencias.setdefault(nome, []).append(time.perf_counter() - inicio)
+
+        tamanho_inicial = _tamanho_banco(db)
+        inicio_total = time.perf_counter()
+        n = 0
+        for n, (operacao, user, item, lembrou) in enumerate(
+            generate_workload(len(user_ids), int(items), int(events), recall, mix, seed), start=1
+        ):
+            uid = user_ids[user]
+            if operacao == "flashcard":
+                _medir(operacao, flash_repo.register_action, uid, _card(user, item), "lembrei" if lembrou else "rever")
+            elif operacao == "question":
+                _medir(operacao, question_repo.register_result, uid, _question(user, item), "correct" if lembrou else "wrong")
+            else:
+                _medir(operacao, legacy.registrar_resultado, uid, _question(user, item), lembrou)
+            if read_every and n % int(read_every) == 0:
+                _medir("list_due_flashcards", flash_repo.list_due, uid)
+                _medir("list_due_questions", question_repo.list_due, uid)
+                _medir("build_daily_queue", daily.build_daily_queue, uid, True)
+        db.writer.flush()
+        duracao = time.perf_counter() - inicio_total
+        tamanho_final = _tamanho_banco(db)
+
+        # Vazao sobre o tempo gasto dentro das operacoes (sem o custo do gerador).
+        escritas = [t for k, v in latencias.items() if k in _MIX_PADRAO for t in v]
+        medido = sum(sum(v) for v in latencias.values())
+        return {
+            "config": {
+                "users": int(users),
+                "items": int(items),
+                "events": n,
+                "read_every": int(read_every),
+                "seed": int(seed),
+            },
+            "throughput_ops_s": round(sum(len(v) for v in latencias.values()) / max(medido, 1e-9), 1),
+            "write_throughput_ops_s": round(len(escritas) / max(sum(escritas), 1e-9), 1),
+            "duration_s": round(duracao, 3),
+            "operations": {nome: _resumo(v) for nome, v in sorted(latencias.items())},
+            "db_size": {
+                "initial_bytes": tamanho_inicial,
+                "final_bytes": tamanho_final,
+                "bytes_per_event": round((tamanho_final - tamanho_inicial) / max(1, n), 1),
+            },
+            "queues": _distribuicao_filas(db),
+        }
+    finally:
+        db.fechar()
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+
+
+def _parse_mix(texto: str) -> Dict[str, float]:
+    mix = {}
+    for parte in str(texto or "").split(","):
+        if "=" in parte:
+            nome, peso = parte.split("=", 1)
+            if nome.strip() not in _MIX_PADRAO:
+                raise argparse.ArgumentTypeError(f"Operacao desconhecida: {nome.strip()}")
+            mix[nome.strip()] = float(peso)
+    return mix or dict(_MIX_PADRAO)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark da revisao espacada com logs sinteticos")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--items", type=int, default=200, help="itens por usuario")
+    parser.add_argument("--events", type=int, default=2000, help="revisoes no log")
+    parser.add_argument("--recall-base", type=float, default=0.7, help="taxa media de lembranca na 1a tentativa")
+    parser.add_argument("--recall-gain", type=float, default=0.35, help="ganho (logit) por repeticao")
+    parser.add_argument("--recall-spread", type=float, default=1.0, help="peso de habilidade/dificuldade")
+    parser.add_argument("--mix", type=_parse_mix, default=dict(_MIX_PADRAO), help="ex.: flashcard=0.5,question=0.5")
+    parser.add_argument("--read-every", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", default=None, help="caminho do SQLite (padrao: temporario)")
+    parser.add_argument("--out", default=None, help="grava o relatorio JSON neste arquivo")
+    args = parser.parse_args(argv)
+
+    relatorio = run_benchmark(
+        users=args.users,
+        items=args.items,
+        events=args.events,
+        recall=RecallModel(args.recall_base, args.recall_gain, args.recall_spread),
+        mix=args.mix,
+        read_every=args.read_every,
+        seed=args.seed,
+        db_path=args.db,
+    )
+    texto = json.dumps(relatorio, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(texto)
+    print(texto)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -13,15 +13,14 @@ Estrutura SM-2:
 """
 
 import datetime
-import json
 import hashlib
-from typing import Optional, List, Dict
+from typing import List, Dict
 
+from core.blob_codec import decode_blob
+from core.srs_engine import SM2Strategy
 
-# Intervalos base em dias por nível
-_INTERVALOS_BASE = {0: 1, 1: 1, 2: 6}
-_EFICIENCIA_INICIAL = 2.5
-_EFICIENCIA_MIN = 1.3
+
+_SM2 = SM2Strategy()
 
 
 def _qhash(questao: dict) -> str:
@@ -30,20 +29,6 @@ def _qhash(questao: dict) -> str:
     return hashlib.md5(chave.encode("utf-8")).hexdigest()
 
 
-def _prox_revisao(nivel: int, dias_atual: Optional[int] = None, ef: float = _EFICIENCIA_INICIAL) -> datetime.datetime:
-    """Calcula a data/hora da próxima revisão."""
-    if nivel <= 0:
-        intervalo = 1
-    elif nivel == 1:
-        intervalo = 1
-    elif nivel == 2:
-        intervalo = 6
-    else:
-        base = dias_atual or 6
-        intervalo = max(1, round(base * max(ef, _EFICIENCIA_MIN)))
-    return datetime.datetime.now() + datetime.timedelta(days=intervalo)
-
-
 class SpacedRepetitionService:
     """
     Serviço que encapsula operações de revisão espaçada.
@@ -70,10 +55,10 @@ class SpacedRepetitionService:
         Se a questão não existir em `questoes_usuario`, ela é criada.
         """
         qh = _qhash(questao)
-        conn = self.db.conectar()
-        try:
-            conn.row_factory = __import__("sqlite3").Row
+        agora = datetime.datetime.utcnow()
+        with self.db.conexao() as conn:
             cur = conn.cursor()
+            cur.row_factory = __import__("sqlite3").Row
 
             # Garantir que a questão existe
             cur.execute(
@@ -83,52 +68,36 @@ class SpacedRepetitionService:
             row = cur.fetchone()
 
             if row is None:
-                # Inserir nova entrada
-                dados = json.dumps(questao, ensure_ascii=False)
+                # Inserir nova entrada. O md5 do enunciado segue como chave do
+                # progresso legado; o conteudo usa o sha256 de `questions`.
+                question_id = self.db._salvar_conteudo_questao(cur, questao, tema=tema)
                 cur.execute(
                     """
                     INSERT INTO questoes_usuario
-                    (user_id, qhash, dados_json, tema, dificuldade,
+                    (user_id, qhash, question_id, dados_json, tema, dificuldade,
                      tentativas, acertos, erros, revisao_nivel, proxima_revisao, ultima_pratica)
-                    VALUES (?, ?, ?, ?, ?, 1, ?, ?, 0, ?, CURRENT_TIMESTAMP)
+                    VALUES (?, ?, ?, '', ?, ?, 1, ?, ?, 0, ?, CURRENT_TIMESTAMP)
                     """,
                     (
-                        user_id, qh, dados, tema, dificuldade,
+                        user_id, qh, question_id, tema, dificuldade,
                         1 if acertou else 0,
                         0 if acertou else 1,
-                        _prox_revisao(1 if acertou else 0).strftime("%Y-%m-%d %H:%M:%S"),
+                        _SM2.schedule_batch([{}], [acertou], agora)[0]["due"],
                     ),
                 )
             else:
-                nivel_atual = int(row["revisao_nivel"] or 0)
-                tentativas  = int(row["tentativas"] or 0) + 1
-                acertos_row = int(row["acertos"] or 0) + (1 if acertou else 0)
-                erros_row   = int(row["erros"] or 0) + (0 if acertou else 1)
-
-                # Calcular novo nível
-                if acertou:
-                    novo_nivel = nivel_atual + 1
-                else:
-                    novo_nivel = max(0, nivel_atual - 1)
-
-                # Calcular eficiência (simplificado)
-                ef = round(
-                    (acertos_row / tentativas) * (_EFICIENCIA_INICIAL - _EFICIENCIA_MIN)
-                    + _EFICIENCIA_MIN,
-                    2,
-                )
-
-                # Dias do último intervalo (em dias, aproximado)
-                ultima = row["ultima_pratica"]
-                dias_decorridos = None
-                if ultima:
-                    try:
-                        dt_ult = datetime.datetime.strptime(str(ultima), "%Y-%m-%d %H:%M:%S")
-                        dias_decorridos = max(1, (datetime.datetime.now() - dt_ult).days)
-                    except Exception:
-                        dias_decorridos = None
-
-                prox = _prox_revisao(novo_nivel, dias_decorridos, ef)
+                erros_row = int(row["erros"] or 0) + (0 if acertou else 1)
+                # SM-2 do srs_engine (nivel, fator pela taxa de acerto, intervalo anterior)
+                estado = _SM2.schedule_batch(
+                    [{
+                        "level": int(row["revisao_nivel"] or 0),
+                        "attempts": int(row["tentativas"] or 0),
+                        "hits": int(row["acertos"] or 0),
+                        "last_review": row["ultima_pratica"],
+                    }],
+                    [acertou],
+                    agora,
+                )[0]
 
                 cur.execute(
                     """
@@ -139,33 +108,30 @@ class SpacedRepetitionService:
                     WHERE user_id=? AND qhash=?
                     """,
                     (
-                        tentativas, acertos_row, erros_row, novo_nivel,
-                        prox.strftime("%Y-%m-%d %H:%M:%S"),
+                        estado["attempts"], estado["hits"], erros_row, estado["level"],
+                        estado["due"],
                         1 if not acertou else row["marcado_erro"],
                         user_id, qh,
                     ),
                 )
 
-            conn.commit()
-        finally:
-            conn.close()
-
     # ──────────────────────────────────────────────────────────────
     # Consultas
     # ──────────────────────────────────────────────────────────────
 
     def questoes_para_revisao_hoje(self, user_id: int, limite: int = 30) -> List[Dict]:
         """Retorna questões cujo proxima_revisao <= agora."""
-        conn = self.db.conectar()
-        try:
-            conn.row_factory = __import__("sqlite3").Row
+        with self.db.conexao() as conn:
             cur = conn.cursor()
+            cur.row_factory = __import__("sqlite3").Row
             cur.execute(
                 """
-                SELECT dados_json, tema, dificuldade, revisao_nivel, acertos, erros
-                FROM questoes_usuario
+                SELECT COALESCE(qc.dados_json, qu.dados_json) AS dados_json,
+                       qu.tema, qu.dificuldade, qu.revisao_nivel, qu.acertos, qu.erros
+                FROM questoes_usuario qu
+                LEFT JOIN questions qc ON qc.id = qu.question_id
                 WHERE user_id=? AND proxima_revisao IS NOT NULL
-                  AND DATETIME(proxima_revisao) <= DATETIME('now')
+                  AND proxima_revisao <= DATETIME('now')
                 ORDER BY proxima_revisao ASC
                 LIMIT ?
                 """,
@@ -175,7 +141,7 @@ class SpacedRepetitionService:
             resultado = []
             for r in rows:
                 try:
-                    q = json.loads(r["dados_json"])
+                    q = decode_blob(r["dados_json"])
                     q["_srs"] = {
                         "tema": r["tema"],
                         "nivel": r["revisao_nivel"],
@@ -186,20 +152,19 @@ class SpacedRepetitionService:
                 except Exception:
                     pass
             return resultado
-        finally:
-            conn.close()
 
     def questoes_por_tema(self, user_id: int, tema: str, limite: int = 20) -> List[Dict]:
         """Retorna questões de um tema específico para revisão."""
-        conn = self.db.conectar()
-        try:
-            conn.row_factory = __import__("sqlite3").Row
+        with self.db.conexao() as conn:
             cur = conn.cursor()
+            cur.row_factory = __import__("sqlite3").Row
             cur.execute(
                 """
-                SELECT dados_json, tema, revisao_nivel, acertos, erros
-                FROM questoes_usuario
-                WHERE user_id=? AND tema=?
+                SELECT COALESCE(qc.dados_json, qu.dados_json) AS dados_json,
+                       qu.tema, qu.revisao_nivel, qu.acertos, qu.erros
+                FROM questoes_usuario qu
+                LEFT JOIN questions qc ON qc.id = qu.question_id
+                WHERE user_id=? AND qu.tema=?
                 ORDER BY proxima_revisao ASC NULLS FIRST
                 LIMIT ?
                 """,
@@ -209,43 +174,37 @@ class SpacedRepetitionService:
             resultado = []
             for r in rows:
                 try:
-                    q = json.loads(r["dados_json"])
+                    q = decode_blob(r["dados_json"])
                     q["_srs"] = {"tema": r["tema"], "nivel": r["revisao_nivel"]}
                     resultado.append(q)
                 except Exception:
                     pass
             return resultado
-        finally:
-            conn.close()
 
     def total_pendentes_hoje(self, user_id: int) -> int:
         """Número de questões com revisão pendente para hoje."""
-        conn = self.db.conectar()
-        try:
+        with self.db.conexao() as conn:
             cur = conn.cursor()
             cur.execute(
                 """
                 SELECT COUNT(*) FROM questoes_usuario
                 WHERE user_id=? AND proxima_revisao IS NOT NULL
-                  AND DATETIME(proxima_revisao) <= DATETIME('now')
+                  AND proxima_revisao <= DATETIME('now')
                 """,
                 (user_id,),
             )
             return int((cur.fetchone() or [0])[0])
-        finally:
-            conn.close()
 
     def temas_com_pendencias(self, user_id: int) -> List[Dict]:
         """Retorna lista de temas com quantidade de pendências."""
-        conn = self.db.conectar()
-        try:
+        with self.db.conexao() as conn:
             cur = conn.cursor()
             cur.execute(
                 """
                 SELECT tema, COUNT(*) as total
                 FROM questoes_usuario
                 WHERE user_id=? AND proxima_revisao IS NOT NULL
-                  AND DATETIME(proxima_revisao) <= DATETIME('now')
+                  AND proxima_revisao <= DATETIME('now')
                 GROUP BY tema
                 ORDER BY total DESC
                 """,
@@ -253,19 +212,13 @@ class SpacedRepetitionService:
             )
             rows = cur.fetchall()
             return [{"tema": r[0], "total": r[1]} for r in rows]
-        finally:
-            conn.close()
 
     def registrar_favorita(self, user_id: int, questao: dict, favorita: bool) -> None:
         """Marca/desmarca questão como favorita."""
         qh = _qhash(questao)
-        conn = self.db.conectar()
-        try:
+        with self.db.conexao() as conn:
             cur = conn.cursor()
             cur.execute(
                 "UPDATE questoes_usuario SET favorita=? WHERE user_id=? AND qhash=?",
                 (1 if favorita else 0, user_id, qh),
             )
-            conn.commit()
-        finally:
-            conn.close()
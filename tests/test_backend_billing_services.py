@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 """Testes unitarios do fluxo de billing backend."""
 
+import asyncio
 import unittest
 from datetime import datetime, timedelta
 import os
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
 os.environ.setdefault("DATABASE_URL", "sqlite+pysqlite:///:memory:")
 
@@ -28,7 +30,13 @@ except Exception:
 
 class BackendBillingServicesTest(unittest.TestCase):
     def setUp(self):
-        self.engine = create_engine("sqlite+pysqlite:///:memory:")
+        # Endpoints async levam o acesso ao banco para o threadpool: a conexao
+        # em memoria precisa ser compartilhada entre threads.
+        self.engine = create_engine(
+            "sqlite+pysqlite:///:memory:",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
         self.Session = sessionmaker(bind=self.engine, autocommit=False, autoflush=False)
         Base.metadata.create_all(bind=self.engine)
         self.db = self.Session()
@@ -197,13 +205,29 @@ class BackendBillingServicesTest(unittest.TestCase):
         _realign_users_id_sequence(self.db)
         self.assertTrue(True)
 
+    def test_password_hash_executor_and_lazy_rehash(self):
+        user = self._create_user(email="legacy@test.local")
+        self.assertTrue(asyncio.run(services.verify_password_async("123456", user.password_hash)))
+        self.assertFalse(services.password_needs_rehash(user.password_hash))
+
+        user.password_hash = "123456"  # texto puro legado
+        self.db.commit()
+        self.assertTrue(asyncio.run(services.verify_password_async("123456", user.password_hash)))
+        self.assertTrue(services.password_needs_rehash(user.password_hash))
+        new_hash = asyncio.run(services.hash_password_async("123456"))
+        self.assertFalse(services.replace_password_hash(self.db, user.id, "outro", new_hash))
+        self.assertTrue(services.replace_password_hash(self.db, user.id, "123456", new_hash))
+        self.db.refresh(user)
+        self.assertTrue(services.verify_password("123456", user.password_hash))
+        self.assertFalse(services.password_needs_rehash(user.password_hash))
+
     def test_register_returns_409_for_duplicate_email(self):
         if HTTPException is None or register is None or schemas is None:
             self.skipTest("backend.app.main indisponivel no ambiente atual")
         self._create_user(email="dup@test.local")
         payload = schemas.RegisterIn(name="Dup", email_id="dup@test.local", password="123456")
         with self.assertRaises(HTTPException) as ctx:
-            register(payload, self.db)
+            asyncio.run(register(payload, self.db))
         self.assertEqual(int(ctx.exception.status_code), 409)
 
 
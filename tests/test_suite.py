@@ -114,6 +114,486 @@ class TestAIService(unittest.TestCase):
         self.assertEqual(len(result3["opcoes"]), 4)
         print("âœ… NormalizaÃ§Ã£o opÃ§Ãµes como objetos funcionou")
 
+    def test_quiz_generation_concurrent_batches(self):
+        """Quiz em lotes concorrentes: limite por provedor, sem duplicatas e entrega incremental."""
+        import asyncio
+        import threading
+        import time
+        from core.services.quiz_generation_service import QuizGenerationService
+
+        class FakeProvider:
+            pass
+
+        class FakeAI:
+            def __init__(self):
+                self.provider = FakeProvider()
+                self.lock = threading.Lock()
+                self.ativos = 0
+                self.pico = 0
+                self.pedidos = []
+
+            def generate_quiz_batch(self, content, topic, difficulty, quantity, retries):
+                with self.lock:
+                    self.ativos += 1
+                    self.pico = max(self.pico, self.ativos)
+                    n = len(self.pedidos)
+                    self.pedidos.append(quantity)
+                time.sleep(0.05)
+                with self.lock:
+                    self.ativos -= 1
+                # O primeiro lote repete uma questao: a rodada extra completa o total.
+                base = n * 100
+                itens = [{"pergunta": f"Q{base + i}", "opcoes": ["a", "b"], "correta_index": 0} for i in range(quantity)]
+                if n == 0:
+                    itens[-1] = dict(itens[0], pergunta="  q0 ")
+                return itens
+
+        fake = FakeAI()
+        service = QuizGenerationService(fake, batch_size=5)
+        self.assertEqual(service.plan_batches(12), [5, 5, 2])
+
+        async def _consumir():
+            recebidos = []
+            async for lote in service.stream(12, None, "Tema"):
+                recebidos.append(len(lote))
+            return recebidos
+
+        inicio = time.perf_counter()
+        lotes = asyncio.run(_consumir())
+        self.assertEqual(sum(lotes), 12)
+        self.assertGreater(len(lotes), 1)
+        self.assertEqual(fake.pico, 2)
+        self.assertEqual(sorted(fake.pedidos), [1, 2, 5, 5])
+        self.assertLess(time.perf_counter() - inicio, 0.05 * 4)
+        print("✅ Geracao de quiz em lotes concorrentes e incremental")
+
+    def test_ai_response_cache(self):
+        """Cache de respostas: hit sem chamar o provedor, TTL, opt-out criativo e LRU."""
+        import os
+        import tempfile
+        import time
+        from core.ai_response_cache import AIResponseCache
+        from core.ai_service_v2 import AIProvider, AIService
+
+        class FakeProvider(AIProvider):
+            def __init__(self):
+                super().__init__("k", "fake-1")
+                self.chamadas = 0
+
+            def generate_text(self, prompt):
+                self.chamadas += 1
+                if "Crie" in prompt:
+                    return '[{"pergunta": "P %d?", "opcoes": ["a", "b", "c", "d"], "correta_index": 0}]' % self.chamadas
+                return f"explicacao {self.chamadas}"
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = AIResponseCache(os.path.join(tmp, "ai.db"), max_bytes=4096)
+            provider = FakeProvider()
+            service = AIService(provider, response_cache=cache)
+
+            primeira = service.explain_simple("Q?", "R")
+            self.assertEqual(service.explain_simple("Q?", "R"), primeira)
+            self.assertEqual(provider.chamadas, 1)
+            # Outro modelo e outra chave.
+            provider.model = "fake-2"
+            self.assertNotEqual(service.explain_simple("Q?", "R"), primeira)
+            self.assertEqual(provider.chamadas, 2)
+
+            # Quiz e criativo: sempre chama o provedor.
+            service.generate_quiz_batch(topic="Tema", quantity=1, retries=1)
+            service.generate_quiz_batch(topic="Tema", quantity=1, retries=1)
+            self.assertEqual(provider.chamadas, 4)
+
+            stats = cache.stats()
+            self.assertEqual(stats["hits"], 1)
+            self.assertEqual(stats["per_task"]["explain_simple"], {"hits": 1, "misses": 2})
+
+            # TTL vencido vira miss.
+            cache.ttls["explain_simple"] = 1
+            cache.put("explain_simple", "x", "m", "velho", "resposta")
+            time.sleep(1.05)
+            self.assertIsNone(cache.get("explain_simple", "x", "m", "velho"))
+
+            # LRU: a entrada mais acessada sobrevive ao orcamento de bytes.
+            cache.ttls["explain_simple"] = 3600
+            cache.put("explain_simple", "x", "m", "quente", "q" * 500)
+            for i in range(12):
+                cache.put("explain_simple", "x", "m", f"frio {i}", "f" * 500)
+                self.assertEqual(cache.get("explain_simple", "x", "m", "quente"), "q" * 500)
+            self.assertLessEqual(cache.stats()["bytes"], 4096)
+            self.assertIsNone(cache.get("explain_simple", "x", "m", "frio 0"))
+            cache.close()
+        print("✅ Cache persistente de respostas da IA")
+
+    def test_provider_registry_and_shared_quota(self):
+        """Registro reaproveita clientes e a cota esgotada vale para todas as instancias da chave."""
+        from core.ai_service_v2 import get_ai_provider, invalidate_ai_providers
+
+        class FakeModels:
+            def __init__(self):
+                self.chamados = []
+
+            def generate_content(self, model, contents):
+                self.chamados.append(model)
+                if model == "gemini-2.5-flash":
+                    raise RuntimeError("429 quota exceeded, rate limit")
+                return type("Resp", (), {"text": f"ok {model}"})()
+
+        try:
+            invalidate_ai_providers()
+            a = get_ai_provider("gemini", "chave-registro", "gemini-2.5-flash")
+        except ImportError:
+            print("⚠️  google-genai nao instalado, pulando teste")
+            return
+        self.assertIs(get_ai_provider("gemini", "chave-registro", "gemini-2.5-flash"), a)
+        self.assertIsNot(get_ai_provider("gemini", "outra-chave", "gemini-2.5-flash"), a)
+
+        fake = FakeModels()
+        a.client = type("Client", (), {"models": fake})()
+        self.assertEqual(a.generate_text("p"), "ok gemini-2.5-flash-lite")
+        self.assertEqual(a.generate_text("p"), "ok gemini-2.5-flash-lite")
+        self.assertEqual(fake.chamados, ["gemini-2.5-flash", "gemini-2.5-flash-lite", "gemini-2.5-flash-lite"])
+
+        # Outra instancia com a mesma chave ja sabe que o modelo esta sem cota.
+        b = get_ai_provider("gemini", "chave-registro", "gemini-2.5-pro")
+        self.assertIsNot(b, a)
+        self.assertNotIn("gemini-2.5-flash", b._candidate_models())
+
+        invalidate_ai_providers("chave-registro")
+        c = get_ai_provider("gemini", "chave-registro", "gemini-2.5-flash")
+        self.assertIsNot(c, a)
+        self.assertEqual(c._candidate_models()[0], "gemini-2.5-flash")
+        invalidate_ai_providers()
+        print("✅ Registro de providers com cota compartilhada")
+
+    def test_shared_provider_error_state_per_thread(self):
+        """Provider compartilhado: erro e modelo da chamada ficam na thread; o servico guarda o seu."""
+        import threading
+        from core.ai_service_v2 import AIProvider, AIService
+
+        dentro = threading.Barrier(2, timeout=2)
+
+        class CotaProvider(AIProvider):
+            def generate_text(self, prompt):
+                self._iniciar_chamada()
+                if prompt == "falha":
+                    self.last_error_kind = "quota_soft"
+                    self.last_error_message = "429 rate limit"
+                else:
+                    self.last_model = "modelo-b"
+                # As duas chamadas ficam abertas ao mesmo tempo.
+                dentro.wait()
+                return None if prompt == "falha" else "ok"
+
+        provider = CotaProvider("k", "modelo-a")
+        vistos = {}
+
+        def _chamar(prompt):
+            service = AIService(provider)
+            texto = service._call_provider_text(prompt, "teste", use_cache=False)
+            vistos[prompt] = (texto, provider.last_error_kind, provider.last_model, service)
+
+        threads = [threading.Thread(target=_chamar, args=(p,)) for p in ("falha", "certo")]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(3)
+        self.assertEqual(vistos["falha"][:3], (None, "quota_soft", "modelo-a"))
+        self.assertEqual(vistos["certo"][:3], ("ok", "", "modelo-b"))
+        # Lido de outra thread (a da UI): o provider nao tem erro aqui, o servico sim.
+        self.assertEqual(provider.last_error_kind, "")
+        self.assertEqual(vistos["falha"][3].last_error_kind, "quota_soft")
+        self.assertEqual(vistos["certo"][3].last_error_kind, "")
+        print("✅ Estado de erro do provider por thread")
+
+    def test_json_stream_parser_and_item_streaming(self):
+        """Parser incremental entrega cada objeto ao fechar; flashcards/quiz saem item a item."""
+        import asyncio
+        import threading
+        from core.ai_service_v2 import AIProvider, AIService
+        from core.json_stream import JsonArrayStreamParser
+
+        texto = (
+            'Claro! ```json\n{"flashcards": [{"frente": "A {x}", "verso": "aspas \\" e ]"},'
+            ' {"frente": quebrado}, {"frente": "B", "verso": "tem [lista]", "tags": [{"t": 1}]}]}\n```'
+        )
+        parser = JsonArrayStreamParser()
+        itens = []
+        por_pedaco = []
+        for i in range(0, len(texto), 7):
+            novos = parser.feed(texto[i:i + 7])
+            itens.extend(novos)
+            por_pedaco.append(len(novos))
+        self.assertEqual([x["frente"] for x in itens], ["A {x}", "B"])
+        self.assertEqual(itens[0]["verso"], 'aspas " e ]')
+        self.assertEqual(itens[1]["tags"], [{"t": 1}])
+        # O primeiro item sai antes do fim do texto.
+        self.assertLess(por_pedaco.index(1), len(por_pedaco) - 3)
+        self.assertTrue(parser.closed)
+        cortado = JsonArrayStreamParser()
+        cortado.feed(texto[:60])
+        self.assertFalse(cortado.closed)
+
+        liberar = threading.Event()
+
+        class StreamProvider(AIProvider):
+            def __init__(self):
+                super().__init__("k", "stream-1")
+
+            def generate_text(self, prompt):
+                return None
+
+            def generate_text_stream(self, prompt):
+                yield '[{"frente": "F1", "verso": "V1"},'
+                # So continua depois que o consumidor recebeu o primeiro card.
+                liberar.wait(2)
+                yield ' {"frente": "F1", "verso": "dup"}, {"frente": "F2", "verso": "V2"}]'
+
+        service = AIService(StreamProvider())
+
+        async def _consumir():
+            recebidos = []
+            async for card in service.generate_flashcards_stream(["texto"], 5, 1):
+                recebidos.append(card["frente"])
+                liberar.set()
+            return recebidos
+
+        self.assertEqual(asyncio.run(_consumir()), ["F1", "F2"])
+        liberar.set()
+
+        class QuizProvider(AIProvider):
+            def generate_text(self, prompt):
+                return (
+                    '[{"pergunta": "P1?", "opcoes": ["a", "b", "c", "d"], "correta_index": 1},'
+                    ' {"pergunta": "P2?", "opcoes": ["a", "b", "c", "d"], "correta_index": 0}]'
+                )
+
+        # Provedor sem streaming nativo cai no padrao (texto inteiro) e respeita a quantidade.
+        quiz = list(AIService(QuizProvider("k", "m")).iter_quiz_batch(topic="T", quantity=1, retries=1))
+        self.assertEqual([q["pergunta"] for q in quiz], ["P1?"])
+
+        # Stream cortado (lista sem fechar) entrega o que veio, mas nao vai para o cache.
+        import os
+        import tempfile
+        from core.ai_response_cache import AIResponseCache
+
+        class CortadoProvider(AIProvider):
+            def __init__(self):
+                super().__init__("k", "corte-1")
+                self.chamadas = 0
+
+            def generate_text(self, prompt):
+                return None
+
+            def generate_text_stream(self, prompt):
+                self.chamadas += 1
+                yield '[{"frente": "C1", "verso": "V1"}, {"frente": "C2", "ver'
+                if self.chamadas > 1:
+                    yield 'so": "V2"}]'
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = AIResponseCache(os.path.join(tmp, "ai.db"))
+            provider = CortadoProvider()
+            service = AIService(provider, response_cache=cache)
+            primeira = [c["frente"] for c in service.iter_flashcards(["texto"], 5, 1)]
+            self.assertEqual(primeira, ["C1"])
+            segunda = [c["frente"] for c in service.iter_flashcards(["texto"], 5, 1)]
+            self.assertEqual((segunda, provider.chamadas), (["C1", "C2"], 2))
+            # A resposta completa ficou no cache.
+            self.assertEqual([c["frente"] for c in service.iter_flashcards(["texto"], 5, 1)], ["C1", "C2"])
+            self.assertEqual(provider.chamadas, 2)
+            cache.close()
+        print("✅ Streaming com parser JSON incremental")
+
+    def test_provider_health_breaker_and_bucket(self):
+        """Disjuntor com sonda em meio-aberto, taxa aprendida com 429 e falha instantanea sem cota."""
+        from core import ai_health
+        from core.ai_service_v2 import AIService, get_ai_provider, invalidate_ai_providers
+
+        saude = ai_health.ModelHealth()
+        # Falhas transitorias so abrem na terceira.
+        saude.record_failure("transient")
+        saude.record_failure("transient")
+        self.assertTrue(saude.available())
+        saude.record_failure("transient")
+        self.assertEqual(saude.snapshot()["state"], ai_health.OPEN)
+        self.assertFalse(saude.acquire())
+        # Vencido o tempo, meio-aberto: uma sonda por vez.
+        saude.retry_at = 0.0
+        self.assertEqual(saude.snapshot()["state"], ai_health.HALF_OPEN)
+        self.assertTrue(saude.acquire())
+        self.assertFalse(saude.available())
+        self.assertFalse(saude.acquire())
+        # Sonda falhou: reabre com o dobro do tempo.
+        saude.record_failure("transient")
+        self.assertEqual(saude.snapshot()["state"], ai_health.OPEN)
+        self.assertGreater(saude.snapshot()["retry_in_s"], 20)
+        saude.retry_at = 0.0
+        self.assertTrue(saude.acquire())
+        saude.record_success()
+        self.assertEqual(saude.snapshot()["state"], ai_health.CLOSED)
+
+        # 429 corta a taxa pela metade e esvazia o balde.
+        taxa = saude.bucket.rate
+        saude.record_failure("quota_soft")
+        self.assertAlmostEqual(saude.bucket.rate, taxa / 2)
+        self.assertGreater(saude.bucket.wait_time(), 0.0)
+        for tentativa in range(10):
+            self.assertLessEqual(ai_health.backoff_delay(tentativa), 8.0)
+
+        class FakeModels:
+            def __init__(self):
+                self.chamados = []
+
+            def generate_content(self, model, contents):
+                self.chamados.append(model)
+                raise RuntimeError("429 Quota exceeded: limit: 0 per day")
+
+        try:
+            invalidate_ai_providers()
+            provider = get_ai_provider("gemini", "chave-saude", "gemini-2.5-flash")
+        except ImportError:
+            print("⚠️  google-genai nao instalado, pulando teste")
+            return
+        fake = FakeModels()
+        provider.client = type("Client", (), {"models": fake})()
+        service = AIService(provider)
+        self.assertFalse(service.quota_exhausted())
+        self.assertIsNone(provider.generate_text("p"))
+        self.assertEqual(len(fake.chamados), len(provider._fallback_models))
+        self.assertTrue(service.quota_exhausted())
+        # Segunda tentativa: nenhuma chamada de rede, erro de cota na hora.
+        self.assertIsNone(provider.generate_text("p"))
+        self.assertEqual(len(fake.chamados), len(provider._fallback_models))
+        self.assertEqual(provider.last_error_kind, "quota_hard")
+        invalidate_ai_providers("chave-saude")
+        self.assertFalse(service.quota_exhausted())
+        print("✅ Saude do provider: disjuntor, balde e backoff")
+
+    def test_chunk_retrieval_context(self):
+        """Contexto por BM25: trechos relevantes dentro do orcamento e fatiamento gravado uma vez."""
+        import os
+        import random
+        import sqlite3
+        import tempfile
+        from core import chunk_index as ci
+        from core.ai_service_v2 import AIProvider, AIService
+
+        temas = ["fotossintese clorofila luz glicose", "revolucao francesa bastilha monarquia",
+                 "derivadas limites calculo funcoes", "contrato civil obrigacoes partes"]
+        paragrafos = []
+        for i in range(60):
+            base = temas[i % len(temas)]
+            paragrafos.append(f"Paragrafo {i}: " + " ".join([base] * 25) + f" detalhe numero {i}.")
+        documento = "\n".join(paragrafos)
+
+        trechos = ci.chunk_text(documento)
+        self.assertGreater(len(trechos), 5)
+        self.assertTrue(all(len(t) <= ci.CHUNK_CHARS for t in trechos))
+        self.assertIn("Paragrafo 59", trechos[-1])
+        self.assertTrue(all(len(t) <= 50 for t in ci.chunk_text("x" * 30 + ". " + "y " * 60, 50)))
+
+        indice = ci.BM25Index(["gato preto no telhado", "cachorro no quintal", "gatos pretos e brancos"])
+        self.assertEqual(indice.rank("Gatos brancos"), [2, 0])
+        self.assertEqual(indice.rank("elefante"), [])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            caminho = os.path.join(tmp, "chunks.db")
+            indice_trechos = ci.ChunkIndex(caminho)
+            escolhidos = indice_trechos.select(["Nota do aluno", documento], "revolução francesa", 300)
+            self.assertEqual(escolhidos[0], "Nota do aluno")
+            self.assertTrue(all("bastilha" in t for t in escolhidos[1:]))
+            self.assertLessEqual(sum(ci.estimate_tokens(t) for t in escolhidos), 300)
+            sorteados = indice_trechos.select([documento], None, 300, random.Random(1))
+            self.assertTrue(sorteados and sum(ci.estimate_tokens(t) for t in sorteados) <= 300)
+            self.assertEqual(indice_trechos.select([documento], None, 300), indice_trechos.select([documento], None, 300))
+            indice_trechos.close()
+
+            # Outro processo reaproveita os trechos gravados sem fatiar de novo.
+            original = ci.chunk_text
+            ci.chunk_text = lambda *_a, **_k: self.fail("documento fatiado de novo")
+            try:
+                recarregado = ci.ChunkIndex(caminho)
+                self.assertEqual(recarregado.document_chunks(documento)[0], trechos)
+                recarregado.close()
+            finally:
+                ci.chunk_text = original
+            conn = sqlite3.connect(caminho)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM chunk_entries").fetchone()[0], len(trechos))
+            conn.close()
+
+        class FakeProvider(AIProvider):
+            def __init__(self):
+                super().__init__("k", "fake-1")
+                self.prompts = []
+
+            def generate_text(self, prompt):
+                self.prompts.append(prompt)
+                return '[{"pergunta": "P?", "opcoes": ["a", "b", "c", "d"], "correta_index": 0}]'
+
+        provider = FakeProvider()
+        service = AIService(provider)
+        self.assertTrue(service.generate_quiz_batch([documento], "derivadas", "Medio", 1, 1))
+        prompt = provider.prompts[-1]
+        self.assertIn("derivadas limites", prompt)
+        self.assertNotIn("bastilha", prompt)
+        self.assertLess(len(prompt), 6000)
+        print("✅ Recuperacao de trechos por BM25 para o contexto")
+
+    def test_flashcards_top_up_skips_response_cache(self):
+        """Reposicao de cards recusados vai ao provedor (sem cache) e cita os recusados."""
+        import asyncio
+        import json
+        import os
+        import tempfile
+        from core.ai_response_cache import AIResponseCache
+        from core.ai_service_v2 import AIProvider, AIService
+        from core.services.flashcards_service import FlashcardsService
+
+        class FakeProvider(AIProvider):
+            def __init__(self):
+                super().__init__("k", "fake-1")
+                self.prompts = []
+
+            def generate_text(self, prompt):
+                self.prompts.append(prompt)
+                n = len(self.prompts)
+                return json.dumps([{"frente": f"Conceito {n}.{i}?", "verso": f"Resposta {i}"} for i in range(3)])
+
+        vistos = set()
+
+        def aceitar(card):
+            if card["frente"] in vistos:
+                return False
+            vistos.add(card["frente"])
+            return True
+
+        async def _gerar(service, accept):
+            return [c async for c in FlashcardsService.stream_new(service, ["Material curto"], 3, accept=accept)]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = AIResponseCache(os.path.join(tmp, "ai.db"))
+            provider = FakeProvider()
+            service = AIService(provider, response_cache=cache)
+            self.assertEqual(len(asyncio.run(_gerar(service, aceitar))), 3)
+            self.assertEqual(len(provider.prompts), 1)
+            # Repetir o pedido traz cards novos em vez do que ficou no cache.
+            self.assertEqual(len(asyncio.run(_gerar(service, aceitar))), 3)
+            self.assertEqual(len(provider.prompts), 2)
+
+            # Recusados na primeira rodada sao repostos e citados no prompt.
+            recusar = {"Conceito 3.0?", "Conceito 3.1?"}
+            cards = asyncio.run(_gerar(service, lambda c: c["frente"] not in recusar))
+            self.assertEqual(len(cards), 3)
+            self.assertIn("Conceito 3.0?", provider.prompts[-1])
+            self.assertIn("Nao repita", provider.prompts[-1])
+            # Sem filtro, o cache continua valendo.
+            antes = len(provider.prompts)
+            self.assertEqual(len(asyncio.run(_gerar(service, None))), 3)
+            self.assertEqual(len(provider.prompts), antes)
+            cache.close()
+        print("✅ Reposicao de flashcards sem reaproveitar o cache")
+
 
 class TestConfig(unittest.TestCase):
     """Testes de configuraÃ§Ã£o"""
@@ -173,14 +653,18 @@ class TestDatabase(unittest.TestCase):
         import os
         # Criar banco de teste
         self.test_db = "test_simulador.db"
-        if os.path.exists(self.test_db):
-            os.remove(self.test_db)
+        for path in (self.test_db, f"{self.test_db}-wal", f"{self.test_db}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
     
     def tearDown(self):
         """Cleanup apÃ³s teste"""
         import os
-        if os.path.exists(self.test_db):
-            os.remove(self.test_db)
+        import gc
+        gc.collect()
+        for path in (self.test_db, f"{self.test_db}-wal", f"{self.test_db}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
     
     def test_database_creation(self):
         """Testa criaÃ§Ã£o e tabelas essenciais usando database_v2.py"""
@@ -204,6 +688,1163 @@ class TestDatabase(unittest.TestCase):
         conn.close()
         print("âœ… Banco criado com tabelas essenciais")
 
+    def test_connection_manager_reuses_thread_connection(self):
+        """Conexao persistente por thread, WAL ativo e transacao reentrante."""
+        from core.database_v2 import Database
+        import threading
+        db = Database(db_path=self.test_db)
+        db.iniciar_banco()
+
+        with db.conexao() as conn_a:
+            with db.conexao() as conn_b:
+                self.assertIs(conn_a, conn_b)
+            mode = conn_a.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(str(mode).lower(), "wal")
+
+        with self.assertRaises(RuntimeError):
+            with db.conexao() as conn:
+                conn.execute("UPDATE usuarios SET xp = 1")
+                conn.execute("INSERT INTO quiz_filtros_salvos (user_id, nome, filtro_json) VALUES (1, 'x', '{}')")
+                raise RuntimeError("falha")
+        self.assertEqual(db.listar_filtros_quiz(1), [])
+
+        # Escrita so em bloco aninhado: o rollback externo tambem a desfaz.
+        with self.assertRaises(RuntimeError):
+            with db.conexao():
+                db.salvar_filtro_quiz(1, "aninhado", {})
+                raise RuntimeError("falha")
+        self.assertEqual(db.listar_filtros_quiz(1), [])
+
+        other = {}
+
+        def _worker():
+            with db.conexao() as conn_thread:
+                other["conn"] = conn_thread
+
+        t = threading.Thread(target=_worker)
+        t.start()
+        t.join()
+        self.assertIsNot(other["conn"], conn_a)
+        db.fechar()
+        print("✅ Gerenciador de conexoes funcionando")
+
+    def test_db_writer_batches_and_isolates_failures(self):
+        """Writer unico aplica comandos em lote; falha de um nao desfaz os outros."""
+        from core.database_v2 import Database
+        import asyncio
+        db = Database(db_path=self.test_db)
+        db.iniciar_banco()
+
+        def _falha():
+            with db.conexao() as conn:
+                conn.execute("INSERT INTO quiz_filtros_salvos (user_id, nome, filtro_json) VALUES (1, 'ruim', '{}')")
+            raise ValueError("falha")
+
+        futuros = [db.writer.submit(db.salvar_filtro_quiz, 1, f"f{i}", {"i": i}) for i in range(20)]
+        ruim = db.writer.submit(_falha)
+        futuros.append(db.writer.submit(db.salvar_filtro_quiz, 1, "depois", {}))
+        for fut in futuros:
+            fut.result(timeout=5)
+        with self.assertRaises(ValueError):
+            ruim.result(timeout=5)
+        with db.conexao() as conn:
+            nomes = {row[0] for row in conn.execute("SELECT nome FROM quiz_filtros_salvos")}
+        self.assertIn("depois", nomes)
+        self.assertNotIn("ruim", nomes)
+        self.assertEqual(len(nomes), 21)
+
+        async def _async_write():
+            return await db.writer.run(db.salvar_filtro_quiz, 1, "async", {})
+
+        asyncio.run(_async_write())
+        db.writer.send(db.salvar_filtro_quiz, 1, "send", {})
+        db.writer.flush(timeout=5)
+        nomes = {f["nome"] for f in db.listar_filtros_quiz(1)}
+        self.assertTrue({"async", "send"} <= nomes)
+
+        # O lote e atomico: outra conexao so ve as escritas depois do COMMIT.
+        def _visivel_fora(nome):
+            conn = db.conectar()
+            try:
+                return conn.execute(
+                    "SELECT COUNT(*) FROM quiz_filtros_salvos WHERE nome = ?", (nome,)
+                ).fetchone()[0]
+            finally:
+                conn.close()
+
+        db.writer.janela_s = 0.5
+        gravou = db.writer.submit(db.salvar_filtro_quiz, 1, "lote", {})
+        durante = db.writer.submit(_visivel_fora, "lote")
+        gravou.result(timeout=5)
+        self.assertEqual(durante.result(timeout=5), 0)
+        self.assertEqual(_visivel_fora("lote"), 1)
+        db.fechar()
+        print("✅ Writer de banco em lote funcionando")
+
+    def test_study_event_journal_write_behind(self):
+        """Eventos de estudo acumulados, aplicados em lote e visiveis na leitura."""
+        from core.database_v2 import Database
+        from core.repositories.question_progress_repository import QuestionProgressRepository
+        db = Database(db_path=self.test_db)
+        db.iniciar_banco()
+        ok, _ = db.criar_conta("journal_user", "journal@test.local", "123456", "01/01/2000")
+        self.assertTrue(ok)
+        uid = int(db.fazer_login("journal@test.local", "123456")["id"])
+        sid = db.iniciar_review_session(uid, "daily", 3)
+
+        journal = db.eventos
+        journal.intervalo_s = 60.0
+        questao = {"enunciado": "Q1", "alternativas": ["a", "b"], "correta_index": 0, "tema": "T"}
+        journal.record(uid, "question", question=questao, action="wrong")
+        journal.record(uid, "progresso", questoes=1, acertos=0)
+        journal.record(uid, "flashcard", card={"frente": "F", "verso": "V", "tema": "T"}, action="lembrei")
+        journal.record(uid, "progresso", flashcards=1)
+        journal.record(
+            uid, "review_item", session_id=sid, item_type="question", item_ref="x",
+            resultado="wrong", is_correct=False, response_time_ms=0,
+        )
+        self.assertEqual(journal.pending(), 5)
+        with db.conexao() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM questoes_usuario").fetchone()[0], 0)
+
+        # Leitura aplica o que estava pendente (le as proprias escritas).
+        erros = QuestionProgressRepository(db).list_errors(uid)
+        self.assertEqual(journal.pending(), 0)
+        self.assertEqual(len(erros), 1)
+        progresso = db.obter_progresso_diario(uid)
+        self.assertEqual(progresso["questoes_respondidas"], 1)
+        self.assertEqual(progresso["flashcards_revisados"], 1)
+        with db.conexao() as conn:
+            eventos = conn.execute("SELECT kind, applied FROM study_events ORDER BY id").fetchall()
+            itens = conn.execute("SELECT COUNT(*) FROM review_session_items").fetchone()[0]
+            rev = conn.execute("SELECT total_revisoes FROM flashcards WHERE user_id = ?", (uid,)).fetchone()[0]
+        self.assertEqual([k for k, _ in eventos], ["question", "progresso", "flashcard", "progresso", "review_item"])
+        self.assertTrue(all(a == 1 for _, a in eventos))
+        self.assertEqual(itens, 1)
+        self.assertEqual(rev, 1)
+
+        # Lote ja entregue ao writer (fila vazia) ainda conta para a leitura.
+        import threading
+        trava = threading.Event()
+        db.writer.send(trava.wait, 5)
+        journal.max_eventos = 2
+        journal.record(uid, "progresso", questoes=1)
+        journal.record(uid, "progresso", questoes=1)
+        self.assertEqual(journal.pending(), 0)
+        self.assertTrue(journal.busy())
+        threading.Timer(0.1, trava.set).start()
+        self.assertEqual(db.obter_progresso_diario(uid)["questoes_respondidas"], 3)
+        self.assertFalse(journal.busy())
+
+        # Simulado, XP e revisoes pelos servicos tambem passam pelo diario.
+        from core.blob_codec import decode_blob
+        from core.services.mock_exam_service import MockExamService
+        from core.services.spaced_repetition_service import SpacedRepetitionService
+        journal.max_eventos = 25
+        mid = db.criar_mock_exam_session(uid, {}, 3, 600)
+        for idx in range(3):
+            MockExamService(db).save_progress(uid, mid, idx, {i: 0 for i in range(idx + 1)})
+        journal.record(uid, "quiz_result", acertos=2, total=3, xp=20)
+        SpacedRepetitionService.from_db(db).record_question_review(uid, questao, True)
+        self.assertEqual(journal.pending(), 6)
+        ranking = db.obter_ranking("Geral")
+        self.assertEqual(journal.pending(), 0)
+        self.assertEqual(ranking[0]["xp"], 20)
+        with db.conexao() as conn:
+            progresso_mock = decode_blob(
+                conn.execute("SELECT progress_json FROM mock_exam_sessions WHERE id = ?", (mid,)).fetchone()[0]
+            )
+        self.assertEqual(progresso_mock["current_idx"], 2)
+        self.assertEqual(db.obter_progresso_diario(uid)["questoes_respondidas"], 7)
+        db.fechar()
+        print("✅ Diario de eventos de estudo funcionando")
+
+    def test_study_event_journal_retries_failures(self):
+        """Evento que falha fica gravado por completo e e reaplicado depois."""
+        from core.database_v2 import Database
+        from core.repositories.question_progress_repository import QuestionProgressRepository
+        db = Database(db_path=self.test_db)
+        db.iniciar_banco()
+        ok, _ = db.criar_conta("retry_user", "retry@test.local", "123456", "01/01/2000")
+        self.assertTrue(ok)
+        uid = int(db.fazer_login("retry@test.local", "123456")["id"])
+        journal = db.eventos
+        journal.intervalo_s = 60.0
+        questao = {"enunciado": "Q retry", "alternativas": ["a", "b"], "correta_index": 0, "tema": "T"}
+
+        original_result = QuestionProgressRepository.register_result
+        original_progresso = db.registrar_progresso_diario
+
+        def _falha(*_args, **_kwargs):
+            raise RuntimeError("falha injetada")
+
+        QuestionProgressRepository.register_result = _falha
+        db.registrar_progresso_diario = _falha
+        try:
+            journal.record(uid, "question", question=questao, action="wrong")
+            journal.record(uid, "progresso", questoes=1)
+            journal.flush()
+        finally:
+            QuestionProgressRepository.register_result = original_result
+            del db.registrar_progresso_diario
+        with db.conexao() as conn:
+            linhas = conn.execute("SELECT kind, payload_json, applied, tentativas FROM study_events ORDER BY id").fetchall()
+        self.assertEqual([(k, a, t) for k, _p, a, t in linhas], [("question", 0, 1), ("progresso", 0, 1)])
+        self.assertEqual(json.loads(linhas[0][1])["question"]["enunciado"], "Q retry")
+
+        # Lote inteiro desfeito: os eventos voltam para a fila.
+        original_aplicar = journal._aplicar
+
+        def _aplicar_e_falhar(eventos):
+            original_aplicar(eventos)
+            raise RuntimeError("commit")
+
+        journal._aplicar = _aplicar_e_falhar
+        journal.record(uid, "quiz_result", acertos=1, total=1, xp=10)
+        with self.assertRaises(RuntimeError):
+            journal.flush()
+        del journal._aplicar
+        self.assertEqual(journal.pending(), 1)
+
+        # Proximo lote reaplica tudo o que ficou pendente.
+        self.assertEqual(len(QuestionProgressRepository(db).list_errors(uid)), 1)
+        # progresso (1) + quiz_result (1).
+        self.assertEqual(db.obter_progresso_diario(uid)["questoes_respondidas"], 2)
+        with db.conexao() as conn:
+            linhas = conn.execute("SELECT kind, payload_json, applied FROM study_events ORDER BY id").fetchall()
+        self.assertEqual([(k, a) for k, _p, a in linhas], [("question", 1), ("progresso", 1), ("quiz_result", 1)])
+        self.assertNotIn("question", json.loads(linhas[0][1]))
+        self.assertEqual(db.obter_ranking("Geral")[0]["xp"], 10)
+        db.fechar()
+        print("✅ Diario de eventos reaplica falhas")
+
+    def test_user_counters_follow_review_writes(self):
+        """user_counters mantido por triggers confere com contagem direta."""
+        from core.database_v2 import Database
+        from core.repositories.question_progress_repository import QuestionProgressRepository
+        db = Database(db_path=self.test_db)
+        db.iniciar_banco()
+        ok, _ = db.criar_conta("counter_user", "counter@test.local", "123456", "01/01/2000")
+        self.assertTrue(ok)
+        uid = int(db.fazer_login("counter@test.local", "123456")["id"])
+
+        def _contagem_direta():
+            with db.conexao() as conn:
+                def _n(sql):
+                    return int(conn.execute(sql, (uid,)).fetchone()[0] or 0)
+                return {
+                    "flashcards_pendentes": _n(
+                        "SELECT COUNT(*) FROM flashcards WHERE user_id = ? AND proxima_revisao <= DATETIME('now')"
+                    ),
+                    "questoes_pendentes": _n(
+                        "SELECT COUNT(*) FROM questoes_usuario WHERE user_id = ? AND proxima_revisao <= DATETIME('now')"
+                    ),
+                    "questoes_marcadas": _n(
+                        "SELECT COUNT(*) FROM questoes_usuario WHERE user_id = ? AND marcado_erro = 1"
+                    ),
+                    "total_respondidas": _n(
+                        "SELECT COALESCE(SUM(tentativas), 0) FROM questoes_usuario WHERE user_id = ?"
+                    ),
+                }
+
+        def _confere():
+            contadores = db.obter_contadores(uid)
+            for chave, valor in _contagem_direta().items():
+                self.assertEqual(contadores[chave], valor, chave)
+
+        cards = [{"frente": f"F{i}", "verso": "V"} for i in range(4)]
+        db.salvar_flashcards_gerados(uid, "Tema", cards)
+        _confere()
+        qrepo = QuestionProgressRepository(db)
+        for i in range(3):
+            qrepo.register_result(uid, {"enunciado": f"Q{i}", "alternativas": ["a"], "correta_index": 0}, "mark")
+        qrepo.register_result(uid, {"enunciado": "Q0", "alternativas": ["a"], "correta_index": 0}, "wrong")
+        _confere()
+        with db.conexao() as conn:
+            conn.execute(
+                "UPDATE flashcards SET proxima_revisao = DATETIME('now', '+3 days') WHERE user_id = ? AND frente = 'F0'",
+                (uid,),
+            )
+            conn.execute(
+                "UPDATE flashcards SET proxima_revisao = DATETIME('now', '-2 days') WHERE user_id = ? AND frente = 'F1'",
+                (uid,),
+            )
+            conn.execute("DELETE FROM flashcards WHERE user_id = ? AND frente = 'F2'", (uid,))
+        _confere()
+
+        # Virada de dia: itens agendados para "amanha" passam a contar como vencidos.
+        with db.conexao() as conn:
+            conn.execute(
+                "UPDATE user_counters SET rolled_day = DATE('now', '-5 days') WHERE user_id = ?", (uid,)
+            )
+            conn.execute(
+                "UPDATE flashcards SET proxima_revisao = DATETIME('now', '-1 days') WHERE user_id = ? AND frente = 'F0'",
+                (uid,),
+            )
+        _confere()
+        db.atualizar_meta_diaria(uid, 10)
+        db.registrar_progresso_diario(uid, questoes=1)
+        contadores = db.obter_contadores(uid)
+        progresso = db.obter_progresso_diario(uid)
+        self.assertEqual(contadores["streak"], progresso["streak_dias"])
+        self.assertEqual(
+            (contadores["meta_questoes"], contadores["questoes_hoje"], contadores["acertos_hoje"]),
+            (progresso["meta_questoes"], progresso["questoes_respondidas"], progresso["acertos"]),
+        )
+        self.assertEqual(db.revisoes_pendentes(uid), _contagem_direta()["questoes_pendentes"])
+        print("✅ Contadores por usuario consistentes")
+
+    def test_materialized_leaderboard(self):
+        """Ranking materializado por periodo e posicao com vizinhanca."""
+        from core.database_v2 import Database
+        db = Database(db_path=self.test_db)
+        db.iniciar_banco()
+        uids = []
+        for i in range(12):
+            ok, _ = db.criar_conta(f"rank{i}", f"rank{i}@test.local", "123456", "01/01/2000")
+            self.assertTrue(ok)
+            uid = int(db.fazer_login(f"rank{i}@test.local", "123456")["id"])
+            uids.append(uid)
+            db.registrar_ganho_xp(uid, (i + 1) * 10, "teste")
+        db.registrar_resultado_quiz(uids[0], 5, 5, 500)
+        db.registrar_progresso_diario(uids[1], tempo_segundos=3600)
+
+        geral = db.obter_ranking("Geral")
+        self.assertEqual(geral[0]["user_id"], uids[0])
+        self.assertEqual(geral[0]["xp"], 510)
+        with db.conexao() as conn:
+            esperado = [r[0] for r in conn.execute("SELECT id FROM usuarios ORDER BY xp DESC, id DESC")]
+        self.assertEqual([r["user_id"] for r in geral], esperado)
+        self.assertEqual([r["posicao"] for r in geral], list(range(1, len(geral) + 1)))
+        self.assertEqual(next(r for r in geral if r["user_id"] == uids[1])["horas_estudo"], 1.0)
+
+        hoje = db.obter_ranking("Hoje")
+        semana = db.obter_ranking("Semana")
+        self.assertEqual(hoje[0]["pontuacao"], 510)
+        self.assertEqual([r["user_id"] for r in hoje], [r["user_id"] for r in semana])
+
+        alvo = uids[5]
+        pos = db.obter_posicao_ranking(alvo, "Geral", vizinhos=5)
+        self.assertEqual(pos["posicao"], esperado.index(alvo) + 1)
+        ids_vizinhos = [r["user_id"] for r in pos["vizinhos"]]
+        i = esperado.index(alvo)
+        self.assertEqual(ids_vizinhos, esperado[max(0, i - 5): i + 6])
+        self.assertEqual(db.obter_posicao_ranking(uids[0])["posicao"], 1)
+        self.assertIsNone(db.obter_posicao_ranking(999999))
+        print("✅ Ranking materializado funcionando")
+
+    def test_questions_content_addressed_store(self):
+        """Conteudo da questao gravado uma vez e referenciado por id/hash."""
+        import json
+        from core.blob_codec import decode_blob
+        from core.database_v2 import Database
+        from core.repositories.question_progress_repository import QuestionProgressRepository
+        db = Database(db_path=self.test_db)
+        db.iniciar_banco()
+        uids = []
+        for i in range(2):
+            ok, _ = db.criar_conta(f"cas{i}", f"cas{i}@test.local", "123456", "01/01/2000")
+            self.assertTrue(ok)
+            uids.append(int(db.fazer_login(f"cas{i}@test.local", "123456")["id"]))
+        questao = {"enunciado": "Capital?", "alternativas": ["A", "B"], "correta_index": 1, "tema": "Geo"}
+
+        qrepo = QuestionProgressRepository(db)
+        qrepo.register_result(uids[0], questao, "wrong")
+        db.registrar_questao_usuario(uids[1], questao, tema="Geo", tentativa_correta=False)
+        db.salvar_questao_cache("Geo", "intermediario", questao)
+        pacote_id = db.salvar_study_package(uids[0], "Pacote", "f.pdf", {"questoes": [questao], "resumo": "r"})
+
+        with db.conexao() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM questions").fetchone()[0], 1)
+            vazios = conn.execute("SELECT COUNT(*) FROM questoes_usuario WHERE dados_json = ''").fetchone()[0]
+            self.assertEqual(vazios, 2)
+            pacote_json = conn.execute("SELECT dados_json FROM study_packages WHERE id = ?", (pacote_id,)).fetchone()[0]
+            self.assertNotIn("questoes", decode_blob(pacote_json))
+
+        # Reprocessar a fila de revisao nao reescreve o conteudo inalterado.
+        due = qrepo.list_errors(uids[0])
+        self.assertEqual(due[0]["enunciado"], "Capital?")
+        with db.conexao() as conn:
+            conn.execute("CREATE TEMP TABLE escritas_questions (n INTEGER)")
+            conn.execute(
+                "CREATE TEMP TRIGGER conta_escritas AFTER UPDATE ON main.questions "
+                "BEGIN INSERT INTO escritas_questions VALUES (1); END"
+            )
+            qrepo.register_result(uids[0], due[0], "correct")
+            db.registrar_questao_usuario(uids[1], dict(questao), tema="Geo", favorita=True)
+            escritas = conn.execute("SELECT COUNT(*) FROM escritas_questions").fetchone()[0]
+            conn.execute("DROP TRIGGER conta_escritas")
+        self.assertEqual(escritas, 0)
+
+        self.assertEqual(db.listar_questoes_usuario(uids[1])[0]["alternativas"], ["A", "B"])
+        self.assertEqual(db.listar_questoes_cache("Geo", "intermediario")[0]["enunciado"], "Capital?")
+        pacote = db.listar_study_packages(uids[0])[0]["dados"]
+        self.assertEqual(pacote["questoes"][0]["enunciado"], "Capital?")
+        self.assertEqual(pacote["resumo"], "r")
+
+        # Linhas antigas (conteudo inline) sao migradas para `questions`.
+        antiga = {"enunciado": "Antiga", "alternativas": ["x"], "correta_index": 0}
+        with db.conexao() as conn:
+            conn.execute(
+                "INSERT INTO questoes_usuario (user_id, qhash, dados_json) VALUES (?, ?, ?)",
+                (uids[0], db._question_hash(antiga), json.dumps(antiga)),
+            )
+            conn.execute("PRAGMA user_version = 5")
+        db.iniciar_banco()
+        textos = {q["enunciado"] for q in db.listar_questoes_usuario(uids[0])}
+        self.assertIn("Antiga", textos)
+        with db.conexao() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM questoes_usuario WHERE dados_json <> ''").fetchone()[0], 0)
+        print("✅ Questoes com armazenamento por conteudo")
+
+    def test_blob_codec_compact_and_lazy(self):
+        """Blobs versionados, compatibilidade com JSON antigo e leitura parcial."""
+        import json
+        from core.blob_codec import LazyBlob, decode_blob, encode_blob, peek_blob
+        from core.database_v2 import Database
+
+        questao = {
+            "enunciado": "Qual das alternativas apresenta a capital do Brasil?",
+            "alternativas": ["Rio de Janeiro", "Sao Paulo", "Brasilia", "Salvador"],
+            "correta_index": 2,
+            "explicacao": "Brasilia e a capital federal desde 1960. " * 4,
+            "tema": "Geografia",
+        }
+        blob = encode_blob(questao, leves=("tema", "enunciado"))
+        self.assertLess(len(blob), len(json.dumps(questao, ensure_ascii=False)))
+        self.assertEqual(decode_blob(blob), questao)
+        self.assertEqual(decode_blob(json.dumps(questao)), questao)
+        self.assertEqual(decode_blob(""), {})
+        self.assertEqual(peek_blob(blob, "tema"), {"tema": "Geografia"})
+        lazy = LazyBlob(blob)
+        self.assertEqual(lazy["enunciado"], questao["enunciado"])
+        self.assertFalse(lazy.decoded)
+        self.assertEqual(lazy["correta_index"], 2)
+        self.assertTrue(lazy.decoded)
+
+        db = Database(db_path=self.test_db)
+        db.iniciar_banco()
+        ok, _ = db.criar_conta("blob_user", "blob@test.local", "123456", "01/01/2000")
+        self.assertTrue(ok)
+        uid = int(db.fazer_login("blob@test.local", "123456")["id"])
+        db.registrar_questao_usuario(uid, questao, tema="Geografia")
+        db.salvar_filtro_quiz(uid, "f", {"tema": "Geografia"})
+        db.salvar_resumo_por_hash(uid, "h1", "Geo", {"resumo": "texto"})
+        with db.conexao() as conn:
+            bruto = conn.execute("SELECT dados_json FROM questions").fetchone()[0]
+            conn.execute(
+                "INSERT INTO quiz_filtros_salvos (user_id, nome, filtro_json) VALUES (?, 'antigo', ?)",
+                (uid, json.dumps({"tema": "Historia"})),
+            )
+        self.assertIsInstance(bruto, bytes)
+        resumo = db.listar_questoes_usuario(uid, campos=("tema", "enunciado"))[0]
+        self.assertEqual(resumo["enunciado"], questao["enunciado"])
+        self.assertNotIn("alternativas", resumo)
+        self.assertEqual(db.listar_questoes_usuario(uid)[0]["alternativas"], questao["alternativas"])
+        filtros = {f["nome"]: f["filtro"] for f in db.listar_filtros_quiz(uid)}
+        self.assertEqual(filtros, {"f": {"tema": "Geografia"}, "antigo": {"tema": "Historia"}})
+        self.assertEqual(db.obter_resumo_por_hash(uid, "h1"), {"resumo": "texto"})
+
+        # Lista de pacotes: resumo e contagens vem dos campos leves, sem o corpo.
+        pacote = {
+            "resumo": "Capitais",
+            "topicos": ["Brasil"],
+            "questoes": [questao],
+            "flashcards": [{"frente": "Capital?", "verso": "Brasilia"}] * 3,
+            "summary_v2": {"resumo": "longo " * 80},
+        }
+        pid = db.salvar_study_package(uid, "Pacote - geo", "geo.txt", pacote)
+        with db.conexao() as conn:
+            bruto = conn.execute("SELECT dados_json FROM study_packages WHERE id = ?", (pid,)).fetchone()[0]
+            conn.execute(
+                "INSERT INTO study_packages (user_id, titulo, source_nome, dados_json) VALUES (?, 'antigo', 'a.txt', ?)",
+                (uid, json.dumps({"resumo": "velho", "questoes": [questao], "flashcards": []})),
+            )
+        leve = LazyBlob(bruto)
+        self.assertEqual(len(leve["questoes_ref"]), 1)
+        self.assertEqual(leve["total_flashcards"], 3)
+        self.assertFalse(leve.decoded)
+        lista = {p["titulo"]: p["dados"] for p in db.listar_study_packages(uid, resumido=True)}
+        self.assertEqual(
+            lista["Pacote - geo"],
+            {"resumo": "Capitais", "topicos": ["Brasil"], "total_questoes": 1, "total_flashcards": 3},
+        )
+        self.assertEqual((lista["antigo"]["total_questoes"], lista["antigo"]["total_flashcards"]), (1, 0))
+        completo = db.obter_study_package(uid, pid)["dados"]
+        self.assertEqual(completo["questoes"], [questao])
+        self.assertNotIn("total_flashcards", completo)
+        self.assertEqual(completo["summary_v2"], pacote["summary_v2"])
+        self.assertIsNone(db.obter_study_package(uid, pid + 99))
+        print("✅ Codec de blobs compacto e com leitura parcial")
+
+    def test_offline_question_bank(self):
+        """Banco offline sem duplicatas, limitado por tema e servindo ineditas primeiro."""
+        from core.database_v2 import Database
+        db = Database(db_path=self.test_db)
+        db.iniciar_banco()
+        ok, _ = db.criar_conta("bank_user", "bank@test.local", "123456", "01/01/2000")
+        self.assertTrue(ok)
+        uid = int(db.fazer_login("bank@test.local", "123456")["id"])
+        db._LIMITE_BANCO_POR_TEMA = 5
+
+        questoes = [
+            {"enunciado": f"Questao {i}", "alternativas": ["A", "B"], "correta_index": 0}
+            for i in range(8)
+        ]
+        for q in questoes[:5]:
+            db.salvar_questao_cache("Historia do Brasil", "Facil", q)
+        db.salvar_questao_cache("  história  do brasil", "facil", questoes[0])  # mesma chave: ignorada
+        with db.conexao() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM banco_questoes").fetchone()[0], 5)
+        db.salvar_questao_cache("Historia do Brasil", "Facil", questoes[5])
+        with db.conexao() as conn:
+            total = conn.execute("SELECT COUNT(*) FROM banco_questoes").fetchone()[0]
+            plano = " ".join(
+                str(r[-1]) for r in conn.execute(
+                    "EXPLAIN QUERY PLAN SELECT id, question_id FROM banco_questoes "
+                    "WHERE tema_key = ? AND dificuldade_key = ? ORDER BY served_count, last_served_at LIMIT 5",
+                    ("historia do brasil", "facil"),
+                )
+            )
+        self.assertEqual(total, 5)
+        self.assertIn("COVERING INDEX idx_banco_questoes_servir", plano)
+        self.assertNotIn("TEMP B-TREE", plano)
+
+        db.registrar_questao_usuario(uid, questoes[1], tema="Historia do Brasil")
+        servidas = db.listar_questoes_cache("HISTORIA DO BRASIL", "Fácil", 3, user_id=uid)
+        self.assertEqual(len(servidas), 3)
+        self.assertNotIn("Questao 1", {q["enunciado"] for q in servidas})
+        db.writer.flush()
+        # As menos servidas vem na proxima chamada: sem repetir enquanto houver outras.
+        seguintes = db.listar_questoes_cache("Historia do Brasil", "facil", 2)
+        self.assertFalse({q["enunciado"] for q in servidas} & {q["enunciado"] for q in seguintes})
+
+        # Estouro do limite descarta a menos usada recentemente, nunca a recem-chegada.
+        db.writer.flush()
+        db.salvar_questao_cache("Historia do Brasil", "facil", questoes[7])
+        with db.conexao() as conn:
+            restantes = conn.execute("SELECT COUNT(*) FROM banco_questoes").fetchone()[0]
+        self.assertEqual(restantes, 5)
+        enunciados = {q["enunciado"] for q in db.listar_questoes_cache("historia do brasil", "facil", 10)}
+        self.assertIn("Questao 7", enunciados)
+        print("✅ Banco offline de questoes indexado e limitado")
+
+    def test_full_text_search(self):
+        """Busca FTS5 sem acentos em questoes, flashcards e pacotes, sincronizada."""
+        from core.database_v2 import Database
+        db = Database(db_path=self.test_db)
+        db.iniciar_banco()
+        with db.conexao() as conn:
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'busca_questoes'").fetchone():
+                self.skipTest("SQLite sem FTS5")
+        uids = []
+        for i in range(2):
+            ok, _ = db.criar_conta(f"busca{i}", f"busca{i}@test.local", "123456", "01/01/2000")
+            self.assertTrue(ok)
+            uids.append(int(db.fazer_login(f"busca{i}@test.local", "123456")["id"]))
+
+        db.registrar_questao_usuario(
+            uids[0],
+            {"enunciado": "Qual foi a causa da Revolução Francesa?", "alternativas": ["Fome", "Guerra"], "correta_index": 0},
+            tema="História",
+        )
+        db.salvar_flashcards_gerados(uids[0], "Biologia", [{"frente": "Função da mitocôndria", "verso": "Respiração celular"}])
+        db.salvar_flashcards_gerados(uids[1], "Biologia", [{"frente": "Mitocôndria", "verso": "Energia"}])
+        db.salvar_study_package(uids[0], "Revisão de Ecologia", "ecologia.pdf", {"resumo": "x"})
+        db.salvar_questao_cache(
+            "Geografia do Brasil", "intermediario",
+            {"enunciado": "Qual a capital do Brasil?", "alternativas": ["Brasília", "Rio"], "correta_index": 0},
+        )
+
+        self.assertEqual([r["tipo"] for r in db.buscar(uids[0], "revolucao")], ["questao"])
+        self.assertEqual([r["tipo"] for r in db.buscar(uids[0], "historia")], ["questao"])
+        flash = db.buscar(uids[0], "mitocondria")
+        self.assertEqual([(r["tipo"], r["titulo"]) for r in flash], [("flashcard", "Função da mitocôndria")])
+        self.assertEqual([r["tipo"] for r in db.buscar(uids[0], "ecolog")], ["pacote"])
+        pid = db.salvar_study_package(
+            uids[0], "Pacote - aula3.pdf", "aula3.pdf",
+            {"resumo": "Cadeia alimentar e decompositores", "topicos": ["Fotossíntese", "Biomas"], "questoes": []},
+        )
+        for termo in ("fotossintese", "decompositor", "biomas"):
+            self.assertEqual([(r["tipo"], r["id"]) for r in db.buscar(uids[0], termo)], [("pacote", pid)])
+        self.assertEqual(db.buscar(uids[1], "fotossintese"), [])
+        with db.conexao() as conn:
+            conn.execute("UPDATE study_packages SET titulo = 'Ecossistemas' WHERE id = ?", (pid,))
+        self.assertEqual([r["id"] for r in db.buscar(uids[0], "ecossistemas biomas")], [pid])
+        with db.conexao() as conn:
+            conn.execute("DELETE FROM study_packages WHERE id = ?", (pid,))
+        self.assertEqual(db.buscar(uids[0], "fotossintese"), [])
+        self.assertEqual([r["tipo"] for r in db.buscar(uids[1], "capital brasilia")], ["questao"])
+        self.assertEqual(db.buscar(uids[1], "revolucao"), [])
+        self.assertEqual(db.buscar(uids[0], '"; DROP TABLE flashcards; --'), [])
+
+        with db.conexao() as conn:
+            conn.execute("UPDATE flashcards SET frente = 'Ribossomo' WHERE user_id = ?", (uids[0],))
+        self.assertEqual(db.buscar(uids[0], "mitocondria", tipos=("flashcard",)), [])
+        self.assertEqual(len(db.buscar(uids[0], "ribossomo")), 1)
+        with db.conexao() as conn:
+            conn.execute("DELETE FROM flashcards WHERE user_id = ?", (uids[0],))
+        self.assertEqual(db.buscar(uids[0], "ribossomo"), [])
+
+        # Tema sem correspondencia exata no banco offline cai na busca textual.
+        offline = db.listar_questoes_cache("geografia", "intermediario", 5)
+        self.assertEqual([q["enunciado"] for q in offline], ["Qual a capital do Brasil?"])
+        print("✅ Busca textual FTS5")
+
+    def test_near_duplicate_filter(self):
+        """Quase-duplicatas: MinHash/LSH, assinaturas persistidas e filtro na geracao."""
+        import asyncio
+        import time
+        from core import near_duplicates
+        from core.database_v2 import Database
+        from core.near_duplicates import NearDuplicateIndex
+        from core.repositories.question_progress_repository import QuestionProgressRepository
+        from core.services.near_duplicate_service import NearDuplicateService
+        from core.services.quiz_generation_service import QuizGenerationService
+
+        base = "Qual e a funcao principal das mitocondrias na celula eucariota durante a respiracao celular?"
+        parecida = "Qual é a função principal das mitocôndrias na célula eucariota durante a respiração celular ?"
+        outra = "Em que ano foi proclamada a independencia do Brasil e quem a proclamou?"
+        sig = near_duplicates.signature(base)
+        self.assertGreaterEqual(near_duplicates.similarity(sig, near_duplicates.signature(parecida)), 0.75)
+        self.assertLess(near_duplicates.similarity(sig, near_duplicates.signature(outra)), 0.5)
+        self.assertEqual(near_duplicates.unpack(near_duplicates.pack(sig)), sig)
+        self.assertIsNone(near_duplicates.signature("  "))
+
+        indice = NearDuplicateIndex()
+        indice.add("a", sig)
+        self.assertEqual(indice.find(near_duplicates.signature(parecida)), "a")
+        self.assertIsNone(indice.find(near_duplicates.signature(outra)))
+
+        db = Database(db_path=self.test_db)
+        db.iniciar_banco()
+        ok, _ = db.criar_conta("ndup", "ndup@test.local", "123456", "01/01/2000")
+        self.assertTrue(ok)
+        uid = int(db.fazer_login("ndup@test.local", "123456")["id"])
+        QuestionProgressRepository(db).register_result(
+            uid, {"enunciado": base, "alternativas": ["A", "B"], "correta_index": 0, "tema": "Bio"}, "wrong"
+        )
+        db.salvar_flashcards_gerados(uid, "Bio", [{"frente": base, "verso": "Produzir ATP"}])
+        with db.conexao() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM assinaturas_quase_dup").fetchone()[0], 2)
+
+        servico = NearDuplicateService(db)
+        aceitar = servico.question_filter(uid)
+        self.assertFalse(aceitar({"enunciado": parecida}))
+        self.assertTrue(aceitar({"enunciado": outra}))
+        # O que acabou de ser aceito tambem bloqueia a repeticao na mesma sessao.
+        self.assertFalse(servico.question_filter(uid)({"enunciado": outra}))
+        self.assertFalse(servico.flashcard_filter(uid)({"frente": parecida, "verso": "x"}))
+
+        # Entrada nova no banco entra no indice pelo delta, sem recarregar tudo.
+        time.sleep(1.1)
+        tardia = "Quais sao as tres leis de Newton e como elas descrevem o movimento dos corpos?"
+        db.salvar_flashcards_gerados(uid, "Fis", [{"frente": tardia, "verso": "..."}])
+        self.assertFalse(servico.flashcard_filter(uid)({"frente": tardia + "?"}))
+
+        textos = [f"Pergunta numero {i} sobre o assunto {i * 7} com detalhes adicionais do tema" for i in range(300)]
+        inicio = time.perf_counter()
+        for texto in textos:
+            servico.for_user(uid).questions.find(near_duplicates.signature(texto))
+        self.assertLess((time.perf_counter() - inicio) / len(textos), 0.001)
+
+        class FakeAI:
+            def __init__(self):
+                self.pedidos = []
+
+            def generate_quiz_batch(self, content, topic, difficulty, quantity, retries):
+                n = len(self.pedidos)
+                self.pedidos.append(quantity)
+                itens = [{"pergunta": f"Tema {n} item {i}: explique o conceito numero {n * 10 + i}"} for i in range(quantity)]
+                if n == 0:
+                    itens[0] = {"pergunta": parecida}
+                return itens
+
+        fake = FakeAI()
+        geradas = asyncio.run(
+            QuizGenerationService(fake, batch_size=5, accept=NearDuplicateService(db).question_filter(uid)).generate(5)
+        )
+        self.assertEqual(len(geradas), 5)
+        self.assertNotIn(parecida, [q["pergunta"] for q in geradas])
+        self.assertEqual(fake.pedidos, [5, 1])
+        print("✅ Filtro de quase-duplicatas")
+
+    def test_daily_xp_rollup(self):
+        """Grafico e resumos lidos do resumo diario; historico bruto compactavel."""
+        from core.database_v2 import Database
+        db = Database(db_path=self.test_db)
+        db.iniciar_banco()
+        ok, _ = db.criar_conta("rollup_user", "rollup@test.local", "123456", "01/01/2000")
+        self.assertTrue(ok)
+        uid = int(db.fazer_login("rollup@test.local", "123456")["id"])
+
+        db.registrar_ganho_xp(uid, 30, "teste")
+        db.registrar_resultado_quiz(uid, acertos=3, total=4, xp=20)
+        with db.conexao() as conn:
+            conn.execute(
+                "INSERT INTO historico_xp (user_id, xp_ganho, motivo, data_hora) VALUES (?, 15, 'antigo', DATETIME('now', '-3 days'))",
+                (uid,),
+            )
+            conn.execute(
+                "INSERT INTO historico_xp (user_id, xp_ganho, motivo, data_hora) VALUES (?, 99, 'velho', DATETIME('now', '-200 days'))",
+                (uid,),
+            )
+
+        dados, total = db.obter_dados_grafico(uid, 7)
+        self.assertEqual(len(dados), 7)
+        self.assertEqual(dados[-1]["xp"], 50)
+        self.assertEqual(dados[-4]["xp"], 15)
+        self.assertEqual(total, 65)
+        self.assertEqual(db.obter_dados_grafico(uid, 365)[1], 164)
+
+        hoje = db.obter_resumo_estudo(uid, dias=1)[0]
+        self.assertEqual((hoje["xp"], hoje["questoes"], hoje["acertos"], hoje["precisao"]), (50, 4, 3, 0.75))
+        meses = db.obter_resumo_estudo(uid, dias=365, agrupar="mes")
+        self.assertEqual(sum(m["xp"] for m in meses), 164)
+
+        self.assertEqual(db.compactar_historico_xp(manter_dias=90), 1)
+        self.assertEqual(db.obter_dados_grafico(uid, 365)[1], 164)
+
+        # Migracao recalcula o XP diario a partir do historico existente.
+        with db.conexao() as conn:
+            conn.execute("UPDATE estudo_progresso_diario SET xp = 0")
+            conn.execute("PRAGMA user_version = 8")
+        db.iniciar_banco()
+        self.assertEqual(db.obter_dados_grafico(uid, 7)[1], 65)
+        print("✅ Resumo diario de XP")
+
+    def test_api_key_cipher_cache_benchmark(self):
+        """Cifra da chave de API derivada uma vez; leituras seguintes sem PBKDF2."""
+        import time
+        import core.database_v2 as dbmod
+        if dbmod.Fernet is None:
+            self.skipTest("cryptography indisponivel")
+        db = dbmod.Database(db_path=self.test_db)
+        dbmod._CIFRAS_API_KEY.clear()
+
+        inicio = time.perf_counter()
+        token = db._encrypt_api_key("sk-teste-123")
+        frio = time.perf_counter() - inicio
+        self.assertTrue(token.startswith(db._API_KEY_PREFIX))
+
+        rodadas = 20
+        inicio = time.perf_counter()
+        for _ in range(rodadas):
+            db._encrypt_api_key("sk-teste-123")
+            db.limpar_segredos_sessao()
+            self.assertEqual(db._decrypt_api_key(token), "sk-teste-123")
+        quente = (time.perf_counter() - inicio) / rodadas
+        print(f"   PBKDF2 + cifra: {frio * 1000:.1f} ms | cifra em cache: {quente * 1000:.3f} ms")
+        self.assertLess(quente * 10, frio)
+
+        # Outra semente (db_path) gera outra cifra: o token antigo nao decifra.
+        outro = dbmod.Database(db_path=self.test_db + ".outro")
+        self.assertIsNone(outro._decrypt_api_key(token))
+        self.assertEqual(len(dbmod._CIFRAS_API_KEY), 2)
+
+        # Segredo decifrado fica em memoria na sessao e sai no logout.
+        db._decrypt_api_key(token)
+        self.assertIn(token[len(db._API_KEY_PREFIX):], db._segredos_sessao)
+        db.limpar_segredos_sessao()
+        self.assertEqual(db._segredos_sessao, {})
+        print("✅ Cifra da chave de API em cache")
+
+    def test_password_hasher_bounded_and_lazy_rehash(self):
+        """Hash de senha em executor limitado; hash legado trocado depois do login."""
+        import asyncio
+        import threading
+        import time
+        from core.database_v2 import Database
+        from core.password_hasher import PasswordHasher
+
+        ativos = []
+        pico = [0]
+        lock = threading.Lock()
+
+        def _hash_lento(senha):
+            with lock:
+                ativos.append(1)
+                pico[0] = max(pico[0], len(ativos))
+            time.sleep(0.02)
+            with lock:
+                ativos.pop()
+            return senha[::-1]
+
+        hasher = PasswordHasher(_hash_lento, lambda s, h: s[::-1] == h, max_concorrentes=2)
+
+        async def _rajada():
+            return await asyncio.gather(*(hasher.hash_async(f"s{i}") for i in range(8)))
+
+        self.assertEqual(asyncio.run(_rajada()), [f"s{i}"[::-1] for i in range(8)])
+        self.assertEqual(pico[0], 2)
+        self.assertTrue(asyncio.run(hasher.verify_async("abc", "cba")))
+        hasher.close()
+
+        db = Database(db_path=self.test_db)
+        db.iniciar_banco()
+        ok, _ = asyncio.run(db.criar_conta_async("hash_user", "hash@test.local", "123456", "01/01/2000"))
+        self.assertTrue(ok)
+        with db.conexao() as conn:
+            conn.execute("UPDATE usuarios SET senha = ? WHERE email = ?", (db._legacy_sha256("123456"), "hash@test.local"))
+        user = asyncio.run(db.fazer_login_async("hash@test.local", "123456"))
+        self.assertIsNotNone(user)
+        self.assertIsNone(db.fazer_login("hash@test.local", "errada"))
+
+        prazo = time.time() + 5
+        while time.time() < prazo:
+            db.writer.flush()
+            with db.conexao() as conn:
+                senha = conn.execute("SELECT senha FROM usuarios WHERE email = ?", ("hash@test.local",)).fetchone()[0]
+            if not db._is_legacy_sha256_hash(senha):
+                break
+            time.sleep(0.02)
+        self.assertFalse(db._is_legacy_sha256_hash(senha))
+        self.assertIsNotNone(db.fazer_login("hash", "123456"))
+        print("✅ Hash de senha fora da thread com rehash adiado")
+
+    def test_srs_engine_strategies_and_batch(self):
+        """Motor SRS unico: estrategias plugaveis e reagendamento em lote."""
+        import datetime
+        from core import srs_engine
+        from core.database_v2 import Database
+
+        agora = datetime.datetime(2026, 1, 10, 12, 0, 0)
+        escada = srs_engine.FLASHCARD_STRATEGY.schedule_batch(
+            [{"level": 0}, {"level": 3}, {"level": 8}, {"level": 2}],
+            ["lembrei", "rever", "lembrei", "pular"],
+            agora,
+        )
+        self.assertEqual([e["level"] for e in escada], [1, 2, 8, 2])
+        self.assertEqual(
+            [e["due"] for e in escada],
+            ["2026-01-12 12:00:00", "2026-01-11 12:00:00", "2026-07-09 12:00:00", "2026-01-11 00:00:00"],
+        )
+        fila = srs_engine.REVIEW_QUEUE_STRATEGY.schedule_batch([{"level": 1}, {"level": 0}], ["correct", "wrong"], agora)
+        self.assertEqual([(e["level"], e["due"]) for e in fila], [(0, None), (1, "2026-01-12 12:00:00")])
+        sm2 = srs_engine.get_strategy("sm2").schedule_batch([{"level": 1, "attempts": 1, "hits": 1}], [True], agora)[0]
+        self.assertEqual((sm2["level"], sm2["due"]), (2, "2026-01-16 12:00:00"))
+        fsrs = srs_engine.get_strategy("fsrs")
+        primeira = fsrs.schedule_batch([{}], [True], agora)[0]
+        segunda = fsrs.schedule_batch([dict(primeira, last_review=agora)], [True], agora + datetime.timedelta(days=4))[0]
+        self.assertGreater(segunda["stability"], primeira["stability"])
+        with self.assertRaises(ValueError):
+            srs_engine.get_strategy("inexistente")
+
+        db = Database(db_path=self.test_db)
+        db.iniciar_banco()
+        ok, _ = db.criar_conta("srs_user", "srs@test.local", "123456", "01/01/2000")
+        self.assertTrue(ok)
+        uid = int(db.fazer_login("srs@test.local", "123456")["id"])
+        cards = [{"frente": f"Pergunta {i}", "verso": f"Resposta {i}"} for i in range(6)]
+        db.salvar_flashcards_gerados(uid, "Historia", cards, "intermediario")
+        db.salvar_flashcards_gerados(uid, "Quimica", [{"frente": "H2O", "verso": "Agua"}], "intermediario")
+        with db.conexao() as conn:
+            conn.execute("UPDATE flashcards SET revisao_nivel = 3, proxima_revisao = DATETIME('now', '+1 day') WHERE user_id = ?", (uid,))
+
+        self.assertEqual(db.reagendar_revisoes(uid, "adiar", tema="Historia", dias=5), 6)
+        self.assertEqual(db.reagendar_revisoes(uid, "resetar", tema="Quimica"), 1)
+        with db.conexao() as conn:
+            rows = dict(conn.execute(
+                "SELECT tema, MIN(CAST(JULIANDAY(proxima_revisao) - JULIANDAY('now') AS INTEGER)) FROM flashcards WHERE user_id = ? GROUP BY tema",
+                (uid,),
+            ).fetchall())
+            nivel_quimica = conn.execute("SELECT revisao_nivel FROM flashcards WHERE tema = 'Quimica'").fetchone()[0]
+        self.assertEqual(rows["Historia"], 5)
+        self.assertEqual(rows["Quimica"], 0)
+        self.assertEqual(nivel_quimica, 0)
+        self.assertEqual(db.reagendar_revisoes(uid, "migrar", tema="Historia", estrategia="fsrs"), 6)
+        self.assertEqual(db.estrategia_revisao(uid, "flashcard").name, "fsrs")
+        self.assertEqual(db.estrategia_revisao(uid, "questao").name, "mistakes")
+        with db.conexao() as conn:
+            estabilidades = [r[0] for r in conn.execute(
+                "SELECT srs_estabilidade FROM flashcards WHERE user_id = ? AND tema = 'Historia'", (uid,)
+            ).fetchall()]
+        self.assertTrue(all(e and e > 0 for e in estabilidades))
+        # a revisao seguinte usa a estrategia gravada (FSRS), nao a escada padrao
+        from core.repositories.flashcard_repository import FlashcardRepository
+        FlashcardRepository(db).register_action(uid, dict(cards[0], tema="Historia"), "lembrei")
+        with db.conexao() as conn:
+            nivel, estabilidade = conn.execute(
+                "SELECT revisao_nivel, srs_estabilidade FROM flashcards WHERE user_id = ? AND frente = 'Pergunta 0'", (uid,)
+            ).fetchone()
+        self.assertEqual(nivel, 4)
+        self.assertGreater(estabilidade, estabilidades[0])
+        self.assertEqual(db.reagendar_revisoes(uid, "resetar", tema="Historia"), 6)
+        with db.conexao() as conn:
+            self.assertIsNone(conn.execute("SELECT MAX(srs_estabilidade) FROM flashcards WHERE user_id = ?", (uid,)).fetchone()[0])
+        with self.assertRaises(ValueError):
+            db.reagendar_revisoes(uid, "apagar")
+        print("✅ Motor SRS com estrategias plugaveis e reagendamento em lote")
+
+    def test_legacy_spaced_repetition_uses_content_hash(self):
+        """Servico legado grava o conteudo na chave sha256 de `questions`."""
+        from core.database_v2 import Database
+        from services.spaced_repetition import SpacedRepetitionService
+
+        db = Database(db_path=self.test_db)
+        db.iniciar_banco()
+        questao = {"enunciado": "Capital do Peru?", "alternativas": ["Lima", "Quito"], "correta_index": 0}
+        SpacedRepetitionService(db).registrar_resultado(1, dict(questao), False, tema="Geo")
+        with db.conexao() as conn:
+            chaves = [row[0] for row in conn.execute("SELECT qhash FROM questions")]
+        self.assertEqual(chaves, [db._question_hash(questao)])
+        self.assertEqual(len(SpacedRepetitionService(db).questoes_por_tema(1, "Geo")), 1)
+        db.fechar()
+        print("✅ Servico SRS legado usa a chave de conteudo sha256")
+
+    def test_question_strategy_shared_by_quiz_and_review(self):
+        """Quiz e fila de revisao agendam a mesma questao com a mesma estrategia."""
+        from core.database_v2 import Database
+        from core.repositories.question_progress_repository import QuestionProgressRepository
+
+        db = Database(db_path=self.test_db)
+        db.iniciar_banco()
+        ok, _ = db.criar_conta("srs_q_user", "srsq@test.local", "123456", "01/01/2000")
+        self.assertTrue(ok)
+        uid = int(db.fazer_login("srsq@test.local", "123456")["id"])
+        repo = QuestionProgressRepository(db)
+        questao = {"enunciado": "Quanto vale g?", "alternativas": ["9,8", "10"], "correta_index": 0, "tema": "Fisica"}
+
+        def _linha():
+            with db.conexao() as conn:
+                return conn.execute(
+                    """
+                    SELECT revisao_nivel, review_level, proxima_revisao, next_review_at, srs_estabilidade
+                    FROM questoes_usuario WHERE user_id = ?
+                    """,
+                    (uid,),
+                ).fetchone()
+
+        # Escada de erros nos dois caminhos: erro sobe, acerto desce e tira da fila.
+        db.registrar_questao_usuario(uid, dict(questao), tema="Fisica", tentativa_correta=False)
+        repo.register_result(uid, dict(questao), "wrong")
+        nivel, review_level, proxima, proxima_fila, _ = _linha()
+        self.assertEqual((nivel, review_level), (2, 2))
+        self.assertEqual(proxima, proxima_fila)
+        db.registrar_questao_usuario(uid, dict(questao), tema="Fisica", tentativa_correta=True)
+        self.assertEqual(_linha()[:2], (1, 1))
+        repo.register_result(uid, dict(questao), "correct")
+        self.assertEqual(_linha()[:4], (0, 0, None, None))
+
+        # Depois de migrar, os dois caminhos usam a estrategia gravada (FSRS).
+        db.registrar_questao_usuario(uid, dict(questao), tema="Fisica", tentativa_correta=False)
+        self.assertEqual(db.reagendar_revisoes(uid, "migrar", tipo="questao", estrategia="fsrs"), 1)
+        self.assertGreater(_linha()[4], 0)
+        # FSRS sobe o nivel no acerto (a escada de erros desceria).
+        repo.register_result(uid, dict(questao), "correct")
+        self.assertEqual(_linha()[:2], (2, 2))
+        db.registrar_questao_usuario(uid, dict(questao), tema="Fisica", tentativa_correta=True)
+        nivel, review_level, proxima, proxima_fila, estabilidade = _linha()
+        self.assertEqual((nivel, review_level), (3, 3))
+        self.assertIsNotNone(proxima)
+        self.assertEqual(proxima, proxima_fila)
+        self.assertGreater(estabilidade, 0)
+        db.fechar()
+        print("✅ Estrategia de questoes unica entre quiz e revisao")
+
+    def test_daily_review_due_queue_cache(self):
+        """Fila diaria em heap na memoria: carga unica, delta por updated_at e payload sob demanda."""
+        from core.database_v2 import Database
+        from core.repositories.flashcard_repository import FlashcardRepository
+        from core.repositories.question_progress_repository import QuestionProgressRepository
+        from core.services.daily_review_service import DailyReviewService
+
+        db = Database(db_path=self.test_db)
+        db.iniciar_banco()
+        ok, _ = db.criar_conta("fila_user", "fila@test.local", "123456", "01/01/2000")
+        self.assertTrue(ok)
+        uid = int(db.fazer_login("fila@test.local", "123456")["id"])
+        cards = [{"frente": f"Frente {i}", "verso": f"Verso {i}"} for i in range(40)]
+        db.salvar_flashcards_gerados(uid, "Biologia", cards, "intermediario")
+        for i in range(10):
+            q = {"enunciado": f"Questao fila {i}?", "alternativas": ["a", "b"], "correta_index": 0, "tema": "Biologia"}
+            db.registrar_questao_usuario(uid, q, tema="Biologia", tentativa_correta=False)
+        with db.conexao() as conn:
+            conn.execute(
+                "UPDATE flashcards SET proxima_revisao = DATETIME('now', '-' || id || ' minutes') WHERE user_id = ?",
+                (uid,),
+            )
+            conn.execute("UPDATE questoes_usuario SET next_review_at = DATETIME('now', '-1 hour') WHERE user_id = ?", (uid,))
+
+        flash_repo = FlashcardRepository(db)
+        question_repo = QuestionProgressRepository(db)
+        service = DailyReviewService(flash_repo, question_repo)
+        chamadas = []
+        get_many = flash_repo.get_many
+        flash_repo.get_many = lambda user_id, ids: chamadas.append(len(ids)) or get_many(user_id, ids)
+
+        fila = service.build_daily_queue(uid, premium=True)
+        self.assertEqual(len(fila), 50)
+        self.assertEqual([item["item_type"] for item in fila[:5]], ["flashcard"] * 3 + ["question"] * 2)
+        self.assertEqual(chamadas, [6])
+        primeiro = fila[0]["payload"]
+        self.assertEqual(primeiro["frente"], "Frente 39")
+        self.assertEqual(len(service.build_daily_queue(uid, premium=False, free_limit=30)), 30)
+
+        # Revisao atualiza o heap no lugar; o delta traz a nova data do banco.
+        flash_repo.register_action(uid, primeiro, "lembrei")
+        service.mark_reviewed(uid, "flashcard", primeiro)
+        self.assertEqual(len(service.build_daily_queue(uid, premium=True)), 49)
+        with db.conexao() as conn:
+            conn.execute("UPDATE flashcards SET proxima_revisao = DATETIME('now', '-1 day') WHERE id = ?", (primeiro["_srs"]["id"],))
+        self.assertEqual(len(service.build_daily_queue(uid, premium=True)), 50)
+        with db.conexao() as conn:
+            conn.execute("UPDATE questoes_usuario SET next_review_at = NULL WHERE user_id = ?", (uid,))
+        self.assertEqual(len(service.build_daily_queue(uid, premium=True)), 40)
+
+        # Cards apagados depois de montada a fila: saem dela em vez de virar card vazio.
+        fila = service.build_daily_queue(uid, premium=True)
+        apagados = [item_id for _tipo, item_id in fila._keys[:2]]
+        with db.conexao() as conn:
+            conn.executemany("DELETE FROM flashcards WHERE id = ?", [(i,) for i in apagados])
+        itens = list(fila)
+        self.assertEqual(len(itens), 38)
+        self.assertTrue(all(item["payload"].get("frente") for item in itens))
+        self.assertEqual(len(service.due_queue(uid)), 38)
+        self.assertEqual(len(service.build_daily_queue(uid, premium=True)), 38)
+        self.assertIs(service.due_queue(uid), DailyReviewService(flash_repo, question_repo).due_queue(uid))
+        print("✅ Fila diaria em memoria com delta e payloads sob demanda")
+
+    def test_forecast_review_load(self):
+        """Previsao de carga de revisoes: agenda agrupada + projecao, em cache ate mudar a agenda."""
+        from core import srs_engine
+        from core.database_v2 import Database
+        from core.services.spaced_repetition_service import SpacedRepetitionService
+        from core.services.study_plan_service import StudyPlanService
+
+        # Projecao pura: 10 cards no nivel 0 hoje, todos lembrados -> 10 revisoes em 2 dias.
+        carga = srs_engine.forecast_load(srs_engine.FLASHCARD_STRATEGY, {(0, 0): 10}, 7, success_rate=1.0)
+        self.assertEqual(carga[:3], [10.0, 0.0, 10.0])
+        self.assertEqual(carga[6], 10.0)
+
+        db = Database(db_path=self.test_db)
+        db.iniciar_banco()
+        ok, _ = db.criar_conta("prev_user", "prev@test.local", "123456", "01/01/2000")
+        self.assertTrue(ok)
+        uid = int(db.fazer_login("prev@test.local", "123456")["id"])
+        cards = [{"frente": f"Card {i}", "verso": f"Resp {i}"} for i in range(12)]
+        db.salvar_flashcards_gerados(uid, "Fisica", cards, "intermediario")
+        with db.conexao() as conn:
+            conn.execute("UPDATE flashcards SET revisao_nivel = 0, proxima_revisao = DATETIME('now', '-2 days') WHERE user_id = ? AND id % 2 = 0", (uid,))
+            conn.execute("UPDATE flashcards SET revisao_nivel = 4, proxima_revisao = DATETIME('now', '+3 days') WHERE user_id = ? AND id % 2 = 1", (uid,))
+
+        srs = SpacedRepetitionService.from_db(db)
+        previsao = srs.forecast_review_load(uid, 30)
+        self.assertEqual(previsao["scheduled"], 12)
+        self.assertEqual(len(previsao["per_day"]), 30)
+        self.assertEqual(previsao["per_day"][0]["flashcards"], 6)
+        self.assertGreaterEqual(previsao["per_day"][3]["flashcards"], 6)
+        # Datas no relogio UTC do SQLite, o mesmo que agrupa os vencimentos.
+        with db.conexao() as conn:
+            hoje_utc, amanha_utc = conn.execute("SELECT DATE('now'), DATE('now', '+1 day')").fetchone()
+        self.assertEqual([d["date"] for d in previsao["per_day"][:2]], [hoje_utc, amanha_utc])
+        self.assertGreater(previsao["total"], 12)
+
+        chamadas = []
+        original = db.carga_revisoes_agendadas
+        db.carga_revisoes_agendadas = lambda *a, **k: chamadas.append(1) or original(*a, **k)
+        self.assertIs(srs.forecast_review_load(uid, 30), previsao)
+        self.assertEqual(chamadas, [])
+        with db.conexao() as conn:
+            conn.execute("UPDATE flashcards SET proxima_revisao = NULL WHERE user_id = ? AND id % 2 = 0", (uid,))
+        self.assertEqual(srs.forecast_review_load(uid, 30)["per_day"][0]["flashcards"], 0)
+        self.assertEqual(chamadas, [1])
+
+        itens = [{"dia": "Seg", "tema": "Fisica", "atividade": "Questoes", "duracao_min": 30, "prioridade": 2}]
+        plano = StudyPlanService.balance_review_load(itens, {"per_day": [{"total": 40}]}, 30)
+        self.assertEqual((plano[0]["revisoes_previstas"], plano[0]["revisao_min"], plano[0]["prioridade"]), (40, 18, 1))
+        print("✅ Previsao de carga de revisoes com cache por versao da agenda")
+
+    def test_srs_benchmark_harness(self):
+        """Harness de benchmark: log sintetico deterministico reexecutado pelos repositorios."""
+        from scripts.srs_benchmark import RecallModel, generate_workload, run_benchmark
+
+        log = list(generate_workload(4, 30, 200, seed=7))
+        self.assertEqual(log, list(generate_workload(4, 30, 200, seed=7)))
+        self.assertTrue(all(0 <= user < 4 and 0 <= item < 30 for _op, user, item, _ok in log))
+        facil = RecallModel(base=0.9)
+        self.assertGreater(facil.probability(0, 0, 3), facil.probability(0, 0, 0))
+
+        relatorio = run_benchmark(users=3, items=20, events=120, read_every=40, db_path=self.test_db)
+        self.assertEqual(relatorio["config"]["events"], 120)
+        ops = relatorio["operations"]
+        self.assertEqual(sum(ops[k]["count"] for k in ("flashcard", "question", "legacy_sm2") if k in ops), 120)
+        self.assertEqual(ops["build_daily_queue"]["count"], 3)
+        self.assertGreater(relatorio["db_size"]["final_bytes"], relatorio["db_size"]["initial_bytes"])
+        self.assertEqual(relatorio["queues"]["due_in_7d"]["users"], 3)
+        print("✅ Harness de benchmark SRS gera relatorio completo")
+
+    def test_due_queries_use_review_indexes(self):
+        """Datas de revisao normalizadas e filas de revisao usando indice composto."""
+        from core.database_v2 import Database
+        from core.repositories.flashcard_repository import FlashcardRepository
+        db = Database(db_path=self.test_db)
+        db.iniciar_banco()
+        ok, _ = db.criar_conta("idx_user", "idx@test.local", "123456", "01/01/2000")
+        self.assertTrue(ok)
+        uid = int(db.fazer_login("idx@test.local", "123456")["id"])
+        db.salvar_flashcards_gerados(uid, "Tema", [{"frente": "F", "verso": "V"}])
+
+        with db.conexao() as conn:
+            conn.execute(
+                "UPDATE flashcards SET proxima_revisao = '2020-01-02T03:04:05' WHERE user_id = ?",
+                (uid,),
+            )
+            conn.execute("PRAGMA user_version = 1")
+        db.iniciar_banco()
+        due = FlashcardRepository(db).list_due(uid)
+        self.assertEqual(len(due), 1)
+        self.assertEqual(due[0]["_srs"]["proxima_revisao"], "2020-01-02 03:04:05")
+
+        with db.conexao() as conn:
+            plan = conn.execute(
+                """
+                EXPLAIN QUERY PLAN
+                SELECT frente FROM flashcards
+                WHERE user_id = ? AND proxima_revisao IS NOT NULL AND proxima_revisao <= DATETIME('now')
+                ORDER BY proxima_revisao ASC
+                """,
+                (uid,),
+            ).fetchall()
+        detalhes = " ".join(str(row[-1]) for row in plan)
+        self.assertIn("idx_flashcards_user_revisao", detalhes)
+        self.assertNotIn("TEMP B-TREE", detalhes)
+        print("✅ Filas de revisao usando indices")
+
+    def test_schema_migrations_fast_path(self):
+        """Migracoes versionadas por user_version e banco legado sem versao."""
+        from core.database_v2 import Database
+        db = Database(db_path=self.test_db)
+        self.assertEqual(db.versao_schema(), 0)
+        db.iniciar_banco()
+        self.assertEqual(db.versao_schema(), Database.SCHEMA_VERSION)
+
+        statements = []
+        with db.conexao() as conn:
+            conn.set_trace_callback(statements.append)
+        try:
+            db.iniciar_banco()
+        finally:
+            with db.conexao() as conn:
+                conn.set_trace_callback(None)
+        self.assertEqual(statements, ["PRAGMA user_version"])
+
+        # Banco criado antes do versionamento: tabelas antigas, user_version = 0.
+        with db.conexao() as conn:
+            conn.execute("DROP INDEX idx_flashcards_user_revisao")
+            conn.execute("DELETE FROM conquistas")
+            conn.execute("PRAGMA user_version = 0")
+        db.iniciar_banco()
+        self.assertEqual(db.versao_schema(), Database.SCHEMA_VERSION)
+        with db.conexao() as conn:
+            idx = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_flashcards_user_revisao'"
+            ).fetchone()
+            conquistas = conn.execute("SELECT COUNT(*) FROM conquistas").fetchone()[0]
+        self.assertIsNotNone(idx)
+        self.assertGreater(conquistas, 0)
+        print("✅ Migracoes de schema versionadas")
+
     def test_daily_limit_usage(self):
         """Prompt 4/6: limite diário deve bloquear excedente."""
         from core.database_v2 import Database
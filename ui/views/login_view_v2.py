@@ -373,7 +373,7 @@ class LoginView(ft.View):
             except Exception as ex_backend:
                 # Compatibilidade: contas legadas podiam existir apenas no SQLite local.
                 try:
-                    legacy_user = await asyncio.to_thread(self.db.fazer_login, email, senha)
+                    legacy_user = await self.db.fazer_login_async(email, senha)
                 except Exception:
                     legacy_user = None
 
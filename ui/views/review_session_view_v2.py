@@ -75,6 +75,7 @@ def build_review_session_body(state: dict, navigate, dark: bool, modo: str = "se
     itens_revisao: List[Dict] = []
     spaced_service = None
     session_service = None
+    daily_service = None
 
     if db and user_id:
         try:
@@ -180,7 +181,8 @@ def build_review_session_body(state: dict, navigate, dark: bool, modo: str = "se
                 item_ref = db._question_hash(payload) if db else str(hash(str(payload)))
             else:
                 item_ref = db._flashcard_hash(payload) if db else str(hash(str(payload)))
-            session_service.record(
+            session_service.record_later(
+                user_id,
                 int(sess["review_session_id"]),
                 item_type=item_type,
                 item_ref=item_ref,
@@ -235,11 +237,19 @@ def build_review_session_body(state: dict, navigate, dark: bool, modo: str = "se
             page.update()
 
     def _render_card():
+        nonlocal total
         cards_col.controls.clear()
         idx = int(sess.get("idx", 0))
+        item = None
+        try:
+            item = itens_revisao[idx] if idx < len(itens_revisao) else None
+        except IndexError:
+            item = None
+        # A fila diaria encolhe se itens foram apagados depois de montada.
+        total = len(itens_revisao)
         prog = min(1.0, idx / max(1, total))
 
-        if idx >= total:
+        if item is None:
             _finalize_if_needed()
             acertos, erros, puladas = _get_counts()
             taxa = (acertos / max(1, total)) * 100.0
@@ -272,7 +282,6 @@ def build_review_session_body(state: dict, navigate, dark: bool, modo: str = "se
             )
             return
 
-        item = itens_revisao[idx]
         item_type = str(item.get("item_type") or "question")
         payload = item.get("payload") or {}
         cards_col.controls.append(
@@ -309,8 +318,9 @@ def build_review_session_body(state: dict, navigate, dark: bool, modo: str = "se
 
             def _avaliar_flash(acao: str):
                 if spaced_service and user_id:
-                    spaced_service.review_flashcard(user_id, payload, acao)
-                    db.registrar_progresso_diario(user_id, flashcards=1)
+                    spaced_service.record_flashcard_review(user_id, payload, acao)
+                    if daily_service:
+                        daily_service.mark_reviewed(user_id, "flashcard", payload)
                 resultado = "remembered" if acao == "lembrei" else ("review" if acao == "rever" else "skip")
                 sess["outcomes"][idx] = resultado
                 _record("flashcard", payload, resultado, True if resultado == "remembered" else (False if resultado == "review" else None))
@@ -399,7 +409,9 @@ def build_review_session_body(state: dict, navigate, dark: bool, modo: str = "se
 
             def _skip_question(_=None):
                 if spaced_service and user_id:
-                    spaced_service.skip_question(user_id, payload)
+                    spaced_service.record_question_skip(user_id, payload)
+                    if daily_service:
+                        daily_service.mark_reviewed(user_id, "question", payload)
                 sess["outcomes"][idx] = "skip"
                 _record("question", payload, "skip", None)
                 _advance()
@@ -412,8 +424,9 @@ def build_review_session_body(state: dict, navigate, dark: bool, modo: str = "se
                     return
                 acertou = int(selecao) == int(correta_idx)
                 if spaced_service and user_id:
-                    spaced_service.review_question(user_id, payload, acertou)
-                    db.registrar_progresso_diario(user_id, questoes=1, acertos=1 if acertou else 0)
+                    spaced_service.record_question_review(user_id, payload, acertou)
+                    if daily_service:
+                        daily_service.mark_reviewed(user_id, "question", payload)
                 sess.setdefault("question_confirmed", set()).add(idx)
                 resultado = "correct" if acertou else "wrong"
                 sess["outcomes"][idx] = resultado